@@ -25,6 +25,8 @@ from application.exceptions.exception_campaign import CampaignIsDefaultError
 from application.exceptions.exception_critical_path import AdminBuildModelsPathError
 from application.exceptions.exception_critical_path import AdminTransactionModelPathError
 from application.exceptions.exception_critical_path import EmailHTTPStatusError
+from application.exceptions.exception_donation import DonationIdempotencyKeyMismatchError
+from application.exceptions.exception_donation import DonationInFlightError
 from application.exceptions.exception_file_management import FileManagementIncompleteQueryString
 from application.exceptions.exception_jwt import JWTRequestError
 from application.exceptions.exception_model import ModelCagedDonorNotFoundError
@@ -43,6 +45,9 @@ from application.exceptions.exception_uuid import UUIDLessThanFiveCharsError
 from application.flask_essentials import database
 from application.flask_essentials import jwt
 from application.flask_essentials import redis_queue
+from application.resources.admin import DonateAdminBulkCorrection
+from application.resources.admin import DonateAdminBulkRefund
+from application.resources.admin import DonateAdminBulkVoid
 from application.resources.admin import DonateAdminCorrection
 from application.resources.admin import DonateAdminRecordBouncedCheck
 from application.resources.admin import DonateAdminRefund
@@ -57,7 +62,9 @@ from application.resources.campaign import CampaignsByDefault
 from application.resources.campaign import GetCampaignById
 from application.resources.campaign import ManageCampaigns
 from application.resources.dashboard import DashboardData
+from application.resources.donate import DonateBulkDonation
 from application.resources.donate import DonateGetToken
+from application.resources.donate import DonateGetTokenPoolStatistics
 from application.resources.donate import Donation
 from application.resources.donor import Donors
 from application.resources.file_management import GetS3File
@@ -75,6 +82,7 @@ from application.resources.gift_thank_you_letter import GiftsSendThankYouLetter
 from application.resources.gift_thank_you_letter import GiftsThankYouLetter
 from application.resources.paypal_etl import PaypalETL
 from application.resources.reprocess_queued_donors import DonateReprocessQueuedDonors
+from application.resources.reprocess_queued_donors import DonateReprocessQueuedDonorsStatus
 from application.resources.transaction import TransactionBuild
 from application.resources.transaction import TransactionsByGift
 from application.resources.transaction import TransactionsByGifts
@@ -83,6 +91,8 @@ from application.resources.transaction import TransactionsById
 from application.resources.transaction import TransactionsByIds
 from application.resources.transaction import TransactionsForCSV
 from application.resources.user import UltsysUser
+from application.resources.user import UltsysUserCacheStatistics
+from application.resources.user import UltsysUserMirrorStatus
 from application.resources.utilities import Enumeration
 # pylint: disable=too-many-locals
 # pylint: disable=too-many-statements
@@ -160,6 +170,7 @@ def create_app( app_config_env=None ):
     api.add_resource( Agents, '/donation/agents' )
     api.add_resource( DashboardData, '/donation/dashboard/<string:data_type>' )
     api.add_resource( DonateGetToken, '/donation/braintree/get-token' )
+    api.add_resource( DonateGetTokenPoolStatistics, '/donation/braintree/token-pool-statistics' )
     api.add_resource( Donors, '/donation/donors/<string:donor_type>' )
     api.add_resource( CageDonorAsUltsysUser, '/donation/cage' )
     api.add_resource( CageDonorUpdate, '/donation/cage/update' )
@@ -169,6 +180,7 @@ def create_app( app_config_env=None ):
     api.add_resource( ManageCampaigns, '/donation/campaigns' )
     api.add_resource( AmountsByCampaignId, '/donation/campaigns/<int:campaign_id>/amounts' )
     api.add_resource( Donation, '/donation/donate' )
+    api.add_resource( DonateBulkDonation, '/donation/donate/bulk' )
     api.add_resource( Enumeration, '/donation/enumeration/<string:model>/<string:attribute>' )
     api.add_resource( GiftsByPartialSearchableId, '/donation/gifts/uuid_prefix/<string:searchable_id_prefix>' )
     api.add_resource( GiftByUserId, '/donation/gift/user/<int:user_id>', '/donation/gift/user' )
@@ -183,9 +195,12 @@ def create_app( app_config_env=None ):
     api.add_resource( TransactionsByGifts, '/donation/gifts/transactions' )
     api.add_resource( Heartbeat, '/donation/heartbeat' )
     api.add_resource( DonateAdminCorrection, '/donation/correction' )
+    api.add_resource( DonateAdminBulkCorrection, '/donation/correction/bulk' )
     api.add_resource( DonateAdminRecordBouncedCheck, '/donation/record-bounced-check' )
     api.add_resource( DonateAdminRefund, '/donation/refund' )
+    api.add_resource( DonateAdminBulkRefund, '/donation/refund/bulk' )
     api.add_resource( DonateReprocessQueuedDonors, '/donation/reprocess-queued-donors' )
+    api.add_resource( DonateReprocessQueuedDonorsStatus, '/donation/reprocess-queued-donors/<string:reprocess_id>' )
     api.add_resource( GetS3File, '/donation/s3/csv/download' )
     api.add_resource( GetS3FileList, '/donation/s3/csv/files' )
     api.add_resource( GetS3FilePath, '/donation/s3/campaign/<int:campaign_id>/file-path' )
@@ -195,7 +210,10 @@ def create_app( app_config_env=None ):
     api.add_resource( TransactionsByGrossGiftAmount, '/donation/transactions/gross-gift-amount' )
     api.add_resource( TransactionsForCSV, '/donation/transactions/csv' )
     api.add_resource( UltsysUser, '/donation/user' )
+    api.add_resource( UltsysUserCacheStatistics, '/donation/user/cache-statistics' )
+    api.add_resource( UltsysUserMirrorStatus, '/donation/user/mirror-status' )
     api.add_resource( DonateAdminVoid, '/donation/void' )
+    api.add_resource( DonateAdminBulkVoid, '/donation/void/bulk' )
     api.add_resource( BraintreeWebhookSubscription, '/donation/webhook/braintree/subscription' )
     api.add_resource( PaypalETL, '/donation/paypal-etl' )
 
@@ -256,10 +274,23 @@ def create_app( app_config_env=None ):
         response.status_code = 404
         return response
 
+    @app.errorhandler( DonationInFlightError )
+    def handle_409( error ):  # pylint: disable=unused-variable
+        """HTTP status 409 ( conflict ) error handler.
+
+        :param error: Error message raised by exception.
+        :return:
+        """
+
+        response = jsonify( handle_error_message( error ) )
+        response.status_code = 409
+        return response
+
     @app.errorhandler( BraintreeNotInSettlingOrSettledError )
     @app.errorhandler( BraintreeNotInSubmittedForSettlementError )
     @app.errorhandler( BraintreeNotIsSuccessError )
     @app.errorhandler( BraintreeRefundWithNegativeAmountError )
+    @app.errorhandler( DonationIdempotencyKeyMismatchError )
     @app.errorhandler( ModelCampaignImproperFieldError )
     @app.errorhandler( ModelGiftImproperFieldError )
     @app.errorhandler( ModelTransactionImproperFieldError )
@@ -1,8 +1,6 @@
 """The controllers for administrative endpoints, e.g. correct gifts, reallocate funds, and refund transaction."""
 import logging
 
-from flask import current_app
-
 from application.exceptions.exception_critical_path import AdminBuildModelsPathError
 from application.exceptions.exception_critical_path import AdminFindGiftPathError
 from application.exceptions.exception_critical_path import AdminFindSubscriptionPathError
@@ -14,6 +12,7 @@ from application.exceptions.exception_critical_path import EmailSendPathError
 from application.exceptions.exception_critical_path import GeneralHelperFindUserPathError
 from application.exceptions.exception_critical_path import SendAdminEmailModelError
 
+from application.helpers.admin_bulk_transactions import apply_bulk_admin_operation
 from application.helpers.admin_correct_gift import correct_transaction
 from application.helpers.admin_correct_gift import reallocate_subscription
 
@@ -21,10 +20,9 @@ from application.helpers.admin_record_bounced_check import record_bounced_check
 from application.helpers.admin_refund_transaction import refund_transaction
 from application.helpers.admin_void_transaction import void_transaction
 from application.helpers.braintree_api import get_braintree_transaction
-from application.helpers.braintree_api import init_braintree_credentials
 from application.helpers.email import send_admin_email
 from application.helpers.general_helper_functions import find_user
-from application.models.agent import AgentModel
+from application.helpers.reference_data import find_agent
 from application.models.gift import GiftModel
 from application.models.transaction import TransactionModel
 
@@ -36,8 +34,6 @@ def admin_get_braintree_sale_status( transaction_id ):
     :return: Braintree status.
     """
 
-    init_braintree_credentials( current_app )
-
     try:
         transaction = TransactionModel.query.filter_by( id=transaction_id ).one()
         braintree_id = transaction.reference_number
@@ -106,7 +102,7 @@ def admin_correct_gift( payload ):
     # Build the transaction to correct the gift.
     try:
         # Build what we can from the payload and then pass the models on.
-        enacted_by_agent_model = AgentModel.get_agent( 'Staff Member', 'user_id', payload[ 'agent_ultsys_id' ] )
+        enacted_by_agent_model = find_agent( 'Staff Member', 'user_id', payload[ 'agent_ultsys_id' ] )
 
         gift_model = GiftModel.query.filter_by( searchable_id=payload[ 'gift' ][ 'searchable_id' ] ).one()
 
@@ -256,3 +252,29 @@ def admin_void_transaction( payload ):
         return False
 
     return True
+
+
+def admin_bulk_operation( operation, payload ):
+    """A function to refund, void or correct many gifts at once, with a result for each.
+
+    payload = {
+        "user_id": "1234",
+        "transaction_notes": "Some transaction notes.",
+        "items": [
+            { "transaction_id": 1, "amount": "0.01" },
+            { "searchable_id": "6AE03D8EA2DC48E8874F0A76A1C43D5F", "amount": "0.01" }
+        ]
+    }
+
+    :param str operation: The operation: refund, void or correction.
+    :param dict payload: A dictionary of the agent, notes and the items to apply the operation to.
+    :return: A dictionary of the counts and the result of each item by its index in the list.
+    """
+
+    results = apply_bulk_admin_operation( operation, payload )
+
+    response = { 'completed': 0, 'invalid': 0, 'failed': 0 }
+    for result in results:
+        response[ result[ 'status' ] ] += 1
+    response[ 'results' ] = results
+    return response
@@ -11,7 +11,7 @@ from application.exceptions.exception_critical_path import EmailHTTPStatusError
 from application.exceptions.exception_critical_path import EmailSendPathError
 from application.exceptions.exception_critical_path import GeneralHelperFindUserPathError
 from application.exceptions.exception_critical_path import SendAdminEmailModelError
-from application.helpers.braintree_api import init_braintree_gateway
+from application.helpers.braintree_api import get_braintree_gateway
 from application.helpers.braintree_webhooks import manage_subscription
 from application.helpers.email import send_admin_email
 from application.helpers.general_helper_functions import find_user
@@ -25,7 +25,7 @@ def subscription_webhook( form_payload ):
     :return: Boolean
     """
 
-    gateway = init_braintree_gateway( current_app )
+    gateway = get_braintree_gateway( current_app )
 
     try:
         signature = str( form_payload[ 'bt_signature' ] )
@@ -4,25 +4,28 @@ from decimal import Decimal
 
 from flask import current_app
 
-from application.exceptions.exception_critical_path import BuildEmailPayloadPathError
 from application.exceptions.exception_critical_path import BuildModelsGiftTransactionsPathError
 from application.exceptions.exception_critical_path import BuildModelsQueuedDonorPathError
 from application.exceptions.exception_critical_path import DonateBuildModelPathError
-from application.exceptions.exception_critical_path import EmailHTTPStatusError
-from application.exceptions.exception_critical_path import EmailSendPathError
-from application.exceptions.exception_critical_path import SendAdminEmailModelError
 from application.exceptions.exception_model import ModelGiftImproperFieldError
 from application.flask_essentials import database
+from application.helpers.admin_bulk_sale import build_models_bulk_sale
+from application.helpers.admin_bulk_sale import make_admin_bulk_sale
 from application.helpers.admin_sale import make_admin_sale
 from application.helpers.braintree_api import generate_braintree_token
-from application.helpers.braintree_api import init_braintree_credentials
 from application.helpers.braintree_api import make_braintree_sale
+from application.helpers.braintree_token_pool import DEFAULT_TOKEN_POOL
+from application.helpers.braintree_token_pool import get_braintree_token_pool_statistics
+from application.helpers.braintree_token_pool import get_token_pools
+from application.helpers.braintree_token_pool import pop_braintree_token
+from application.helpers.build_models import build_gift_thank_you_letter
 from application.helpers.build_models import build_model_queued_donor
 from application.helpers.build_models import build_models_sale
 from application.helpers.caging import redis_queue_caging
-from application.helpers.email import send_admin_email
+from application.helpers.caging_batch import is_caging_batch_enabled
+from application.helpers.caging_batch import queue_caging_batch
+from application.helpers.caging_batch import queue_caging_batches
 from application.helpers.general_helper_functions import validate_user_payload
-from application.models.gift_thank_you_letter import GiftThankYouLetterModel
 # pylint: disable=bare-except
 # flake8: noqa:E722
 
@@ -89,8 +92,6 @@ def post_donation( payload ):
     :return: Boolean for success or failure.
     """
 
-    init_braintree_credentials( current_app )
-
     # This is a fix to a mismatch between what the back-end expects and what the front-end is passing.
     user = payload.pop( 'user' )
     user = validate_user_payload( user )
@@ -115,54 +116,51 @@ def post_donation( payload ):
         donation = make_admin_sale( payload )
 
     # Getting ready to save to the database, and want to prevent orphaned gifts/transactions.
+    # The donation is saved as one unit of work: the gift and transactions are flushed once for their ID's, the
+    # receipt, Thank You letter and queued donor are each added inside a SAVEPOINT, and everything is committed once.
     # The response sent back will have redis job ID, status, and the gift searchable ID.
     response = {}
+    gift_built = False
     try:
         # Call build_models_sale() and if an exception occurs while building gift/transaction roll back and quit.
-        # If the gift/transaction is made then see about the Thank You letter and the email. If either fails
-        # log and move on.
-        build_models_sale( donation[ 'user' ], donation[ 'gift' ], donation[ 'transactions' ] )
+        # The receipt is added to the email outbox with the gift, and sent by the dispatcher: see email_outbox.py.
+        build_models_sale(
+            donation[ 'user' ], donation[ 'gift' ], donation[ 'transactions' ], receipt=True, commit=False
+        )
+        gift_built = True
 
-        # If the gift amount >= $100 ( current threshold ), add to gift_thank_you_letter table
+        # If the gift amount >= $100 ( current threshold ), add to gift_thank_you_letter table. If it fails log and
+        # move on.
         if Decimal( donation[ 'transactions' ][ 0 ][ 'gross_gift_amount' ] ) \
                 >= Decimal( current_app.config[ 'THANK_YOU_LETTER_THRESHOLD' ] ):
-            try:
-                database.session.add( GiftThankYouLetterModel( gift_id=donation[ 'transactions' ][ 0 ][ 'gift_id' ] ) )
-                database.session.commit()
-            except:
-                database.session.rollback()
-                logging.exception( DonateBuildModelPathError().message )
-
-        try:
-            recurring = False
-            if 'recurring_subscription_id' in donation[ 'gift' ] and donation[ 'gift' ][ 'recurring_subscription_id' ]:
-                recurring = True
-            send_admin_email( donation[ 'transactions' ][ 0 ], donation[ 'user' ], recurring )
-        except (
-                SendAdminEmailModelError,
-                EmailSendPathError,
-                BuildEmailPayloadPathError,
-                EmailHTTPStatusError
-        ) as error:
-            logging.exception( error.message )
-
-        response[ 'gift_searchable_id' ] = str( donation[ 'user' ][ 'gift_searchable_id' ] )
+            build_gift_thank_you_letter( donation[ 'transactions' ][ 0 ][ 'gift_id' ] )
     except BuildModelsGiftTransactionsPathError as error:
         logging.exception( error.message )
 
     # Build the queued donor model with whatever information we have from above.
     # It can still help construct what happened if there is an error higher up.
     try:
-        build_model_queued_donor( donation[ 'user' ] )
+        build_model_queued_donor( donation[ 'user' ], commit=False )
     except BuildModelsQueuedDonorPathError as error:
         logging.exception( error.message )
 
+    try:
+        database.session.commit()
+        if gift_built:
+            response[ 'gift_searchable_id' ] = str( donation[ 'user' ][ 'gift_searchable_id' ] )
+    except:
+        database.session.rollback()
+        logging.exception( DonateBuildModelPathError().message )
+
     # Once on the queue it is out of our hands, but may fail on arguments to queue().
     job = None
     try:
-        job = redis_queue_caging.queue(
-            donation[ 'user' ], donation[ 'transactions' ], current_app.config[ 'ENV' ]
-        )
+        if is_caging_batch_enabled():
+            job = queue_caging_batch( donation[ 'user' ], donation[ 'transactions' ], current_app.config[ 'ENV' ] )
+        else:
+            job = redis_queue_caging.queue(
+                donation[ 'user' ], donation[ 'transactions' ], current_app.config[ 'ENV' ]
+            )
     except:
         pass
 
@@ -180,16 +178,96 @@ def post_donation( payload ):
     return response
 
 
-def get_braintree_token():
+def post_bulk_donation( payload ):
+    """Handle a batch of administrative donations, e.g. the checks and money orders of a bank deposit.
+
+    Each gift is built and validated as make_admin_sale() does for a single administrative donation. The gifts that
+    validate are inserted in bulk by build_models_bulk_sale() and committed once, and their donors are queued for
+    caging in batches. A gift that does not validate does not stop the others.
+
+    payload = {
+        "sourced_from_agent_user_id": 3255162,
+        "gifts": [ { "gift": {}, "transaction": {}, "user": {} } ]
+    }
+
+    :param dict payload: The agent and the list of administrative donations, as for post_donation().
+    :return: A dictionary of the counts, the result of each gift by its index in the list, and the caging job ID's.
+    """
+
+    sales, results = make_admin_bulk_sale( payload )
+
+    created = False
+    if sales:
+        try:
+            build_models_bulk_sale( sales )
+            database.session.commit()
+            created = True
+        except:
+            database.session.rollback()
+            logging.exception( DonateBuildModelPathError().message )
+
+    for sale in sales:
+        if created:
+            results.append(
+                {
+                    'index': sale[ 'index' ],
+                    'status': 'created',
+                    'gift_searchable_id': str( sale[ 'gift' ].searchable_id )
+                }
+            )
+        else:
+            results.append( { 'index': sale[ 'index' ], 'status': 'failed' } )
+
+    # Once on the queue it is out of our hands, and a donor that is not queued is caged by the reprocess.
+    jobs = []
+    if created:
+        try:
+            donors = [
+                { 'user': sale[ 'donation' ][ 'user' ], 'transactions': sale[ 'donation' ][ 'transactions' ] }
+                for sale in sales
+            ]
+            jobs = queue_caging_batches( donors, current_app.config[ 'ENV' ] )
+        except:
+            logging.exception( 'Unable to queue the bulk donation for caging.' )
+
+    response = { 'created': 0, 'invalid': 0, 'failed': 0 }
+    for result in results:
+        response[ result[ 'status' ] ] += 1
+    response[ 'results' ] = sorted( results, key=lambda result: result[ 'index' ] )
+    response[ 'job_ids' ] = [ job.get_id() for job in jobs ]
+    return response
+
+
+def get_braintree_token( given_to=None ):
     """Handle token generation for Braintree API.
 
     The front-end uses hosted fields and requires a Braintree token to make a submission for a sale. On submission
     a payment nonce will be returned to the back-end to create the Transaction.sale( {} ). The initial token is
     created with a call to this endpoint.
 
+    The token is popped from the pool kept by jobs/braintree_token_pool.py, and generated with a live call to
+    Braintree if the pool is empty.
+
+    :param str given_to: The account the donation is given to, e.g. NERF, for its merchant account's pool.
     :return: Braintree token.
     """
 
-    init_braintree_credentials( current_app )
+    token_pools = get_token_pools()
+    pool_name = given_to if given_to in token_pools else DEFAULT_TOKEN_POOL
+
+    token = pop_braintree_token( pool_name )
+    if token:
+        return token
 
+    if token_pools[ pool_name ]:
+        return generate_braintree_token( token_pools[ pool_name ] )
     return generate_braintree_token()
+
+
+def braintree_token_pool_statistics():
+    """Controller to return the depth, hits and misses of the Braintree token pools.
+
+    :return: A dictionary of the pool statistics.
+    """
+
+    return get_braintree_token_pool_statistics()
@@ -5,6 +5,7 @@ from application.flask_essentials import database
 from application.helpers.front_end_caging import ultsys_user_create
 from application.helpers.front_end_caging import ultsys_user_update
 from application.models.caged_donor import CagedDonorModel
+from application.models.caged_donor import normalize_street
 
 
 def build_ultsys_user( payload ):
@@ -41,6 +42,10 @@ def update_caged_donor( payload ):
     :return: The Boolean.
     """
 
+    # A bulk update does not run the model's validator, and so the normalized street is set here.
+    if 'user_address' in payload:
+        payload[ 'user_street' ] = normalize_street( payload[ 'user_address' ] )
+
     try:
         caged_donor_query = CagedDonorModel.query.filter_by( id=payload[ 'id' ] )
         caged_donor_query.update( payload )
@@ -9,9 +9,9 @@ from sqlalchemy.exc import SQLAlchemyError
 from application.flask_essentials import database
 from application.helpers.gift_helpers import build_gifts_from_query
 from application.helpers.model_serialization import from_json
+from application.helpers.reference_data import find_agent
 from application.helpers.sql_queries import query_gift_equal_uuid
 from application.helpers.sql_queries import query_gift_like_uuid
-from application.models.agent import AgentModel
 from application.models.gift import GiftModel
 from application.models.transaction import TransactionModel
 from application.schemas.transaction import TransactionSchema
@@ -213,7 +213,7 @@ def gift_update_note( searchable_id, payload ):
     if results:
         gift_id = results[ 0 ]
 
-        enacted_by_agent = AgentModel.get_agent( 'Staff Member', 'user_id', payload[ 'agent_ultsys_id' ] )
+        enacted_by_agent = find_agent( 'Staff Member', 'user_id', payload[ 'agent_ultsys_id' ] )
 
         transaction_dict = {
             'gift_id': gift_id,
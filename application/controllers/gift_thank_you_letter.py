@@ -13,7 +13,7 @@ from application.flask_essentials import database
 from application.helpers.build_output_file import build_flat_bytesio_csv
 from application.helpers.general_helper_functions import get_date_with_day_suffix
 from application.helpers.model_serialization import to_json
-from application.helpers.ultsys_user import find_ultsys_user
+from application.helpers.ultsys_user import find_ultsys_users
 from application.models.caged_donor import CagedDonorModel
 from application.models.gift import GiftModel
 from application.models.gift_thank_you_letter import GiftThankYouLetterModel
@@ -143,20 +143,38 @@ def build_out_gift_ids( searchable_ids ):
 def build_out_user_data( searchable_ids ):
     """Build a lookup table from searchable to gift ID, as well as construct a list of Gift IDs to delete.
 
+    The gifts, caged and queued donors are each retrieved with a single query, and the Ultsys users in batches using
+    find_ultsys_users(), rather than a request per gift.
+
     :param searchable_ids: The searchable IDs to process.
     :return: User data based upon the user ID on the gift.
     """
 
     searchable_ids_uuid = [ UUID( searchable_id ) for searchable_id in searchable_ids ]
+    gifts = GiftModel.query.filter( GiftModel.searchable_id.in_( searchable_ids_uuid ) ).all() \
+        if searchable_ids_uuid else []
+    gifts = { gift.searchable_id: gift for gift in gifts }
+
+    donor_model = { -1: CagedDonorModel, -2: QueuedDonorModel }
+    donors = {}
+    for user_id, model in donor_model.items():
+        gift_ids = [ gift.id for gift in gifts.values() if gift.user_id == user_id ]
+        if gift_ids:
+            donor_query = model.query.filter( model.gift_id.in_( gift_ids ) )
+            donors[ user_id ] = { donor.gift_id: donor for donor in donor_query.all() }
+
+    ultsys_users = find_ultsys_users(
+        ids=[ gift.user_id for gift in gifts.values() if gift.user_id not in donor_model ]
+    )
+
     user_data = {}
     for searchable_id_uuid in searchable_ids_uuid:
-        gift = GiftModel.query.filter_by( searchable_id=searchable_id_uuid ).one_or_none()
+        gift = gifts.get( searchable_id_uuid )
         if gift:
             user_id = gift.user_id
 
-            donor_model = { -1: CagedDonorModel, -2: QueuedDonorModel }
             if user_id in [ -1, -2 ]:
-                donor = donor_model[ user_id ].query.filter_by( gift_id=gift.id ).one_or_none()
+                donor = donors[ user_id ].get( gift.id )
                 user = [ {
                     'firstname': donor.user_first_name,
                     'lastname': donor.user_last_name,
@@ -169,8 +187,7 @@ def build_out_user_data( searchable_ids ):
                     'email': donor.user_email_address
                 } ]
             else:
-                user_query_terms = { 'action': 'find', 'search_terms': { 'ID': { 'eq': user_id } }, 'sort_terms': [ ] }
-                user = find_ultsys_user( user_query_terms )
+                user = ultsys_users.get( int( user_id ) )
 
             # Ensure the number of users returned is correct: 1.
             # Need to definitely catch no users found, and might as well protect against multiple users found.
@@ -1,56 +1,30 @@
-"""Resources entry point to make a Braintree sale."""
-from flask import current_app
-
-from application.helpers.caging import redis_queue_caging
-from application.helpers.general_helper_functions import validate_user_payload
-from application.helpers.model_serialization import to_json
-from application.models.queued_donor import QueuedDonorModel
-from application.models.transaction import TransactionModel
-from application.schemas.queued_donor import QueuedDonorSchema
-from application.schemas.transaction import TransactionSchema
-# pylint: disable=bare-except
-# flake8: noqa:E722
+"""Controllers to reprocess queued donors in the background and report on the progress."""
+from application.helpers.reprocess_queued_donors import get_reprocess_status
+from application.helpers.reprocess_queued_donors import register_reprocess
 
 
 def reprocess_queued_donors( payload=None ):
-    """Reprocess existing queued donors."""
+    """Reprocess existing queued donors.
+
+    The reprocess is registered and done by a job, and so this returns as soon as the job is queued. The progress is
+    returned by reprocess_queued_donors_status().
 
+    :param payload: Optionally the queued donors to reprocess: { "queued_donor_ids": [ 1, 2 ] }. Otherwise all.
+    :return: The status of the reprocess, with its reprocess_id, or None if it could not be queued.
+    """
+
+    queued_donor_ids = None
     if payload:
-        queued_donors = QueuedDonorModel.query.filter( QueuedDonorModel.id.in_( payload[ 'queued_donor_ids' ] ) )
-    else:
-        queued_donors = QueuedDonorModel.query.all()
-
-    jobs = []
-    for queued_donor_model in queued_donors:
-        queued_donor_dict = to_json( QueuedDonorSchema(), queued_donor_model ).data
-        queued_donor_dict[ 'gift_id' ] = queued_donor_model.gift_id
-        queued_donor_dict[ 'queued_donor_id' ] = queued_donor_model.id
-        queued_donor_dict[ 'category' ] = 'queued'
-        queued_donor_dict.pop( 'id' )
-
-        # May be multiple transactions for a gift, e.g. check with a Gift and Deposit to Bank.
-        transaction_models = TransactionModel.query.filter_by( gift_id=queued_donor_model.gift_id ).all()
-        transactions = []
-        for transaction_model in transaction_models:
-            if transaction_model.type in [ 'Gift', 'Deposit to Bank' ]:
-                transaction_dict = to_json( TransactionSchema(), transaction_model ).data
-                transactions.append( transaction_dict )
-
-        # Caging expects a user dictionary that has a user something like: { user_address:{}, 'billing_address':{} }.
-        # Put the queued donor dictionary in this form.
-        queued_donor_dict = validate_user_payload( queued_donor_dict )
-
-        # Once on the queue it is out of our hands, but may fail on arguments to queue().
-        try:
-            job = redis_queue_caging.queue(
-                queued_donor_dict, transactions, current_app.config[ 'ENV' ]
-            )
-            jobs.append( ( queued_donor_dict[ 'queued_donor_id' ], job.get_id() ) )
-        except:
-            jobs.append( ( queued_donor_dict[ 'queued_donor_id' ], 'failed' ) )
-
-    response = None
-    if jobs:
-        response = { 'reprocessed_jobs': jobs }
-
-    return response
+        queued_donor_ids = payload[ 'queued_donor_ids' ]
+
+    return register_reprocess( queued_donor_ids )
+
+
+def reprocess_queued_donors_status( reprocess_id ):
+    """The progress of a reprocess of the queued donors.
+
+    :param reprocess_id: The ID returned when the reprocess was registered.
+    :return: The status, e.g. { "status": "running", "queued_donors": 500, "enqueued": 500, "failed": 0 }, or None.
+    """
+
+    return get_reprocess_status( reprocess_id )
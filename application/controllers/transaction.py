@@ -12,6 +12,7 @@ from sqlalchemy.orm import aliased
 from application.flask_essentials import database
 from application.helpers.build_output_file import build_flat_bytesio_csv
 from application.helpers.gift_helpers import build_filters
+from application.helpers.reference_data import find_agent
 from application.helpers.transaction_helpers import create_transaction
 from application.models.agent import AgentModel
 from application.models.gift import GiftModel
@@ -125,7 +126,7 @@ def build_transaction( transaction_dict, agent_ultsys_id ):
     :param agent_ultsys_id: The agent ultsys ID to be converted to the Agent ID primary key.
     :return: A transaction.
     """
-    enacted_by_agent = AgentModel.get_agent( 'Staff Member', 'user_id', agent_ultsys_id )
+    enacted_by_agent = find_agent( 'Staff Member', 'user_id', agent_ultsys_id )
     transaction_dict[ 'enacted_by_agent_id' ] = enacted_by_agent.id
     transaction = create_transaction( transaction_dict )
 
@@ -5,6 +5,8 @@ from application.helpers.general_helper_functions import transform_to_ultsys_que
 from application.helpers.ultsys_user import create_user
 from application.helpers.ultsys_user import find_ultsys_user
 from application.helpers.ultsys_user import update_ultsys_user
+from application.helpers.ultsys_user_cache import get_cache_statistics
+from application.helpers.ultsys_user_mirror import get_mirror_status
 
 
 def ultsys_user( payload ):
@@ -73,3 +75,21 @@ def ultsys_user( payload ):
         request = find_ultsys_user( query_parameters )
 
     return request
+
+
+def ultsys_user_cache_statistics():
+    """Controller to return the hit and miss counts of the Ultsys user cache.
+
+    :return: A dictionary of the cache statistics.
+    """
+
+    return get_cache_statistics()
+
+
+def ultsys_user_mirror_status():
+    """Controller to return the staleness and watermarks of the local Ultsys user mirror.
+
+    :return: A dictionary of the mirror status.
+    """
+
+    return get_mirror_status()
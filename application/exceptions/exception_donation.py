@@ -0,0 +1,22 @@
+"""Exception handlers for the donation endpoint."""
+# pylint: disable=too-few-public-methods
+
+
+class DonationError( Exception ):
+    """Base class for some custom exceptions for the donation endpoint."""
+
+
+class DonationInFlightError( DonationError ):
+    """Exception for a retried donation whose first request did not finish in time."""
+
+    def __init__( self ):
+        super().__init__()
+        self.message = 'The donation with this idempotency key is still being processed.'
+
+
+class DonationIdempotencyKeyMismatchError( DonationError ):
+    """Exception for an idempotency key sent with a donation other than the one it was first used for."""
+
+    def __init__( self ):
+        super().__init__()
+        self.message = 'The idempotency key was used for a different donation.'
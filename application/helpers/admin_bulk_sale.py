@@ -0,0 +1,280 @@
+"""A module for entering a batch of administrative gifts at once, e.g. the checks and money orders of a bank deposit.
+
+Entering a deposit through /donation/donate is a request per gift, each with its own flushes, receipt, queued donor,
+commit and caging job. Here make_admin_bulk_sale() builds each gift of the batch with make_admin_sale(), as the
+donation endpoint does, and validates it with the gift, transaction and queued donor schemas. A gift that does not
+validate is reported in the results and left out, and the rest of the batch carries on.
+
+build_models_bulk_sale() then inserts the gifts, their Gift and Deposit to Bank transactions, the queued donors, the
+thank you letters and the receipts with multi-row INSERT statements of at most BULK_SALE_INSERT_SIZE rows
+( default 500 ). The ID's of the gifts are read back by their searchable ID's, and those of the transactions and
+queued donors by their gift ID's, on the indexes ix_gift_searchable_id, ix_transaction_gift_id and
+ix_queued_donor_gift_id. The caller commits once for the batch, and queues the donors for caging in bulk with
+queue_caging_batches().
+"""
+import logging
+from decimal import Decimal
+
+from flask import current_app
+from marshmallow import ValidationError
+
+from application.flask_essentials import database
+from application.helpers.admin_sale import make_admin_sale
+from application.helpers.email import format_email_payload
+from application.helpers.email import queue_emails
+from application.helpers.general_helper_functions import validate_user_payload
+from application.helpers.model_serialization import from_json
+from application.models.gift import GiftModel
+from application.models.gift_thank_you_letter import GiftThankYouLetterModel
+from application.models.queued_donor import QueuedDonorModel
+from application.models.transaction import TransactionModel
+from application.schemas.gift import GiftSchema
+from application.schemas.queued_donor import QueuedDonorSchema
+from application.schemas.transaction import TransactionSchema
+# pylint: disable=bare-except
+# flake8: noqa:E722
+
+# The methods used that are sales through Braintree, and so are made one at a time through /donation/donate.
+BRAINTREE_METHODS_USED = [ 'web form credit card', 'web form paypal', 'admin-entered credit card' ]
+
+DEFAULT_INSERT_SIZE = 500
+
+
+def get_bulk_sale_insert_size():
+    """The most rows inserted by a multi-row INSERT statement."""
+
+    return int( current_app.config.get( 'BULK_SALE_INSERT_SIZE' ) or DEFAULT_INSERT_SIZE )
+
+
+def make_admin_bulk_sale( payload ):
+    """Build and validate each gift of a batch of administrative gifts.
+
+    payload = {
+      "sourced_from_agent_user_id": 3255162,
+      "gifts": [
+        {
+          "gift": { "method_used": "Check", "given_to": "NERF" },
+          "transaction": {
+            "date_of_method_used": "2018-07-12 00:00:00",
+            "gross_gift_amount": "15.00",
+            "reference_number": "1201",
+            "bank_deposit_number": "<bank-deposit-number>",
+            "type": "Gift",
+            "notes": "A note for the transaction."
+          },
+          "user": { "user_id": null, "user_address": {}, "billing_address": {} }
+        }
+      ]
+    }
+
+    Each gift has the form of the administrative payload to make_admin_sale().
+
+    :param dict payload: The agent and the list of gifts.
+    :return: A tuple of the sales that validated, and the results of the gifts that did not.
+    """
+
+    sales = []
+    results = []
+    for index, entry in enumerate( payload[ 'gifts' ] ):
+        try:
+            sales.append( build_bulk_sale( index, entry, payload[ 'sourced_from_agent_user_id' ] ) )
+        except ValidationError as error:
+            results.append( { 'index': index, 'status': 'invalid', 'errors': error.messages } )
+        except KeyError as error:
+            errors = { error.args[ 0 ]: [ 'Missing data for required field.' ] }
+            results.append( { 'index': index, 'status': 'invalid', 'errors': errors } )
+        except:
+            logging.exception( 'Unable to build the gift of the bulk sale: %s', index )
+            errors = { 'gift': [ 'Unable to build the gift.' ] }
+            results.append( { 'index': index, 'status': 'invalid', 'errors': errors } )
+    return sales, results
+
+
+def build_bulk_sale( index, entry, sourced_from_agent_user_id ):
+    """Build a gift of the batch with make_admin_sale(), and load its models through the schemas to validate them.
+
+    :param int index: The position of the gift in the batch.
+    :param dict entry: The administrative payload of the gift.
+    :param sourced_from_agent_user_id: The Ultsys ID of the staff member entering the batch.
+    :return: A dictionary of the donation dictionaries and the models that are not yet added to the session.
+    """
+
+    if entry[ 'gift' ][ 'method_used' ].lower() in BRAINTREE_METHODS_USED:
+        raise ValidationError( { 'method_used': [ 'A Braintree sale is made through /donation/donate.' ] } )
+
+    entry[ 'user' ] = validate_user_payload( entry[ 'user' ] )
+    entry[ 'sourced_from_agent_user_id' ] = sourced_from_agent_user_id
+    donation = make_admin_sale( entry )
+
+    donation[ 'gift' ][ 'user_id' ] = -2
+    gift_model = from_json( GiftSchema(), donation[ 'gift' ] ).data
+    transaction_models = [
+        from_json( TransactionSchema( partial=( 'gift_id', ) ), transaction ).data
+        for transaction in donation[ 'transactions' ]
+    ]
+    queued_donor_model = from_json( QueuedDonorSchema(), donation[ 'user' ][ 'user_address' ] ).data
+
+    return {
+        'index': index,
+        'donation': donation,
+        'gift': gift_model,
+        'transactions': transaction_models,
+        'queued_donor': queued_donor_model
+    }
+
+
+def build_models_bulk_sale( sales ):
+    """Insert the gifts, transactions, queued donors, thank you letters and receipts of the sales, without committing.
+
+    The donation dictionaries of each sale are updated with the ID's, as build_models_sale() and
+    build_model_queued_donor() do, so that the donors can be queued for caging.
+
+    :param sales: The sales from make_admin_bulk_sale().
+    :return:
+    """
+
+    insert_size = get_bulk_sale_insert_size()
+
+    # The gifts, and their ID's read back by the searchable ID's generated by from_json().
+    insert_rows(
+        GiftModel.__table__,
+        [
+            {
+                'searchable_id': sale[ 'gift' ].searchable_id,
+                'user_id': -2,
+                'campaign_id': sale[ 'gift' ].campaign_id,
+                'customer_id': '',
+                'method_used_id': sale[ 'gift' ].method_used_id,
+                'sourced_from_agent_id': sale[ 'gift' ].sourced_from_agent_id,
+                'given_to': sale[ 'gift' ].given_to,
+                'recurring_subscription_id': None
+            }
+            for sale in sales
+        ],
+        insert_size
+    )
+    gift_ids = dict(
+        select_in(
+            database.session.query( GiftModel.searchable_id, GiftModel.id ),
+            GiftModel.searchable_id,
+            [ sale[ 'gift' ].searchable_id for sale in sales ],
+            insert_size
+        )
+    )
+    for sale in sales:
+        sale[ 'gift' ].id = gift_ids[ sale[ 'gift' ].searchable_id ]
+
+    # The transactions, and their ID's read back by gift in the order they were inserted.
+    insert_rows(
+        TransactionModel.__table__,
+        [
+            {
+                'gift_id': sale[ 'gift' ].id,
+                'date_in_utc': transaction_model.date_in_utc,
+                'receipt_sent_in_utc': None,
+                'enacted_by_agent_id': transaction_model.enacted_by_agent_id,
+                'type': transaction_model.type,
+                'status': transaction_model.status,
+                'reference_number': transaction_model.reference_number,
+                'gross_gift_amount': transaction_model.gross_gift_amount,
+                'fee': transaction_model.fee or Decimal( 0 ),
+                'notes': transaction_model.notes
+            }
+            for sale in sales for transaction_model in sale[ 'transactions' ]
+        ],
+        insert_size
+    )
+    transaction_ids = {}
+    for gift_id, transaction_id in select_in(
+            database.session.query( TransactionModel.gift_id, TransactionModel.id ).order_by( TransactionModel.id ),
+            TransactionModel.gift_id,
+            list( gift_ids.values() ),
+            insert_size
+    ):
+        transaction_ids.setdefault( gift_id, [] ).append( transaction_id )
+
+    # The queued donors, and their ID's read back by gift.
+    queued_donor_rows = []
+    for sale in sales:
+        queued_donor_model = sale[ 'queued_donor' ]
+        queued_donor_model.gift_id = sale[ 'gift' ].id
+        queued_donor_model.gift_searchable_id = sale[ 'gift' ].searchable_id
+        queued_donor_model.campaign_id = sale[ 'gift' ].campaign_id
+        queued_donor_model.customer_id = sale[ 'donation' ][ 'user' ][ 'customer_id' ]
+        queued_donor_rows.append(
+            {
+                column.key: getattr( queued_donor_model, column.key )
+                for column in QueuedDonorModel.__table__.columns if column.key != 'id'
+            }
+        )
+    insert_rows( QueuedDonorModel.__table__, queued_donor_rows, insert_size )
+    queued_donor_ids = dict(
+        select_in(
+            database.session.query( QueuedDonorModel.gift_id, QueuedDonorModel.id ),
+            QueuedDonorModel.gift_id,
+            list( gift_ids.values() ),
+            insert_size
+        )
+    )
+
+    threshold = Decimal( current_app.config[ 'THANK_YOU_LETTER_THRESHOLD' ] )
+    thank_you_rows = []
+    receipts = []
+    for sale in sales:
+        gift_id = sale[ 'gift' ].id
+        user = sale[ 'donation' ][ 'user' ]
+        user[ 'gift_id' ] = gift_id
+        user[ 'gift_searchable_id' ] = sale[ 'gift' ].searchable_id
+        user[ 'campaign_id' ] = sale[ 'gift' ].campaign_id
+        user[ 'queued_donor_id' ] = queued_donor_ids[ gift_id ]
+        for transaction, transaction_id in zip( sale[ 'donation' ][ 'transactions' ], transaction_ids[ gift_id ] ):
+            transaction[ 'gift_id' ] = gift_id
+            transaction[ 'id' ] = transaction_id
+
+        receipted_transaction = sale[ 'donation' ][ 'transactions' ][ 0 ]
+        if sale[ 'transactions' ][ 0 ].gross_gift_amount >= threshold:
+            thank_you_rows.append( { 'gift_id': gift_id } )
+        try:
+            receipts.append(
+                (
+                    format_email_payload(
+                        receipted_transaction, user, sale[ 'gift' ], sale[ 'transactions' ][ 0 ].date_in_utc
+                    ),
+                    receipted_transaction[ 'id' ]
+                )
+            )
+        except:
+            logging.exception( 'The receipt could not be queued for the gift: %s', gift_id )
+
+    insert_rows( GiftThankYouLetterModel.__table__, thank_you_rows, insert_size )
+    for start in range( 0, len( receipts ), insert_size ):
+        queue_emails( 'receipt', receipts[ start:start + insert_size ] )
+
+
+def insert_rows( table, rows, insert_size ):
+    """Insert the rows with multi-row INSERT statements of at most insert_size rows.
+
+    :param table: The table, e.g. GiftModel.__table__.
+    :param rows: A list of dictionaries, all with the same columns.
+    :param int insert_size: The most rows inserted by a statement.
+    :return:
+    """
+
+    for start in range( 0, len( rows ), insert_size ):
+        database.session.execute( table.insert().values( rows[ start:start + insert_size ] ) )
+
+
+def select_in( query, column, values, chunk_size ):
+    """Run the query for the values of the column, with an IN list of at most chunk_size values at a time.
+
+    :param query: The query, e.g. of the ID's.
+    :param column: The column the values are matched on.
+    :param values: The values.
+    :param int chunk_size: The most values in an IN list.
+    :return: A list of the rows.
+    """
+
+    rows = []
+    for start in range( 0, len( values ), chunk_size ):
+        rows.extend( query.filter( column.in_( values[ start:start + chunk_size ] ) ).all() )
+    return rows
@@ -0,0 +1,318 @@
+"""A module for refunding, voiding or correcting many gifts at once, e.g. to clean up after a wave of fraud.
+
+The single administrative endpoints find the transaction, get it from Braintree and make the refund or void, build the
+new transaction and commit, one gift per request. apply_bulk_admin_operation() takes a list of items, each naming a
+transaction by transaction_id or a gift by searchable_id, and:
+
+    1. Finds the transactions and gifts of all the items, and every transaction on those gifts, with an IN query
+       each. An item that is not found, or whose gift is already in the batch, is reported as invalid.
+    2. Makes the Braintree calls of the items concurrently on BULK_ADMIN_MAX_WORKERS threads ( default 8 ): the
+       status check and refund or void, or the update of the subscription of a reallocated gift. The threads only
+       call Braintree, and the database is used from the request thread.
+    3. Builds the Refund, Void or Correction transaction of each item that succeeded as the single endpoints do, and
+       adds the receipts to the email outbox inside a SAVEPOINT.
+    4. Commits every new transaction once.
+
+Each item has a result: completed, with the ID of the new transaction, invalid or failed, with the error.
+"""
+import datetime
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from application.exceptions.exception_braintree import BraintreeError
+from application.flask_essentials import database
+from application.helpers.admin_correct_gift import reallocate_subscription
+from application.helpers.admin_refund_transaction import build_refund_transaction
+from application.helpers.admin_void_transaction import build_void_transaction
+from application.helpers.braintree_api import make_braintree_refund
+from application.helpers.braintree_api import make_braintree_void
+from application.helpers.email import format_email_payload
+from application.helpers.email import queue_emails
+from application.helpers.general_helper_functions import find_users
+from application.helpers.model_serialization import from_json
+from application.helpers.model_serialization import to_json
+from application.helpers.reference_data import find_agent
+from application.models.gift import GiftModel
+from application.models.transaction import TransactionModel
+from application.schemas.transaction import TransactionSchema
+# pylint: disable=bare-except
+# flake8: noqa:E722
+
+BULK_ADMIN_OPERATIONS = [ 'refund', 'void', 'correction' ]
+DEFAULT_MAX_WORKERS = 8
+
+
+def get_bulk_admin_max_workers():
+    """The most Braintree calls made at the same time."""
+
+    return int( current_app.config.get( 'BULK_ADMIN_MAX_WORKERS' ) or DEFAULT_MAX_WORKERS )
+
+
+def apply_bulk_admin_operation( operation, payload ):
+    """Refund, void or correct the gifts of the items, with concurrent Braintree calls and a single commit.
+
+    payload = {
+        "user_id": 1234,
+        "transaction_notes": "Fraudulent donations.",
+        "items": [
+            { "transaction_id": 1, "amount": "10.00" },
+            { "searchable_id": "6AE03D8EA2DC48E8874F0A76A1C43D5F", "amount": "25.00" }
+        ]
+    }
+
+    A refund item has the amount. A correction item has the corrected_gross_gift_amount, and may have the fee and
+    reallocate_to, e.g. NERF. Any item may have its own transaction_notes.
+
+    :param str operation: The operation: refund, void or correction.
+    :param dict payload: The agent, the default notes and the items.
+    :return: A list of the results of the items, in order.
+    """
+
+    enacted_by_agent = find_agent( 'Staff Member', 'user_id', payload[ 'user_id' ] )
+    entries, results = find_bulk_admin_entries( payload[ 'items' ] )
+
+    # The Braintree calls only, on the threads: each runs in its own application context.
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    with ThreadPoolExecutor( max_workers=get_bulk_admin_max_workers() ) as executor:
+        braintree_results = list(
+            executor.map( lambda entry: call_braintree( app, operation, entry ), entries )
+        )
+
+    completed = []
+    for entry, ( braintree_result, error ) in zip( entries, braintree_results ):
+        if error:
+            results.append( { 'index': entry[ 'index' ], 'status': 'failed', 'error': error } )
+            continue
+        try:
+            notes = entry[ 'item' ].get( 'transaction_notes', payload.get( 'transaction_notes', '' ) )
+            entry[ 'transaction_json' ], entry[ 'model' ] = build_bulk_admin_transaction(
+                operation, entry, braintree_result, enacted_by_agent, notes
+            )
+            completed.append( entry )
+        except:
+            logging.exception( 'Unable to build the %s of the transaction: %s', operation, entry[ 'transaction' ].id )
+            results.append(
+                { 'index': entry[ 'index' ], 'status': 'failed', 'error': 'Unable to build the transaction.' }
+            )
+
+    try:
+        database.session.add_all( [ entry[ 'model' ] for entry in completed ] )
+        database.session.flush()
+        transaction_ids = [ entry[ 'model' ].id for entry in completed ]
+        queue_bulk_admin_receipts( completed )
+        database.session.commit()
+        for entry, transaction_id in zip( completed, transaction_ids ):
+            results.append( { 'index': entry[ 'index' ], 'status': 'completed', 'transaction_id': transaction_id } )
+    except:
+        database.session.rollback()
+        logging.critical(
+            'The bulk %s was made in Braintree but not saved: %s',
+            operation,
+            [ entry[ 'transaction' ].reference_number for entry in completed ]
+        )
+        for entry in completed:
+            results.append(
+                { 'index': entry[ 'index' ], 'status': 'failed', 'error': 'Made in Braintree but not saved.' }
+            )
+
+    return sorted( results, key=lambda result: result[ 'index' ] )
+
+
+def find_bulk_admin_entries( items ):
+    """Find the transaction and gift of each item, and every transaction on the gifts, with a query for each.
+
+    An item with a transaction_id is for that transaction. An item with a searchable_id is for the Gift transaction of
+    the gift.
+
+    :param items: The items of the payload.
+    :return: A tuple of the entries that were found, and the results of the items that were not.
+    """
+
+    results = []
+    transaction_ids = [ int( item[ 'transaction_id' ] ) for item in items if item.get( 'transaction_id' ) ]
+    searchable_ids = []
+    for item in items:
+        if not item.get( 'transaction_id' ) and item.get( 'searchable_id' ):
+            try:
+                searchable_ids.append( uuid.UUID( str( item[ 'searchable_id' ] ) ) )
+            except ValueError:
+                continue
+
+    transactions = {}
+    if transaction_ids:
+        transactions = {
+            transaction.id: transaction
+            for transaction in TransactionModel.query.filter( TransactionModel.id.in_( transaction_ids ) ).all()
+        }
+    gift_ids = { transaction.gift_id for transaction in transactions.values() }
+    gifts_by_searchable_id = {}
+    if searchable_ids:
+        gifts_by_searchable_id = {
+            gift.searchable_id: gift
+            for gift in GiftModel.query.filter( GiftModel.searchable_id.in_( searchable_ids ) ).all()
+        }
+    gift_ids.update( gift.id for gift in gifts_by_searchable_id.values() )
+
+    gifts = {}
+    transactions_by_gift = {}
+    if gift_ids:
+        gifts = { gift.id: gift for gift in GiftModel.query.filter( GiftModel.id.in_( gift_ids ) ).all() }
+        gift_transactions = TransactionModel.query \
+            .filter( TransactionModel.gift_id.in_( gift_ids ) ) \
+            .order_by( TransactionModel.id ) \
+            .all()
+        for transaction in gift_transactions:
+            transactions_by_gift.setdefault( transaction.gift_id, [] ).append( transaction )
+
+    entries = []
+    gifts_in_batch = set()
+    for index, item in enumerate( items ):
+        transaction = None
+        if item.get( 'transaction_id' ):
+            transaction = transactions.get( int( item[ 'transaction_id' ] ) )
+        elif item.get( 'searchable_id' ):
+            try:
+                gift = gifts_by_searchable_id.get( uuid.UUID( str( item[ 'searchable_id' ] ) ) )
+            except ValueError:
+                gift = None
+            if gift:
+                transaction = next(
+                    ( gift_transaction for gift_transaction in transactions_by_gift.get( gift.id, [] )
+                      if gift_transaction.type == 'Gift' ),
+                    None
+                )
+
+        if not transaction or transaction.gift_id not in gifts:
+            results.append( { 'index': index, 'status': 'invalid', 'error': 'The transaction was not found.' } )
+        elif transaction.gift_id in gifts_in_batch:
+            results.append( { 'index': index, 'status': 'invalid', 'error': 'The gift is already in the batch.' } )
+        else:
+            gifts_in_batch.add( transaction.gift_id )
+            entries.append(
+                {
+                    'index': index,
+                    'item': item,
+                    'transaction': transaction,
+                    'gift': gifts[ transaction.gift_id ],
+                    'gift_transactions': transactions_by_gift[ transaction.gift_id ]
+                }
+            )
+    return entries, results
+
+
+def get_latest_transaction( entry ):
+    """The latest transaction on the gift, as the first of GiftModel.transactions."""
+
+    return max( entry[ 'gift_transactions' ], key=lambda transaction: transaction.date_in_utc )
+
+
+def call_braintree( app, operation, entry ):
+    """Make the Braintree calls of an item, on a thread of the pool.
+
+    :param app: The application, for the context of the thread.
+    :param str operation: The operation: refund, void or correction.
+    :param dict entry: The entry of the item from find_bulk_admin_entries().
+    :return: A tuple of the Braintree result and the error, one of which is None.
+    """
+
+    with app.app_context():
+        try:
+            reference_number = entry[ 'transaction' ].reference_number
+            if operation == 'refund':
+                current_balance = get_latest_transaction( entry ).gross_gift_amount
+                return make_braintree_refund( reference_number, entry[ 'item' ][ 'amount' ], current_balance ), None
+            if operation == 'void':
+                return make_braintree_void( reference_number ), None
+
+            reallocate_to = entry[ 'item' ].get( 'reallocate_to' )
+            if reallocate_to and entry[ 'gift' ].recurring_subscription_id:
+                return reallocate_subscription( entry[ 'gift' ].recurring_subscription_id, reallocate_to ), None
+            return None, None
+        except BraintreeError as error:
+            return None, error.message
+        except KeyError as error:
+            return None, 'Missing data for required field: {}'.format( error.args[ 0 ] )
+        except:
+            logging.exception( 'The Braintree %s failed for the transaction: %s', operation, entry[ 'transaction' ].id )
+            return None, 'The Braintree {} failed.'.format( operation )
+
+
+def build_bulk_admin_transaction( operation, entry, braintree_result, enacted_by_agent, notes ):
+    """Build the new transaction of an item as the single endpoints do, without adding it to the session.
+
+    :param str operation: The operation: refund, void or correction.
+    :param dict entry: The entry of the item from find_bulk_admin_entries().
+    :param braintree_result: The Braintree result from call_braintree().
+    :param enacted_by_agent: The agent of the staff member.
+    :param str notes: The notes for the new transaction.
+    :return: A tuple of the transaction dictionary and TransactionModel.
+    """
+
+    enacted_by_agent_id = enacted_by_agent.id if enacted_by_agent else None
+    if operation == 'correction':
+        if entry[ 'item' ].get( 'reallocate_to' ):
+            entry[ 'gift' ].given_to = entry[ 'item' ][ 'reallocate_to' ]
+        transaction_json = {
+            'gift_id': entry[ 'gift' ].id,
+            'date_in_utc': datetime.datetime.utcnow().strftime( '%Y-%m-%d %H:%M:%S' ),
+            'enacted_by_agent_id': enacted_by_agent_id,
+            'type': 'Correction',
+            'status': 'Completed',
+            'reference_number': entry[ 'transaction' ].reference_number,
+            'gross_gift_amount': entry[ 'item' ][ 'corrected_gross_gift_amount' ],
+            'fee': entry[ 'item' ].get( 'fee', '0.00' ),
+            'notes': notes
+        }
+        return transaction_json, from_json( TransactionSchema(), transaction_json ).data
+
+    transaction_json = to_json( TransactionSchema(), entry[ 'transaction' ] ).data
+    transaction_json[ 'gift_id' ] = entry[ 'transaction' ].gift_id
+    transaction_json[ 'notes' ] = notes
+    transaction_json[ 'enacted_by_agent_id' ] = enacted_by_agent_id
+
+    gross_amount = get_latest_transaction( entry ).gross_gift_amount
+    if operation == 'refund':
+        return build_refund_transaction( transaction_json, braintree_result, gross_amount )
+    return build_void_transaction( transaction_json, braintree_result, gross_amount )
+
+
+def queue_bulk_admin_receipts( entries ):
+    """Add the receipts of the new transactions to the email outbox inside a SAVEPOINT, with one search for the users
+    of all the gifts. Receipts that cannot be queued are rolled back and logged, and the transactions are kept.
+
+    :param entries: The entries with the new transactions, flushed for their ID's.
+    :return:
+    """
+
+    if not entries:
+        return
+
+    savepoint = database.session.begin_nested()
+    try:
+        users = find_users( [ entry[ 'gift' ] for entry in entries ] )
+        receipts = []
+        for entry in entries:
+            transaction_json = entry[ 'transaction_json' ]
+            transaction_json[ 'gift_id' ] = entry[ 'gift' ].id
+            gift_transaction = next(
+                ( transaction for transaction in entry[ 'gift_transactions' ] if transaction.type == 'Gift' ),
+                entry[ 'transaction' ]
+            )
+            email_payload = format_email_payload(
+                transaction_json,
+                users[ entry[ 'gift' ].id ],
+                entry[ 'gift' ],
+                gift_transaction.date_in_utc,
+                bool( entry[ 'gift' ].recurring_subscription_id )
+            )
+            if transaction_json[ 'type' ] == 'Refund':
+                email_payload[ 'past_amount' ] = str( get_latest_transaction( entry ).gross_gift_amount )
+            receipts.append( ( email_payload, entry[ 'model' ].id ) )
+        queue_emails( 'receipt', receipts )
+        savepoint.commit()
+    except:
+        savepoint.rollback()
+        logging.exception( 'The receipts of the bulk operation could not be queued.' )
@@ -3,15 +3,14 @@ import datetime
 import logging
 from decimal import Decimal
 
-import braintree
 from flask import current_app
 
 from application.exceptions.exception_critical_path import AdminFindGiftPathError
 from application.exceptions.exception_critical_path import AdminTransactionModelPathError
 from application.exceptions.exception_critical_path import AdminUpdateSubscriptionPathError
 from application.flask_essentials import database
+from application.helpers.braintree_api import get_braintree_gateway
 from application.helpers.braintree_api import handle_braintree_errors
-from application.helpers.braintree_api import init_braintree_credentials
 from application.helpers.model_serialization import from_json
 from application.models.agent import AgentModel
 from application.models.gift import GiftModel
@@ -48,22 +47,19 @@ def reallocate_subscription( recurring_subscription_id, reallocate_to ):
     :return: Braintree subscription
     """
 
-    # Configure Braintree.
-    init_braintree_credentials( current_app )
-
     merchant_account_id = {
         'NERF': current_app.config[ 'NUMBERSUSA' ],
         'ACTION': current_app.config[ 'NUMBERSUSA_ACTION' ]
     }
 
     # This is an administrative function and we allow them to grab a default payment method.
-    subscription = braintree.Subscription.find( recurring_subscription_id )
+    subscription = get_braintree_gateway().subscription.find( recurring_subscription_id )
 
     # Getting this far, we can now update the subscription to the new plan and merchant account ID as required.
     # The original Braintree transaction maintains the same merchant account ID for historical significance.
     # The original Braintree transaction that is reallocated will have the new subscription plan ID.
     # New Braintree transactions from the subscription will have new merchant account ID/subscription plan ID.
-    braintree_subscription = braintree.Subscription.update(
+    braintree_subscription = get_braintree_gateway().subscription.update(
         recurring_subscription_id,
         {
             'id': recurring_subscription_id,
@@ -7,9 +7,9 @@ from application.exceptions.exception_critical_path import AdminTransactionModel
 from application.exceptions.exception_model import ModelGiftImproperFieldError
 from application.flask_essentials import database
 from application.helpers.model_serialization import from_json
-from application.models.agent import AgentModel
+from application.helpers.reference_data import find_agent
+from application.helpers.reference_data import find_method_used
 from application.models.gift import GiftModel
-from application.models.method_used import MethodUsedModel
 from application.schemas.transaction import TransactionSchema
 # pylint: disable=bare-except
 # flake8: noqa:E722
@@ -47,11 +47,11 @@ def record_bounced_check( payload ):
 
     # Make sure the gift exists and that it has method_used='Check'.
     # Do not modify the database if method_used is not cCheck. Handle with app.errorhandler().
-    method_used = MethodUsedModel.get_method_used( 'name', 'Check' )
+    method_used = find_method_used( 'name', 'Check' )
     if gift_model.method_used_id != method_used.id:
         raise ModelGiftImproperFieldError
 
-    enacted_by_agent = AgentModel.get_agent( 'Staff Member', 'user_id', payload[ 'user_id' ] )
+    enacted_by_agent = find_agent( 'Staff Member', 'user_id', payload[ 'user_id' ] )
 
     try:
         # If gift exists and method_used is a check, record thet the check bounced.
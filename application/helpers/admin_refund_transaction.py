@@ -1,15 +1,12 @@
 """Module that handles the refund of a Braintree transaction."""
-from flask import current_app
-
 from application.exceptions.exception_critical_path import AdminBuildModelsPathError
 from application.exceptions.exception_critical_path import AdminTransactionModelPathError
 from application.flask_essentials import database
-from application.helpers.braintree_api import init_braintree_credentials
 from application.helpers.braintree_api import make_braintree_refund
 from application.helpers.model_serialization import from_json
 from application.helpers.model_serialization import to_json
-from application.models.agent import AgentModel
-from application.models.gift import GiftModel
+from application.helpers.reference_data import find_agent
+from application.helpers.transaction_helpers import get_gift_balance
 from application.models.transaction import TransactionModel
 from application.schemas.braintree_sale import BraintreeSaleSchema
 from application.schemas.transaction import TransactionSchema
@@ -43,8 +40,7 @@ def refund_transaction( payload ):
     except:
         raise AdminTransactionModelPathError( where='parent' )
 
-    transactions = TransactionModel.query.filter_by( gift_id=transaction_model.gift_id ).all()
-    current_balance = transactions[ -1 ].gross_gift_amount
+    current_balance = get_gift_balance( transaction_model.gift_id )
 
     # If the model cannot be built do not continue to Braintree.
     # Raise an exception.
@@ -58,37 +54,46 @@ def refund_transaction( payload ):
     except:
         raise AdminBuildModelsPathError()
 
-    # Configure Braintree so we can generate a refund.
-    init_braintree_credentials( current_app )
-
     # Function make_braintree_refund() returns: a Braintree refund transaction.
     transaction_refund = make_braintree_refund( braintree_id, payload[ 'amount' ], current_balance )
 
     # Need to attach the user who is doing the reallocation.
-    enacted_by_agent = AgentModel.get_agent( 'Staff Member', 'user_id', payload[ 'user_id' ] )
+    enacted_by_agent = find_agent( 'Staff Member', 'user_id', payload[ 'user_id' ] )
     transaction_json[ 'enacted_by_agent_id' ] = enacted_by_agent.id
 
     try:
-        # Use BraintreeSaleSchema to populate gift and transaction dictionaries.
-        braintree_schema = BraintreeSaleSchema()
-        braintree_schema.context = {
-            'gift': {},
-            'transaction': transaction_json
-        }
-        braintree_sale = braintree_schema.dump( transaction_refund.transaction )
-        transaction_json = braintree_sale.data[ 'transaction' ]
-        transaction_json.pop( 'id' )
-
-        gift_model = GiftModel.query.get( transaction_json[ 'gift_id' ] )
-        gross_amount = gift_model.transactions[ 0 ].gross_gift_amount
-        transaction_json[ 'gross_gift_amount' ] += gross_amount
-
-        transaction_refund_model = from_json( TransactionSchema(), transaction_json )
-        database.session.add( transaction_refund_model.data )
+        transaction_json, transaction_refund_model = build_refund_transaction(
+            transaction_json, transaction_refund, current_balance
+        )
+
+        database.session.add( transaction_refund_model )
         database.session.commit()
         database.session.flush()
-        transaction_json[ 'id' ] = transaction_refund_model.data.id
+        transaction_json[ 'id' ] = transaction_refund_model.id
     except:
         raise AdminBuildModelsPathError()
 
     return transaction_json
+
+
+def build_refund_transaction( transaction_json, transaction_refund, gross_amount ):
+    """Build the refund transaction from the Braintree refund, without adding it to the session.
+
+    :param dict transaction_json: The refunded transaction, with the gift ID, notes and agent of the refund.
+    :param transaction_refund: The Braintree refund result.
+    :param gross_amount: The gross gift amount of the latest transaction on the gift.
+    :return: A tuple of the refund transaction dictionary and TransactionModel.
+    """
+
+    # Use BraintreeSaleSchema to populate gift and transaction dictionaries.
+    braintree_schema = BraintreeSaleSchema()
+    braintree_schema.context = {
+        'gift': {},
+        'transaction': transaction_json
+    }
+    braintree_sale = braintree_schema.dump( transaction_refund.transaction )
+    transaction_json = braintree_sale.data[ 'transaction' ]
+    transaction_json.pop( 'id' )
+    transaction_json[ 'gross_gift_amount' ] += gross_amount
+
+    return transaction_json, from_json( TransactionSchema(), transaction_json ).data
@@ -1,8 +1,8 @@
 """Module for creating an administrative sale with Braintree."""
 import datetime
 
-from application.models.agent import AgentModel
-from application.models.method_used import MethodUsedModel
+from application.helpers.reference_data import find_agent
+from application.helpers.reference_data import find_method_used
 # pylint: disable=bare-except
 # flake8: noqa:E722
 
@@ -65,10 +65,10 @@ def make_admin_sale( payload ):
     # This is not a Braintree transaction and do set the Braintree customer ID to None.
     payload[ 'user' ][ 'customer_id' ] = ''
 
-    sourced_from_agent = AgentModel.get_agent( 'Staff Member', 'user_id', payload[ 'sourced_from_agent_user_id' ] )
+    sourced_from_agent = find_agent( 'Staff Member', 'user_id', payload[ 'sourced_from_agent_user_id' ] )
     enacted_by_agent = sourced_from_agent
 
-    method_used = MethodUsedModel.get_method_used( 'name', payload[ 'gift' ][ 'method_used' ] )
+    method_used = find_method_used( 'name', payload[ 'gift' ][ 'method_used' ] )
 
     # Create the gift dictionary from admin payload.
 
@@ -108,7 +108,7 @@ def make_admin_sale( payload ):
     )
 
     if is_check_money_order:
-        bank_agent = AgentModel.get_agent( 'Organization', 'name', 'Fidelity Bank' )
+        bank_agent = find_agent( 'Organization', 'name', 'Fidelity Bank' )
         bank_agent_id = bank_agent.id
 
         transactions.append(
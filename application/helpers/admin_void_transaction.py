@@ -1,15 +1,12 @@
 """Module that handles the details of voiding a transaction."""
-from flask import current_app
-
 from application.exceptions.exception_critical_path import AdminBuildModelsPathError
 from application.exceptions.exception_critical_path import AdminTransactionModelPathError
 from application.flask_essentials import database
-from application.helpers.braintree_api import init_braintree_credentials
 from application.helpers.braintree_api import make_braintree_void
 from application.helpers.model_serialization import from_json
 from application.helpers.model_serialization import to_json
-from application.models.agent import AgentModel
-from application.models.gift import GiftModel
+from application.helpers.reference_data import find_agent
+from application.helpers.transaction_helpers import get_gift_balance
 from application.models.transaction import TransactionModel
 from application.schemas.braintree_sale import BraintreeSaleSchema
 from application.schemas.transaction import TransactionSchema
@@ -50,31 +47,42 @@ def void_transaction( payload ):
         raise AdminBuildModelsPathError()
 
     # Generate Braintree void, where make_braintree_void() returns a Braintree voided transaction.
-    init_braintree_credentials( current_app )
-
     transaction_void = make_braintree_void( braintree_id )
 
     # Need to attach the user who is doing the void.
-    enacted_by_agent = AgentModel.get_agent( 'Staff Member', 'user_id', payload[ 'user_id' ] )
+    enacted_by_agent = find_agent( 'Staff Member', 'user_id', payload[ 'user_id' ] )
     transaction_json[ 'enacted_by_agent_id' ] = enacted_by_agent.id
 
     try:
-        # Use BraintreeSaleSchema to populate gift and transaction dictionaries.
-        braintree_schema = BraintreeSaleSchema()
-        braintree_schema.context = { 'gift': {}, 'transaction': transaction_json }
-        braintree_sale = braintree_schema.dump( transaction_void.transaction )
-        transaction_json = braintree_sale.data[ 'transaction' ]
-
-        gift_model = GiftModel.query.get( transaction_json[ 'gift_id' ] )
-        gross_amount = gift_model.transactions[ 0 ].gross_gift_amount
-        transaction_json[ 'gross_gift_amount' ] += gross_amount
-
-        transaction_void_model = from_json( TransactionSchema(), transaction_json )
-        database.session.add( transaction_void_model.data )
+        gross_amount = get_gift_balance( transaction_json[ 'gift_id' ] )
+        transaction_json, transaction_void_model = build_void_transaction(
+            transaction_json, transaction_void, gross_amount
+        )
+
+        database.session.add( transaction_void_model )
         database.session.commit()
         database.session.flush()
-        transaction_json[ 'id' ] = transaction_void_model.data.id
+        transaction_json[ 'id' ] = transaction_void_model.id
     except:
         raise AdminBuildModelsPathError()
 
     return transaction_json
+
+
+def build_void_transaction( transaction_json, transaction_void, gross_amount ):
+    """Build the void transaction from the Braintree void, without adding it to the session.
+
+    :param dict transaction_json: The voided transaction, with the gift ID, notes and agent of the void.
+    :param transaction_void: The Braintree void result.
+    :param gross_amount: The gross gift amount of the latest transaction on the gift.
+    :return: A tuple of the void transaction dictionary and TransactionModel.
+    """
+
+    # Use BraintreeSaleSchema to populate gift and transaction dictionaries.
+    braintree_schema = BraintreeSaleSchema()
+    braintree_schema.context = { 'gift': {}, 'transaction': transaction_json }
+    braintree_sale = braintree_schema.dump( transaction_void.transaction )
+    transaction_json = braintree_sale.data[ 'transaction' ]
+    transaction_json[ 'gross_gift_amount' ] += gross_amount
+
+    return transaction_json, from_json( TransactionSchema(), transaction_json ).data
@@ -1,8 +1,21 @@
-"""A module to support Braintree API operations."""
+"""A module to support Braintree API operations.
+
+The Braintree API is called through a gateway built once per worker process by get_braintree_gateway(), rather than
+the global braintree.Configuration set up on every request. The gateway sends its requests on the pooled, keep-alive
+session for the BRAINTREE prefix ( see http_session.py ), with the BRAINTREE_CONNECT_TIMEOUT and
+BRAINTREE_READ_TIMEOUT timeouts, and records the latency of each call for get_braintree_latency_statistics().
+"""
+import functools
 import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
 from decimal import Decimal
 
 import braintree
+from braintree.util.http import Http
 from flask import current_app
 
 from application.exceptions.exception_braintree import BraintreeAttributeError
@@ -11,12 +24,22 @@ from application.exceptions.exception_braintree import BraintreeNotInSettlingOrS
 from application.exceptions.exception_braintree import BraintreeNotInSubmittedForSettlementError
 from application.exceptions.exception_braintree import BraintreeNotIsSuccessError
 from application.exceptions.exception_braintree import BraintreeRefundWithNegativeAmountError
-from application.models.agent import AgentModel
-from application.models.method_used import MethodUsedModel
+from application.helpers.http_session import get_http_session
+from application.helpers.http_session import get_http_timeout
+from application.helpers.reference_data import find_agent
+from application.helpers.reference_data import find_method_used
 from application.schemas.braintree_sale import BraintreeSaleSchema
 # pylint: disable=bare-except
 # flake8: noqa:E722
 
+BRAINTREE_HTTP_PREFIX = 'BRAINTREE'
+
+BRAINTREE_GATEWAYS = {}
+BRAINTREE_GATEWAYS_LOCK = threading.Lock()
+
+BRAINTREE_LATENCY = {}
+BRAINTREE_LATENCY_LOCK = threading.Lock()
+
 
 def make_braintree_refund( braintree_id, amount, current_balance ):
     """Use the payload to build a Braintree Transaction.refund(). The sale has to be in a status of settling or
@@ -60,7 +83,7 @@ def make_braintree_void( braintree_id ):
     # Ensure transaction is in status of submitted for settlement.
     if transaction.status == braintree.Transaction.Status.SubmittedForSettlement:
         # Void braintree transaction.
-        result_void = braintree.Transaction.void( transaction.id )
+        result_void = get_braintree_gateway().transaction.void( transaction.id )
         if result_void.is_success:
             return result_void
         errors = handle_braintree_errors( result_void )
@@ -158,11 +181,11 @@ def make_braintree_sale( payload, app ):
 
     # Get the sourced from agent ID and if it doesn't exist handle.
     if gift[ 'method_used' ] == 'Admin-Entered Credit Card':
-        sourced_from_agent = AgentModel.get_agent( 'Staff Member', 'user_id', payload[ 'sourced_from_agent_user_id' ] )
+        sourced_from_agent = find_agent( 'Staff Member', 'user_id', payload[ 'sourced_from_agent_user_id' ] )
         gift[ 'sourced_from_agent_id' ] = sourced_from_agent.id
 
     # Get the enacted by agent ID and if it doesn't exist handle.
-    enacted_by_agent = AgentModel.get_agent( 'Organization', 'name', 'Braintree' )
+    enacted_by_agent = find_agent( 'Organization', 'name', 'Braintree' )
     transaction[ 'enacted_by_agent_id' ] = enacted_by_agent.id
 
     # On success of sale return the model dictionaries.
@@ -175,7 +198,7 @@ def get_payment_method_token( payload ):
     :param payload: The payload includes the user, gift, and transaction.
     :return:
     """
-    method_used = MethodUsedModel.get_method_used( 'name', payload[ 'gift' ][ 'method_used' ] )
+    method_used = find_method_used( 'name', payload[ 'gift' ][ 'method_used' ] )
     braintree_customer = create_braintree_customer( payload[ 'user' ], method_used.billing_address_required  )
     payload[ 'user' ][ 'customer_id' ] = braintree_customer.id
     # This was newly created and the only payment method associated with the customer.
@@ -227,7 +250,7 @@ def create_braintree_customer( user, billing_address_required ):
             }
         }
 
-    result_customer = braintree.Customer.create( customer )
+    result_customer = get_braintree_gateway().customer.create( customer )
 
     if result_customer.is_success:
         return result_customer.customer
@@ -246,7 +269,7 @@ def create_braintree_sale( payment_method_token, user, gross_gift_amount, mercha
     :raises BraintreeIsNotSuccess: Braintree operation was unsuccessful.
     """
 
-    result_sale = braintree.Transaction.sale(
+    result_sale = get_braintree_gateway().transaction.sale(
         {
             'amount': gross_gift_amount,
             'payment_method_token': payment_method_token,
@@ -275,7 +298,7 @@ def create_braintree_subscription( payment_method_token, plan_id, gross_gift_amo
     :raises BraintreeIsNotSuccess: Braintree operation was unsuccessful.
     """
 
-    result_subscription = braintree.Subscription.create(
+    result_subscription = get_braintree_gateway().subscription.create(
         {
             'payment_method_token': payment_method_token,
             'plan_id': plan_id,
@@ -299,7 +322,7 @@ def create_braintree_refund( transaction_id, amount ):
     """
 
     try:
-        return braintree.Transaction.refund( transaction_id, amount )
+        return get_braintree_gateway().transaction.refund( transaction_id, amount )
     except braintree.exceptions.not_found_error.NotFoundError:
         raise BraintreeNotFoundError()
 
@@ -312,7 +335,7 @@ def get_braintree_transaction( braintree_id ):
     """
 
     try:
-        transaction = braintree.Transaction.find( braintree_id )
+        transaction = get_braintree_gateway().transaction.find( braintree_id )
     except braintree.exceptions.not_found_error.NotFoundError:
         raise BraintreeNotFoundError()
 
@@ -320,7 +343,7 @@ def get_braintree_transaction( braintree_id ):
 
 
 def init_braintree_credentials( app ):
-    """Configure the Braintree API."""
+    """Configure the global Braintree API, used by the scripts. The application uses get_braintree_gateway()."""
 
     with app.app_context():
 
@@ -341,8 +364,32 @@ def init_braintree_credentials( app ):
         )
 
 
+def get_braintree_gateway( app=None ):
+    """The Braintree gateway for the worker process, built once from app.config.
+
+    The gateway is keyed on the process ID, as the pooled sessions are, so that a forked worker builds its own.
+
+    :param app: The app, or None for the current app.
+    :return: Braintree gateway.
+    """
+
+    app = app or current_app._get_current_object()  # pylint: disable=protected-access
+    gateway_key = ( os.getpid(), app.config[ 'MERCHANT_ID' ], app.config[ 'BRAINTREE_ENVIRONMENT' ] )
+    gateway = BRAINTREE_GATEWAYS.get( gateway_key )
+    if gateway:
+        return gateway
+
+    with BRAINTREE_GATEWAYS_LOCK:
+        # Another greenlet may have built the gateway while this one waited on the lock.
+        gateway = BRAINTREE_GATEWAYS.get( gateway_key )
+        if not gateway:
+            gateway = init_braintree_gateway( app )
+            BRAINTREE_GATEWAYS[ gateway_key ] = gateway
+    return gateway
+
+
 def init_braintree_gateway( app ):
-    """Configure the Braintree API gateway.
+    """Configure the Braintree API gateway, with its requests sent on the pooled session for the BRAINTREE prefix.
 
     :param app: The current app.
     :return: Braintree gateway.
@@ -361,24 +408,113 @@ def init_braintree_gateway( app ):
         else:
             braintree_environment = braintree.Environment.Sandbox
 
+        http_strategy = functools.partial(
+            PooledBraintreeHttp,
+            session=get_http_session( BRAINTREE_HTTP_PREFIX ),
+            timeout=get_http_timeout( BRAINTREE_HTTP_PREFIX )
+        )
         gateway = braintree.BraintreeGateway(
             braintree.Configuration(
                 braintree_environment,
                 merchant_id=merchant_id,
                 public_key=public_key,
-                private_key=private_key
+                private_key=private_key,
+                http_strategy=http_strategy
             )
         )
 
         return gateway
 
 
-def generate_braintree_token():
+class PooledBraintreeHttp( Http ):
+    """The Braintree HTTP strategy: sends the request on a pooled session and records its latency."""
+
+    def __init__( self, config, environment=None, session=None, timeout=None ):
+        super().__init__( config, environment )
+        self.session = session
+        self.timeout = timeout
+
+    def http_do( self, http_verb, path, headers, request_body ):
+        """Send a request to the Braintree API.
+
+        :param str http_verb: The HTTP method.
+        :param str path: The path, or the full URL.
+        :param dict headers: The headers built by Braintree.
+        :param request_body: The body, or a tuple of the body and files.
+        :return: The status code and text of the response.
+        """
+
+        data = request_body
+        files = None
+        if isinstance( request_body, tuple ):
+            data, files = request_body
+
+        base_url = self.config.base_url()
+        full_path = path if path.startswith( base_url ) else base_url + path
+        if self.config.environment == braintree.Environment.Development:
+            verify = False
+        else:
+            verify = self.environment.ssl_certificate
+
+        started = time.perf_counter()
+        try:
+            response = self.session.request(
+                http_verb, full_path, headers=headers, data=data, files=files, verify=verify, timeout=self.timeout
+            )
+        finally:
+            record_braintree_latency( http_verb, path, time.perf_counter() - started )
+        return [ response.status_code, response.text ]
+
+
+def record_braintree_latency( http_verb, path, seconds ):
+    """Record the latency of a call to the Braintree API by method and resource, e.g. POST transactions.
+
+    :param str http_verb: The HTTP method.
+    :param str path: The full URL, e.g. https://<host>/merchants/<merchant_id>/transactions/<id>/void, or the path.
+    :param float seconds: The latency.
+    :return:
+    """
+
+    parts = [ part for part in urllib.parse.urlparse( path ).path.split( '/' ) if part ]
+    if len( parts ) > 1 and parts[ 0 ] == 'merchants':
+        parts = parts[ 2: ]
+    resource = parts[ 0 ] if parts else '/'
+    key = '{} {}'.format( http_verb.upper(), resource )
+
+    with BRAINTREE_LATENCY_LOCK:
+        latency = BRAINTREE_LATENCY.setdefault( key, { 'calls': 0, 'total_seconds': 0.0, 'maximum_seconds': 0.0 } )
+        latency[ 'calls' ] += 1
+        latency[ 'total_seconds' ] += seconds
+        latency[ 'maximum_seconds' ] = max( latency[ 'maximum_seconds' ], seconds )
+    logging.debug( 'Braintree %s: %.3f seconds', key, seconds )
+
+
+def get_braintree_latency_statistics():
+    """The number of calls, and mean and maximum latency, of the Braintree API by method and resource.
+
+    :return: A dictionary keyed by method and resource.
+    """
+
+    with BRAINTREE_LATENCY_LOCK:
+        return {
+            key: {
+                'calls': latency[ 'calls' ],
+                'mean_seconds': latency[ 'total_seconds' ] / latency[ 'calls' ],
+                'maximum_seconds': latency[ 'maximum_seconds' ]
+            }
+            for key, latency in BRAINTREE_LATENCY.items()
+        }
+
+
+def generate_braintree_token( merchant_account_id=None ):
     """Will get a Braintree token for a transaction.
+    :param str merchant_account_id: The merchant account ID, or None for the default merchant account.
     :return: Braintree generated token.
     """
 
-    return braintree.ClientToken.generate()
+    if merchant_account_id:
+        return get_braintree_gateway().client_token.generate( { 'merchant_account_id': merchant_account_id } )
+    return get_braintree_gateway().client_token.generate()
 
 
 def handle_braintree_errors( result ):
@@ -0,0 +1,156 @@
+"""A module for a pool of Braintree client tokens, generated ahead of the donation forms that ask for them.
+
+Every load of a donation form calls /donation/braintree/get-token, and generating a client token is a call to
+Braintree before the donor can see the card fields. Here the job jobs/braintree_token_pool.py keeps a pool of fresh
+tokens in a Redis list per merchant account, and the endpoint pops one with a single LPOP. When the pool is empty, or
+Redis is unavailable, the endpoint generates a token with a live call as it did before.
+
+A client token is valid for 24 hours. A token is only kept in the pool for BRAINTREE_TOKEN_POOL_MAX_AGE seconds, well
+inside that lifetime, and an expired token is skipped when popped and trimmed by the refiller.
+
+The hits, misses and depth of each pool are returned by get_braintree_token_pool_statistics().
+
+Configuration in app.config:
+
+    BRAINTREE_TOKEN_POOL_SIZE: The number of tokens kept in each pool ( default 20 ).
+    BRAINTREE_TOKEN_POOL_MAX_AGE: Seconds a token is kept in the pool ( default 3600 ).
+"""
+import json
+import logging
+import time
+
+from flask import current_app
+
+from application.flask_essentials import redis_queue
+from application.helpers.braintree_api import generate_braintree_token
+# pylint: disable=bare-except
+# flake8: noqa:E722
+
+TOKEN_POOL_KEY = 'braintree:token_pool:{}'
+TOKEN_POOL_METRICS_KEY = 'braintree:token_pool:metrics'
+DEFAULT_TOKEN_POOL = 'default'
+
+DEFAULT_POOL_SIZE = 20
+DEFAULT_MAX_AGE = 3600
+
+# The most expired tokens skipped by a pop before it is counted as a miss.
+MAXIMUM_EXPIRED_POPS = 5
+
+
+def get_token_pool_config( name, default ):
+    """Get a token pool setting from app.config and fall back to the default if it is missing or empty."""
+
+    value = current_app.config.get( 'BRAINTREE_TOKEN_POOL_{}'.format( name ) )
+    if value is None or value == '':
+        return default
+    return int( value )
+
+
+def get_token_pools():
+    """The pools and the merchant account ID their tokens are generated for: None for the default merchant account.
+
+    :return: A dictionary of merchant account ID's keyed by the pool name, e.g. NERF.
+    """
+
+    return {
+        DEFAULT_TOKEN_POOL: None,
+        'NERF': current_app.config.get( 'NUMBERSUSA' ),
+        'ACTION': current_app.config.get( 'NUMBERSUSA_ACTION' )
+    }
+
+
+def pop_braintree_token( pool_name=DEFAULT_TOKEN_POOL ):
+    """Pop a fresh token from the pool, and record the hit or miss.
+
+    :param str pool_name: The name of the pool, e.g. NERF.
+    :return: The client token, or None if the pool has no fresh token or Redis is unavailable.
+    """
+
+    try:
+        key = TOKEN_POOL_KEY.format( pool_name )
+        now = time.time()
+        for _ in range( MAXIMUM_EXPIRED_POPS ):
+            entry = redis_queue.connection.lpop( key )
+            if entry is None:
+                break
+            entry = json.loads( entry.decode( 'utf-8' ) )
+            if entry[ 'expires' ] > now:
+                redis_queue.connection.hincrby( TOKEN_POOL_METRICS_KEY, '{}:hits'.format( pool_name ), 1 )
+                return entry[ 'token' ]
+        redis_queue.connection.hincrby( TOKEN_POOL_METRICS_KEY, '{}:misses'.format( pool_name ), 1 )
+    except:
+        logging.exception( 'Unable to pop a Braintree token from the pool: %s', pool_name )
+    return None
+
+
+def refill_braintree_token_pools():
+    """Trim the expired tokens from each pool and generate tokens until it is full.
+
+    :return: A dictionary keyed by pool name of the tokens added and the depth of the pool.
+    """
+
+    pool_size = get_token_pool_config( 'SIZE', DEFAULT_POOL_SIZE )
+    max_age = get_token_pool_config( 'MAX_AGE', DEFAULT_MAX_AGE )
+
+    summary = {}
+    for pool_name, merchant_account_id in get_token_pools().items():
+        key = TOKEN_POOL_KEY.format( pool_name )
+        trim_expired_tokens( key )
+
+        tokens = []
+        for _ in range( max( 0, pool_size - redis_queue.connection.llen( key ) ) ):
+            try:
+                tokens.append( generate_braintree_token( merchant_account_id ) )
+            except:
+                logging.exception( 'Unable to generate a Braintree token for the pool: %s', pool_name )
+                break
+
+        expires = time.time() + max_age
+        if tokens:
+            pipeline = redis_queue.connection.pipeline()
+            for token in tokens:
+                pipeline.rpush( key, json.dumps( { 'token': token, 'expires': expires } ) )
+            pipeline.execute()
+        summary[ pool_name ] = { 'added': len( tokens ), 'depth': redis_queue.connection.llen( key ) }
+    return summary
+
+
+def trim_expired_tokens( key ):
+    """Remove the expired tokens from the front of a pool. The tokens are pushed in order, so the oldest are first.
+
+    :param str key: The Redis key of the pool.
+    :return: The number of tokens removed.
+    """
+
+    now = time.time()
+    removed = 0
+    entry = redis_queue.connection.lindex( key, 0 )
+    while entry is not None and json.loads( entry.decode( 'utf-8' ) )[ 'expires' ] <= now:
+        redis_queue.connection.lpop( key )
+        removed += 1
+        entry = redis_queue.connection.lindex( key, 0 )
+    return removed
+
+
+def get_braintree_token_pool_statistics():
+    """The depth, hits and misses of each pool.
+
+    :return: A dictionary keyed by pool name.
+    """
+
+    metrics = {
+        field.decode( 'utf-8' ): int( value )
+        for field, value in redis_queue.connection.hgetall( TOKEN_POOL_METRICS_KEY ).items()
+    }
+
+    statistics = {}
+    for pool_name in get_token_pools():
+        hits = metrics.get( '{}:hits'.format( pool_name ), 0 )
+        misses = metrics.get( '{}:misses'.format( pool_name ), 0 )
+        statistics[ pool_name ] = {
+            'depth': redis_queue.connection.llen( TOKEN_POOL_KEY.format( pool_name ) ),
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / ( hits + misses ) if hits + misses else None
+        }
+    return statistics
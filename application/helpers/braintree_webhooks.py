@@ -15,11 +15,11 @@ from application.exceptions.exception_critical_path import BraintreeWebhooksIDPa
 from application.flask_essentials import database
 from application.helpers.model_serialization import from_json
 from application.helpers.model_serialization import to_json
-from application.models.agent import AgentModel
+from application.helpers.reference_data import find_agent
+from application.helpers.reference_data import find_method_used
 from application.models.caged_donor import CagedDonorModel
 from application.models.gift import GiftModel
 from application.models.gift_thank_you_letter import GiftThankYouLetterModel
-from application.models.method_used import MethodUsedModel
 from application.models.queued_donor import QueuedDonorModel
 from application.schemas.caged_donor import CagedDonorSchema
 from application.schemas.gift import GiftSchema
@@ -114,7 +114,7 @@ def get_agent_id():
     :return: agent_id
     """
 
-    agent = AgentModel.get_agent( 'Organization', 'name', 'Donate API' )
+    agent = find_agent( 'Organization', 'name', 'Donate API' )
     agent_id = agent.id
 
     return agent_id
@@ -148,8 +148,8 @@ def get_gift_with_customer_id( customer_id ):
     try:
         # Find if a gift exists with the customer ID. We only have to look at Online or administrative online sales.
         # The customer_id is renewed on each sale and so should be unique to that donation.
-        id_online = MethodUsedModel.get_method_used( 'name', 'Web Form Credit Card' ).id
-        id_credit_card = MethodUsedModel.get_method_used( 'name', 'Admin-Entered Credit Card' ).id
+        id_online = find_method_used( 'name', 'Web Form Credit Card' ).id
+        id_credit_card = find_method_used( 'name', 'Admin-Entered Credit Card' ).id
         gift_with_customer_id = GiftModel.query \
             .filter( or_( GiftModel.method_used_id == id_online, GiftModel.method_used_id == id_credit_card ) ) \
             .filter_by( customer_id=customer_id ) \
@@ -1,13 +1,20 @@
 """A module to support the construction of models given dictionaries across the application."""
-from application.controllers.campaign import get_campaign_by_id
-from application.controllers.campaign import get_campaigns_by_type
+import logging
+
+from application.exceptions.exception_critical_path import BuildEmailPayloadPathError
 from application.exceptions.exception_critical_path import BuildModelsGiftTransactionsPathError
 from application.exceptions.exception_critical_path import BuildModelsQueuedDonorPathError
+from application.exceptions.exception_critical_path import DonateBuildModelPathError
 from application.flask_essentials import database
+from application.helpers.email import queue_admin_email
 from application.helpers.model_serialization import from_json
+from application.helpers.reference_data import find_campaign
+from application.helpers.reference_data import find_default_campaign
 from application.helpers.ultsys_user import create_user
 from application.helpers.ultsys_user import find_ultsys_user
-from application.helpers.ultsys_user import update_ultsys_user
+from application.helpers.ultsys_user_mirror import mirror_created_user
+from application.helpers.ultsys_user_updates import queue_ultsys_user_update
+from application.models.gift_thank_you_letter import GiftThankYouLetterModel
 from application.schemas.gift import GiftSchema
 from application.schemas.queued_donor import QueuedDonorSchema
 from application.schemas.transaction import TransactionSchema
@@ -15,14 +22,20 @@ from application.schemas.transaction import TransactionSchema
 # flake8: noqa:E722
 
 
-def build_models_sale( user, gift, transactions ):
+def build_models_sale( user, gift, transactions, receipt=False, commit=True ):
     """Given the dictionaries for the models go ahead and build them.
 
+    The transactions are attached to the gift through the relationship, so that a single flush inserts the gift and
+    then its transactions and gets all of their ID's. With commit=False the caller owns the unit of work: the models
+    are flushed but not committed, and the caller commits once, e.g. with the queued donor in post_donation().
+
     :param dict user: User dictionary with necessary model fields, and may have additional fields.
     :param dict gift: Gift dictionary with necessary model fields, and may have additional fields.
     :param transactions: The list of transactions. If this is a Braintree sale, for example, there will be one
            transaction in the list. On the other hand if this is an administrative sale where the method used is
            a check or money order there will be 2 transactions.
+    :param bool receipt: Whether to add the receipt to the email outbox in the same database transaction.
+    :param bool commit: Whether to commit, or leave the commit to the caller.
     :return:
     """
 
@@ -30,44 +43,100 @@ def build_models_sale( user, gift, transactions ):
     # The user is stored in QueuedDonorModel and the gift is given a user_id = -2
     user_id = -2
 
-    # Build the gift model dictionary, and flush to get new auto-incremented gift_id.
     try:
         # Build the gift.
         if not gift[ 'campaign_id' ]:
             gift[ 'campaign_id' ] = None
-        elif not get_campaign_by_id( gift[ 'campaign_id' ] ):
-            gift[ 'campaign_id' ] = get_campaigns_by_type( 'is_default', 1 )[ 0 ].id
+        elif not find_campaign( gift[ 'campaign_id' ] ):
+            gift[ 'campaign_id' ] = find_default_campaign().id
 
         gift[ 'user_id' ] = user_id
-        gift_model = from_json( GiftSchema(), gift )
-        database.session.add( gift_model.data )
-        database.session.flush()
-        gift_id = gift_model.data.id
-        user[ 'gift_id' ] = gift_id
-        user[ 'gift_searchable_id' ] = gift_model.data.searchable_id
-        user[ 'campaign_id' ] = gift_model.data.campaign_id
+        gift_model = from_json( GiftSchema(), gift ).data
+        database.session.add( gift_model )
 
-        # Build the transactions.
+        # Build the transactions. The gift ID is set from the relationship when the gift is flushed.
+        transaction_models = []
         for transaction in transactions:
-            transaction[ 'gift_id' ] = gift_id
-            transaction_model = from_json( TransactionSchema(), transaction )
-            database.session.add( transaction_model.data )
-            database.session.flush()
-            transaction[ 'id' ] = transaction_model.data.id
-        database.session.commit()
+            transaction.pop( 'gift_id', None )
+            transaction_model = from_json( TransactionSchema( partial=( 'gift_id', ) ), transaction ).data
+            transaction_model.gift = gift_model
+            database.session.add( transaction_model )
+            transaction_models.append( transaction_model )
+
+        # One flush for the ID's of the gift and all its transactions.
+        database.session.flush()
+        user[ 'gift_id' ] = gift_model.id
+        user[ 'gift_searchable_id' ] = gift_model.searchable_id
+        user[ 'campaign_id' ] = gift_model.campaign_id
+        for transaction, transaction_model in zip( transactions, transaction_models ):
+            transaction[ 'gift_id' ] = gift_model.id
+            transaction[ 'id' ] = transaction_model.id
+
+        if receipt:
+            queue_sale_receipt( user, gift, transactions )
+        if commit:
+            database.session.commit()
     except:
         database.session.rollback()
         raise BuildModelsGiftTransactionsPathError()
 
 
-def build_model_queued_donor( user ):
+def queue_sale_receipt( user, gift, transactions ):
+    """Add the receipt for the sale to the email outbox inside a SAVEPOINT. A receipt that cannot be queued is rolled
+    back on its own and logged, and the sale carries on.
+
+    :param dict user: User dictionary.
+    :param dict gift: Gift dictionary.
+    :param transactions: The list of transactions, where the first is the one receipted.
+    :return:
+    """
+
+    savepoint = database.session.begin_nested()
+    try:
+        recurring = bool( gift.get( 'recurring_subscription_id' ) )
+        queue_admin_email( transactions[ 0 ], user, recurring )
+        savepoint.commit()
+    except BuildEmailPayloadPathError as error:
+        savepoint.rollback()
+        logging.exception( error.message )
+    except:
+        savepoint.rollback()
+        logging.exception( 'The receipt could not be queued for the gift: %s', user.get( 'gift_id' ) )
+
+
+def build_gift_thank_you_letter( gift_id ):
+    """Add the gift to the thank you letters inside a SAVEPOINT, without committing. A failure is rolled back on its
+    own and logged.
+
+    :param int gift_id: The ID of the gift.
+    :return:
+    """
+
+    savepoint = database.session.begin_nested()
+    try:
+        database.session.add( GiftThankYouLetterModel( gift_id=gift_id ) )
+        savepoint.commit()
+    except:
+        savepoint.rollback()
+        logging.exception( DonateBuildModelPathError().message )
+
+
+def build_model_queued_donor( user, commit=True ):
     """Given the dictionaries for the models go ahead and build them.
 
+    With commit=False the queued donor is built inside a SAVEPOINT, so that a failure rolls back the queued donor and
+    not the gift it is added with, and the caller commits.
+
     :param dict queued_donor_user: User dictionary with necessary model fields, and may have additional fields.
+    :param bool commit: Whether to commit, or leave the commit to the caller.
     :return:
     """
 
+    savepoint = None
     try:
+        if not commit:
+            savepoint = database.session.begin_nested()
+
         # Build queued donor here because: Gift needs user_id, and queued donor needs gift_id.
         queued_donor_model = from_json( QueuedDonorSchema(), user[ 'user_address' ] )
         queued_donor_model.data.gift_id = user[ 'gift_id' ]
@@ -77,9 +146,15 @@ def build_model_queued_donor( user ):
         database.session.add( queued_donor_model.data )
         database.session.flush()
         user[ 'queued_donor_id' ] = queued_donor_model.data.id
-        database.session.commit()
+        if savepoint:
+            savepoint.commit()
+        else:
+            database.session.commit()
     except:
-        database.session.rollback()
+        if savepoint:
+            savepoint.rollback()
+        elif commit:
+            database.session.rollback()
         raise BuildModelsQueuedDonorPathError()
 
 
@@ -117,6 +192,9 @@ def build_model_new( user, gross_gift_amount ):
 
     ultsys_user = find_ultsys_user( query_parameters )
 
+    # Write the new user through to the local mirror so that caging finds them before the next synchronization.
+    mirror_created_user( ultsys_user[ 0 ] )
+
     user[ 'id' ] = ultsys_user[ 0 ][ 'ID' ]
 
     return user[ 'id' ]
@@ -125,10 +203,11 @@ def build_model_new( user, gross_gift_amount ):
 def build_model_exists( user, gross_gift_amount ):
     """Given an existing user their ID that has been provided in the form or attached by caging.
 
-    Update their latest donation information.
+    Update their latest donation information: the update is queued in the write-behind buffer, and sent by the flush in
+    ultsys_user_updates.py, so that caging does not wait on the user service.
 
     :param dict user: User dictionary with necessary model fields, and may have additional fields.
     :param dict gross_gift_amount: The gross gift amount.
     """
 
-    update_ultsys_user( user, gross_gift_amount )
+    queue_ultsys_user_update( user[ 'id' ], gross_gift_amount, user.get( 'gift_id' ) )
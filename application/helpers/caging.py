@@ -9,15 +9,20 @@ from application.flask_essentials import database
 from application.flask_essentials import redis_queue
 from application.helpers.build_models import build_model_exists
 from application.helpers.build_models import build_model_new
+from application.helpers.caging_blocks import find_caging_candidates
+from application.helpers.caging_scoring import score_donor_batch
 from application.helpers.general_helper_functions import flatten_user_dict
 from application.helpers.general_helper_functions import munge_address
 from application.helpers.general_helper_functions import validate_user_payload
 from application.helpers.model_serialization import from_json
-from application.helpers.ultsys_user import find_ultsys_user
+from application.helpers.ultsys_user_mirror import find_caging_users
+from application.helpers.ultsys_user_mirror import is_mirror_usable
 from application.models.caged_donor import CagedDonorModel
+from application.models.caged_donor import normalize_street
 from application.models.gift import GiftModel
 from application.models.queued_donor import QueuedDonorModel
 from application.schemas.caged_donor import CagedDonorSchema
+from application.worker import worker_app_context
 
 
 def categorize_donor( donor_dict ):
@@ -33,8 +38,12 @@ def categorize_donor( donor_dict ):
         "user_phone_number": user_phone_number
     }
 
-    A query is made to the database for all users with the donor's last name. Then a loop is made over all the users
-    returned and matches made against the fields used for caging:
+    The searches are made on the local Ultsys user mirror when it is enabled and fresh, and otherwise on the Ultsys
+    user service: see find_caging_users().
+
+    A query is made to the database for all users with the donor's last name, or on the mirror for the users sharing a
+    blocking key with the donor ( see caging_blocks.py ), which gives the same category. Then a loop is made over all
+    the users returned and matches made against the fields used for caging:
         category = [ first_name, last_name, zipcode, street_address, email, phone_number ]
     A complete match would look like [ 1, 1, 1, 1, 1, 1, 1 ], and in this case this would indicate the donor exists.
 
@@ -69,36 +78,46 @@ def categorize_donor( donor_dict ):
 
     # Check to see if the donor has a registered email and if so pull user ID.
     if 'user_email_address' in donor_dict and donor_dict[ 'user_email_address' ]:
-        query_parameters = {
-            'search_terms': { 'email': { 'eq': donor_dict[ 'user_email_address' ] } },
-            'sort_terms': [ ]
-        }
-        users_with_given_email = find_ultsys_user( query_parameters )
+        users_with_given_email = find_caging_users( { 'email': { 'eq': donor_dict[ 'user_email_address' ] } } )
         if users_with_given_email:
             ultsys_user = users_with_given_email[ 0 ]
             return category_definitions[ 2 ], [ ultsys_user[ 'ID' ] ]
 
     # Check to see if the donor has already been caged.
     if check_if_caged( donor_dict ) == 3:
-        return category_definitions[ check_if_caged( donor_dict ) ], []
+        return category_definitions[ 3 ], []
 
     # If they don't already exist and are not previously caged: cage the donor.
-    query_parameters = {
-        'search_terms': { 'lastname': { 'eq': donor_dict[ 'user_last_name' ] } },
-        'sort_terms': []
-    }
-    users_by_last_name = find_ultsys_user( query_parameters )
+    # On the mirror only the users sharing a blocking key with the donor can be weighted, and so only they are scored.
+    if is_mirror_usable():
+        users_by_last_name = find_caging_candidates( donor_dict )
+    else:
+        users_by_last_name = find_caging_users( { 'lastname': { 'eq': donor_dict[ 'user_last_name' ] } } )
 
     # If no last names exist this is a new donor.
     if not users_by_last_name:
         return category_definitions[ 0 ], []
 
+    # Large surname cohorts are scored at once with NumPy: see caging_scoring.py.
+    maximum_weight, exists_user_ids = score_donor_batch( donor_dict, users_by_last_name )
+
+    return category_definitions[ maximum_weight ], exists_user_ids
+
+
+def score_donor( donor_dict, users ):
+    """Match each user against the donor and weight them to find the maximum weight and the matching user IDs.
+
+    :param donor_dict: The flattened donor dictionary.
+    :param users: The users with the donor's last name to score.
+    :return: The maximum weight: 0, 1 or 2, and the user ID's that exactly match the donor.
+    """
+
     donor_street = munge_address( donor_dict[ 'user_address' ] )
 
     user_ids = []
     exists_user_ids = []
     maximum_weight = 0
-    for user in users_by_last_name:
+    for user in users:
         # The identifier in Drupal is uppercase.
         if user[ 'ID' ] not in user_ids:
             # Capture the user so that it isn't considered more than once.
@@ -134,7 +153,7 @@ def categorize_donor( donor_dict ):
             # Keep track of the maximum weight found.
             maximum_weight = track_maximum_weight( weight, maximum_weight, exists_user_ids, user[ 'ID' ] )
 
-    return category_definitions[ maximum_weight ], exists_user_ids
+    return maximum_weight, exists_user_ids
 
 
 def track_maximum_weight( weight, maximum_weight, exists_user_ids, user_id ):
@@ -210,19 +229,46 @@ def check_if_caged( donor_dict ):
     :return: 3 for caged and 0 for not caged.
     """
 
+    # The street is normalized as CagedDonorModel.user_street is, and so the check is a single indexed query.
     street = munge_address( donor_dict[ 'user_address' ] )
+    if street == '':
+        return 0
 
     caged_donor = CagedDonorModel.query \
-        .filter_by( user_first_name=donor_dict[ 'user_first_name' ] ) \
         .filter_by( user_last_name=donor_dict[ 'user_last_name' ] ) \
-        .filter_by( user_zipcode=donor_dict[ 'user_zipcode' ] )
-    for caged_query in caged_donor.all():
-        caged_address = munge_address( caged_query.user_address )
-        if caged_address.strip() == street and street != '':
-            return 3
+        .filter_by( user_first_name=donor_dict[ 'user_first_name' ] ) \
+        .filter_by( user_zipcode=donor_dict[ 'user_zipcode' ] ) \
+        .filter_by( user_street=street )
+    if database.session.query( caged_donor.exists() ).scalar():
+        return 3
     return 0
 
 
+def backfill_caged_donor_streets( batch_size=1000 ):
+    """Fill in the normalized street of caged donors created before the column, a batch at a time.
+
+    :param int batch_size: The number of caged donors updated per commit.
+    :return: The number of caged donors updated.
+    """
+
+    updated = 0
+    last_id = 0
+    while True:
+        caged_donors = CagedDonorModel.query \
+            .filter( CagedDonorModel.id > last_id ) \
+            .filter( CagedDonorModel.user_street.is_( None ) ) \
+            .order_by( CagedDonorModel.id ) \
+            .limit( batch_size ) \
+            .all()
+        if not caged_donors:
+            return updated
+        for caged_donor in caged_donors:
+            caged_donor.user_street = normalize_street( caged_donor.user_address )
+        database.session.commit()
+        updated += len( caged_donors )
+        last_id = caged_donors[ -1 ].id
+
+
 def check_if_user( donor_dict ):
     """See if the donor exists.
 
@@ -239,11 +285,7 @@ def check_if_user( donor_dict ):
     """
 
     # A user ID is said to exist and so if one isn't returned there is a problem.
-    query_parameters = {
-        'search_terms': { 'ID': { 'eq': donor_dict[ 'id' ] } },
-        'sort_terms': []
-    }
-    user_by_id = find_ultsys_user( query_parameters )
+    user_by_id = find_caging_users( { 'ID': { 'eq': donor_dict[ 'id' ] } } )
     if user_by_id:
         # We are returning a category here: ( category_weight, [ user_id ] )
         return 2, [ user_by_id[ 0 ][ 'ID' ] ]
@@ -294,11 +336,9 @@ def redis_queue_caging( user, transactions, app_config_name ):
     :return:
     """
 
-    # This is getting pushed onto the queue outside an application context: create it here.
-    from application.app import create_app  # pylint: disable=cyclic-import
-    app = create_app( app_config_name )  # pylint: disable=C0103
-
-    with app.app_context():
+    # This is getting pushed onto the queue outside an application context. The worker's context is used if it has
+    # one, and otherwise the application is built once per worker process and reused: see application/worker.py.
+    with worker_app_context( app_config_name ):
         # Categorize the user: new, cage, caged, exists.
         # The variable category is a tuple:
         #    category[ 0 ]: the category of the donor.
@@ -317,44 +357,59 @@ def redis_queue_caging( user, transactions, app_config_name ):
         category = categorize_donor( donor_dict )
         logging.debug( '***** category: %s', category )
 
-        gross_gift_amount = str( transactions[ 0 ][ 'gross_gift_amount' ] )
-
-        if category[ 0 ] == 'exists':
-            ultsys_user_id = category[ 1 ][ 0 ]
-            user[ 'id' ] = ultsys_user_id
-            build_model_exists( user, gross_gift_amount )
-            gift_model = GiftModel.query.filter_by( id=user[ 'gift_id' ] ).one_or_none()
-            gift_model.user_id = ultsys_user_id
-            try:
-                QueuedDonorModel.query.filter_by( id=user[ 'queued_donor_id' ] ).delete()
-            except KeyError:
-                logging.warning("Record without queued_donor_id processed. This should only happen for old records")
-        elif category[ 0 ] == 'cage' or category[ 0 ] == 'caged':
-            gift_model = GiftModel.query.filter_by( id=user[ 'gift_id' ] ).one_or_none()
-            gift_model.user_id = -1
-            caged_donor_dict = user[ 'user_address' ]
-            caged_donor_dict[ 'gift_searchable_id' ] = gift_model.searchable_id
-            caged_donor_dict[ 'campaign_id' ] = user[ 'campaign_id' ]
-            caged_donor_dict[ 'customer_id' ] = user[ 'customer_id' ]
-            caged_donor_model = from_json( CagedDonorSchema(), caged_donor_dict, create=True )
-            caged_donor_model.data.gift_id = user[ 'gift_id' ]
-            database.session.add( caged_donor_model.data )
-            try:
-                QueuedDonorModel.query.filter_by( id=user[ 'queued_donor_id' ] ).delete()
-            except KeyError:
-                logging.warning("Record without queued_donor_id processed. This should only happen for old records")
-        elif category[ 0 ] == 'new':
-            ultsys_user_id = build_model_new( user, gross_gift_amount )
-            user[ 'id' ] = ultsys_user_id
-            gift_model = GiftModel.query.filter_by( id=user[ 'gift_id' ] ).one_or_none()
-            gift_model.user_id = ultsys_user_id
-            try:
-                QueuedDonorModel.query.filter_by( id=user[ 'queued_donor_id' ] ).delete()
-            except KeyError:
-                logging.warning("Record without queued_donor_id processed. This should only happen for old records")
+        cage_donor( user, transactions, category )
 
         try:
             database.session.commit()
         except SQLAlchemyError as error:
             database.session.rollback()
             raise error
+
+
+def cage_donor( user, transactions, category ):
+    """Update the models for the category of the donor: the gift's user ID, a caged donor or an Ultsys user.
+
+    The queued donor is deleted. The session is not committed here: redis_queue_caging() commits for the donor and
+    the batched caging in caging_batch.py commits once for the batch.
+
+    :param user: The validated user dictionary.
+    :param transactions: The list of transactions for the gift.
+    :param category: The category tuple from categorize_donor(), e.g. ( 'exists', [ 1234 ] ).
+    :return:
+    """
+
+    gross_gift_amount = str( transactions[ 0 ][ 'gross_gift_amount' ] )
+
+    if category[ 0 ] == 'exists':
+        ultsys_user_id = category[ 1 ][ 0 ]
+        user[ 'id' ] = ultsys_user_id
+        build_model_exists( user, gross_gift_amount )
+        gift_model = GiftModel.query.filter_by( id=user[ 'gift_id' ] ).one_or_none()
+        gift_model.user_id = ultsys_user_id
+        try:
+            QueuedDonorModel.query.filter_by( id=user[ 'queued_donor_id' ] ).delete()
+        except KeyError:
+            logging.warning("Record without queued_donor_id processed. This should only happen for old records")
+    elif category[ 0 ] == 'cage' or category[ 0 ] == 'caged':
+        gift_model = GiftModel.query.filter_by( id=user[ 'gift_id' ] ).one_or_none()
+        gift_model.user_id = -1
+        caged_donor_dict = user[ 'user_address' ]
+        caged_donor_dict[ 'gift_searchable_id' ] = gift_model.searchable_id
+        caged_donor_dict[ 'campaign_id' ] = user[ 'campaign_id' ]
+        caged_donor_dict[ 'customer_id' ] = user[ 'customer_id' ]
+        caged_donor_model = from_json( CagedDonorSchema(), caged_donor_dict, create=True )
+        caged_donor_model.data.gift_id = user[ 'gift_id' ]
+        database.session.add( caged_donor_model.data )
+        try:
+            QueuedDonorModel.query.filter_by( id=user[ 'queued_donor_id' ] ).delete()
+        except KeyError:
+            logging.warning("Record without queued_donor_id processed. This should only happen for old records")
+    elif category[ 0 ] == 'new':
+        ultsys_user_id = build_model_new( user, gross_gift_amount )
+        user[ 'id' ] = ultsys_user_id
+        gift_model = GiftModel.query.filter_by( id=user[ 'gift_id' ] ).one_or_none()
+        gift_model.user_id = ultsys_user_id
+        try:
+            QueuedDonorModel.query.filter_by( id=user[ 'queued_donor_id' ] ).delete()
+        except KeyError:
+            logging.warning("Record without queued_donor_id processed. This should only happen for old records")
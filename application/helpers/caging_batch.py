@@ -0,0 +1,332 @@
+"""A module for caging queued donors in batches rather than one RQ job per donor.
+
+With CAGING_BATCH_ENABLED the donation and reprocessing paths push the donor onto a Redis list for the configuration
+and queue a redis_queue_caging_batch() job. Each job drains up to CAGING_BATCH_SIZE donors ( default 100 ) from the
+list, so that a burst of donations is caged by a few jobs, and:
+
+    1. Makes one search for the emails of all the donors in the batch.
+    2. Groups the donors by their normalized last name and makes one search per group for the users with that last
+       name, when the first donor of the group needs it. Every donor in the group is scored against the shared set.
+    3. Cages each donor inside a SAVEPOINT, so that a donor that fails is rolled back on their own and the rest of
+       the batch carries on.
+    4. Commits the gift, caged donor and queued donor changes once for the batch.
+    5. Cages the new donors, creating their Ultsys users, one at a time and each with its own commit.
+
+Creating an Ultsys user is a call to the user service, which a rollback does not undo. The new donors are therefore
+caged only after the batch is committed: a batch whose commit fails has created no user, and its donors are caged
+again by reprocess_queued_donors() without creating a user twice. A later donor in the batch with the email or last
+name of a new donor is caged after them, in the order of the batch, since the user created may be theirs.
+
+A new user created for one donor is added to the shared email and last name sets, so that a later donation in the
+same batch by the same donor is found as existing, as it would be by a later redis_queue_caging() job.
+
+A donor that fails, or a batch whose commit fails, keeps its queued donor, and is caged again by
+reprocess_queued_donors(). The list is drained with LRANGE and LTRIM in a MULTI, so two jobs never take the same donor.
+
+Configuration in app.config:
+
+    CAGING_BATCH_ENABLED: Whether donors are caged in batches ( default False ).
+    CAGING_BATCH_SIZE: The most donors caged by a job ( default 100 ).
+"""
+import copy
+import logging
+import pickle
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from application.flask_essentials import database
+from application.flask_essentials import redis_queue
+from application.helpers.caging import cage_donor
+from application.helpers.caging import check_if_caged
+from application.helpers.caging import check_if_user
+from application.helpers.caging_scoring import score_donor_batch
+from application.helpers.general_helper_functions import flatten_user_dict
+from application.helpers.general_helper_functions import validate_user_payload
+from application.helpers.ultsys_user import find_ultsys_users
+from application.helpers.ultsys_user_mirror import find_caging_users
+from application.helpers.ultsys_user_mirror import find_mirror_users
+from application.helpers.ultsys_user_mirror import is_mirror_usable
+from application.worker import worker_app_context
+
+CAGING_BATCH_KEY = 'caging:batch:{}'
+CATEGORY_DEFINITIONS = { 0: 'new', 1: 'cage', 2: 'exists', 3: 'caged' }
+DEFAULT_BATCH_SIZE = 100
+
+
+def is_caging_batch_enabled():
+    """Whether donors are caged in batches."""
+
+    enabled = current_app.config.get( 'CAGING_BATCH_ENABLED', False )
+    if isinstance( enabled, str ):
+        return enabled.lower() in [ '1', 'true', 'yes' ]
+    return bool( enabled )
+
+
+def get_caging_batch_size():
+    """The most donors caged by a batch job."""
+
+    return int( current_app.config.get( 'CAGING_BATCH_SIZE' ) or DEFAULT_BATCH_SIZE )
+
+
+def queue_caging_batch( user, transactions, app_config_name ):
+    """Push a donor onto the batch list and queue a job to drain it.
+
+    :param user: The user dictionary, as for redis_queue_caging().
+    :param transactions: The list of transactions for the gift.
+    :param app_config_name: The configuration ( PROD, DEV, TEST ) that the app is running.
+    :return: The RQ job.
+    """
+
+    donor = pickle.dumps( { 'user': user, 'transactions': transactions } )
+    redis_queue.connection.rpush( CAGING_BATCH_KEY.format( app_config_name ), donor )
+    return redis_queue_caging_batch.queue( app_config_name )
+
+
+def queue_caging_batches( donors, app_config_name ):
+    """Push many donors onto the batch list in one pipeline, and queue a job for every batch of them.
+
+    :param donors: A list of dictionaries with the user and transactions: { 'user': {}, 'transactions': [] }.
+    :param app_config_name: The configuration ( PROD, DEV, TEST ) that the app is running.
+    :return: The RQ jobs.
+    """
+
+    if not donors:
+        return []
+
+    pipeline = redis_queue.connection.pipeline()
+    for donor in donors:
+        pipeline.rpush( CAGING_BATCH_KEY.format( app_config_name ), pickle.dumps( donor ) )
+    pipeline.execute()
+
+    batch_size = get_caging_batch_size()
+    batches = ( len( donors ) + batch_size - 1 ) // batch_size
+    return [ redis_queue_caging_batch.queue( app_config_name ) for _ in range( batches ) ]
+
+
+def drain_caging_batch( app_config_name, batch_size ):
+    """Take up to batch_size donors from the front of the batch list.
+
+    :param app_config_name: The configuration ( PROD, DEV, TEST ) that the app is running.
+    :param batch_size: The most donors to take.
+    :return: A list of dictionaries with the user and transactions.
+    """
+
+    key = CAGING_BATCH_KEY.format( app_config_name )
+    pipeline = redis_queue.connection.pipeline()
+    pipeline.lrange( key, 0, batch_size - 1 )
+    pipeline.ltrim( key, batch_size, -1 )
+    donors, _ = pipeline.execute()
+    return [ pickle.loads( donor ) for donor in donors ]
+
+
+@redis_queue.job
+def redis_queue_caging_batch( app_config_name ):
+    """Cage the next batch of donors on the list. A job that finds the list empty has nothing to do.
+
+    :param app_config_name: The configuration ( PROD, DEV, TEST ) that the app is running.
+    :return: The summary of the batch from cage_donor_batch().
+    """
+
+    with worker_app_context( app_config_name ):
+        donors = drain_caging_batch( app_config_name, get_caging_batch_size() )
+        if not donors:
+            return None
+        return cage_donor_batch( donors )
+
+
+def cage_donor_batch( donors ):
+    """Categorize and cage a batch of donors, with shared searches and a single commit.
+
+    :param donors: A list of dictionaries with the user and transactions: { 'user': {}, 'transactions': [] }.
+    :return: A dictionary of the number of donors in each category and the queued donor ID's that failed.
+    """
+
+    batch = []
+    for donor in donors:
+        user = validate_user_payload( donor[ 'user' ] )
+        donor_dict = flatten_user_dict( copy.deepcopy( user ) )
+        batch.append( ( user, donor[ 'transactions' ], donor_dict ) )
+
+    # One search for all the emails, keyed by the normalized email.
+    emails = [ donor_dict[ 'user_email_address' ] for _, _, donor_dict in batch
+               if donor_dict.get( 'user_email_address' ) ]
+    users_by_email = find_caging_users_by_email( emails )
+
+    # The users for each last name group, searched the first time a donor in the group needs them.
+    users_by_last_name = {}
+
+    summary = { 'donors': len( batch ), 'failed': [] }
+    summary.update( { category: 0 for category in CATEGORY_DEFINITIONS.values() } )
+
+    # The new donors, and the later donors who may match the users created for them, are caged after the commit.
+    deferred_donors = []
+    deferred_keys = set()
+    for donor in batch:
+        donor_keys = get_deferral_keys( donor[ 2 ] )
+        if not donor_keys & deferred_keys:
+            category = cage_batch_donor( donor, users_by_email, users_by_last_name, create_user=False )
+            if not category:
+                summary[ 'failed' ].append( donor[ 0 ].get( 'queued_donor_id' ) )
+                continue
+            if category[ 0 ] != 'new':
+                summary[ category[ 0 ] ] += 1
+                continue
+        deferred_donors.append( donor )
+        deferred_keys.update( donor_keys )
+
+    try:
+        database.session.commit()
+    except SQLAlchemyError as error:
+        database.session.rollback()
+        raise error
+
+    for user, transactions, donor_dict in deferred_donors:
+        category = cage_batch_donor(
+            ( user, transactions, donor_dict ), users_by_email, users_by_last_name, create_user=True
+        )
+        if category:
+            try:
+                database.session.commit()
+            except SQLAlchemyError:
+                database.session.rollback()
+                logging.exception(
+                    'Batched caging failed to commit the queued donor: %s', user.get( 'queued_donor_id' )
+                )
+                category = None
+        if not category:
+            summary[ 'failed' ].append( user.get( 'queued_donor_id' ) )
+            continue
+
+        summary[ category[ 0 ] ] += 1
+        if category[ 0 ] == 'new':
+            add_created_user( user, donor_dict, users_by_email, users_by_last_name )
+
+    logging.info( 'Batched caging: %s', summary )
+    return summary
+
+
+def cage_batch_donor( donor, users_by_email, users_by_last_name, create_user ):
+    """Categorize and cage a donor of the batch inside a SAVEPOINT, which is rolled back if it fails.
+
+    :param donor: A tuple of the user dictionary, the transactions and the flattened donor dictionary.
+    :param users_by_email: The users keyed by normalized email.
+    :param users_by_last_name: The users keyed by normalized last name, filled in as groups are searched.
+    :param create_user: Whether a new donor is caged, creating their Ultsys user, or only categorized.
+    :return: The category tuple, or None if the donor failed.
+    """
+
+    user, transactions, donor_dict = donor
+    savepoint = database.session.begin_nested()
+    try:
+        category = categorize_batch_donor( donor_dict, users_by_email, users_by_last_name )
+        logging.debug( '***** category: %s', category )
+        if category[ 0 ] != 'new' or create_user:
+            cage_donor( user, transactions, category )
+        savepoint.commit()
+    except Exception:  # pylint: disable=broad-except
+        savepoint.rollback()
+        logging.exception( 'Batched caging failed for the queued donor: %s', user.get( 'queued_donor_id' ) )
+        return None
+    return category
+
+
+def get_deferral_keys( donor_dict ):
+    """The normalized email and last name of a donor, which a user created for an earlier donor may match."""
+
+    keys = { ( 'last_name', normalize_last_name( donor_dict[ 'user_last_name' ] ) ) }
+    email = normalize_email( donor_dict.get( 'user_email_address' ) )
+    if email:
+        keys.add( ( 'email', email ) )
+    return keys
+
+
+def categorize_batch_donor( donor_dict, users_by_email, users_by_last_name ):
+    """Categorize a donor against the users shared by the batch, in the same order of checks as categorize_donor().
+
+    :param donor_dict: The flattened donor dictionary.
+    :param users_by_email: The users keyed by normalized email.
+    :param users_by_last_name: The users keyed by normalized last name, filled in as groups are searched.
+    :return: A category tuple: ( 'exists', [ 1234 ] ).
+    """
+
+    if 'id' in donor_dict and donor_dict[ 'id' ]:
+        is_user = check_if_user( donor_dict )
+        return CATEGORY_DEFINITIONS[ is_user[ 0 ] ], is_user[ 1 ]
+
+    email = normalize_email( donor_dict.get( 'user_email_address' ) )
+    if email and users_by_email.get( email ):
+        return CATEGORY_DEFINITIONS[ 2 ], [ users_by_email[ email ][ 0 ][ 'ID' ] ]
+
+    if check_if_caged( donor_dict ) == 3:
+        return CATEGORY_DEFINITIONS[ 3 ], []
+
+    last_name = normalize_last_name( donor_dict[ 'user_last_name' ] )
+    if last_name not in users_by_last_name:
+        users_by_last_name[ last_name ] = find_caging_users(
+            { 'lastname': { 'eq': donor_dict[ 'user_last_name' ].strip() } }
+        )
+    users = users_by_last_name[ last_name ]
+    if not users:
+        return CATEGORY_DEFINITIONS[ 0 ], []
+
+    maximum_weight, exists_user_ids = score_donor_batch( donor_dict, users )
+    return CATEGORY_DEFINITIONS[ maximum_weight ], exists_user_ids
+
+
+def find_caging_users_by_email( emails ):
+    """Find the users for many emails at once, on the mirror if it is usable, and otherwise the Ultsys user service.
+
+    :param emails: A list of email addresses.
+    :return: A dictionary of lists of users keyed by the normalized email.
+    """
+
+    emails = sorted( { normalize_email( email ) for email in emails if normalize_email( email ) } )
+    if not emails:
+        return {}
+    if not is_mirror_usable():
+        return find_ultsys_users( emails=emails )
+
+    users_by_email = {}
+    for ultsys_user in find_mirror_users( { 'email': { 'in': emails } } ):
+        users_by_email.setdefault( normalize_email( ultsys_user[ 'email' ] ), [] ).append( ultsys_user )
+    return users_by_email
+
+
+def add_created_user( user, donor_dict, users_by_email, users_by_last_name ):
+    """Add a user created for a new donor to the shared sets, so that later donors in the batch are matched to them.
+
+    :param user: The user dictionary, with the new Ultsys user ID.
+    :param donor_dict: The flattened donor dictionary.
+    :param users_by_email: The users keyed by normalized email.
+    :param users_by_last_name: The users keyed by normalized last name.
+    :return:
+    """
+
+    created_user = {
+        'ID': user[ 'id' ],
+        'firstname': donor_dict[ 'user_first_name' ],
+        'lastname': donor_dict[ 'user_last_name' ],
+        'zip': donor_dict[ 'user_zipcode' ],
+        'address': donor_dict[ 'user_address' ],
+        'email': donor_dict[ 'user_email_address' ],
+        'phone': donor_dict[ 'user_phone_number' ]
+    }
+    email = normalize_email( donor_dict.get( 'user_email_address' ) )
+    if email:
+        users_by_email.setdefault( email, [] ).append( created_user )
+    last_name = normalize_last_name( donor_dict[ 'user_last_name' ] )
+    if last_name in users_by_last_name:
+        users_by_last_name[ last_name ].append( created_user )
+
+
+def normalize_email( email ):
+    """The email as it is keyed by find_ultsys_users()."""
+
+    return email.strip().lower() if email else ''
+
+
+def normalize_last_name( last_name ):
+    """The last name that groups donors."""
+
+    return ( last_name or '' ).strip().lower()
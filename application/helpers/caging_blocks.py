@@ -0,0 +1,150 @@
+"""A module for the blocking index used to find the candidate users for caging a donor.
+
+Before the index categorize_donor() scored every user with the donor's last name. A user can only be weighted as
+cage or exists by category_weight() when, along with the last name, they match the donor on at least one of: zip,
+street address, email or phone. Users matching on the last name alone are weighted 0, the same as no users at all.
+
+And so the candidates are the union of the users sharing one of these blocking keys with the donor:
+
+    lz:<lastname>|<zip>   The normalized last name and zip.
+    s:<street>            The munged street address.
+    e:<email>             The lowercased email address.
+    p:<phone>             The digits of the phone number, or p:|<lastname> for an empty phone.
+
+restricted to those with the donor's last name. Scoring these candidates gives the same category as scoring all the
+users with the last name. The keys are built from the user table mirror, application.models.ultsys_user, and are
+maintained whenever a mirrored user is inserted or updated.
+"""
+import re
+
+from application.flask_essentials import database
+from application.helpers.general_helper_functions import munge_address
+from application.models.caging_block import CagingBlockModel
+from application.models.ultsys_user import UltsysUserModel
+# pylint: disable=bare-except
+# flake8: noqa:E722
+
+
+def build_block_keys( last_name, zipcode, address, email, phone ):
+    """Build the blocking keys for a user or donor from their normalized fields.
+
+    :param last_name: The last name.
+    :param zipcode: The zip code.
+    :param address: The street address.
+    :param email: The email address.
+    :param phone: The phone number.
+    :return: A set of blocking keys.
+    """
+
+    # The keys must never be narrower than the matches made in score_donor(), which only leaves out the values it
+    # excludes: an empty street, an empty email and the phone '0'. And so an empty zip matches an empty zip, and an
+    # empty phone an empty phone, while the email is compared lowercased, but not stripped.
+    last_name = str( last_name or '' ).strip().lower()
+    block_keys = set()
+    block_keys.add( 'lz:{}|{}'.format( last_name, str( zipcode or '' ).strip() ) )
+    street = munge_address( address or '' )
+    if street:
+        block_keys.add( 's:{}'.format( street ) )
+    email = str( email or '' ).lower()
+    if email:
+        block_keys.add( 'e:{}'.format( email ) )
+    phone = str( phone or '' )
+    if phone != '0':
+        phone = re.sub( r'\D', '', phone ) or phone
+        # Every user without a phone shares the empty phone, and so its block is kept to the last name.
+        block_keys.add( 'p:{}'.format( phone ) if phone else 'p:|{}'.format( last_name ) )
+    return block_keys
+
+
+def build_user_block_keys( user_model ):
+    """The blocking keys for a user on the mirror."""
+
+    return build_block_keys(
+        user_model.lastname, user_model.zip, user_model.address, user_model.email, user_model.phone
+    )
+
+
+def build_donor_block_keys( donor_dict ):
+    """The blocking keys for a donor being caged."""
+
+    return build_block_keys(
+        donor_dict[ 'user_last_name' ],
+        donor_dict[ 'user_zipcode' ],
+        donor_dict[ 'user_address' ],
+        donor_dict[ 'user_email_address' ],
+        donor_dict[ 'user_phone_number' ]
+    )
+
+
+def index_caging_blocks( user_models ):
+    """Replace the blocking keys of the given mirrored users. The session is not committed here.
+
+    :param list user_models: UltsysUserModels that were inserted or updated.
+    :return:
+    """
+
+    user_ids = [ user_model.ID for user_model in user_models ]
+    if not user_ids:
+        return
+    CagingBlockModel.query.filter( CagingBlockModel.user_id.in_( user_ids ) ).delete( synchronize_session=False )
+    database.session.bulk_save_objects( [
+        CagingBlockModel( block_key=block_key, user_id=user_model.ID )
+        for user_model in user_models for block_key in build_user_block_keys( user_model )
+    ] )
+
+
+def rebuild_caging_blocks( batch_size=5000 ):
+    """Rebuild the blocking index for every user on the mirror, e.g. after the mirror is first loaded.
+
+    The index is emptied and refilled in a single transaction. Until it commits, caging on other connections reads the
+    old keys, and so never sees an empty index.
+
+    :param batch_size: The number of users read and indexed at a time.
+    :return: The number of users indexed.
+    """
+
+    indexed = 0
+    try:
+        CagingBlockModel.query.delete( synchronize_session=False )
+        last_id = 0
+        while True:
+            user_models = UltsysUserModel.query.filter( UltsysUserModel.ID > last_id )\
+                .order_by( UltsysUserModel.ID ).limit( batch_size ).all()
+            if not user_models:
+                break
+            database.session.bulk_save_objects( [
+                CagingBlockModel( block_key=block_key, user_id=user_model.ID )
+                for user_model in user_models for block_key in build_user_block_keys( user_model )
+            ] )
+            indexed += len( user_models )
+            last_id = user_models[ -1 ].ID
+            # The keys are flushed and the users let go of, so that the session does not grow with the mirror.
+            database.session.flush()
+            database.session.expunge_all()
+        database.session.commit()
+    except:
+        database.session.rollback()
+        raise
+    return indexed
+
+
+def find_caging_candidates( donor_dict ):
+    """Find the users on the mirror sharing a blocking key and the last name with the donor.
+
+    The candidates are ordered by ID.
+
+    :param dict donor_dict: The flattened donor dictionary.
+    :return: A list of user dictionaries, as returned by the Ultsys user service.
+    """
+
+    # Import here: ultsys_user_mirror maintains the blocks when it upserts users.
+    from application.helpers.ultsys_user_mirror import mirror_user_to_dict  # pylint: disable=cyclic-import
+
+    block_keys = build_donor_block_keys( donor_dict )
+    candidate_ids = database.session.query( CagingBlockModel.user_id ).distinct()\
+        .filter( CagingBlockModel.block_key.in_( block_keys ) )
+    user_models = UltsysUserModel.query\
+        .filter( UltsysUserModel.ID.in_( candidate_ids ) )\
+        .filter( UltsysUserModel.lastname == donor_dict[ 'user_last_name' ] )\
+        .order_by( UltsysUserModel.ID ).all()
+    return [ mirror_user_to_dict( user_model ) for user_model in user_models ]
@@ -0,0 +1,95 @@
+"""A module for scoring all the caging candidates for a donor at once with NumPy.
+
+The loop in score_donor() builds a category_match_matrix and calls category_weight() and track_maximum_weight() for
+each user. Here the candidate columns ( first name, zip, munged address, email and phone ) are normalized into arrays,
+the match matrix for every candidate is computed in one pass, and the category_weight() rules are applied as masks:
+
+    base fields [ first_name, last_name, zipcode ], where the last name always matches:
+        [ 1, 1, 1 ] and all 3 discriminators: 2
+        [ 1, 1, 1 ] otherwise: 1
+        [ 0, 1, 1 ] or [ 0, 1, 0 ] and at least 1 discriminator: 1
+        otherwise: 0
+
+track_maximum_weight() downgrades the maximum weight to 1 when more than one user exactly matches the donor, and so
+the maximum weight is 1 if there are two or more users weighted 2, and otherwise the largest weight.
+
+NumPy is optional: without it, or for fewer candidates than CAGING_VECTORIZE_MINIMUM ( default 32 ), the loop in
+score_donor() is used, since building the arrays costs more than it saves for a handful of users.
+"""
+from flask import current_app
+
+from application.helpers.general_helper_functions import munge_address
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # pylint: disable=invalid-name
+
+DEFAULT_VECTORIZE_MINIMUM = 32
+
+
+def score_donor_batch( donor_dict, users ):
+    """Score the candidates with the vectorized engine, or the loop when it is unavailable or not worthwhile.
+
+    :param donor_dict: The flattened donor dictionary.
+    :param users: The users with the donor's last name to score.
+    :return: The maximum weight: 0, 1 or 2, and the user ID's that exactly match the donor.
+    """
+
+    # Import here: caging imports this module.
+    from application.helpers.caging import score_donor  # pylint: disable=cyclic-import
+
+    minimum = int( current_app.config.get( 'CAGING_VECTORIZE_MINIMUM' ) or DEFAULT_VECTORIZE_MINIMUM )
+    if numpy is None or len( users ) < minimum:
+        return score_donor( donor_dict, users )
+    return score_donor_vectorized( donor_dict, users )
+
+
+def score_donor_vectorized( donor_dict, users ):
+    """Score all the candidates at once with NumPy, giving the same result as score_donor().
+
+    :param donor_dict: The flattened donor dictionary.
+    :param users: The users with the donor's last name to score.
+    :return: The maximum weight: 0, 1 or 2, and the user ID's that exactly match the donor.
+    """
+
+    # A user is only considered once, at their first appearance.
+    user_ids = []
+    unique_users = []
+    for user in users:
+        if user[ 'ID' ] not in user_ids:
+            user_ids.append( user[ 'ID' ] )
+            unique_users.append( user )
+    if not unique_users:
+        return 0, []
+
+    # Normalize the candidate columns. The zip and phone are compared as given, and so kept as objects.
+    first_names = numpy.array( [ user[ 'firstname' ].lower() for user in unique_users ] )
+    zipcodes = numpy.array( [ user[ 'zip' ] for user in unique_users ], dtype=object )
+    streets = numpy.array( [ munge_address( user[ 'address' ] ) for user in unique_users ] )
+    emails = numpy.array( [ user[ 'email' ].lower() for user in unique_users ] )
+    phones = numpy.array( [ user[ 'phone' ] for user in unique_users ], dtype=object )
+
+    donor_street = munge_address( donor_dict[ 'user_address' ] )
+    donor_email = donor_dict[ 'user_email_address' ]
+    donor_phone = donor_dict[ 'user_phone_number' ]
+
+    # The match matrix, a column at a time: the last name always matches.
+    first_name_match = first_names == donor_dict[ 'user_first_name' ].lower()
+    zipcode_match = ( zipcodes == donor_dict[ 'user_zipcode' ] ).astype( bool ) \
+        & ( donor_dict[ 'user_zipcode' ] != 0 )
+    street_match = ( streets == donor_street ) & ( donor_street != '' )
+    email_match = ( emails == donor_email.lower() ) & ( donor_email != '' )
+    phone_match = ( phones == donor_phone ).astype( bool ) & ( donor_phone != '0' )
+    sum_discriminators = street_match.astype( int ) + email_match.astype( int ) + phone_match.astype( int )
+
+    # The category_weight() rules as masks.
+    weights = numpy.where(
+        first_name_match & zipcode_match,
+        numpy.where( sum_discriminators == 3, 2, 1 ),
+        numpy.where( ~first_name_match & ( sum_discriminators >= 1 ), 1, 0 )
+    )
+
+    exists_user_ids = [ user_ids[ index ] for index in numpy.flatnonzero( weights == 2 ) ]
+    maximum_weight = 1 if len( exists_user_ids ) > 1 else int( weights.max() )
+    return maximum_weight, exists_user_ids
@@ -11,6 +11,7 @@ from sqlalchemy.exc import SQLAlchemyError
 from application.exceptions.exception_model import ModelCampaignImproperFieldError
 from application.flask_essentials import database
 from application.helpers.model_serialization import from_json
+from application.helpers.reference_data import invalidate_reference_data
 from application.models.campaign import CampaignAmountsModel
 from application.models.campaign import CampaignModel
 from application.schemas.campaign import CampaignAmountsSchema
@@ -57,6 +58,7 @@ def make_campaign( request, create ):
 
     database.session.add( campaign_model.data )
     database.session.commit()
+    invalidate_reference_data( 'campaign' )
 
     return True
 
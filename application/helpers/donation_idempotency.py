@@ -0,0 +1,180 @@
+"""A module to make the donation endpoint idempotent, so that a retried donation is not made twice.
+
+Donors double-click, and front-ends retry /donation/donate when a request times out. Each retry used to create the
+customer, make the Braintree sale, insert the gift and queue a caging job again. Here a donation is given a key:
+
+    1. The Idempotency-Key header sent by the client, or otherwise
+    2. A hash of the payment method nonce, the gross gift amount and the donor's email. A Braintree nonce can be used
+       only once, so a second request with the same nonce is a retry. A donation without a nonce, e.g. a check, and
+       without the header, is not deduplicated.
+
+run_idempotent_donation() claims the key in Redis with SET NX before the donation is made, and stores the response
+under it for DONATION_IDEMPOTENCY_TTL seconds. A retry with the key returns the stored response without touching
+Braintree or MySQL. A duplicate that arrives while the first request is in flight waits for its response, polling every
+DONATION_IDEMPOTENCY_POLL_INTERVAL seconds, rather than racing it. If the first request fails the claim is released,
+and the duplicate makes the donation itself. A duplicate that waits more than DONATION_IDEMPOTENCY_WAIT seconds raises
+DonationInFlightError ( 409 ).
+
+The claim and the response are stored with a fingerprint of the donation: its nonce, amount and email, and the
+ultsys_id of the JWT if there is one. A client may reuse its key for a different donation, or two clients may send the
+same key, and so a request whose fingerprint does not match the one stored under its key is rejected with
+DonationIdempotencyKeyMismatchError ( 422 ) rather than given the response of another donation.
+
+The claim of a request that dies without releasing it expires after DONATION_IDEMPOTENCY_IN_FLIGHT_TTL seconds. If
+Redis is unavailable the donation is made without deduplication.
+
+Configuration in app.config:
+
+    DONATION_IDEMPOTENCY_TTL: Seconds the response of a donation is kept for its retries ( default 86400 ).
+    DONATION_IDEMPOTENCY_IN_FLIGHT_TTL: Seconds a claim is held by a request in flight ( default 120 ).
+    DONATION_IDEMPOTENCY_WAIT: The most seconds a duplicate waits for the first request ( default 30 ).
+    DONATION_IDEMPOTENCY_POLL_INTERVAL: Seconds between the checks of a waiting duplicate ( default 0.1 ).
+"""
+import hashlib
+import json
+import logging
+import time
+
+from flask import current_app
+
+from application.exceptions.exception_donation import DonationIdempotencyKeyMismatchError
+from application.exceptions.exception_donation import DonationInFlightError
+from application.flask_essentials import redis_queue
+# pylint: disable=bare-except
+# flake8: noqa:E722
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+DONATION_IDEMPOTENCY_KEY = 'donation:idempotency:{}'
+
+DEFAULT_TTL = 86400
+DEFAULT_IN_FLIGHT_TTL = 120
+DEFAULT_WAIT = 30
+DEFAULT_POLL_INTERVAL = 0.1
+
+
+def get_idempotency_config( name, default ):
+    """Get an idempotency setting from app.config and fall back to the default if it is missing or empty."""
+
+    value = current_app.config.get( 'DONATION_IDEMPOTENCY_{}'.format( name ) )
+    if value is None or value == '':
+        return default
+    return float( value )
+
+
+def get_donation_idempotency_key( payload, header_key=None ):
+    """The idempotency key of a donation: the client's key, or a hash of the nonce, amount and email.
+
+    :param dict payload: The donation payload, before it is changed by post_donation().
+    :param str header_key: The value of the Idempotency-Key header, if any.
+    :return: The key, or None if the donation is not deduplicated.
+    """
+
+    if header_key and header_key.strip():
+        return 'client:{}'.format( hashlib.sha256( header_key.strip().encode( 'utf-8' ) ).hexdigest() )
+
+    nonce = payload.get( 'payment_method_nonce' )
+    if not nonce:
+        return None
+
+    return 'nonce:{}'.format( get_donation_fingerprint( payload ) )
+
+
+def get_donation_fingerprint( payload, ultsys_id=None ):
+    """A hash of the nonce, amount and email of the donation, and the ultsys_id of the caller if there is one.
+
+    :param dict payload: The donation payload, before it is changed by post_donation().
+    :param ultsys_id: The ultsys_id of the JWT, or None for an anonymous donor.
+    :return: The fingerprint.
+    """
+
+    user_address = ( payload.get( 'user' ) or {} ).get( 'user_address' ) or {}
+    fingerprint = [
+        str( payload.get( 'payment_method_nonce' ) ),
+        str( ( payload.get( 'transaction' ) or {} ).get( 'gross_gift_amount' ) ),
+        str( user_address.get( 'user_email_address' ) or '' ).strip().lower()
+    ]
+    if ultsys_id is not None:
+        fingerprint.append( str( ultsys_id ) )
+    return hashlib.sha256( '|'.join( fingerprint ).encode( 'utf-8' ) ).hexdigest()
+
+
+def run_idempotent_donation( idempotency_key, make_donation, fingerprint=None ):
+    """Make the donation once for the key, and return the same response to its retries.
+
+    :param idempotency_key: The key from get_donation_idempotency_key(), or None to make the donation as is.
+    :param make_donation: A function that makes the donation and returns its response dictionary.
+    :param fingerprint: The fingerprint of the donation from get_donation_fingerprint().
+    :return: A tuple of the response dictionary, and whether it was replayed from an earlier request.
+    """
+
+    if not idempotency_key:
+        return make_donation(), False
+
+    key = DONATION_IDEMPOTENCY_KEY.format( idempotency_key )
+    wait = get_idempotency_config( 'WAIT', DEFAULT_WAIT )
+    poll_interval = get_idempotency_config( 'POLL_INTERVAL', DEFAULT_POLL_INTERVAL )
+    started = time.monotonic()
+    while True:
+        try:
+            claimed = redis_queue.connection.set(
+                key,
+                json.dumps( { 'fingerprint': fingerprint } ),
+                nx=True,
+                ex=int( get_idempotency_config( 'IN_FLIGHT_TTL', DEFAULT_IN_FLIGHT_TTL ) )
+            )
+            stored = None if claimed else redis_queue.connection.get( key )
+        except:
+            logging.exception( 'Unable to claim the donation idempotency key: %s', idempotency_key )
+            return make_donation(), False
+
+        if claimed:
+            return make_claimed_donation( key, make_donation, fingerprint ), False
+
+        if stored is not None:
+            stored = json.loads( stored.decode( 'utf-8' ) )
+            if stored.get( 'fingerprint' ) != fingerprint:
+                logging.warning( 'Donation idempotency key reused for a different donation: %s', idempotency_key )
+                raise DonationIdempotencyKeyMismatchError()
+            if 'response' in stored:
+                logging.info( 'Donation replayed for the idempotency key: %s', idempotency_key )
+                return stored[ 'response' ], True
+
+        # The first request is in flight, or has just released its claim: check again shortly.
+        if time.monotonic() - started > wait:
+            raise DonationInFlightError()
+        time.sleep( poll_interval )
+
+
+def make_claimed_donation( key, make_donation, fingerprint ):
+    """Make the donation under a claimed key, and store its response for the retries, or release the claim if it fails.
+
+    :param str key: The Redis key.
+    :param make_donation: A function that makes the donation and returns its response dictionary.
+    :param fingerprint: The fingerprint of the donation, stored with its response.
+    :return: The response dictionary.
+    """
+
+    try:
+        response = make_donation()
+    except:
+        release_claim( key )
+        raise
+
+    try:
+        redis_queue.connection.set(
+            key,
+            json.dumps( { 'fingerprint': fingerprint, 'response': response } ),
+            ex=int( get_idempotency_config( 'TTL', DEFAULT_TTL ) )
+        )
+    except:
+        logging.exception( 'Unable to store the donation response for the idempotency key: %s', key )
+    return response
+
+
+def release_claim( key ):
+    """Release the claim of a donation that failed, so that a retry makes it."""
+
+    try:
+        redis_queue.connection.delete( key )
+    except:
+        logging.exception( 'Unable to release the donation idempotency key: %s', key )
@@ -1,10 +1,15 @@
-"""Helper to handle email """
+"""Helper to handle email.
+
+Emails are not sent on the request path. They are written to the email outbox ( EmailOutboxModel ) with queue_email(),
+in the same database transaction as the change they are about, and sent by the dispatcher in email_outbox.py, which
+sets receipt_sent_in_utc on the transactions whose receipts are sent.
+"""
 import copy
 import datetime
+import json
 import logging
 from decimal import Decimal
 
-import requests
 from flask import current_app
 from flask_api import status
 
@@ -13,7 +18,10 @@ from application.exceptions.exception_critical_path import EmailHTTPStatusError
 from application.exceptions.exception_critical_path import EmailSendPathError
 from application.exceptions.exception_critical_path import SendAdminEmailModelError
 from application.flask_essentials import database
-from application.models.agent import AgentModel
+from application.helpers.http_session import get_http_session
+from application.helpers.http_session import get_http_timeout
+from application.helpers.reference_data import find_agent
+from application.models.email_outbox import EmailOutboxModel
 from application.models.gift import GiftModel
 from application.models.transaction import TransactionModel
 
@@ -30,6 +38,9 @@ MAP_SALE_TYPE = {
     'Gift': 'onetime'
 }
 
+# The app.config prefix of the pooled session for the Ultsys email service: see http_session.py.
+EMAIL_HTTP_PREFIX = 'EMAIL'
+
 
 def send_email( data ):
     """The email POST request builder.
@@ -56,10 +67,11 @@ def send_email( data ):
         ultsys_email_url = current_app.config[ 'ULTSYS_EMAIL_URL' ]
         headers = { 'content-type': 'application/json', 'X-Temporary-Service-Auth': ultsys_email_api_key }
 
-        request = requests.post(
+        request = get_http_session( EMAIL_HTTP_PREFIX ).post(
             ultsys_email_url,
             params=data,
-            headers=headers
+            headers=headers,
+            timeout=get_http_timeout( EMAIL_HTTP_PREFIX )
         )
         logging.debug( 'email send url: %s', request.url )
         status_code = request.status_code
@@ -80,8 +92,60 @@ def send_email( data ):
         raise EmailSendPathError()
 
 
+def queue_email( email_type, data, transaction_id=None ):
+    """Add an email to the outbox. The session is not committed here, so that the email is saved with the change.
+
+    :param email_type: The type of email: receipt, thank_you or statistics.
+    :param data: The email payload.
+    :param transaction_id: The transaction whose receipt_sent_in_utc is set when a receipt is sent.
+    :return: The EmailOutboxModel.
+    """
+
+    now = datetime.datetime.utcnow()
+    outbox_model = EmailOutboxModel(
+        email_type=email_type,
+        transaction_id=transaction_id,
+        payload=json.dumps( data ),
+        status='pending',
+        attempts=0,
+        next_attempt_in_utc=now,
+        created_in_utc=now
+    )
+    database.session.add( outbox_model )
+    return outbox_model
+
+
+def queue_emails( email_type, emails ):
+    """Add many emails to the outbox with a single multi-row INSERT, without committing.
+
+    :param email_type: The type of email: receipt, thank_you or statistics.
+    :param emails: A list of tuples of the email payload and the transaction ID, which may be None.
+    :return:
+    """
+
+    if not emails:
+        return
+
+    now = datetime.datetime.utcnow()
+    rows = [
+        {
+            'email_type': email_type,
+            'transaction_id': transaction_id,
+            'payload': json.dumps( data ),
+            'status': 'pending',
+            'attempts': 0,
+            'next_attempt_in_utc': now,
+            'created_in_utc': now,
+            'sent_in_utc': None,
+            'last_error': None
+        }
+        for data, transaction_id in emails
+    ]
+    database.session.execute( EmailOutboxModel.__table__.insert().values( rows ) )
+
+
 def send_thank_you_letter( thank_you_dicts ):
-    """Send thank you letter email.
+    """Queue the thank you letter emails.
 
     We have from the front-end the following data:
 
@@ -113,11 +177,12 @@ def send_thank_you_letter( thank_you_dicts ):
 
     for thank_you_dict in thank_you_dicts:
         data = build_email_payload( thank_you_dict[ 'transaction' ], thank_you_dict[ 'user' ] )
-        send_email( data )
+        queue_email( 'thank_you', data )
+    commit_email_outbox()
 
 
 def send_statistics_report( payload ):
-    """Send statistics report
+    """Queue the statistics report.
 
     :param payload: The payload of CSV file URL's on Amazon S3.
     :return:
@@ -128,29 +193,41 @@ def send_statistics_report( payload ):
         'email': email,
         'urls': payload
     }
-    send_email( data )
+    queue_email( 'statistics', data )
+    commit_email_outbox()
 
 
 def send_admin_email( transaction, user, recurring=False ):
-    """The code that sends a receipt for a sale.
+    """Queue the receipt for a sale, and commit.
+
     :param transaction: The transaction for the sale.
     :param user: The user on the sale.
     :param recurring: Whether the sale is recurring ( subscription ) or not.
     :return:
     """
 
-    # Make sure if the email has problems and doesn't send the receipt_sent_in_utc is not set.
+    queue_admin_email( transaction, user, recurring )
+    commit_email_outbox()
+
+
+def queue_admin_email( transaction, user, recurring=False ):
+    """Add the receipt for a sale to the outbox, without committing, e.g. in the transaction that builds the sale.
+
+    The transaction's receipt_sent_in_utc is set by the dispatcher when the receipt is sent.
+
+    :param transaction: The transaction for the sale.
+    :param user: The user on the sale.
+    :param recurring: Whether the sale is recurring ( subscription ) or not.
+    :return: The EmailOutboxModel.
+    """
+
     email_payload = build_email_payload( transaction, user, recurring )
     logging.info( 'email payload: %s', email_payload )
-    send_email( email_payload )
+    return queue_email( 'receipt', email_payload, transaction.get( 'id' ) )
 
-    # Update the transaction with the receipt sent date in UTC.
-    try:
-        transaction_model = TransactionModel.query.filter_by( id=transaction[ 'id' ] ).one_or_none()
-        transaction_model.receipt_sent_in_utc = datetime.datetime.now().strftime( '%Y-%m-%d %H:%M:%S' )
-    except:  # noqa: E722
-        database.session.rollback()
-        raise SendAdminEmailModelError()
+
+def commit_email_outbox():
+    """Commit the emails added to the outbox."""
 
     try:
         database.session.commit()
@@ -167,7 +244,7 @@ def build_transaction( payload_transaction, assign_status ):
     :return: transaction
     """
 
-    enacted_by_agent = AgentModel.get_agent( 'Organization', 'name', 'Donate API' )
+    enacted_by_agent = find_agent( 'Organization', 'name', 'Donate API' )
     enacted_by_agent_id = str( enacted_by_agent.id )
 
     transaction = copy.deepcopy( payload_transaction )
@@ -193,43 +270,9 @@ def build_email_payload( transaction, user, recurring=False ):
     """
 
     try:
-        user_payload = user
-        if 'user_address' in user:
-            user_payload = {
-                'first_name': user[ 'user_address' ][ 'user_first_name' ],
-                'last_name': user[ 'user_address' ][ 'user_last_name' ],
-                'city': user[ 'user_address' ][ 'user_city' ],
-                'state': user[ 'user_address' ][ 'user_state' ],
-                'email_address': user[ 'user_address' ][ 'user_email_address' ]
-            }
-
         gift = GiftModel.query.filter_by( id=transaction[ 'gift_id' ] ).one()
-
-        # Set the sale type for the Ultsys endpoint: [ refund, recurring, reallocation, void, onetime, other ]
-        sale_type = MAP_SALE_TYPE[ 'Other' ]
-        if transaction[ 'type' ] in MAP_SALE_TYPE:
-            sale_type = MAP_SALE_TYPE[ transaction[ 'type' ] ]
-
-        gross_gift_amount = transaction[ 'gross_gift_amount' ]
-        if isinstance( transaction[ 'gross_gift_amount' ], Decimal ):
-            gross_gift_amount = str( int( transaction[ 'gross_gift_amount' ] ) )
-
         gift_transaction = TransactionModel.query.filter_by( gift_id=gift.id, type='Gift' ).one()
-        gift_date = gift_transaction.date_in_utc.replace( tzinfo=datetime.timezone.utc ).timestamp()
-
-        email_payload = {
-            'gift_date': str( gift_date ),
-            'gift_id': str( gift.searchable_id ),
-            'firstname': user_payload[ 'first_name' ],
-            'lastname': user_payload[ 'last_name' ],
-            'amount': gross_gift_amount,
-            'city': user_payload[ 'city' ],
-            'state': user_payload[ 'state' ],
-            'email': user_payload[ 'email_address' ],
-            'account': gift.given_to.lower(),
-            'type': sale_type,
-            'recurring': recurring
-        }
+        email_payload = format_email_payload( transaction, user, gift, gift_transaction.date_in_utc, recurring )
 
         # For refunds get previous gross gift amount before refund ( refund already attached to gift ).
         # There are at least 2 transactions: the refund, and the previous transaction ( maybe type Gift ).
@@ -240,3 +283,50 @@ def build_email_payload( transaction, user, recurring=False ):
         return email_payload
     except:  # noqa: E722
         raise BuildEmailPayloadPathError()
+
+
+def format_email_payload( transaction, user, gift, gift_date_in_utc, recurring=False ):
+    """Format the email payload from a gift that is already at hand, e.g. one built by the bulk administrative sale.
+
+    :param transaction: The transaction for the email sent.
+    :param user: The user dictionary.
+    :param gift: The gift model, with its searchable_id and given_to.
+    :param gift_date_in_utc: The datetime of the gift's Gift transaction.
+    :param recurring: Whether the sale is recurring ( subscription ) or not.
+    :return: email_payload
+    """
+
+    user_payload = user
+    if 'user_address' in user:
+        user_payload = {
+            'first_name': user[ 'user_address' ][ 'user_first_name' ],
+            'last_name': user[ 'user_address' ][ 'user_last_name' ],
+            'city': user[ 'user_address' ][ 'user_city' ],
+            'state': user[ 'user_address' ][ 'user_state' ],
+            'email_address': user[ 'user_address' ][ 'user_email_address' ]
+        }
+
+    # Set the sale type for the Ultsys endpoint: [ refund, recurring, reallocation, void, onetime, other ]
+    sale_type = MAP_SALE_TYPE[ 'Other' ]
+    if transaction[ 'type' ] in MAP_SALE_TYPE:
+        sale_type = MAP_SALE_TYPE[ transaction[ 'type' ] ]
+
+    gross_gift_amount = transaction[ 'gross_gift_amount' ]
+    if isinstance( transaction[ 'gross_gift_amount' ], Decimal ):
+        gross_gift_amount = str( int( transaction[ 'gross_gift_amount' ] ) )
+
+    gift_date = gift_date_in_utc.replace( tzinfo=datetime.timezone.utc ).timestamp()
+
+    return {
+        'gift_date': str( gift_date ),
+        'gift_id': str( gift.searchable_id ),
+        'firstname': user_payload[ 'first_name' ],
+        'lastname': user_payload[ 'last_name' ],
+        'amount': gross_gift_amount,
+        'city': user_payload[ 'city' ],
+        'state': user_payload[ 'state' ],
+        'email': user_payload[ 'email_address' ],
+        'account': gift.given_to.lower(),
+        'type': sale_type,
+        'recurring': recurring
+    }
@@ -0,0 +1,175 @@
+"""A module for the dispatcher that sends the emails in the outbox through the Ultsys email service.
+
+Emails are written to the email_outbox table by queue_email() in email.py, in the same database transaction as the
+gift or transaction they are about, and so the donation endpoint never waits on the email service. The dispatcher,
+run by the job jobs/email_outbox.py:
+
+    1. Claims a batch of due emails with SELECT ... FOR UPDATE, marking them sending with a claim timeout, so that a
+       second dispatcher does not send them too. An email claimed by a dispatcher that died is due again once the
+       claim times out.
+    2. Sends the emails, at most EMAIL_OUTBOX_RATE_LIMIT a second, on the pooled session for the EMAIL prefix.
+    3. Retries an email that fails with exponential backoff, and gives up after EMAIL_OUTBOX_MAX_ATTEMPTS.
+    4. Marks the sent emails, and sets receipt_sent_in_utc on the receipted transactions, with one UPDATE each and a
+       single commit per batch.
+
+Configuration in app.config:
+
+    EMAIL_OUTBOX_BATCH_SIZE: The number of emails claimed at a time ( default 50 ).
+    EMAIL_OUTBOX_RATE_LIMIT: The most emails sent a second ( default 10 ).
+    EMAIL_OUTBOX_MAX_ATTEMPTS: The attempts made before an email is marked failed ( default 5 ).
+    EMAIL_OUTBOX_BACKOFF: Seconds before the first retry, doubled on each attempt ( default 60 ).
+    EMAIL_OUTBOX_MAX_BACKOFF: The most seconds between retries ( default 3600 ).
+    EMAIL_OUTBOX_CLAIM_TIMEOUT: Seconds after which a claimed email that was not sent is due again ( default 300 ).
+"""
+import json
+import logging
+import time
+from datetime import datetime
+from datetime import timedelta
+
+from flask import current_app
+
+from application.exceptions.exception_critical_path import EmailHTTPStatusError
+from application.exceptions.exception_critical_path import EmailSendPathError
+from application.flask_essentials import database
+from application.helpers.email import send_email
+from application.models.email_outbox import EmailOutboxModel
+from application.models.transaction import TransactionModel
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_RATE_LIMIT = 10
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF = 60
+DEFAULT_MAX_BACKOFF = 3600
+DEFAULT_CLAIM_TIMEOUT = 300
+
+
+def get_outbox_config( name, default ):
+    """Get an outbox setting from app.config and fall back to the default if it is missing or empty."""
+
+    value = current_app.config.get( 'EMAIL_OUTBOX_{}'.format( name ) )
+    if value is None or value == '':
+        return default
+    return value
+
+
+def dispatch_email_outbox( max_batches=None ):
+    """Send the due emails in the outbox, a batch at a time, until there are none or max_batches have been sent.
+
+    :param max_batches: The most batches to send, or None for no limit.
+    :return: A dictionary of the number of emails sent, retried and failed.
+    """
+
+    summary = { 'sent': 0, 'retried': 0, 'failed': 0 }
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        outbox_models = claim_email_batch()
+        if not outbox_models:
+            break
+        batches += 1
+        for outcome, count in send_email_batch( outbox_models ).items():
+            summary[ outcome ] += count
+
+    if batches:
+        logging.info( 'Email outbox: %s', summary )
+    return summary
+
+
+def claim_email_batch():
+    """Claim the next batch of due emails for this dispatcher.
+
+    :return: A list of EmailOutboxModel.
+    """
+
+    now = datetime.utcnow()
+    batch_size = int( get_outbox_config( 'BATCH_SIZE', DEFAULT_BATCH_SIZE ) )
+    outbox_models = EmailOutboxModel.query \
+        .filter( EmailOutboxModel.status.in_( [ 'pending', 'sending' ] ) ) \
+        .filter( EmailOutboxModel.next_attempt_in_utc <= now ) \
+        .order_by( EmailOutboxModel.id ) \
+        .limit( batch_size ) \
+        .with_for_update() \
+        .all()
+
+    claim_timeout = timedelta( seconds=int( get_outbox_config( 'CLAIM_TIMEOUT', DEFAULT_CLAIM_TIMEOUT ) ) )
+    for outbox_model in outbox_models:
+        outbox_model.status = 'sending'
+        outbox_model.next_attempt_in_utc = now + claim_timeout
+    database.session.commit()
+    return outbox_models
+
+
+def send_email_batch( outbox_models ):
+    """Send a batch of claimed emails at the rate limit, and record the outcomes with a single commit.
+
+    :param outbox_models: The claimed EmailOutboxModel.
+    :return: A dictionary of the number of emails sent, retried and failed.
+    """
+
+    interval = 1.0 / float( get_outbox_config( 'RATE_LIMIT', DEFAULT_RATE_LIMIT ) )
+    max_attempts = int( get_outbox_config( 'MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS ) )
+
+    outcomes = { 'sent': 0, 'retried': 0, 'failed': 0 }
+    sent_ids = []
+    receipted_transaction_ids = []
+    last_sent = None
+    for outbox_model in outbox_models:
+        if last_sent is not None:
+            time.sleep( max( 0.0, interval - ( time.perf_counter() - last_sent ) ) )
+        last_sent = time.perf_counter()
+
+        try:
+            send_email( json.loads( outbox_model.payload ) )
+        except ( EmailHTTPStatusError, EmailSendPathError ) as error:
+            outbox_model.attempts += 1
+            outbox_model.last_error = str( error.message )[ :255 ]
+            if outbox_model.attempts >= max_attempts:
+                outbox_model.status = 'failed'
+                outcomes[ 'failed' ] += 1
+                logging.error( 'Email outbox: giving up on %s: %s', outbox_model.id, outbox_model.last_error )
+            else:
+                outbox_model.status = 'pending'
+                outbox_model.next_attempt_in_utc = datetime.utcnow() + get_backoff( outbox_model.attempts )
+                outcomes[ 'retried' ] += 1
+            continue
+
+        sent_ids.append( outbox_model.id )
+        if outbox_model.email_type == 'receipt' and outbox_model.transaction_id:
+            receipted_transaction_ids.append( outbox_model.transaction_id )
+        outcomes[ 'sent' ] += 1
+
+    now = datetime.utcnow()
+    if sent_ids:
+        EmailOutboxModel.query \
+            .filter( EmailOutboxModel.id.in_( sent_ids ) ) \
+            .update( { 'status': 'sent', 'sent_in_utc': now }, synchronize_session=False )
+    if receipted_transaction_ids:
+        TransactionModel.query \
+            .filter( TransactionModel.id.in_( receipted_transaction_ids ) ) \
+            .update( { 'receipt_sent_in_utc': now }, synchronize_session=False )
+    database.session.commit()
+
+    return outcomes
+
+
+def get_backoff( attempts ):
+    """The delay before the next attempt: doubled on each attempt, up to the maximum.
+
+    :param attempts: The attempts made so far.
+    :return: A timedelta.
+    """
+
+    backoff = int( get_outbox_config( 'BACKOFF', DEFAULT_BACKOFF ) ) * 2 ** ( attempts - 1 )
+    return timedelta( seconds=min( backoff, int( get_outbox_config( 'MAX_BACKOFF', DEFAULT_MAX_BACKOFF ) ) ) )
+
+
+def get_email_outbox_statistics():
+    """The number of emails in the outbox by status, for monitoring.
+
+    :return: A dictionary keyed by status.
+    """
+
+    counts = database.session.query( EmailOutboxModel.status, database.func.count( EmailOutboxModel.id ) ) \
+        .group_by( EmailOutboxModel.status ) \
+        .all()
+    return { outbox_status: count for outbox_status, count in counts }
@@ -7,7 +7,7 @@ from application.flask_essentials import database
 from application.helpers.model_serialization import to_json
 from application.helpers.ultsys_user import create_user
 from application.helpers.ultsys_user import find_ultsys_user
-from application.helpers.ultsys_user import update_ultsys_user
+from application.helpers.ultsys_user_updates import queue_ultsys_user_update
 from application.models.caged_donor import CagedDonorModel
 from application.models.gift import GiftModel
 from application.models.transaction import TransactionModel
@@ -76,9 +76,9 @@ def ultsys_user_create( payload ):
     ultsys_user = find_ultsys_user( get_ultsys_user_query( { 'drupal_user_uid': drupal_user_uid } ) )
     ultsys_user_id = ultsys_user[ 0 ][ 'ID' ]
 
-    # Update the gift with the new Ultsys user ID and the Ultsys user with the gross gift amount.
+    # Update the gift with the new Ultsys user ID, and queue the update of the Ultsys user with the gross gift amount.
     gift.user_id = ultsys_user_id
-    update_ultsys_user( { 'id': ultsys_user_id }, gross_gift_amount )
+    queue_ultsys_user_update( ultsys_user_id, gross_gift_amount, gift.id )
 
     database.session.delete( caged_donor_model )
     database.session.commit()
@@ -118,8 +118,9 @@ def ultsys_user_update( payload ):
         raise ModelTransactionNotFoundError
     gross_gift_amount = transaction.gross_gift_amount
 
-    # Update the Ultsys user with the new donation and delete the caged donor.
-    update_ultsys_user( { 'id': ultsys_user_id }, gross_gift_amount )
+    # Queue the update of the Ultsys user with the new donation and delete the caged donor.
+    # The user returned has the donation amounts from before the update, until the buffer is flushed.
+    queue_ultsys_user_update( ultsys_user_id, gross_gift_amount, gift.id )
     database.session.delete( caged_donor_model )
     database.session.commit()
     updated_ultsys_user = find_ultsys_user( get_ultsys_user_query( { 'ultsys_user_id': ultsys_user_id } ) )
@@ -1,12 +1,11 @@
 """A Module for general helper functions used across the application."""
-import json
 import string
 from copy import deepcopy
 
 import hvac
 
 from application.exceptions.exception_critical_path import GeneralHelperFindUserPathError
-from application.helpers.ultsys_user import get_ultsys_user
+from application.helpers.ultsys_user import find_ultsys_users
 from application.models.caged_donor import CagedDonorModel
 from application.models.queued_donor import QueuedDonorModel
 # pylint: disable=bare-except
@@ -88,31 +87,48 @@ def find_user( gift ):
     :return: A dictionary with user attributes.
     """
 
-    query = { -1: CagedDonorModel.query, -2: QueuedDonorModel.query }
+    return find_users( [ gift ] )[ gift.id ]
+
+
+def find_users( gifts ):
+    """Given gifts return their users, with a query per donor table and batched requests to the Ultsys user service.
+
+    :param gifts: A list of GiftModels with user IDs.
+    :return: A dictionary of dictionaries with user attributes keyed by the gift ID.
+    """
+
+    query = { -1: CagedDonorModel, -2: QueuedDonorModel }
     try:
-        if gift.user_id in [ -1, -2 ]:
-            found_donor = query[ gift.user_id ].filter_by( gift_id=gift.id ).one()
-            user = {
-                'first_name': found_donor.user_first_name,
-                'last_name': found_donor.user_last_name,
-                'city': found_donor.user_city,
-                'state': found_donor.user_state,
-                'email_address': found_donor.user_email_address
-            }
-        else:
-            user_query = {
-                'ID': { 'eq': gift.user_id }
-            }
-            ultsys_user_json = get_ultsys_user( user_query )
-            found_user = json.loads( ultsys_user_json.content.decode( 'utf-8' ) )[ 0 ]
-            user = {
-                'first_name': found_user[ 'firstname' ],
-                'last_name': found_user[ 'lastname' ],
-                'city': found_user[ 'city' ],
-                'state': found_user[ 'state' ],
-                'email_address': found_user[ 'email' ]
-            }
-        return user
+        found_donors = {}
+        for user_id, model in query.items():
+            gift_ids = [ gift.id for gift in gifts if gift.user_id == user_id ]
+            if gift_ids:
+                found_donors.update(
+                    { donor.gift_id: donor for donor in model.query.filter( model.gift_id.in_( gift_ids ) ).all() }
+                )
+        ultsys_users = find_ultsys_users( ids=[ gift.user_id for gift in gifts if gift.user_id not in query ] )
+
+        users = {}
+        for gift in gifts:
+            if gift.user_id in [ -1, -2 ]:
+                found_donor = found_donors[ gift.id ]
+                users[ gift.id ] = {
+                    'first_name': found_donor.user_first_name,
+                    'last_name': found_donor.user_last_name,
+                    'city': found_donor.user_city,
+                    'state': found_donor.user_state,
+                    'email_address': found_donor.user_email_address
+                }
+            else:
+                found_user = ultsys_users[ int( gift.user_id ) ][ 0 ]
+                users[ gift.id ] = {
+                    'first_name': found_user[ 'firstname' ],
+                    'last_name': found_user[ 'lastname' ],
+                    'city': found_user[ 'city' ],
+                    'state': found_user[ 'state' ],
+                    'email_address': found_user[ 'email' ]
+                }
+        return users
     except:
         raise GeneralHelperFindUserPathError()
 
@@ -0,0 +1,128 @@
+"""A module that provides pooled, keep-alive HTTP sessions for the external services the application calls.
+
+Calling requests.get() or requests.post() at module level builds a new connection, and a new TCP+TLS handshake, for
+every request. Here a requests.Session() is built once per service per worker process and reused, so that
+connections to the service are kept alive in a urllib3 pool.
+
+The sessions are configured from app.config using a prefix for the service, e.g. for the prefix ULTSYS:
+
+    ULTSYS_POOL_CONNECTIONS: The number of host pools to cache ( default 4 ).
+    ULTSYS_POOL_MAXSIZE: The maximum number of connections kept alive per host ( default 20 ).
+    ULTSYS_MAX_RETRIES: The number of retries on connection errors and 502, 503, 504 responses ( default 2 ).
+    ULTSYS_BACKOFF_FACTOR: The urllib3 backoff factor between retries ( default 0.3 ).
+    ULTSYS_CONNECT_TIMEOUT: Seconds to wait for the connection to be made ( default 3.05 ).
+    ULTSYS_READ_TIMEOUT: Seconds to wait for the response ( default 30 ).
+
+Retries on responses and read errors are only made for idempotent methods, e.g. GET. A POST is only retried when the
+connection could not be made, i.e. the request was never sent, and so a user is never created twice.
+
+Gunicorn runs the application with gevent workers. The workers are forked, and gevent monkey patches socket and
+threading before the application is loaded. The sessions are keyed on the process ID so that a forked worker never
+shares the sockets of its parent, and each worker builds its own pool. Greenlets within a worker share the pool,
+which is safe since urllib3 checks connections in and out of the pool one request at a time.
+"""
+import os
+import threading
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 20
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_BACKOFF_FACTOR = 0.3
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 30
+RETRY_STATUSES = ( 502, 503, 504 )
+
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+
+
+def get_http_session( prefix ):
+    """Return the pooled session for the service with the given configuration prefix, e.g. ULTSYS.
+
+    :param str prefix: The app.config prefix for the service.
+    :return: A requests.Session() shared by the worker process.
+    """
+
+    session_key = ( os.getpid(), prefix )
+    session = SESSIONS.get( session_key )
+    if session:
+        return session
+
+    with SESSIONS_LOCK:
+        # Another greenlet may have built the session while this one waited on the lock.
+        session = SESSIONS.get( session_key )
+        if not session:
+            session = build_http_session( prefix )
+            SESSIONS[ session_key ] = session
+    return session
+
+
+def build_http_session( prefix ):
+    """Build a requests.Session() with a pooled adapter and retry policy from app.config.
+
+    :param str prefix: The app.config prefix for the service.
+    :return: A requests.Session().
+    """
+
+    max_retries = int( get_http_config( prefix, 'MAX_RETRIES', DEFAULT_MAX_RETRIES ) )
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=float( get_http_config( prefix, 'BACKOFF_FACTOR', DEFAULT_BACKOFF_FACTOR ) ),
+        status_forcelist=RETRY_STATUSES,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=int( get_http_config( prefix, 'POOL_CONNECTIONS', DEFAULT_POOL_CONNECTIONS ) ),
+        pool_maxsize=int( get_http_config( prefix, 'POOL_MAXSIZE', DEFAULT_POOL_MAXSIZE ) ),
+        max_retries=retry,
+        pool_block=False
+    )
+
+    session = requests.Session()
+    session.mount( 'https://', adapter )
+    session.mount( 'http://', adapter )
+    return session
+
+
+def get_http_timeout( prefix ):
+    """The requests.Session() has no default timeout and so it is passed on each request: ( connect, read ).
+
+    :param str prefix: The app.config prefix for the service.
+    :return: A tuple of the connect and read timeouts in seconds.
+    """
+
+    return (
+        float( get_http_config( prefix, 'CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT ) ),
+        float( get_http_config( prefix, 'READ_TIMEOUT', DEFAULT_READ_TIMEOUT ) )
+    )
+
+
+def get_http_config( prefix, name, default ):
+    """Get a configuration value for the service and fall back to the default if it is missing or empty.
+
+    :param str prefix: The app.config prefix for the service.
+    :param str name: The name of the setting, e.g. POOL_MAXSIZE.
+    :param default: The default value.
+    :return: The configured value.
+    """
+
+    value = current_app.config.get( '{}_{}'.format( prefix, name ) )
+    if value is None or value == '':
+        return default
+    return value
+
+
+def close_http_sessions():
+    """Close the sessions built by this process, e.g. when a worker shuts down."""
+
+    with SESSIONS_LOCK:
+        for session_key in [ session_key for session_key in SESSIONS if session_key[ 0 ] == os.getpid() ]:
+            SESSIONS.pop( session_key ).close()
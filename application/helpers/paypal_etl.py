@@ -16,7 +16,7 @@ from application.exceptions.exception_paypal_etl import PayPalETLOnCommitError
 from application.exceptions.exception_paypal_etl import PayPalETLTooManyRowsError
 from application.flask_essentials import database
 from application.helpers.model_serialization import from_json
-from application.helpers.ultsys_user import get_ultsys_user
+from application.helpers.ultsys_user import find_ultsys_users
 from application.models.agent import AgentModel
 from application.models.paypal_etl import PaypalETLModel
 from application.models.transaction import TransactionModel
@@ -132,6 +132,15 @@ def process_paypal_etl( enacted_by_agent_id, reader_list, file_storage ):
 
     agent_emails = get_agent_emails()
 
+    # Find the Ultsys users for the gifts in batches, rather than a request per row.
+    ultsys_users = find_ultsys_users(
+        emails=[
+            row[ 'from_email_address' ] for row in reader_list
+            if row[ 'type' ] in VALID_GIFT_TRANSACTION_TYPES
+            and row[ 'transaction_id' ] not in data_from_models[ 'transaction_ids' ]
+        ]
+    )
+
     # Using for SQLAlchemy bulk_save_objects().
     bulk_objects = {
         'transaction': [],
@@ -154,7 +163,8 @@ def process_paypal_etl( enacted_by_agent_id, reader_list, file_storage ):
                 enacted_by_agent_id,
                 agent_emails,
                 ids,
-                bulk_objects
+                bulk_objects,
+                ultsys_users
             )
         elif transaction_type in REFUND_PAYPAL_TRANSACTION_TYPES:
             refund_paypal_transaction(
@@ -334,7 +344,8 @@ def valid_paypal_transaction(
         enacted_by_agent_id,
         agent_emails,
         ids,
-        bulk_objects
+        bulk_objects,
+        ultsys_users
 ):
     """Build the valid PayPal gifts/transactions.
 
@@ -343,13 +354,14 @@ def valid_paypal_transaction(
     :param agent_emails: The agent emails needed here.
     :param ids: The collected transaction and unresolved transaction IDs.
     :param bulk_objects: The lists for bulk saving.
+    :param ultsys_users: The Ultsys users keyed by lowercase email from find_ultsys_users().
     :return:
     """
 
     # This is a gift.
     try:
         # The returned Ultsys user object is something like: { 'ID': -999 }.
-        user = get_ultsys_user( { 'email': { 'eq': row[ 'from_email_address' ] } } ).json()[ 0 ]
+        user = ultsys_users[ row[ 'from_email_address' ].strip().lower() ][ 0 ]
     except ( AttributeError, IndexError, KeyError ):
         user = None
 
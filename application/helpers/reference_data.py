@@ -0,0 +1,241 @@
+"""A module for a cache of the small reference tables that rarely change: agent, method_used and campaign.
+
+AgentModel.get_agent() and MethodUsedModel.get_method_used() make up to two queries each, and are called several
+times for every sale, webhook, refund and note. The cache loads each table once for the application, which is once
+per gunicorn worker or cron job, keeps the rows as read-only records and indexes them by each field that is looked up,
+e.g. name, user_id and id. The records are not bound to a session, and so may be used across requests.
+
+The keys of an index are compared as the MySQL collation does: as strings, stripped and case insensitive.
+
+A table is loaded again:
+
+    1. When it is invalidated by invalidate_reference_data(), e.g. by the campaign endpoints or the database scripts
+       after they write. The invalidation increments a version in Redis, which the other workers check at most every
+       REFERENCE_DATA_VERSION_INTERVAL seconds ( default 10 ).
+    2. After REFERENCE_DATA_TTL seconds ( default 300 ), in case Redis is unavailable or a row is changed by hand.
+    3. When a lookup finds nothing, at most once every REFERENCE_DATA_VERSION_INTERVAL seconds.
+
+The lookups find_agent() and find_method_used() return the same rows as the model methods they stand in for.
+"""
+import logging
+import time
+from collections import namedtuple
+
+from flask import current_app
+
+from application.flask_essentials import redis_queue
+from application.models.agent import AgentModel
+from application.models.campaign import CampaignModel
+from application.models.method_used import MethodUsedModel
+# pylint: disable=bare-except
+# flake8: noqa:E722
+
+REFERENCE_DATA_EXTENSION = 'reference_data'
+REFERENCE_DATA_VERSION_KEY = 'reference_data:version:{}'
+REFERENCE_MODELS = {
+    'agent': AgentModel,
+    'method_used': MethodUsedModel,
+    'campaign': CampaignModel
+}
+
+DEFAULT_TTL = 300
+DEFAULT_VERSION_INTERVAL = 10
+
+
+class ReferenceTable:
+    """The rows of a reference table as records, with an index per field built the first time it is looked up."""
+
+    def __init__( self, name, records, version ):
+        self.name = name
+        self.records = records
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.checked_at = self.loaded_at
+        self.indexes = {}
+
+    def find( self, field, field_value ):
+        """The records where the field equals the value, ordered by ID.
+
+        :param str field: The field, e.g. name.
+        :param field_value: The value of the field.
+        :return: A list of records.
+        """
+
+        if field not in self.indexes:
+            index = {}
+            for record in self.records:
+                index.setdefault( get_index_key( getattr( record, field ) ), [] ).append( record )
+            self.indexes[ field ] = index
+        return self.indexes[ field ].get( get_index_key( field_value ), [] )
+
+    def find_one( self, field, field_value ):
+        """The first record where the field equals the value, or None."""
+
+        records = self.find( field, field_value )
+        return records[ 0 ] if records else None
+
+
+def get_index_key( value ):
+    """The key of a value in an index, compared as the MySQL collation does."""
+
+    if value is None:
+        return None
+    return str( value ).strip().lower()
+
+
+def get_reference_config( name, default ):
+    """Get a reference data setting from app.config and fall back to the default if it is missing or empty."""
+
+    value = current_app.config.get( 'REFERENCE_DATA_{}'.format( name ) )
+    if value is None or value == '':
+        return default
+    return int( value )
+
+
+def get_reference_tables():
+    """The cached tables of the current application."""
+
+    return current_app.extensions.setdefault( REFERENCE_DATA_EXTENSION, {} )
+
+
+def get_reference_data_version( name ):
+    """The version of a table in Redis, or None if Redis is unavailable."""
+
+    try:
+        version = redis_queue.connection.get( REFERENCE_DATA_VERSION_KEY.format( name ) )
+    except:
+        logging.debug( 'Unable to get the reference data version: %s', name )
+        return None
+    return int( version ) if version else 0
+
+
+def load_reference_table( name ):
+    """Load a reference table into the cache of the current application.
+
+    :param str name: The name of the table: agent, method_used or campaign.
+    :return: The ReferenceTable.
+    """
+
+    # Get the version before the rows, so that a write made while loading is seen by the next check.
+    version = get_reference_data_version( name )
+    model = REFERENCE_MODELS[ name ]
+    columns = [ column.key for column in model.__table__.columns ]
+    record_class = namedtuple( '{}Record'.format( model.__name__ ), columns )
+    records = [
+        record_class( *[ getattr( model_instance, column ) for column in columns ] )
+        for model_instance in model.query.order_by( model.id ).all()
+    ]
+
+    table = ReferenceTable( name, records, version )
+    get_reference_tables()[ name ] = table
+    logging.debug( 'Reference data loaded: %s, %s rows', name, len( records ) )
+    return table
+
+
+def get_reference_table( name ):
+    """The cached table, loaded again if it has expired or its version has changed.
+
+    :param str name: The name of the table: agent, method_used or campaign.
+    :return: The ReferenceTable.
+    """
+
+    table = get_reference_tables().get( name )
+    if table is None:
+        return load_reference_table( name )
+
+    now = time.monotonic()
+    if now - table.loaded_at > get_reference_config( 'TTL', DEFAULT_TTL ):
+        return load_reference_table( name )
+
+    if now - table.checked_at > get_reference_config( 'VERSION_INTERVAL', DEFAULT_VERSION_INTERVAL ):
+        table.checked_at = now
+        if get_reference_data_version( name ) != table.version:
+            return load_reference_table( name )
+
+    return table
+
+
+def find_reference_record( name, field, field_value ):
+    """The first record of a table where the field equals the value. A miss loads the table again, at most once every
+    REFERENCE_DATA_VERSION_INTERVAL seconds, in case the row was added since it was loaded.
+
+    :param str name: The name of the table: agent, method_used or campaign.
+    :param str field: The field, e.g. name.
+    :param field_value: The value of the field.
+    :return: The record, or None.
+    """
+
+    table = get_reference_table( name )
+    record = table.find_one( field, field_value )
+    interval = get_reference_config( 'VERSION_INTERVAL', DEFAULT_VERSION_INTERVAL )
+    if record is None and time.monotonic() - table.loaded_at > interval:
+        record = load_reference_table( name ).find_one( field, field_value )
+    return record
+
+
+def invalidate_reference_data( *names ):
+    """Drop tables from the cache of this process, and increment their versions so that the other processes load them
+    again. Call after committing a write to a reference table.
+
+    :param names: The names of the tables, or all of them if none are given.
+    :return:
+    """
+
+    names = names or tuple( REFERENCE_MODELS )
+    tables = get_reference_tables()
+    for name in names:
+        tables.pop( name, None )
+
+    try:
+        pipeline = redis_queue.connection.pipeline()
+        for name in names:
+            pipeline.incr( REFERENCE_DATA_VERSION_KEY.format( name ) )
+        pipeline.execute()
+    except:
+        logging.exception( 'Unable to increment the reference data versions: %s', names )
+
+
+def find_agent( agent_type, field, field_value ):
+    """The cached equivalent of AgentModel.get_agent(): the agent where the field equals the value, and otherwise the
+    unknown agent for the type.
+
+    :param str agent_type: The type of agent: Staff Member, Organization or Automated.
+    :param str field: The field, e.g. user_id or name.
+    :param field_value: The value of the field.
+    :return: The agent record, or None.
+    """
+
+    agent = find_reference_record( 'agent', field, field_value )
+    if not agent:
+        if agent_type == 'Staff Member':
+            agent = find_reference_record( 'agent', 'name', 'Unknown Staff Member' )
+        elif agent_type in ( 'Automated', 'Organization' ):
+            agent = find_reference_record( 'agent', 'name', 'Unknown Organization' )
+    return agent
+
+
+def find_method_used( field, field_value ):
+    """The cached equivalent of MethodUsedModel.get_method_used(): the method used where the field equals the value,
+    and otherwise the unknown method used.
+
+    :param str field: The field, e.g. name.
+    :param field_value: The value of the field.
+    :return: The method used record, or None.
+    """
+
+    method_used = find_reference_record( 'method_used', field, field_value )
+    if not method_used:
+        method_used = find_reference_record( 'method_used', 'name', 'Unknown Method Used' )
+    return method_used
+
+
+def find_campaign( campaign_id ):
+    """The cached campaign with the ID, or None."""
+
+    return find_reference_record( 'campaign', 'id', campaign_id )
+
+
+def find_default_campaign():
+    """The cached default campaign, or None."""
+
+    return get_reference_table( 'campaign' ).find_one( 'is_default', 1 )
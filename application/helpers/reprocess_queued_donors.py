@@ -0,0 +1,226 @@
+"""A module for reprocessing queued donors in the background, e.g. after an outage of the Ultsys user service.
+
+The endpoint registers a reprocess and queues redis_queue_reprocess_queued_donors(), and so returns at once rather
+than holding a gunicorn worker while every queued donor is queued for caging. The job:
+
+    1. Streams the queued donors in chunks of REPROCESS_CHUNK_SIZE ( default 500 ), ordered by ID.
+    2. Gets the transactions for all the gifts in a chunk with a single IN query, and serializes each chunk once.
+    3. Queues the chunk for caging in bulk: onto the batch list in one Redis pipeline when CAGING_BATCH_ENABLED is
+       set ( see caging_batch.py ), or with the RQ queue's enqueue_many(), which uses a pipeline, when it has one.
+
+The progress of a reprocess is kept in a Redis hash for REPROCESS_STATUS_TTL seconds ( default 86400 ), and returned
+by get_reprocess_status().
+"""
+import logging
+import uuid
+from datetime import datetime
+
+from flask import current_app
+from rq import Queue
+
+from application.flask_essentials import redis_queue
+from application.helpers.caging import redis_queue_caging
+from application.helpers.caging_batch import is_caging_batch_enabled
+from application.helpers.caging_batch import queue_caging_batches
+from application.helpers.general_helper_functions import validate_user_payload
+from application.helpers.model_serialization import to_json
+from application.models.queued_donor import QueuedDonorModel
+from application.models.transaction import TransactionModel
+from application.schemas.queued_donor import QueuedDonorSchema
+from application.schemas.transaction import TransactionSchema
+from application.worker import worker_app_context
+# pylint: disable=bare-except
+# flake8: noqa:E722
+
+REPROCESS_STATUS_KEY = 'reprocess_queued_donors:{}'
+REPROCESS_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+REPROCESS_TRANSACTION_TYPES = [ 'Gift', 'Deposit to Bank' ]
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_STATUS_TTL = 86400
+
+
+def register_reprocess( queued_donor_ids=None ):
+    """Register a reprocess of the queued donors and queue the job that does it.
+
+    :param queued_donor_ids: The queued donor ID's to reprocess, or None for all of them.
+    :return: The status of the reprocess, or None if it could not be queued.
+    """
+
+    reprocess_id = uuid.uuid4().hex
+    set_reprocess_status(
+        reprocess_id,
+        {
+            'status': 'registered',
+            'registered_in_utc': datetime.utcnow().strftime( REPROCESS_DATE_FORMAT ),
+            'queued_donors': 0,
+            'enqueued': 0,
+            'failed': 0
+        }
+    )
+
+    try:
+        redis_queue_reprocess_queued_donors.queue( reprocess_id, queued_donor_ids, current_app.config[ 'ENV' ] )
+    except:
+        logging.exception( 'Unable to queue the reprocess of the queued donors: %s', reprocess_id )
+        set_reprocess_status( reprocess_id, { 'status': 'failed' } )
+        return None
+
+    return get_reprocess_status( reprocess_id )
+
+
+@redis_queue.job
+def redis_queue_reprocess_queued_donors( reprocess_id, queued_donor_ids, app_config_name ):
+    """Queue the queued donors for caging a chunk at a time, recording the progress.
+
+    :param reprocess_id: The ID of the reprocess from register_reprocess().
+    :param queued_donor_ids: The queued donor ID's to reprocess, or None for all of them.
+    :param app_config_name: The configuration ( PROD, DEV, TEST ) that the app is running.
+    :return:
+    """
+
+    with worker_app_context( app_config_name ):
+        set_reprocess_status(
+            reprocess_id, { 'status': 'running', 'started_in_utc': datetime.utcnow().strftime( REPROCESS_DATE_FORMAT ) }
+        )
+        try:
+            for chunk in stream_queued_donors( queued_donor_ids ):
+                donors = build_reprocess_donors( chunk )
+                enqueued = enqueue_reprocess_donors( donors, app_config_name )
+                increment_reprocess_status(
+                    reprocess_id,
+                    { 'queued_donors': len( donors ), 'enqueued': enqueued, 'failed': len( donors ) - enqueued }
+                )
+        except:
+            logging.exception( 'The reprocess of the queued donors failed: %s', reprocess_id )
+            set_reprocess_status( reprocess_id, { 'status': 'failed' } )
+            raise
+
+        set_reprocess_status(
+            reprocess_id,
+            { 'status': 'finished', 'finished_in_utc': datetime.utcnow().strftime( REPROCESS_DATE_FORMAT ) }
+        )
+
+
+def stream_queued_donors( queued_donor_ids=None ):
+    """Yield the queued donors in chunks, paging on the ID so that each chunk is a short indexed query.
+
+    :param queued_donor_ids: The queued donor ID's to reprocess, or None for all of them.
+    :return: A generator of lists of queued donor models.
+    """
+
+    chunk_size = int( current_app.config.get( 'REPROCESS_CHUNK_SIZE' ) or DEFAULT_CHUNK_SIZE )
+    last_id = 0
+    while True:
+        query = QueuedDonorModel.query.filter( QueuedDonorModel.id > last_id )
+        if queued_donor_ids is not None:
+            query = query.filter( QueuedDonorModel.id.in_( queued_donor_ids ) )
+        chunk = query.order_by( QueuedDonorModel.id ).limit( chunk_size ).all()
+        if not chunk:
+            return
+        last_id = chunk[ -1 ].id
+        yield chunk
+
+
+def build_reprocess_donors( queued_donor_models ):
+    """Build the user dictionaries and transactions for caging, with one query for all the transactions of a chunk.
+
+    :param queued_donor_models: A chunk of queued donor models.
+    :return: A list of dictionaries with the user and transactions: { 'user': {}, 'transactions': [] }.
+    """
+
+    gift_ids = { queued_donor_model.gift_id for queued_donor_model in queued_donor_models }
+    transaction_models = TransactionModel.query \
+        .filter( TransactionModel.gift_id.in_( gift_ids ) ) \
+        .filter( TransactionModel.type.in_( REPROCESS_TRANSACTION_TYPES ) ) \
+        .order_by( TransactionModel.id ) \
+        .all()
+
+    # May be multiple transactions for a gift, e.g. check with a Gift and Deposit to Bank.
+    transactions_by_gift = {}
+    transaction_dicts = to_json( TransactionSchema( many=True ), transaction_models ).data
+    for transaction_model, transaction_dict in zip( transaction_models, transaction_dicts ):
+        transactions_by_gift.setdefault( transaction_model.gift_id, [] ).append( transaction_dict )
+
+    donors = []
+    queued_donor_dicts = to_json( QueuedDonorSchema( many=True ), queued_donor_models ).data
+    for queued_donor_model, queued_donor_dict in zip( queued_donor_models, queued_donor_dicts ):
+        queued_donor_dict[ 'gift_id' ] = queued_donor_model.gift_id
+        queued_donor_dict[ 'queued_donor_id' ] = queued_donor_model.id
+        queued_donor_dict[ 'category' ] = 'queued'
+        queued_donor_dict.pop( 'id' )
+
+        # Caging expects a user dictionary that has a user something like: { user_address:{}, 'billing_address':{} }.
+        # Put the queued donor dictionary in this form.
+        user = validate_user_payload( queued_donor_dict )
+        donors.append( { 'user': user, 'transactions': transactions_by_gift.get( queued_donor_model.gift_id, [] ) } )
+    return donors
+
+
+def enqueue_reprocess_donors( donors, app_config_name ):
+    """Queue the donors for caging in bulk.
+
+    :param donors: A list of dictionaries with the user and transactions.
+    :param app_config_name: The configuration ( PROD, DEV, TEST ) that the app is running.
+    :return: The number of donors queued.
+    """
+
+    if is_caging_batch_enabled():
+        queue_caging_batches( donors, app_config_name )
+        return len( donors )
+
+    queue = redis_queue.get_queue()
+    if hasattr( queue, 'enqueue_many' ):
+        job_datas = [
+            Queue.prepare_data( redis_queue_caging, ( donor[ 'user' ], donor[ 'transactions' ], app_config_name ) )
+            for donor in donors
+        ]
+        return len( queue.enqueue_many( job_datas ) )
+
+    enqueued = 0
+    for donor in donors:
+        try:
+            redis_queue_caging.queue( donor[ 'user' ], donor[ 'transactions' ], app_config_name )
+            enqueued += 1
+        except:
+            logging.exception( 'Unable to queue the queued donor: %s', donor[ 'user' ][ 'queued_donor_id' ] )
+    return enqueued
+
+
+def set_reprocess_status( reprocess_id, fields ):
+    """Set fields of the status of a reprocess."""
+
+    key = REPROCESS_STATUS_KEY.format( reprocess_id )
+    pipeline = redis_queue.connection.pipeline()
+    pipeline.hmset( key, fields )
+    pipeline.expire( key, int( current_app.config.get( 'REPROCESS_STATUS_TTL' ) or DEFAULT_STATUS_TTL ) )
+    pipeline.execute()
+
+
+def increment_reprocess_status( reprocess_id, counts ):
+    """Add to the counts of the status of a reprocess."""
+
+    key = REPROCESS_STATUS_KEY.format( reprocess_id )
+    pipeline = redis_queue.connection.pipeline()
+    for field, count in counts.items():
+        pipeline.hincrby( key, field, count )
+    pipeline.execute()
+
+
+def get_reprocess_status( reprocess_id ):
+    """The status and progress of a reprocess.
+
+    :param reprocess_id: The ID of the reprocess from register_reprocess().
+    :return: A dictionary of the status, or None if the reprocess is unknown or has expired.
+    """
+
+    fields = redis_queue.connection.hgetall( REPROCESS_STATUS_KEY.format( reprocess_id ) )
+    if not fields:
+        return None
+
+    reprocess_status = { 'reprocess_id': reprocess_id }
+    for field, value in fields.items():
+        field = field.decode( 'utf-8' )
+        value = value.decode( 'utf-8' )
+        reprocess_status[ field ] = int( value ) if field in [ 'queued_donors', 'enqueued', 'failed' ] else value
+    return reprocess_status
@@ -1,8 +1,15 @@
-"""A helper file that contains functions for modifying transactions. """
+"""A helper file that contains functions for modifying transactions.
+
+The balance of a gift is not a sum: each transaction carries the gift's running gross_gift_amount, and the balance is
+the gross_gift_amount of its latest transaction, by date_in_utc and then ID. get_gift_balance() and
+get_latest_transactions() read it with a query on the ix_transaction_gift_id_date_in_utc index, rather than loading
+every transaction of the gift.
+"""
 from datetime import datetime
 from decimal import Decimal
 
 from marshmallow.exceptions import ValidationError as MarshmallowValidationError
+from sqlalchemy import and_
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm.exc import NoResultFound as SQLAlchemyORMNoResultFoundError
 
@@ -31,12 +38,8 @@ def create_transaction( transaction_dict ):
     try:
         gift_model = database.session.execute( sql_query ).fetchone()
 
-        # Get all the transactions on the gift and grab the current gross_gift_amount.
-        transactions = TransactionModel.query.filter_by( gift_id=gift_model.id )\
-            .order_by( TransactionModel.date_in_utc.desc() ).all()
-        current_gross_gift_amount = Decimal( 0.00 )
-        if transactions:
-            current_gross_gift_amount = transactions[ 0 ].gross_gift_amount
+        # Grab the current gross_gift_amount on the gift.
+        current_gross_gift_amount = get_gift_balance( gift_model.id )
 
     except SQLAlchemyORMNoResultFoundError as error:
         raise error
@@ -95,3 +98,52 @@ def scrub_transaction_dict( transaction_dict ):
     if 'gross_gift_amount' not in transaction_dict or \
             ( 'gross_gift_amount' in transaction_dict and transaction_dict[ 'gross_gift_amount' ] == '' ):
         transaction_dict[ 'gross_gift_amount' ] = Decimal( 0 )
+
+
+def get_gift_balance( gift_id ):
+    """The current balance on a gift: the gross_gift_amount of its latest transaction.
+
+    :param gift_id: The gift ID.
+    :return: The balance as a Decimal, 0 if the gift has no transactions.
+    """
+
+    balance = database.session.query( TransactionModel.gross_gift_amount ) \
+        .filter( TransactionModel.gift_id == gift_id ) \
+        .order_by( TransactionModel.date_in_utc.desc(), TransactionModel.id.desc() ) \
+        .limit( 1 ) \
+        .scalar()
+    return Decimal( balance ) if balance is not None else Decimal( 0 )
+
+
+def get_latest_transactions( gift_ids ):
+    """The latest transaction of each gift, with a query for the latest date_in_utc of each joined to the transactions.
+
+    :param gift_ids: A list of gift ID's.
+    :return: A dictionary of gift ID to a tuple of the latest transaction's ID, date_in_utc and gross_gift_amount.
+    """
+
+    if not gift_ids:
+        return {}
+
+    latest_dates = database.session.query(
+        TransactionModel.gift_id, database.func.max( TransactionModel.date_in_utc ).label( 'date_in_utc' )
+    ).filter( TransactionModel.gift_id.in_( gift_ids ) ) \
+        .group_by( TransactionModel.gift_id ) \
+        .subquery()
+
+    latest_transactions = {}
+    for gift_id, transaction_id, date_in_utc, gross_gift_amount in database.session.query(
+            TransactionModel.gift_id,
+            TransactionModel.id,
+            TransactionModel.date_in_utc,
+            TransactionModel.gross_gift_amount
+    ).join(
+        latest_dates, and_(
+            TransactionModel.gift_id == latest_dates.c.gift_id,
+            TransactionModel.date_in_utc == latest_dates.c.date_in_utc
+        )
+    ).all():
+        # Transactions on the same date: the one with the largest ID is the latest.
+        if gift_id not in latest_transactions or transaction_id > latest_transactions[ gift_id ][ 0 ]:
+            latest_transactions[ gift_id ] = ( transaction_id, date_in_utc, Decimal( gross_gift_amount ) )
+    return latest_transactions
@@ -1,8 +1,9 @@
 """Controllers for Flask-RESTful resources: handle the business logic for the endpoint."""
+import copy
 import json
 from operator import itemgetter
+from urllib.parse import quote
 
-import requests
 from flask import current_app
 from flask_api import status
 
@@ -11,9 +12,21 @@ from application.exceptions.exception_ultsys_user import UltsysUserBadRequestErr
 from application.exceptions.exception_ultsys_user import UltsysUserHTTPStatusCodeError
 from application.exceptions.exception_ultsys_user import UltsysUserInternalServerError
 from application.exceptions.exception_ultsys_user import UltsysUserNotFoundError
+from application.helpers.http_session import get_http_session
+from application.helpers.http_session import get_http_timeout
+from application.helpers.ultsys_user_cache import get_cached_users
+from application.helpers.ultsys_user_cache import invalidate_user
+from application.helpers.ultsys_user_cache import set_cached_users
 # pylint: disable=bare-except
 # flake8: noqa:E722
 
+# The app.config prefix for the pooled session settings, e.g. ULTSYS_POOL_MAXSIZE and ULTSYS_READ_TIMEOUT.
+ULTSYS_HTTP_PREFIX = 'ULTSYS'
+
+# The bulk search splits its values so that the JSON encoded "in" list stays well inside common URL length limits.
+DEFAULT_BATCH_URL_LENGTH = 1500
+DEFAULT_BATCH_SIZE = 100
+
 
 def create_user( user_parameters ):
     """Function to create a user using the Drupal user service.
@@ -40,14 +53,18 @@ def create_user( user_parameters ):
     drupal_url = current_app.config[ 'ULTSYS_USER_CREATE_SERVICE' ]
     headers = { 'content-type': 'application/json', 'api-key': drupal_api_key }
 
-    request = requests.post(
+    request = get_http_session( ULTSYS_HTTP_PREFIX ).post(
         drupal_url,
         data=json.dumps( user_parameters ),
-        headers=headers
+        headers=headers,
+        timeout=get_http_timeout( ULTSYS_HTTP_PREFIX )
     )
     raise_error( request )
     drupal_uid = request.json()[ 'uid' ]
 
+    # Cached searches on any of the new user's fields, or its UID, may no longer hold all the users.
+    invalidate_user( user_parameters=dict( user_parameters, uid=drupal_uid ) )
+
     return drupal_uid
 
 
@@ -67,12 +84,16 @@ def update_ultsys_user( user, gross_gift_amount ):
     drupal_api_key_parameter = 'apikey={}'.format( current_app.config[ 'ULTSYS_API_KEY' ] )
     url_with_api_key = '{}?{}'.format( current_app.config[ 'ULTSYS_USER_UPDATE_SERVICE' ], drupal_api_key_parameter )
     headers = { 'content-type': 'application/json' }
-    request = requests.post(
+    request = get_http_session( ULTSYS_HTTP_PREFIX ).post(
         url_with_api_key,
         params=user_parameters,
-        headers=headers
+        headers=headers,
+        timeout=get_http_timeout( ULTSYS_HTTP_PREFIX )
     )
     raise_error( request )
+
+    # The cached searches holding the user have a stale donation amount.
+    invalidate_user( user_id=user[ 'id' ] )
     return status.HTTP_200_OK
 
 
@@ -89,10 +110,18 @@ def find_ultsys_user( query_parameters ):
 
     Refer to get_ultsys_user() and sort_ultsys_user() for search_terms, and sort_terms respectively.
 
+    The unsorted users for the search terms are read through the cache in ultsys_user_cache.py.
+
     :param dict query_parameters: A dictionary with information for the retrieval and sorting of users.
     :return: A list of dictionaries containing unsorted/sorted users.
     """
 
+    # get_ultsys_user() serializes the search terms in place, and so keep a copy for the cache.
+    search_terms = copy.deepcopy( query_parameters[ 'search_terms' ] )
+    ultsys_user_data = get_cached_users( search_terms )
+    if ultsys_user_data is not None:
+        return sort_ultsys_user( ultsys_user_data, query_parameters[ 'sort_terms' ] )
+
     request = get_ultsys_user( query_parameters[ 'search_terms' ] )
     # The request.content is offered up in ISO-8859-1, and so in json.loads() use ISO-8859-1 as the encoding.
     # json.loads() will convert this to unicode by default.
@@ -101,11 +130,78 @@ def find_ultsys_user( query_parameters ):
     elif request.status_code == 200:
         ultsys_user_data = request.content.decode( 'ISO-8859-1' )
         ultsys_user_data = json.loads( ultsys_user_data, encoding='ISO-8859-1' )
+        set_cached_users( search_terms, ultsys_user_data )
         ultsys_user_data = sort_ultsys_user( ultsys_user_data, query_parameters[ 'sort_terms' ] )
         return ultsys_user_data
+    set_cached_users( search_terms, [] )
     return []
 
 
+def find_ultsys_users( ids=None, emails=None ):
+    """Find many users by ID or email using the "in" operator of the user service, in as few requests as possible.
+
+    The values are split into batches whose JSON encoded search terms are at most ULTSYS_BATCH_URL_LENGTH characters
+    and ULTSYS_BATCH_SIZE values, and each batch is a single find_ultsys_user() call ( and so is cached ).
+
+    The dictionary returned is keyed by the integer ID for the IDs, and the lowercase email for the emails, and the
+    values are lists of the users found. An email may belong to more than one user, and callers can check an ID
+    returns exactly one user. Values that are not found are missing from the dictionary.
+
+    ultsys_users = {
+        1234: [ { "ID": 1234, "firstname": "Joe", ... } ],
+        "jbaker@gmail.com": [ { "ID": 1234, "firstname": "Joe", ... } ]
+    }
+
+    :param ids: An iterable of Ultsys user IDs.
+    :param emails: An iterable of email addresses.
+    :return: A dictionary of lists of user dictionaries keyed by ID or email.
+    """
+
+    ultsys_users = {}
+
+    ids = sorted( { int( user_id ) for user_id in ids or [] } )
+    for batch in build_search_batches( ids ):
+        query_parameters = { 'action': 'find', 'search_terms': { 'ID': { 'in': batch } }, 'sort_terms': [] }
+        for ultsys_user in find_ultsys_user( query_parameters ):
+            ultsys_users.setdefault( int( ultsys_user[ 'ID' ] ), [] ).append( ultsys_user )
+
+    emails = sorted( { email.strip().lower() for email in emails or [] if email and email.strip() } )
+    for batch in build_search_batches( emails ):
+        query_parameters = { 'action': 'find', 'search_terms': { 'email': { 'in': batch } }, 'sort_terms': [] }
+        for ultsys_user in find_ultsys_user( query_parameters ):
+            if ultsys_user.get( 'email' ):
+                ultsys_users.setdefault( ultsys_user[ 'email' ].strip().lower(), [] ).append( ultsys_user )
+
+    return ultsys_users
+
+
+def build_search_batches( values ):
+    """Split the values for an "in" search into batches that keep the request URL a safe length.
+
+    :param list values: The values to search on.
+    :return: A list of lists of values.
+    """
+
+    max_length = int( current_app.config.get( 'ULTSYS_BATCH_URL_LENGTH' ) or DEFAULT_BATCH_URL_LENGTH )
+    max_size = int( current_app.config.get( 'ULTSYS_BATCH_SIZE' ) or DEFAULT_BATCH_SIZE )
+
+    batches = []
+    batch = []
+    batch_length = 0
+    for value in values:
+        # The URL encoded length of the value in the JSON list, plus the separator.
+        value_length = len( quote( json.dumps( value ) ) ) + len( quote( ', ' ) )
+        if batch and ( batch_length + value_length > max_length or len( batch ) >= max_size ):
+            batches.append( batch )
+            batch = []
+            batch_length = 0
+        batch.append( value )
+        batch_length += value_length
+    if batch:
+        batches.append( batch )
+    return batches
+
+
 def get_ultsys_user( search_terms ):
     """The get request for retrieving ultsys user data.
 
@@ -135,7 +231,9 @@ def get_ultsys_user( search_terms ):
         url_with_api_key = '{}?{}'\
             .format( current_app.config[ 'ULTSYS_USER_SEARCH_SERVICE' ], drupal_api_key_parameter )
         headers = { 'content-type': 'application/json', 'Cache-Control': 'no-cache' }
-        request = requests.get( url_with_api_key, params=search_terms, headers=headers )
+        request = get_http_session( ULTSYS_HTTP_PREFIX ).get(
+            url_with_api_key, params=search_terms, headers=headers, timeout=get_http_timeout( ULTSYS_HTTP_PREFIX )
+        )
         return request
     except:
         raise UltsysUserGetUserPathError()
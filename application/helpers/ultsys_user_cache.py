@@ -0,0 +1,289 @@
+"""A read-through cache for the Ultsys user search service used by find_ultsys_user().
+
+The same search terms, e.g. { "ID": { "eq": 1234 } } or { "lastname": { "eq": "Smith" } }, are sent to Drupal over and
+over by caging, the thank you letters, find_user() and GiftThankYouLetterModel.user. The unsorted users returned for
+a search are cached here keyed on the normalized search terms, and sorting is still done by find_ultsys_user().
+
+The cache is held in Redis, using the redis_queue connection, so that it is shared by the web and worker containers.
+If Redis can't be reached the cache falls back to a bounded in-process LRU with the same TTL.
+
+Only searches whose terms are all "eq" or "in" are cached: a new user can't be matched to a "like" or other search
+without running it, and so those always go to Drupal.
+
+Every entry is tagged with the IDs of the users it holds, and with a field:value pair for each value of its search
+terms. When update_ultsys_user() touches a user the entries tagged with that ID are dropped. When create_user() makes a
+user the entries tagged with any of the new user's field values are dropped, since those searches may now have another
+user.
+
+Configuration in app.config:
+
+    ULTSYS_USER_CACHE_ENABLED: Whether to cache ( default is True except when the app is testing ).
+    ULTSYS_USER_CACHE_TTL: Seconds an entry is kept ( default 300 ).
+    ULTSYS_USER_CACHE_MAXSIZE: The number of entries kept by the in-process fallback ( default 2048 ).
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+from application.flask_essentials import redis_queue
+
+CACHE_KEY_PREFIX = 'ultsys_user_cache'
+DEFAULT_TTL = 300
+DEFAULT_MAXSIZE = 2048
+
+# The search operators that are cached: their entries can be tagged with every value they match.
+CACHED_OPERATORS = ( 'eq', 'in' )
+
+LOCAL_CACHE = OrderedDict()
+LOCAL_TAGS = {}
+LOCAL_STATISTICS = { 'hits': 0, 'misses': 0, 'invalidations': 0, 'redis_errors': 0 }
+LOCAL_LOCK = threading.Lock()
+
+
+def is_cache_enabled():
+    """The cache is on unless it is turned off in app.config, or the app is under test."""
+
+    enabled = current_app.config.get( 'ULTSYS_USER_CACHE_ENABLED' )
+    if enabled is None or enabled == '':
+        return not current_app.testing
+    if isinstance( enabled, str ):
+        return enabled.lower() in [ '1', 'true', 'yes' ]
+    return bool( enabled )
+
+
+def get_cache_ttl():
+    """The time to live in seconds of an entry."""
+
+    ttl = current_app.config.get( 'ULTSYS_USER_CACHE_TTL' )
+    if ttl is None or ttl == '':
+        return DEFAULT_TTL
+    return int( ttl )
+
+
+def normalize_search_terms( search_terms ):
+    """Build the cache key from the search terms.
+
+    The search terms are serialized with sorted keys, scalars are cast to strings and lowercased ( MySQL compares case
+    insensitively ), so that { "ID": { "eq": 12 } } and { "ID": { "eq": "12" } } share an entry.
+
+    :param dict search_terms: A dictionary of column names and search parameters: operator, value.
+    :return: The cache key.
+    """
+
+    def normalize( value ):
+        if isinstance( value, dict ):
+            return { str( key ): normalize( item ) for key, item in value.items() }
+        if isinstance( value, ( list, tuple, set ) ):
+            return sorted( normalize( item ) for item in value )
+        return str( value ).strip().lower()
+
+    normalized = json.dumps( normalize( search_terms ), sort_keys=True )
+    return '{}:{}'.format( CACHE_KEY_PREFIX, hashlib.sha1( normalized.encode( 'utf-8' ) ).hexdigest() )
+
+
+def is_cacheable( search_terms ):
+    """Whether the search terms are all "eq" or "in", and so can be cached.
+
+    :param dict search_terms: A dictionary of column names and search parameters: operator, value.
+    :return: True if the search can be cached.
+    """
+
+    for operation in search_terms.values():
+        if not isinstance( operation, dict ) or not operation:
+            return False
+        if any( operator not in CACHED_OPERATORS for operator in operation ):
+            return False
+    return True
+
+
+def build_tags( search_terms, ultsys_users ):
+    """The tags for an entry: the user IDs it holds and every value of its "eq" and "in" search terms.
+
+    :param dict search_terms: The search terms of the entry.
+    :param list ultsys_users: The users returned by the search.
+    :return: A set of tags.
+    """
+
+    tags = { build_tag( 'ID', ultsys_user[ 'ID' ] ) for ultsys_user in ultsys_users if 'ID' in ultsys_user }
+    for field, operation in search_terms.items():
+        for value in operation.values():
+            values = value if isinstance( value, ( list, tuple, set ) ) else [ value ]
+            tags.update( build_tag( field, item ) for item in values )
+    return tags
+
+
+def build_tag( field, value ):
+    """A tag is the field and its normalized value, e.g. ID:1234 or lastname:smith."""
+
+    return '{}:{}'.format( field, str( value ).strip().lower() )
+
+
+def get_cached_users( search_terms ):
+    """Get the cached users for the search terms.
+
+    :param dict search_terms: The search terms.
+    :return: The list of users, or None on a miss.
+    """
+
+    if not is_cache_enabled() or not is_cacheable( search_terms ):
+        return None
+
+    cache_key = normalize_search_terms( search_terms )
+    try:
+        cached = redis_queue.connection.get( cache_key )
+        ultsys_users = json.loads( cached.decode( 'utf-8' ) ) if cached else None
+    except RedisError:
+        record_redis_error()
+        ultsys_users = get_local( cache_key )
+
+    record_lookup( ultsys_users is not None )
+    return ultsys_users
+
+
+def set_cached_users( search_terms, ultsys_users ):
+    """Cache the users for the search terms and tag the entry for invalidation.
+
+    :param dict search_terms: The search terms.
+    :param list ultsys_users: The users returned by the search service.
+    :return:
+    """
+
+    if not is_cache_enabled() or not is_cacheable( search_terms ):
+        return
+
+    cache_key = normalize_search_terms( search_terms )
+    tags = build_tags( search_terms, ultsys_users )
+    ttl = get_cache_ttl()
+    try:
+        pipeline = redis_queue.connection.pipeline()
+        pipeline.setex( cache_key, ttl, json.dumps( ultsys_users ) )
+        for tag in tags:
+            tag_key = '{}:tag:{}'.format( CACHE_KEY_PREFIX, tag )
+            pipeline.sadd( tag_key, cache_key )
+            pipeline.expire( tag_key, ttl )
+        pipeline.execute()
+    except RedisError:
+        record_redis_error()
+        set_local( cache_key, ultsys_users, tags, ttl )
+
+
+def invalidate_user( user_id=None, user_parameters=None ):
+    """Drop the cached entries that hold a user or that a new user would now appear in.
+
+    :param user_id: The Ultsys user ID that was updated.
+    :param dict user_parameters: The parameters of a created user: firstname, lastname, email, etc.
+    :return:
+    """
+
+    if not is_cache_enabled():
+        return
+
+    tags = set()
+    if user_id is not None:
+        tags.add( build_tag( 'ID', user_id ) )
+    if user_parameters:
+        for field, value in user_parameters.items():
+            if field != 'action' and value not in [ None, '' ]:
+                tags.add( build_tag( field, value ) )
+
+    try:
+        connection = redis_queue.connection
+        for tag in tags:
+            tag_key = '{}:tag:{}'.format( CACHE_KEY_PREFIX, tag )
+            cache_keys = connection.smembers( tag_key )
+            connection.delete( tag_key, *cache_keys )
+        connection.incrby( '{}:invalidations'.format( CACHE_KEY_PREFIX ), len( tags ) )
+    except RedisError:
+        record_redis_error()
+
+    # The in-process fallback may hold entries from a time Redis was down: drop them as well.
+    with LOCAL_LOCK:
+        for tag in tags:
+            for cache_key in LOCAL_TAGS.pop( tag, set() ):
+                LOCAL_CACHE.pop( cache_key, None )
+        LOCAL_STATISTICS[ 'invalidations' ] += len( tags )
+
+
+def get_local( cache_key ):
+    """Get an entry from the in-process LRU, dropping it if it has expired."""
+
+    with LOCAL_LOCK:
+        entry = LOCAL_CACHE.get( cache_key )
+        if not entry:
+            return None
+        expires_at, ultsys_users = entry
+        if expires_at < time.time():
+            del LOCAL_CACHE[ cache_key ]
+            return None
+        LOCAL_CACHE.move_to_end( cache_key )
+        return ultsys_users
+
+
+def set_local( cache_key, ultsys_users, tags, ttl ):
+    """Set an entry on the in-process LRU and evict the least recently used entries beyond the maximum size."""
+
+    maxsize = int( current_app.config.get( 'ULTSYS_USER_CACHE_MAXSIZE' ) or DEFAULT_MAXSIZE )
+    with LOCAL_LOCK:
+        LOCAL_CACHE[ cache_key ] = ( time.time() + ttl, ultsys_users )
+        LOCAL_CACHE.move_to_end( cache_key )
+        for tag in tags:
+            LOCAL_TAGS.setdefault( tag, set() ).add( cache_key )
+        while len( LOCAL_CACHE ) > maxsize:
+            LOCAL_CACHE.popitem( last=False )
+
+
+def record_lookup( hit ):
+    """Count a hit or a miss: in Redis so the counts are across workers, and locally."""
+
+    counter = 'hits' if hit else 'misses'
+    with LOCAL_LOCK:
+        LOCAL_STATISTICS[ counter ] += 1
+    try:
+        redis_queue.connection.incr( '{}:{}'.format( CACHE_KEY_PREFIX, counter ) )
+    except RedisError:
+        pass
+
+
+def record_redis_error():
+    """Count and log falling back to the in-process cache."""
+
+    with LOCAL_LOCK:
+        LOCAL_STATISTICS[ 'redis_errors' ] += 1
+    logging.warning( 'Ultsys user cache: Redis unavailable, using the in-process cache.' )
+
+
+def get_cache_statistics():
+    """The hit and miss counts across workers ( Redis ) and for this process.
+
+    :return: A dictionary of the statistics.
+    """
+
+    statistics = { 'enabled': is_cache_enabled(), 'ttl': get_cache_ttl() }
+    with LOCAL_LOCK:
+        statistics[ 'process' ] = dict( LOCAL_STATISTICS, size=len( LOCAL_CACHE ) )
+    try:
+        connection = redis_queue.connection
+        shared = {}
+        for counter in [ 'hits', 'misses', 'invalidations' ]:
+            value = connection.get( '{}:{}'.format( CACHE_KEY_PREFIX, counter ) )
+            shared[ counter ] = int( value ) if value else 0
+        lookups = shared[ 'hits' ] + shared[ 'misses' ]
+        shared[ 'hit_ratio' ] = round( shared[ 'hits' ] / lookups, 4 ) if lookups else None
+        statistics[ 'shared' ] = shared
+    except RedisError:
+        statistics[ 'shared' ] = None
+    return statistics
+
+
+def clear_local_cache():
+    """Empty the in-process cache, e.g. between tests."""
+
+    with LOCAL_LOCK:
+        LOCAL_CACHE.clear()
+        LOCAL_TAGS.clear()
@@ -0,0 +1,318 @@
+"""A module for the local read mirror of the Ultsys users held in the user table.
+
+Caging makes two to three searches of the Ultsys user service per donor: by ID, by email, and by last name. With the
+mirror enabled these are indexed queries on the local user table, which is kept up to date incrementally by
+sync_ultsys_user_mirror() run from the job jobs/ultsys_user_mirror.py.
+
+The synchronization keeps two watermarks on the sync_state table:
+
+    1. watermark_id: The largest Ultsys user ID mirrored. New users are found with ID windows above it.
+    2. watermark_in_utc: When the last synchronization started. Changed users are found with a search on the
+       ULTSYS_USER_MIRROR_CHANGED_FIELD column ( default donation_time ) from this time less an overlap.
+
+The Ultsys user service returns no modification time of a user, and so the search for changed users only finds users
+whose changed field moved, e.g. a new donation: a change of name, address or email is not found by it. These changes
+are picked up by a periodic full resynchronization, resync_ultsys_user_mirror(), run daily from the job. It searches
+every ID window up to the watermark_id again, and keeps the window it has reached as the watermark_id of its own row
+on sync_state, ultsys_user_mirror_resync, so that a resynchronization that fails resumes where it stopped.
+
+Users created by this application are written through to the mirror when they are created ( build_model_new() ), so
+a second donation by a new donor is not caged as new again before the next synchronization.
+
+Caging only uses the mirror when its staleness, the seconds since the last completed synchronization, is within
+ULTSYS_USER_MIRROR_MAX_STALENESS. Otherwise it falls back to the Ultsys user service.
+
+Configuration in app.config:
+
+    ULTSYS_USER_MIRROR_ENABLED: Whether caging uses the mirror ( default False ).
+    ULTSYS_USER_MIRROR_MAX_STALENESS: Seconds after which the mirror is not used ( default 900 ).
+    ULTSYS_USER_MIRROR_ID_WINDOW: The number of IDs searched at a time for new users ( default 5000 ).
+    ULTSYS_USER_MIRROR_EMPTY_WINDOWS: Empty ID windows in a row that end the search for new users ( default 3 ).
+    ULTSYS_USER_MIRROR_CHANGED_FIELD: The Ultsys column searched for changed users ( default donation_time ).
+    ULTSYS_USER_MIRROR_OVERLAP: Seconds subtracted from the watermark for changed users ( default 300 ).
+"""
+import json
+import logging
+from datetime import datetime
+from datetime import timedelta
+
+from flask import current_app
+
+from application.flask_essentials import database
+from application.helpers.caging_blocks import index_caging_blocks
+from application.helpers.ultsys_user import find_ultsys_user
+from application.helpers.ultsys_user import get_ultsys_user
+from application.helpers.ultsys_user import raise_error
+from application.models.sync_state import SyncStateModel
+from application.models.ultsys_user import UltsysUserModel
+
+MIRROR_SYNC_NAME = 'ultsys_user_mirror'
+MIRROR_RESYNC_NAME = 'ultsys_user_mirror_resync'
+MIRROR_COLUMNS = [ column.name for column in UltsysUserModel.__table__.columns ]
+MIRROR_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+DEFAULT_MAX_STALENESS = 900
+DEFAULT_ID_WINDOW = 5000
+DEFAULT_EMPTY_WINDOWS = 3
+DEFAULT_CHANGED_FIELD = 'donation_time'
+DEFAULT_OVERLAP = 300
+
+
+def get_mirror_config( name, default ):
+    """Get a mirror setting from app.config and fall back to the default if it is missing or empty."""
+
+    value = current_app.config.get( 'ULTSYS_USER_MIRROR_{}'.format( name ) )
+    if value is None or value == '':
+        return default
+    return value
+
+
+def is_mirror_enabled():
+    """Whether caging is configured to use the mirror."""
+
+    enabled = get_mirror_config( 'ENABLED', False )
+    if isinstance( enabled, str ):
+        return enabled.lower() in [ '1', 'true', 'yes' ]
+    return bool( enabled )
+
+
+def get_mirror_staleness():
+    """The staleness metric: seconds since the last completed synchronization, or None if it has never run.
+
+    :return: The staleness in seconds.
+    """
+
+    sync_state = SyncStateModel.query.filter_by( name=MIRROR_SYNC_NAME ).one_or_none()
+    if not sync_state or not sync_state.last_synced_in_utc:
+        return None
+    return ( datetime.utcnow() - sync_state.last_synced_in_utc ).total_seconds()
+
+
+def is_mirror_usable():
+    """The mirror is used when it is enabled and fresh enough."""
+
+    if not is_mirror_enabled():
+        return False
+    staleness = get_mirror_staleness()
+    max_staleness = float( get_mirror_config( 'MAX_STALENESS', DEFAULT_MAX_STALENESS ) )
+    if staleness is None or staleness > max_staleness:
+        logging.warning(
+            'Ultsys user mirror: staleness %s exceeds %s, using the user service.', staleness, max_staleness
+        )
+        return False
+    return True
+
+
+def get_mirror_status():
+    """The state of the mirror for monitoring.
+
+    :return: A dictionary with the staleness metric and watermarks.
+    """
+
+    sync_state = SyncStateModel.query.filter_by( name=MIRROR_SYNC_NAME ).one_or_none()
+    return {
+        'enabled': is_mirror_enabled(),
+        'staleness': get_mirror_staleness(),
+        'max_staleness': float( get_mirror_config( 'MAX_STALENESS', DEFAULT_MAX_STALENESS ) ),
+        'watermark_id': sync_state.watermark_id if sync_state else None,
+        'watermark_in_utc': sync_state.watermark_in_utc.strftime( MIRROR_DATE_FORMAT )
+        if sync_state and sync_state.watermark_in_utc else None,
+        'rows_synced': sync_state.rows_synced if sync_state else 0,
+        'users': database.session.query( database.func.count( UltsysUserModel.ID ) ).scalar()
+    }
+
+
+def find_caging_users( search_terms ):
+    """Find users for caging on the mirror if it is usable, and otherwise on the Ultsys user service.
+
+    :param dict search_terms: The search terms, e.g. { "lastname": { "eq": "Smith" } }.
+    :return: A list of user dictionaries, as returned by find_ultsys_user().
+    """
+
+    if is_mirror_usable():
+        return find_mirror_users( search_terms )
+    return find_ultsys_user( { 'action': 'find', 'search_terms': search_terms, 'sort_terms': [] } )
+
+
+def find_mirror_users( search_terms ):
+    """Query the mirror with the same search terms as the Ultsys user service: the operators "eq" and "in".
+
+    :param dict search_terms: The search terms, e.g. { "lastname": { "eq": "Smith" } }.
+    :return: A list of user dictionaries.
+    """
+
+    query = UltsysUserModel.query
+    for field, operation in search_terms.items():
+        column = getattr( UltsysUserModel, field )
+        for operator, value in operation.items():
+            if operator == 'eq':
+                query = query.filter( column == value )
+            elif operator == 'in':
+                query = query.filter( column.in_( value ) )
+            else:
+                raise ValueError( 'The Ultsys user mirror does not support the operator: {}'.format( operator ) )
+    return [ mirror_user_to_dict( user_model ) for user_model in query.all() ]
+
+
+def mirror_user_to_dict( user_model ):
+    """Convert a mirrored user to the dictionary returned by the Ultsys user service."""
+
+    ultsys_user = {}
+    for column in MIRROR_COLUMNS:
+        value = getattr( user_model, column )
+        if isinstance( value, datetime ):
+            value = value.strftime( MIRROR_DATE_FORMAT )
+        ultsys_user[ column ] = value
+    return ultsys_user
+
+
+def upsert_mirror_users( ultsys_users ):
+    """Insert or update users on the mirror, with a single query for the users that already exist.
+
+    The caging blocking keys of the users are rebuilt. The session is not committed here.
+
+    :param list ultsys_users: User dictionaries from the Ultsys user service.
+    :return: The number of users inserted or updated.
+    """
+
+    if not ultsys_users:
+        return 0
+
+    user_ids = [ int( ultsys_user[ 'ID' ] ) for ultsys_user in ultsys_users ]
+    existing_users = UltsysUserModel.query.filter( UltsysUserModel.ID.in_( user_ids ) ).all()
+    existing_users = { user_model.ID: user_model for user_model in existing_users }
+
+    user_models = []
+    for ultsys_user in ultsys_users:
+        user_model = existing_users.get( int( ultsys_user[ 'ID' ] ) )
+        if not user_model:
+            user_model = UltsysUserModel( ID=int( ultsys_user[ 'ID' ] ), email='' )
+            database.session.add( user_model )
+        user_models.append( user_model )
+        for column in MIRROR_COLUMNS:
+            if column != 'ID' and column in ultsys_user:
+                value = ultsys_user[ column ]
+                # The service returns an empty string for a user who has never donated.
+                if column == 'donation_time' and not value:
+                    value = None
+                # The email column is not nullable, and a user without an email is stored with an empty one.
+                if column == 'email' and value is None:
+                    value = ''
+                setattr( user_model, column, value )
+
+    index_caging_blocks( user_models )
+    return len( ultsys_users )
+
+
+def mirror_created_user( ultsys_user ):
+    """Write a user created by this application through to the mirror."""
+
+    if is_mirror_enabled():
+        upsert_mirror_users( [ ultsys_user ] )
+
+
+def search_ultsys_users( search_terms ):
+    """Search the Ultsys user service directly, bypassing the cache, for the synchronization.
+
+    :param dict search_terms: The search terms.
+    :return: A list of user dictionaries.
+    """
+
+    request = get_ultsys_user( search_terms )
+    if request.status_code == 404:
+        return []
+    if request.status_code != 200:
+        raise_error( request )
+    return json.loads( request.content.decode( 'ISO-8859-1' ) )
+
+
+def sync_ultsys_user_mirror():
+    """Synchronize the mirror with the users that are new or changed since the watermarks.
+
+    :return: A dictionary of the number of new and changed users, and the watermarks.
+    """
+
+    started_in_utc = datetime.utcnow()
+    sync_state = SyncStateModel.query.filter_by( name=MIRROR_SYNC_NAME ).one_or_none()
+    if not sync_state:
+        maximum_id = database.session.query( database.func.max( UltsysUserModel.ID ) ).scalar()
+        sync_state = SyncStateModel( name=MIRROR_SYNC_NAME, watermark_id=maximum_id or 0, rows_synced=0 )
+        database.session.add( sync_state )
+
+    # 1. New users: search ID windows above the watermark until several are empty.
+    id_window = int( get_mirror_config( 'ID_WINDOW', DEFAULT_ID_WINDOW ) )
+    empty_windows_allowed = int( get_mirror_config( 'EMPTY_WINDOWS', DEFAULT_EMPTY_WINDOWS ) )
+    window_start = sync_state.watermark_id or 0
+    empty_windows = 0
+    new_users = 0
+    while empty_windows < empty_windows_allowed:
+        window_end = window_start + id_window
+        ultsys_users = search_ultsys_users( { 'ID': { 'gt': window_start, 'le': window_end } } )
+        if ultsys_users:
+            empty_windows = 0
+            new_users += upsert_mirror_users( ultsys_users )
+            sync_state.watermark_id = max( [ int( ultsys_user[ 'ID' ] ) for ultsys_user in ultsys_users ] )
+            database.session.commit()
+        else:
+            empty_windows += 1
+        window_start = window_end
+
+    # 2. Changed users: search the changed field from the last watermark, less an overlap for clock skew.
+    changed_users = 0
+    if sync_state.watermark_in_utc:
+        overlap = timedelta( seconds=int( get_mirror_config( 'OVERLAP', DEFAULT_OVERLAP ) ) )
+        changed_field = get_mirror_config( 'CHANGED_FIELD', DEFAULT_CHANGED_FIELD )
+        changed_since = ( sync_state.watermark_in_utc - overlap ).strftime( MIRROR_DATE_FORMAT )
+        changed_users = upsert_mirror_users( search_ultsys_users( { changed_field: { 'ge': changed_since } } ) )
+
+    sync_state.watermark_in_utc = started_in_utc
+    sync_state.last_synced_in_utc = datetime.utcnow()
+    sync_state.rows_synced = new_users + changed_users
+    database.session.commit()
+
+    return {
+        'new_users': new_users,
+        'changed_users': changed_users,
+        'watermark_id': sync_state.watermark_id,
+        'watermark_in_utc': sync_state.watermark_in_utc.strftime( MIRROR_DATE_FORMAT )
+    }
+
+
+def resync_ultsys_user_mirror():
+    """Search every ID window of the mirror again, to pick up the changes the search for changed users misses.
+
+    The resynchronization runs from the watermark_id of its sync_state row up to the watermark_id of the mirror, and
+    commits each window, so that a resynchronization that fails resumes from the last window committed.
+
+    :return: A dictionary of the number of users resynchronized, and the ID the resynchronization ended at.
+    """
+
+    sync_state = SyncStateModel.query.filter_by( name=MIRROR_SYNC_NAME ).one_or_none()
+    if sync_state and sync_state.watermark_id:
+        end_id = sync_state.watermark_id
+    else:
+        end_id = database.session.query( database.func.max( UltsysUserModel.ID ) ).scalar() or 0
+
+    resync_state = SyncStateModel.query.filter_by( name=MIRROR_RESYNC_NAME ).one_or_none()
+    if not resync_state:
+        resync_state = SyncStateModel( name=MIRROR_RESYNC_NAME, watermark_id=0, rows_synced=0 )
+        database.session.add( resync_state )
+
+    id_window = int( get_mirror_config( 'ID_WINDOW', DEFAULT_ID_WINDOW ) )
+    window_start = resync_state.watermark_id or 0
+    resynced_users = 0
+    while window_start < end_id:
+        window_end = min( window_start + id_window, end_id )
+        ultsys_users = search_ultsys_users( { 'ID': { 'gt': window_start, 'le': window_end } } )
+        resynced_users += upsert_mirror_users( ultsys_users )
+        resync_state.watermark_id = window_end
+        database.session.commit()
+        window_start = window_end
+
+    # The pass is complete: the next one starts from the first ID again.
+    resync_state.watermark_id = 0
+    resync_state.last_synced_in_utc = datetime.utcnow()
+    resync_state.rows_synced = resynced_users
+    database.session.commit()
+
+    return { 'resynced_users': resynced_users, 'end_id': end_id }
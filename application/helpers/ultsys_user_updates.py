@@ -0,0 +1,327 @@
+"""A module for the write-behind buffer of the donation amounts sent to the Ultsys user service.
+
+Caging an existing donor, and front-end caging, used to POST the donation amount to the user service in the job, one
+request per gift, and the job waited on it. A recurring subscription day, or a campaign, sends many updates for the
+same user in a few minutes. Here:
+
+    1. queue_ultsys_user_update() adds a row to the ultsys_user_update table, in the same database transaction as the
+       caging of the gift, and so the caging job no longer waits on the user service. An update is never lost to a
+       job that dies after its commit, and never sent for a caging that was rolled back.
+    2. flush_ultsys_user_updates() claims the due updates of a batch of users with SELECT ... FOR UPDATE, sends the
+       updates of each user one per gift in the order they were queued, and marks them sent with one UPDATE and a
+       single commit per batch. The service sets the user's prior donation amount to the amount of each update, and so
+       the updates are never summed: the user service sees the same updates, in the same order, as when caging sent
+       them. After a failed update the later updates of the user wait for its retry, so that they stay in order.
+    3. An update that fails is retried with exponential backoff, and marked failed after ULTSYS_UPDATE_MAX_ATTEMPTS.
+       get_ultsys_user_update_report() reconciles the buffer: the updates, users and amounts by status, the oldest
+       update waiting, and the failed updates by user, which retry_failed_ultsys_user_updates() makes due again.
+
+The buffer is flushed every minute by the job jobs/ultsys_user_updates.py, and sooner when it fills: every
+ULTSYS_UPDATE_FLUSH_SIZE updates queued, counted in Redis, a redis_queue_flush_ultsys_user_updates() job is queued.
+
+Configuration in app.config:
+
+    ULTSYS_UPDATE_BATCH_SIZE: The number of users claimed at a time ( default 100 ).
+    ULTSYS_UPDATE_FLUSH_SIZE: The updates queued that trigger a flush before the next interval ( default 200 ).
+    ULTSYS_UPDATE_MAX_ATTEMPTS: The attempts made before an update is marked failed ( default 5 ).
+    ULTSYS_UPDATE_BACKOFF: Seconds before the first retry, doubled on each attempt ( default 60 ).
+    ULTSYS_UPDATE_MAX_BACKOFF: The most seconds between retries ( default 3600 ).
+    ULTSYS_UPDATE_CLAIM_TIMEOUT: Seconds after which a claimed update that was not sent is due again ( default 300 ).
+"""
+import logging
+from datetime import datetime
+from datetime import timedelta
+from decimal import Decimal
+
+from flask import current_app
+
+from application.flask_essentials import database
+from application.flask_essentials import redis_queue
+from application.helpers.ultsys_user import update_ultsys_user
+from application.models.ultsys_user_update import UltsysUserUpdateModel
+from application.worker import worker_app_context
+# pylint: disable=bare-except
+# flake8: noqa:E722
+
+ULTSYS_UPDATE_QUEUED_KEY = 'ultsys_user_update:queued:{}'
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_SIZE = 200
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF = 60
+DEFAULT_MAX_BACKOFF = 3600
+DEFAULT_CLAIM_TIMEOUT = 300
+
+# The most failed users listed by the reconciliation report.
+MAXIMUM_REPORTED_FAILURES = 100
+
+
+def get_ultsys_update_config( name, default ):
+    """Get a write-behind setting from app.config and fall back to the default if it is missing or empty."""
+
+    value = current_app.config.get( 'ULTSYS_UPDATE_{}'.format( name ) )
+    if value is None or value == '':
+        return default
+    return int( value )
+
+
+def queue_ultsys_user_update( user_id, donation_amount, gift_id=None ):
+    """Add a donation amount for a user to the buffer. The session is not committed here, so that the update is saved
+    with the caging of the gift.
+
+    :param user_id: The Ultsys user ID.
+    :param donation_amount: The gross gift amount.
+    :param gift_id: The gift the amount is for.
+    :return: The UltsysUserUpdateModel.
+    """
+
+    now = datetime.utcnow()
+    update_model = UltsysUserUpdateModel(
+        user_id=int( user_id ),
+        gift_id=gift_id,
+        donation_amount=Decimal( donation_amount ),
+        status='pending',
+        attempts=0,
+        next_attempt_in_utc=now,
+        created_in_utc=now
+    )
+    database.session.add( update_model )
+    count_queued_update()
+    return update_model
+
+
+def count_queued_update():
+    """Count the update in Redis, and queue a flush every ULTSYS_UPDATE_FLUSH_SIZE updates.
+
+    The flush may run before the caller commits, and then the update is sent by the next flush.
+
+    :return:
+    """
+
+    try:
+        app_config_name = current_app.config[ 'ENV' ]
+        queued = redis_queue.connection.incr( ULTSYS_UPDATE_QUEUED_KEY.format( app_config_name ) )
+        if queued % get_ultsys_update_config( 'FLUSH_SIZE', DEFAULT_FLUSH_SIZE ) == 0:
+            redis_queue_flush_ultsys_user_updates.queue( app_config_name )
+    except:
+        logging.exception( 'Unable to count the queued Ultsys user update.' )
+
+
+@redis_queue.job
+def redis_queue_flush_ultsys_user_updates( app_config_name ):
+    """Flush the buffer when it fills, between the flushes of the job.
+
+    :param app_config_name: The configuration ( PROD, DEV, TEST ) that the app is running.
+    :return: The summary from flush_ultsys_user_updates().
+    """
+
+    with worker_app_context( app_config_name ):
+        return flush_ultsys_user_updates()
+
+
+def flush_ultsys_user_updates( max_batches=None ):
+    """Send the due updates in the buffer, a batch of users at a time, until there are none or max_batches are sent.
+
+    :param max_batches: The most batches to send, or None for no limit.
+    :return: A dictionary of the number of users and updates sent, and the updates retried and failed.
+    """
+
+    summary = { 'users': 0, 'sent': 0, 'retried': 0, 'failed': 0 }
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        update_models = claim_ultsys_user_update_batch()
+        if not update_models:
+            break
+        batches += 1
+        for outcome, count in send_ultsys_user_update_batch( update_models ).items():
+            summary[ outcome ] += count
+
+    if batches:
+        logging.info( 'Ultsys user updates: %s', summary )
+    return summary
+
+
+def claim_ultsys_user_update_batch():
+    """Claim the due updates of the next batch of users for this flush.
+
+    A user with an update waiting for its retry, or being sent by another flush, is skipped, so that their updates are
+    sent in order.
+
+    :return: A list of UltsysUserUpdateModel.
+    """
+
+    now = datetime.utcnow()
+    batch_size = get_ultsys_update_config( 'BATCH_SIZE', DEFAULT_BATCH_SIZE )
+    due = ( UltsysUserUpdateModel.status.in_( [ 'pending', 'sending' ] ),
+            UltsysUserUpdateModel.next_attempt_in_utc <= now )
+    waiting_user_ids = database.session.query( UltsysUserUpdateModel.user_id ) \
+        .filter( UltsysUserUpdateModel.status.in_( [ 'pending', 'sending' ] ) ) \
+        .filter( UltsysUserUpdateModel.next_attempt_in_utc > now )
+
+    user_ids = [
+        user_id for user_id, in database.session.query( UltsysUserUpdateModel.user_id )
+        .filter( *due )
+        .filter( ~UltsysUserUpdateModel.user_id.in_( waiting_user_ids ) )
+        .group_by( UltsysUserUpdateModel.user_id )
+        .order_by( database.func.min( UltsysUserUpdateModel.id ) )
+        .limit( batch_size )
+        .all()
+    ]
+    if not user_ids:
+        database.session.commit()
+        return []
+
+    update_models = UltsysUserUpdateModel.query \
+        .filter( UltsysUserUpdateModel.user_id.in_( user_ids ) ) \
+        .filter( *due ) \
+        .order_by( UltsysUserUpdateModel.id ) \
+        .with_for_update() \
+        .all()
+
+    claim_timeout = timedelta( seconds=get_ultsys_update_config( 'CLAIM_TIMEOUT', DEFAULT_CLAIM_TIMEOUT ) )
+    for update_model in update_models:
+        update_model.status = 'sending'
+        update_model.next_attempt_in_utc = now + claim_timeout
+    database.session.commit()
+    return update_models
+
+
+def send_ultsys_user_update_batch( update_models ):
+    """Send the updates of each user in the order they were queued, and record the outcomes with a single commit.
+
+    The first update of a user that fails is retried or failed, and the updates after it are made due with its retry.
+
+    :param update_models: The claimed UltsysUserUpdateModel.
+    :return: A dictionary of the number of users and updates sent, and the updates retried and failed.
+    """
+
+    max_attempts = get_ultsys_update_config( 'MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS )
+
+    updates_by_user = {}
+    for update_model in update_models:
+        updates_by_user.setdefault( update_model.user_id, [] ).append( update_model )
+
+    outcomes = { 'users': 0, 'sent': 0, 'retried': 0, 'failed': 0 }
+    sent_ids = []
+    for user_id, user_update_models in updates_by_user.items():
+        for index, update_model in enumerate( user_update_models ):
+            try:
+                update_ultsys_user( { 'id': user_id }, str( update_model.donation_amount ) )
+            except Exception as error:  # pylint: disable=broad-except
+                last_error = '{}: {}'.format( type( error ).__name__, error )[ :255 ]
+                update_model.attempts += 1
+                update_model.last_error = last_error
+                if update_model.attempts >= max_attempts:
+                    update_model.status = 'failed'
+                    outcomes[ 'failed' ] += 1
+                    next_attempt_in_utc = datetime.utcnow()
+                else:
+                    update_model.status = 'pending'
+                    next_attempt_in_utc = datetime.utcnow() + get_backoff( update_model.attempts )
+                    update_model.next_attempt_in_utc = next_attempt_in_utc
+                    outcomes[ 'retried' ] += 1
+
+                # The later updates of the user are not attempted, and wait for the retry to stay in order.
+                for later_update_model in user_update_models[ index + 1: ]:
+                    later_update_model.status = 'pending'
+                    later_update_model.next_attempt_in_utc = next_attempt_in_utc
+                    outcomes[ 'retried' ] += 1
+                logging.warning( 'Ultsys user update failed for %s: %s', user_id, last_error )
+                break
+
+            sent_ids.append( update_model.id )
+            outcomes[ 'sent' ] += 1
+        else:
+            outcomes[ 'users' ] += 1
+
+    if sent_ids:
+        UltsysUserUpdateModel.query \
+            .filter( UltsysUserUpdateModel.id.in_( sent_ids ) ) \
+            .update( { 'status': 'sent', 'sent_in_utc': datetime.utcnow() }, synchronize_session=False )
+    database.session.commit()
+
+    return outcomes
+
+
+def get_backoff( attempts ):
+    """The delay before the next attempt: doubled on each attempt, up to the maximum.
+
+    :param attempts: The attempts made so far.
+    :return: A timedelta.
+    """
+
+    backoff = get_ultsys_update_config( 'BACKOFF', DEFAULT_BACKOFF ) * 2 ** ( attempts - 1 )
+    return timedelta( seconds=min( backoff, get_ultsys_update_config( 'MAX_BACKOFF', DEFAULT_MAX_BACKOFF ) ) )
+
+
+def get_ultsys_user_update_report():
+    """Reconcile the buffer: the updates, users and amounts by status, the oldest update waiting, and the failed updates
+    by user.
+
+    :return: A dictionary of the report.
+    """
+
+    statuses = {}
+    for update_status, updates, users, amount in database.session.query(
+            UltsysUserUpdateModel.status,
+            database.func.count( UltsysUserUpdateModel.id ),
+            database.func.count( database.distinct( UltsysUserUpdateModel.user_id ) ),
+            database.func.sum( UltsysUserUpdateModel.donation_amount )
+    ).group_by( UltsysUserUpdateModel.status ).all():
+        statuses[ update_status ] = { 'updates': updates, 'users': users, 'amount': str( amount ) }
+
+    oldest_waiting = database.session.query( database.func.min( UltsysUserUpdateModel.created_in_utc ) ) \
+        .filter( UltsysUserUpdateModel.status.in_( [ 'pending', 'sending' ] ) ) \
+        .scalar()
+
+    failed = [
+        {
+            'user_id': user_id,
+            'updates': updates,
+            'amount': str( amount ),
+            'gift_ids': [],
+            'last_error': None
+        }
+        for user_id, updates, amount in database.session.query(
+            UltsysUserUpdateModel.user_id,
+            database.func.count( UltsysUserUpdateModel.id ),
+            database.func.sum( UltsysUserUpdateModel.donation_amount )
+        ).filter( UltsysUserUpdateModel.status == 'failed' )
+        .group_by( UltsysUserUpdateModel.user_id )
+        .order_by( UltsysUserUpdateModel.user_id )
+        .limit( MAXIMUM_REPORTED_FAILURES )
+        .all()
+    ]
+    failed_by_user = { failure[ 'user_id' ]: failure for failure in failed }
+    if failed_by_user:
+        for user_id, gift_id, last_error in database.session.query(
+                UltsysUserUpdateModel.user_id, UltsysUserUpdateModel.gift_id, UltsysUserUpdateModel.last_error
+        ).filter( UltsysUserUpdateModel.status == 'failed' ) \
+                .filter( UltsysUserUpdateModel.user_id.in_( list( failed_by_user ) ) ) \
+                .order_by( UltsysUserUpdateModel.id ) \
+                .all():
+            failed_by_user[ user_id ][ 'gift_ids' ].append( gift_id )
+            failed_by_user[ user_id ][ 'last_error' ] = last_error
+
+    return {
+        'statuses': statuses,
+        'oldest_waiting_in_utc': oldest_waiting.strftime( '%Y-%m-%d %H:%M:%S' ) if oldest_waiting else None,
+        'failed': failed
+    }
+
+
+def retry_failed_ultsys_user_updates( user_ids=None ):
+    """Make the failed updates due again, e.g. once the user service is fixed, with their attempts reset.
+
+    :param user_ids: The Ultsys user ID's to retry, or None for all.
+    :return: The number of updates made due again.
+    """
+
+    query = UltsysUserUpdateModel.query.filter( UltsysUserUpdateModel.status == 'failed' )
+    if user_ids:
+        query = query.filter( UltsysUserUpdateModel.user_id.in_( user_ids ) )
+    retried = query.update(
+        { 'status': 'pending', 'attempts': 0, 'next_attempt_in_utc': datetime.utcnow() }, synchronize_session=False
+    )
+    database.session.commit()
+    return retried
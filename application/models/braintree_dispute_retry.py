@@ -0,0 +1,28 @@
+"""The model for the Donations API service: braintree_dispute_retry table.
+
+A row per Braintree dispute that the status updater in jobs/braintree.py failed to apply. The disputes cursor advances
+past the dispute, and the dispute is found by its ID and applied again on the next runs until it succeeds, when the row
+is deleted, or it is given up on.
+
+Tables are explicitly named. Notice that the database=SQLAlchemy() is done through the import of flask_essentials. This
+will keep the Marshmallow and model SQLAlchemy sessions the same. The Wiki has some information about this in the
+StackOverflow section.
+"""
+# pylint: disable=R0903
+from application.flask_essentials import database
+
+
+class BraintreeDisputeRetryModel( database.Model ):
+    """A Braintree dispute waiting to be applied again by the updater, or the record of one given up on."""
+
+    __tablename__ = 'braintree_dispute_retry'
+    dispute_id = database.Column( database.VARCHAR( 64 ), primary_key=True, nullable=False )
+    status = database.Column(
+        database.Enum( 'pending', 'failed', native_enum=False ),
+        default='pending',
+        nullable=False,
+        index=True
+    )
+    attempts = database.Column( database.Integer, nullable=False, default=0 )
+    created_in_utc = database.Column( database.DateTime, nullable=False )
+    last_attempt_in_utc = database.Column( database.DateTime, nullable=True, default=None )
@@ -5,8 +5,14 @@ The process of caging and its requirements can be found in the Wiki under the se
 Tables are explicitly named. Notice that the database=SQLAlchemy() is done through the import of flask_essentials. This
 will keep the Marshmallow and model SQLAlchemy sessions the same. The Wiki has some information about this in the
 StackOverflow section.
+
+The user_street column holds the donor's street address normalized by munge_address(), and is kept up to date by
+the validator whenever the user_address is set. With the composite index ix_caged_donor_caging the check for a caged
+donor in caging is a single indexed existence query.
 """
 # pylint: disable=R0903
+from sqlalchemy.orm import validates
+
 from application.flask_essentials import database
 from application.models.binary_uuid import BinaryUUID
 
@@ -15,6 +21,9 @@ class CagedDonorModel( database.Model ):
     """If a donor cannot be confidently associated with an existing user cage them."""
 
     __tablename__ = 'caged_donor'
+    __table_args__ = (
+        database.Index( 'ix_caged_donor_caging', 'user_last_name', 'user_first_name', 'user_zipcode', 'user_street' ),
+    )
     id = database.Column(
         database.Integer, primary_key=True,
         autoincrement=True, nullable=False
@@ -32,3 +41,23 @@ class CagedDonorModel( database.Model ):
     user_zipcode = database.Column( database.VARCHAR( 5 ), nullable=True, default=None )
     user_phone_number = database.Column( database.BigInteger, nullable=True, default=0 )
     times_viewed = database.Column( database.Integer, nullable=True )
+    user_street = database.Column( database.VARCHAR( 255 ), nullable=True, default=None )
+
+    @validates( 'user_address' )
+    def validate_user_address( self, key, user_address ):  # pylint: disable=unused-argument
+        """Keep the normalized street in step with the street address."""
+
+        self.user_street = normalize_street( user_address )
+        return user_address
+
+
+def normalize_street( user_address ):
+    """The street address as compared by caging: munged, and with any remaining whitespace stripped.
+
+    :param user_address: The street address.
+    :return: The normalized street.
+    """
+
+    # Import here: general_helper_functions imports this module.
+    from application.helpers.general_helper_functions import munge_address  # pylint: disable=cyclic-import
+    return munge_address( user_address or '' ).strip()
@@ -0,0 +1,20 @@
+"""The model for the Donations API service: caging_block table.
+
+The blocking index for caging. Each mirrored Ultsys user has a row per blocking key: their normalized last name and
+zip, munged street address, lowercased email, and phone. Caging only scores the users sharing a key with the donor.
+
+Tables are explicitly named. Notice that the database=SQLAlchemy() is done through the import of flask_essentials. This
+will keep the Marshmallow and model SQLAlchemy sessions the same. The Wiki has some information about this in the
+StackOverflow section.
+"""
+# pylint: disable=R0903
+from application.flask_essentials import database
+
+
+class CagingBlockModel( database.Model ):
+    """A blocking key for a user on the local Ultsys user mirror."""
+
+    __tablename__ = 'caging_block'
+    id = database.Column( database.Integer, primary_key=True, autoincrement=True, nullable=False )
+    block_key = database.Column( database.VARCHAR( 320 ), nullable=False, index=True )
+    user_id = database.Column( database.Integer, nullable=False, index=True )
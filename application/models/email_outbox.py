@@ -0,0 +1,38 @@
+"""The model for the Donations API service: email_outbox table.
+
+A row per email to send through the Ultsys email service: receipts, thank you letters and statistics reports. The rows
+are written in the same database transaction as the change the email is about, and sent by the dispatcher in
+application/helpers/email_outbox.py.
+
+Tables are explicitly named. Notice that the database=SQLAlchemy() is done through the import of flask_essentials. This
+will keep the Marshmallow and model SQLAlchemy sessions the same. The Wiki has some information about this in the
+StackOverflow section.
+"""
+# pylint: disable=R0903
+from application.flask_essentials import database
+
+
+class EmailOutboxModel( database.Model ):
+    """An email waiting to be sent, or the record of one sent or given up on."""
+
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        database.Index( 'ix_email_outbox_dispatch', 'status', 'next_attempt_in_utc' ),
+    )
+    id = database.Column( database.Integer, primary_key=True, autoincrement=True, nullable=False )
+    email_type = database.Column(
+        database.Enum( 'receipt', 'thank_you', 'statistics', native_enum=False ),
+        nullable=False
+    )
+    transaction_id = database.Column( database.Integer, nullable=True, default=None )
+    payload = database.Column( database.Text, nullable=False )
+    status = database.Column(
+        database.Enum( 'pending', 'sending', 'sent', 'failed', native_enum=False ),
+        default='pending',
+        nullable=False
+    )
+    attempts = database.Column( database.Integer, nullable=False, default=0 )
+    next_attempt_in_utc = database.Column( database.DateTime, nullable=False )
+    created_in_utc = database.Column( database.DateTime, nullable=False )
+    sent_in_utc = database.Column( database.DateTime, nullable=True, default=None )
+    last_error = database.Column( database.VARCHAR( 255 ), nullable=True, default=None )
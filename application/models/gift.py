@@ -19,6 +19,9 @@ class GiftModel( database.Model ):
     """Head, or master table, for donations."""
 
     __tablename__ = 'gift'
+    __table_args__ = (
+        database.Index( 'ix_gift_searchable_id', 'searchable_id' ),
+    )
     id = database.Column( database.Integer, primary_key=True, autoincrement=True, nullable=False )
     searchable_id = database.Column( BinaryUUID, nullable=False, default=uuid.uuid4 )
     user_id = database.Column( database.Integer, nullable=True, default=None )
@@ -17,6 +17,9 @@ class QueuedDonorModel( database.Model ):
     """If a donor cannot be confidently associated with an existing user cage them."""
 
     __tablename__ = 'queued_donor'
+    __table_args__ = (
+        database.Index( 'ix_queued_donor_gift_id', 'gift_id' ),
+    )
     id = database.Column( database.Integer, primary_key=True, autoincrement=True, nullable=False )
     gift_id = database.Column( database.Integer, nullable=True )
     gift_searchable_id = database.Column( BinaryUUID, nullable=True )
@@ -0,0 +1,22 @@
+"""The model for the Donations API service: sync_state table.
+
+A row per synchronization, e.g. the Ultsys user mirror or a search of the Braintree updater, holding its watermark and
+when it last completed.
+
+Tables are explicitly named. Notice that the database=SQLAlchemy() is done through the import of flask_essentials. This
+will keep the Marshmallow and model SQLAlchemy sessions the same. The Wiki has some information about this in the
+StackOverflow section.
+"""
+# pylint: disable=R0903
+from application.flask_essentials import database
+
+
+class SyncStateModel( database.Model ):
+    """The watermarks of the incremental synchronizations run by the jobs."""
+
+    __tablename__ = 'sync_state'
+    name = database.Column( database.VARCHAR( 64 ), primary_key=True, nullable=False )
+    watermark_id = database.Column( database.Integer, nullable=True, default=None )
+    watermark_in_utc = database.Column( database.DateTime, nullable=True, default=None )
+    last_synced_in_utc = database.Column( database.DateTime, nullable=True, default=None )
+    rows_synced = database.Column( database.Integer, nullable=True, default=0 )
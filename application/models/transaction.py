@@ -14,6 +14,10 @@ class TransactionModel( database.Model ):
     """A general transaction model to include Braintree and other donations."""
 
     __tablename__ = 'transaction'
+    __table_args__ = (
+        database.Index( 'ix_transaction_gift_id', 'gift_id' ),
+        database.Index( 'ix_transaction_gift_id_date_in_utc', 'gift_id', 'date_in_utc' ),
+    )
     id = database.Column( database.Integer, primary_key=True, autoincrement=True, nullable=False )
     gift_id = database.Column( database.Integer, nullable=False )
     date_in_utc = database.Column( database.DateTime, nullable=False )
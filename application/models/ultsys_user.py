@@ -0,0 +1,31 @@
+"""The model for the Donations API service: user table, a local read mirror of the Ultsys users.
+
+The mirror holds the Ultsys user fields that caging needs, and is kept up to date by the job
+jobs/ultsys_user_mirror.py. The secondary indexes allow caging to search on last name, email, zip and phone with
+indexed SQL rather than requests to the Ultsys user service.
+
+Tables are explicitly named. Notice that the database=SQLAlchemy() is done through the import of flask_essentials. This
+will keep the Marshmallow and model SQLAlchemy sessions the same. The Wiki has some information about this in the
+StackOverflow section.
+"""
+# pylint: disable=R0903
+from application.flask_essentials import database
+
+
+class UltsysUserModel( database.Model ):
+    """A local mirror of the Ultsys user: the same column names as the Ultsys user service returns."""
+
+    __tablename__ = 'user'
+    ID = database.Column( database.Integer, primary_key=True, autoincrement=True, nullable=False )
+    email = database.Column( database.VARCHAR( 255 ), nullable=False, index=True )
+    firstname = database.Column( database.VARCHAR( 64 ), nullable=True, default='' )
+    lastname = database.Column( database.VARCHAR( 64 ), nullable=True, default=None, index=True )
+    address = database.Column( database.VARCHAR( 255 ), nullable=True, default=None )
+    state = database.Column( database.VARCHAR( 2 ), nullable=True, default=None )
+    city = database.Column( database.VARCHAR( 64 ), nullable=True, default=None )
+    zip = database.Column( database.VARCHAR( 5 ), nullable=True, default=None, index=True )
+    phone = database.Column( database.VARCHAR( 16 ), nullable=True, default=None, index=True )
+    donation_prior_amount = database.Column( database.VARCHAR( 255 ), nullable=True, default=None )
+    donation_sum = database.Column( database.VARCHAR( 255 ), nullable=True, default=None )
+    donation_time = database.Column( database.DateTime, nullable=True )
+    uid = database.Column( database.Integer, nullable=True )
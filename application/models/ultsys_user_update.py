@@ -0,0 +1,36 @@
+"""The model for the Donations API service: ultsys_user_update table.
+
+A row per donation amount to send to the Ultsys user service for a user. The rows are written in the same database
+transaction as the caging of the gift, and the rows of a user are sent in order by the flush in
+application/helpers/ultsys_user_updates.py.
+
+Tables are explicitly named. Notice that the database=SQLAlchemy() is done through the import of flask_essentials. This
+will keep the Marshmallow and model SQLAlchemy sessions the same. The Wiki has some information about this in the
+StackOverflow section.
+"""
+# pylint: disable=R0903
+from application.flask_essentials import database
+
+
+class UltsysUserUpdateModel( database.Model ):
+    """A donation amount waiting to be sent to the Ultsys user, or the record of one sent or given up on."""
+
+    __tablename__ = 'ultsys_user_update'
+    __table_args__ = (
+        database.Index( 'ix_ultsys_user_update_flush', 'status', 'next_attempt_in_utc' ),
+        database.Index( 'ix_ultsys_user_update_user_id', 'user_id' ),
+    )
+    id = database.Column( database.Integer, primary_key=True, autoincrement=True, nullable=False )
+    user_id = database.Column( database.Integer, nullable=False )
+    gift_id = database.Column( database.Integer, nullable=True, default=None )
+    donation_amount = database.Column( database.DECIMAL( 10, 2 ), nullable=False )
+    status = database.Column(
+        database.Enum( 'pending', 'sending', 'sent', 'failed', native_enum=False ),
+        default='pending',
+        nullable=False
+    )
+    attempts = database.Column( database.Integer, nullable=False, default=0 )
+    next_attempt_in_utc = database.Column( database.DateTime, nullable=False )
+    created_in_utc = database.Column( database.DateTime, nullable=False )
+    sent_in_utc = database.Column( database.DateTime, nullable=True, default=None )
+    last_error = database.Column( database.VARCHAR( 255 ), nullable=True, default=None )
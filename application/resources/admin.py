@@ -4,6 +4,7 @@ from flask_api import status
 from nusa_jwt_auth import get_jwt_claims
 from nusa_jwt_auth.restful import AdminResource
 
+from application.controllers.admin import admin_bulk_operation
 from application.controllers.admin import admin_get_braintree_sale_status
 from application.controllers.admin import admin_correct_gift
 from application.controllers.admin import admin_record_bounced_check
@@ -132,3 +133,60 @@ class DonateAdminVoid( AdminResource ):
         if admin_void_transaction( payload ):
             return None, status.HTTP_200_OK
         return None, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+class DonateAdminBulkRefund( AdminResource ):
+    """Flask-RESTful resource endpoint for refunding many gifts at once."""
+
+    def post( self ):
+        """POST method to refund a list of transactions, with a result for each.
+
+        :return: The counts and results of the refunds.
+        """
+
+        # Authenticate the admin user.
+        payload = request.json
+        try:
+            payload[ 'user_id' ] = get_jwt_claims()[ 'ultsys_id' ]
+        except KeyError:
+            raise JWTRequestError()
+
+        return admin_bulk_operation( 'refund', payload ), status.HTTP_200_OK
+
+
+class DonateAdminBulkVoid( AdminResource ):
+    """Flask-RESTful resource endpoint for voiding many gifts at once."""
+
+    def post( self ):
+        """POST method to void a list of transactions, with a result for each.
+
+        :return: The counts and results of the voids.
+        """
+
+        # Authenticate the admin user.
+        payload = request.json
+        try:
+            payload[ 'user_id' ] = get_jwt_claims()[ 'ultsys_id' ]
+        except KeyError:
+            raise JWTRequestError()
+
+        return admin_bulk_operation( 'void', payload ), status.HTTP_200_OK
+
+
+class DonateAdminBulkCorrection( AdminResource ):
+    """Flask-RESTful resource endpoint for correcting and/or reallocating many gifts at once."""
+
+    def post( self ):
+        """POST method to correct a list of gifts, with a result for each.
+
+        :return: The counts and results of the corrections.
+        """
+
+        # Authenticate the admin user.
+        payload = request.json
+        try:
+            payload[ 'user_id' ] = get_jwt_claims()[ 'ultsys_id' ]
+        except KeyError:
+            raise JWTRequestError()
+
+        return admin_bulk_operation( 'correction', payload ), status.HTTP_200_OK
@@ -7,11 +7,18 @@ from flask_restful import Resource
 from nusa_filter_param_parser.build_query_set import query_set
 from nusa_jwt_auth import get_jwt_claims
 from nusa_jwt_auth import jwt_optional
+from nusa_jwt_auth.restful import AdminResource
 
+from application.controllers.donate import braintree_token_pool_statistics
 from application.controllers.donate import get_braintree_token
+from application.controllers.donate import post_bulk_donation
 from application.controllers.donate import post_donation
 from application.exceptions.exception_critical_path import AdminAgentModelPathError
 from application.exceptions.exception_jwt import JWTRequestError
+from application.helpers.donation_idempotency import get_donation_fingerprint
+from application.helpers.donation_idempotency import get_donation_idempotency_key
+from application.helpers.donation_idempotency import IDEMPOTENCY_KEY_HEADER
+from application.helpers.donation_idempotency import run_idempotent_donation
 from application.models.agent import AgentModel
 # pylint: disable=too-few-public-methods
 # pylint: disable=no-self-use
@@ -26,48 +33,104 @@ class Donation( Resource ):
     # This endpoint can be accessed both by an anonymous donor and an administrative staff member.
     @jwt_optional
     def post( self ):
-        """Endpoint to post a transaction: online and administrative."""
+        """Endpoint to post a transaction: online and administrative.
 
-        payload = request.json
-        if payload[ 'gift' ][ 'method_used' ].lower() != 'web form credit card':
-            if 'NUSA_DISABLE_JWT_AUTH' in current_app.config and current_app.config[ 'NUSA_DISABLE_JWT_AUTH' ] != '':
-                query_terms = [ ( 'name', 'eq', 'Unknown Staff Member' ) ]
-            else:
-                try:
-                    # Set ADMIN to ensure detailed Braintree AVS and CVV logging are enabled.
-                    current_app.config[ 'ADMIN' ] = True
-                    ultsys_id = get_jwt_claims()[ 'ultsys_id' ]
-                    if 'read' not in get_jwt_claims()[ 'roles' ]:
-                        query_terms = [ ( 'name', 'eq', 'Unknown Staff Member' ) ]
-                    else:
-                        query_terms = [ ( 'user_id', 'eq', ultsys_id ) ]
-                except KeyError:
-                    raise JWTRequestError()
-            try:
-                agent_ultsys = query_set(
-                    AgentModel,
-                    AgentModel.query,
-                    query_terms
-                ).one()
-                agent_ultsys_id = agent_ultsys.id
-            except:
-                raise AdminAgentModelPathError
+        A retry of a donation, with the same Idempotency-Key header or payment method nonce, returns the response of
+        the first request, and a key sent with a different donation is rejected: see helpers/donation_idempotency.py.
+        """
 
-            payload[ 'sourced_from_agent_user_id' ] = agent_ultsys_id
+        payload = request.json
+        idempotency_key = get_donation_idempotency_key( payload, request.headers.get( IDEMPOTENCY_KEY_HEADER ) )
+        fingerprint = get_donation_fingerprint( payload, get_caller_ultsys_id() )
+        donation, replayed = run_idempotent_donation( idempotency_key, lambda: make_donation( payload ), fingerprint )
 
-        response = jsonify( post_donation( payload ) )
+        response = jsonify( donation )
 
         if response:
             response.status_code = status.HTTP_200_OK
+            if replayed:
+                response.headers[ 'Idempotent-Replayed' ] = 'true'
             return response
 
         return None, status.HTTP_500_INTERNAL_SERVER_ERROR
 
 
+def get_caller_ultsys_id():
+    """The ultsys_id of the JWT, or None for an anonymous donor."""
+
+    try:
+        return ( get_jwt_claims() or {} ).get( 'ultsys_id' )
+    except:
+        return None
+
+
+def make_donation( payload ):
+    """Attach the agent for an administrative donation from the JWT, and make the donation.
+
+    :param dict payload: The donation payload.
+    :return: The response dictionary from post_donation().
+    """
+
+    if payload[ 'gift' ][ 'method_used' ].lower() != 'web form credit card':
+        if 'NUSA_DISABLE_JWT_AUTH' in current_app.config and current_app.config[ 'NUSA_DISABLE_JWT_AUTH' ] != '':
+            query_terms = [ ( 'name', 'eq', 'Unknown Staff Member' ) ]
+        else:
+            try:
+                # Set ADMIN to ensure detailed Braintree AVS and CVV logging are enabled.
+                current_app.config[ 'ADMIN' ] = True
+                ultsys_id = get_jwt_claims()[ 'ultsys_id' ]
+                if 'read' not in get_jwt_claims()[ 'roles' ]:
+                    query_terms = [ ( 'name', 'eq', 'Unknown Staff Member' ) ]
+                else:
+                    query_terms = [ ( 'user_id', 'eq', ultsys_id ) ]
+            except KeyError:
+                raise JWTRequestError()
+        try:
+            agent_ultsys = query_set(
+                AgentModel,
+                AgentModel.query,
+                query_terms
+            ).one()
+            agent_ultsys_id = agent_ultsys.id
+        except:
+            raise AdminAgentModelPathError
+
+        payload[ 'sourced_from_agent_user_id' ] = agent_ultsys_id
+
+    return post_donation( payload )
+
+
+class DonateBulkDonation( AdminResource ):
+    """Flask-RESTful resource endpoint for a batch of administrative donations, e.g. checks and money orders."""
+
+    def post( self ):
+        """Endpoint to post a batch of administrative donations, with a result for each gift.
+
+        :return: The counts and results of the batch.
+        """
+
+        payload = request.json
+        try:
+            payload[ 'sourced_from_agent_user_id' ] = get_jwt_claims()[ 'ultsys_id' ]
+        except KeyError:
+            raise JWTRequestError()
+
+        return post_bulk_donation( payload ), status.HTTP_200_OK
+
+
 class DonateGetToken( Resource ):
     """Flask-RESTful resource endpoint to get a Braintree token for payment submission."""
 
     def get( self ):
-        """Endpoint to get a Braintree generated token."""
+        """Endpoint to get a Braintree generated token, optionally for the merchant account of ?given_to=NERF."""
+
+        return get_braintree_token( request.args.get( 'given_to' ) ), status.HTTP_200_OK
+
+
+class DonateGetTokenPoolStatistics( AdminResource ):
+    """Flask-RESTful resource endpoint for the statistics of the Braintree token pools."""
+
+    def get( self ):
+        """Simple endpoint to return the depth, hits and misses of the Braintree token pools."""
 
-        return get_braintree_token(), status.HTTP_200_OK
+        return braintree_token_pool_statistics(), status.HTTP_200_OK
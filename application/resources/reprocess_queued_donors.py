@@ -1,14 +1,16 @@
-"""Resources entry point to make a Braintree sale."""
+"""Resources entry point to reprocess queued donors."""
 from flask import request
+from flask_api import status
 from nusa_jwt_auth.restful import AdminResource
 
 from application.controllers.reprocess_queued_donors import reprocess_queued_donors
+from application.controllers.reprocess_queued_donors import reprocess_queued_donors_status
 # pylint: disable=too-few-public-methods
 # pylint: disable=no-self-use
 
 
 class DonateReprocessQueuedDonors( AdminResource ):
-    """Flask-RESTful resource endpoint for a Braintree donation transaction."""
+    """Flask-RESTful resource endpoint to reprocess queued donors."""
 
     def get( self ):
         """Endpoint to reprocess all queued donors in the redis queue."""
@@ -16,9 +18,9 @@ class DonateReprocessQueuedDonors( AdminResource ):
         response = reprocess_queued_donors()
 
         if response:
-            return None, 200
+            return response, status.HTTP_202_ACCEPTED
 
-        return None, 500
+        return None, status.HTTP_500_INTERNAL_SERVER_ERROR
 
     def post( self ):
         """Endpoint to process given queued donor ID's in the redis queue."""
@@ -26,6 +28,20 @@ class DonateReprocessQueuedDonors( AdminResource ):
         response = reprocess_queued_donors( request.json )
 
         if response:
-            return None, 200
+            return response, status.HTTP_202_ACCEPTED
 
-        return None, 500
+        return None, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+class DonateReprocessQueuedDonorsStatus( AdminResource ):
+    """Flask-RESTful resource endpoint for the progress of a reprocess of queued donors."""
+
+    def get( self, reprocess_id ):
+        """Endpoint to return the status of a reprocess."""
+
+        response = reprocess_queued_donors_status( reprocess_id )
+
+        if response:
+            return response, status.HTTP_200_OK
+
+        return None, status.HTTP_404_NOT_FOUND
@@ -6,6 +6,8 @@ from flask_api import status
 from nusa_jwt_auth.restful import AdminResource
 
 from application.controllers.user import ultsys_user
+from application.controllers.user import ultsys_user_cache_statistics
+from application.controllers.user import ultsys_user_mirror_status
 
 
 class UltsysUser( AdminResource ):
@@ -34,3 +36,21 @@ class UltsysUser( AdminResource ):
             return response, status.HTTP_200_OK
 
         return None, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+class UltsysUserCacheStatistics( AdminResource ):
+    """Flask-RESTful resource endpoint for the Ultsys user cache statistics."""
+
+    def get( self ):
+        """Simple endpoint to return the hit and miss counts of the Ultsys user cache."""
+        response = ultsys_user_cache_statistics()
+        return response, status.HTTP_200_OK
+
+
+class UltsysUserMirrorStatus( AdminResource ):
+    """Flask-RESTful resource endpoint for the status of the local Ultsys user mirror."""
+
+    def get( self ):
+        """Simple endpoint to return the staleness and watermarks of the Ultsys user mirror."""
+        response = ultsys_user_mirror_status()
+        return response, status.HTTP_200_OK
@@ -6,7 +6,7 @@ from marshmallow import post_dump
 from marshmallow import pre_dump
 from marshmallow import Schema
 
-from application.models.agent import AgentModel
+from application.helpers.reference_data import find_agent
 # pylint: disable=too-few-public-methods
 # pylint: disable=bare-except
 # flake8: noqa:E722
@@ -83,7 +83,7 @@ class BraintreeSaleSchema( Schema ):
         if not data[ 'fee' ]:
             transaction[ 'fee' ] = Decimal( 0.00 )
 
-        sourced_from_agent = AgentModel.get_agent( 'Organization', 'name', 'Braintree' )
+        sourced_from_agent = find_agent( 'Organization', 'name', 'Braintree' )
         gift[ 'sourced_from_agent_id' ] = sourced_from_agent.id
 
         data[ 'transaction' ] = transaction
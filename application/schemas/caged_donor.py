@@ -15,7 +15,7 @@ class CagedDonorSchema( ModelSchema ):
     class Meta:
         """Meta object for Marshmallow schema."""
 
-        exclude = [ 'gift_id' ]
+        exclude = [ 'gift_id', 'user_street' ]
         model = CagedDonorModel
         strict = True
         sqla_session = database.session
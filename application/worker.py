@@ -0,0 +1,142 @@
+"""The RQ worker for caging, which builds the Flask application once per worker process and reuses it across jobs.
+
+With `flask rq worker` every caging job paid for the application twice: the default RQ worker forks a child per job,
+where FlaskJob loads the application through the Flask CLI, and then redis_queue_caging() called create_app(). Each
+create_app() reads conf.yml, runs dictConfig, registers every resource and error handler, and initializes SQLAlchemy,
+RQ and JWT before any caging is done.
+
+Here:
+
+    1. get_worker_app() builds the application once per process and configuration, and caches it.
+    2. worker_app_context() is used by the jobs: it reuses the application context already pushed by the worker,
+       or pushes the cached application's, and removes the SQLAlchemy session when the job is done.
+    3. CagingWorker is an RQ SimpleWorker, which runs jobs in the worker process rather than a forked child. The
+       application, and its SQLAlchemy engine and connection pool, are built once when the worker starts and every job
+       runs in its application context. The session is removed after each job so that no state leaks between jobs.
+
+The worker is started with jobs/caging_worker.py, or with `flask rq worker` and RQ_WORKER_CLASS set to
+application.worker.CagingWorker. The time a job spends getting its application context, the per-job overhead, is
+recorded by record_job_overhead() and logged by the worker.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app
+from flask import has_app_context
+from rq.worker import SimpleWorker
+
+from application.flask_essentials import database
+
+WORKER_APPS = {}
+WORKER_APPS_LOCK = threading.Lock()
+
+JOB_OVERHEAD = { 'jobs': 0, 'total_seconds': 0.0, 'maximum_seconds': 0.0 }
+JOB_OVERHEAD_LOCK = threading.Lock()
+
+# Log the running per-job overhead every so many jobs.
+OVERHEAD_LOG_INTERVAL = 100
+
+
+def get_worker_app( app_config_name ):
+    """Return the application for the configuration, building it only the first time in this process.
+
+    :param str app_config_name: The configuration ( PROD, DEV, TEST ) that the app is running.
+    :return: The Flask application.
+    """
+
+    app_key = ( os.getpid(), app_config_name )
+    app = WORKER_APPS.get( app_key )
+    if app:
+        return app
+
+    with WORKER_APPS_LOCK:
+        app = WORKER_APPS.get( app_key )
+        if not app:
+            from application.app import create_app  # pylint: disable=cyclic-import
+            app = create_app( app_config_name )
+            WORKER_APPS[ app_key ] = app
+    return app
+
+
+@contextmanager
+def worker_app_context( app_config_name ):
+    """The application context for a job.
+
+    If the worker has already pushed an application context for the same configuration it is used as is, and the
+    worker cleans up the session. Otherwise the cached application's context is pushed here, and the session removed
+    when the job is done.
+
+    :param str app_config_name: The configuration ( PROD, DEV, TEST ) that the app is running.
+    :return: The Flask application.
+    """
+
+    started = time.perf_counter()
+    if has_app_context() and current_app.config.get( 'ENV' ) == app_config_name:
+        record_job_overhead( time.perf_counter() - started )
+        yield current_app
+        return
+
+    app = get_worker_app( app_config_name )
+    with app.app_context():
+        record_job_overhead( time.perf_counter() - started )
+        try:
+            yield app
+        finally:
+            database.session.remove()
+
+
+def record_job_overhead( seconds ):
+    """Record the time a job took to get its application context.
+
+    :param float seconds: The overhead in seconds.
+    :return:
+    """
+
+    with JOB_OVERHEAD_LOCK:
+        JOB_OVERHEAD[ 'jobs' ] += 1
+        JOB_OVERHEAD[ 'total_seconds' ] += seconds
+        JOB_OVERHEAD[ 'maximum_seconds' ] = max( JOB_OVERHEAD[ 'maximum_seconds' ], seconds )
+        jobs = JOB_OVERHEAD[ 'jobs' ]
+    logging.debug( '***** caging job overhead: %.6f seconds', seconds )
+    if jobs % OVERHEAD_LOG_INTERVAL == 0:
+        logging.info( 'Caging job overhead: %s', get_job_overhead_statistics() )
+
+
+def get_job_overhead_statistics():
+    """The count, mean and maximum of the per-job overhead in this process.
+
+    :return: A dictionary of the statistics.
+    """
+
+    with JOB_OVERHEAD_LOCK:
+        jobs = JOB_OVERHEAD[ 'jobs' ]
+        return {
+            'jobs': jobs,
+            'mean_seconds': JOB_OVERHEAD[ 'total_seconds' ] / jobs if jobs else None,
+            'maximum_seconds': JOB_OVERHEAD[ 'maximum_seconds' ]
+        }
+
+
+class CagingWorker( SimpleWorker ):
+    """An RQ worker that runs every job in the application context of an application built once for the worker."""
+
+    def __init__( self, *args, app=None, **kwargs ):
+        """Keep the application: the one given, or the one whose context the worker is created in.
+
+        :param app: The Flask application, e.g. from get_worker_app().
+        """
+
+        super().__init__( *args, **kwargs )
+        self.app = app or current_app._get_current_object()  # pylint: disable=protected-access
+
+    def perform_job( self, job, queue, *args, **kwargs ):  # pylint: disable=arguments-differ
+        """Perform the job in the application context and then remove the session, whatever the outcome."""
+
+        with self.app.app_context():
+            try:
+                return super().perform_job( job, queue, *args, **kwargs )
+            finally:
+                database.session.remove()
@@ -11,12 +11,61 @@ function allows sales to be returned for searches such as authorized_at and subm
 
 The module here also provides for writing data to CSV files in an S3 bucket.
 
+The updater is incremental. Each search kind keeps a sync cursor, a row on the sync_state table:
+
+    1. braintree_<status>: One per status in TRACKED_STATUSES and FAILURE_STATUSES, e.g. braintree_settled_at.
+    2. braintree_disputes: The dispute search on effective_date.
+
+A run searches each kind from its cursor's watermark_in_utc, less BRAINTREE_SYNC_OVERLAP seconds for events indexed
+late by Braintree, to the time the run started. The watermark of a status is advanced to that time only when every sale
+it found was applied; otherwise the next run searches from the same watermark. A dispute that fails is kept on the
+braintree_dispute_retry table and found by its ID on the next runs, up to BRAINTREE_DISPUTE_RETRY_MAX_ATTEMPTS times,
+and so the disputes watermark advances past it. Transactions are only built when they do not already exist, and so the
+overlap is processed again without duplicates. A kind without a cursor, or whose watermark is older than INTERVAL, is
+searched over the full window INTERVAL.
+
+The local transactions and gifts of the sales and disputes found are loaded before they are processed, in chunked IN
+queries on the reference numbers and subscription ID's, into a LocalIndex, with the balance of each gift from
+get_latest_transactions(). The handlers read the index rather than querying per sale, and add the transactions and gifts
+they build to it. The statements a run executes are counted on its own thread, and logged with the number it would have
+executed without the index: the statements plus the lookups the index served, each of which was a query per sale.
+
+The searches of the kinds are fetched first, concurrently on BRAINTREE_SEARCH_MAX_WORKERS threads, each paging through
+its results. The threads only call Braintree. A search that is rate limited, or finds Braintree unavailable, is retried
+with exponential backoff and jitter. The sales of the tracked statuses are then de-duplicated by ID into one dict. A
+kind whose search fails after BRAINTREE_SEARCH_MAX_ATTEMPTS is not processed, and its cursor is not advanced.
+
+Each sale or dispute is applied inside a SAVEPOINT, which is rolled back if it fails, and the applied sales are
+committed every BRAINTREE_COMMIT_CHUNK_SIZE sales rather than one at a time. If the commit of a chunk fails the chunk
+is rolled back, the run stops applying, and the cursors of the sales or disputes not applied are not advanced.
+
+A backfill searches every kind over the full window INTERVAL, as the updater did before the cursors, for recovery:
+
 python -c "import jobs.braintree;jobs.braintree.manage_status_updates()"
+python -c "import jobs.braintree;jobs.braintree.manage_status_updates( backfill=True )"
+
+Configuration in app.config:
+
+    BRAINTREE_SYNC_OVERLAP: Seconds subtracted from the watermark of each search kind ( default 3600 ).
+    BRAINTREE_PREFETCH_CHUNK_SIZE: The most values in the IN clause of a prefetch query ( default 500 ).
+    BRAINTREE_COMMIT_CHUNK_SIZE: The sales or disputes applied per commit ( default 200 ).
+    BRAINTREE_DISPUTE_RETRY_MAX_ATTEMPTS: The runs that retry a dispute that failed before it is given up on
+        ( default 10 ).
+    BRAINTREE_SEARCH_MAX_WORKERS: The most Braintree searches made at the same time ( default 4 ).
+    BRAINTREE_SEARCH_MAX_ATTEMPTS: The attempts made of a search before it fails ( default 5 ).
+    BRAINTREE_SEARCH_BACKOFF: Seconds before the first retry of a search, doubled on each attempt ( default 2 ).
+    BRAINTREE_SEARCH_MAX_BACKOFF: The most seconds between the retries of a search ( default 60 ).
 """
 import logging
+import math
 import os
+import random
+import threading
+import time
 import uuid
+from collections import namedtuple
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 from datetime import datetime
 from datetime import timedelta
@@ -24,17 +73,23 @@ from decimal import Decimal
 
 import braintree
 from s3_web_storage.web_storage import WebStorage
+from sqlalchemy import event
+from sqlalchemy.orm.exc import MultipleResultsFound
 
 from application.app import create_app
 from application.exceptions.exception_critical_path import UpdaterCriticalPathError
 from application.flask_essentials import database
-from application.helpers.braintree_api import init_braintree_credentials
+from application.helpers.braintree_api import get_braintree_gateway
 from application.helpers.build_output_file import build_flat_bytesio_csv
 from application.helpers.email import send_statistics_report
 from application.helpers.model_serialization import from_json
-from application.models.agent import AgentModel
+from application.helpers.reference_data import find_agent
+from application.helpers.transaction_helpers import get_gift_balance
+from application.helpers.transaction_helpers import get_latest_transactions
+from application.models.braintree_dispute_retry import BraintreeDisputeRetryModel
 from application.models.gift import GiftModel
 from application.models.gift_thank_you_letter import GiftThankYouLetterModel
+from application.models.sync_state import SyncStateModel
 from application.models.transaction import TransactionModel
 from application.schemas.gift import GiftSchema
 from application.schemas.transaction import TransactionSchema
@@ -55,7 +110,7 @@ app = create_app( app_config_env )  # pylint: disable=C0103
 
 WebStorage.init_storage( app, app.config[ 'AWS_CSV_FILES_BUCKET' ], app.config[ 'AWS_CSV_FILES_PATH' ] )
 
-init_braintree_credentials( app )
+BRAINTREE_GATEWAY = get_braintree_gateway( app )
 
 THANK_YOU_LETTER_THRESHOLD = Decimal( app.config[ 'THANK_YOU_LETTER_THRESHOLD' ] )
 MODEL_DATE_STRING_FORMAT = '%Y-%m-%d %H:%M:%S'
@@ -119,7 +174,7 @@ MULTIPLIER_FOR_TYPE_STATUS = {
 
 # Get the Agent ID from the model for type Automated. This is used on both the Gift and Transaction models.
 with app.app_context():
-    AGENT_MODEL = AgentModel.get_agent( 'Organization', 'name', 'Donate API' )  # pylint: disable=invalid-name
+    AGENT_MODEL = find_agent( 'Organization', 'name', 'Donate API' )  # pylint: disable=invalid-name
     AGENT_ID = str( AGENT_MODEL.id )
 
 # **************************************************************** #
@@ -128,22 +183,54 @@ with app.app_context():
 #     */5 * * * * cd /home/apeters/git/DONATE_updater && /home/apeters/git/DONATE_updater/venv/bin/python3
 #         -c "import jobs.braintree;jobs.braintree.manage_status_updates()" >>
 #         /home/apeters/git/DONATE_updater/cron.log 2>&1
+# The interval is the full window of a backfill, and the longest window searched from a sync cursor.
 
 INTERVAL = timedelta( days=30, hours=23, minutes=59, seconds=59, microseconds=999999 )
 
-DATE1 = datetime.utcnow().replace( hour=23, minute=59, second=59, microsecond=999999 )
-DATE0 = DATE1 - INTERVAL
-LOG_INFO = 'Transaction updater cron job: %s ~ %s' % (
-    DATE0.strftime( MODEL_DATE_STRING_FORMAT ), DATE1.strftime( MODEL_DATE_STRING_FORMAT )
+SYNC_NAME_PREFIX = 'braintree_'
+DISPUTES_SYNC_NAME = SYNC_NAME_PREFIX + 'disputes'
+DEFAULT_SYNC_OVERLAP = 3600
+SYNC_OVERLAP = timedelta(
+    seconds=int( app.config.get( 'BRAINTREE_SYNC_OVERLAP' ) or DEFAULT_SYNC_OVERLAP )
+)
+DEFAULT_PREFETCH_CHUNK_SIZE = 500
+PREFETCH_CHUNK_SIZE = int( app.config.get( 'BRAINTREE_PREFETCH_CHUNK_SIZE' ) or DEFAULT_PREFETCH_CHUNK_SIZE )
+DEFAULT_COMMIT_CHUNK_SIZE = 200
+COMMIT_CHUNK_SIZE = int( app.config.get( 'BRAINTREE_COMMIT_CHUNK_SIZE' ) or DEFAULT_COMMIT_CHUNK_SIZE )
+DEFAULT_DISPUTE_RETRY_MAX_ATTEMPTS = 10
+DISPUTE_RETRY_MAX_ATTEMPTS = int(
+    app.config.get( 'BRAINTREE_DISPUTE_RETRY_MAX_ATTEMPTS' ) or DEFAULT_DISPUTE_RETRY_MAX_ATTEMPTS
+)
+DEFAULT_SEARCH_MAX_WORKERS = 4
+DEFAULT_SEARCH_MAX_ATTEMPTS = 5
+DEFAULT_SEARCH_BACKOFF = 2
+DEFAULT_SEARCH_MAX_BACKOFF = 60
+SEARCH_MAX_WORKERS = int( app.config.get( 'BRAINTREE_SEARCH_MAX_WORKERS' ) or DEFAULT_SEARCH_MAX_WORKERS )
+SEARCH_MAX_ATTEMPTS = int( app.config.get( 'BRAINTREE_SEARCH_MAX_ATTEMPTS' ) or DEFAULT_SEARCH_MAX_ATTEMPTS )
+SEARCH_BACKOFF = float( app.config.get( 'BRAINTREE_SEARCH_BACKOFF' ) or DEFAULT_SEARCH_BACKOFF )
+SEARCH_MAX_BACKOFF = float( app.config.get( 'BRAINTREE_SEARCH_MAX_BACKOFF' ) or DEFAULT_SEARCH_MAX_BACKOFF )
+
+# The errors of a search that are retried with backoff: Braintree's rate limit, and Braintree being unavailable. The
+# SDK raises ServiceUnavailableError for the 503 from version 4, and DownForMaintenanceError before it.
+RETRIED_SEARCH_ERRORS = tuple(
+    getattr( getattr( braintree.exceptions, module_name ), error_name ) for module_name, error_name in (
+        ( 'too_many_requests_error', 'TooManyRequestsError' ),
+        ( 'service_unavailable_error', 'ServiceUnavailableError' ),
+        ( 'down_for_maintenance_error', 'DownForMaintenanceError' )
+    ) if hasattr( braintree.exceptions, module_name )
 )
 logging.debug( 'INTERVAL: %s', INTERVAL )
-logging.debug( 'DATES   : %s', LOG_INFO )
+logging.debug( 'OVERLAP : %s', SYNC_OVERLAP )
 
 # **************************************************************** #
 
 
-def manage_status_updates():
-    """A top level function that calls lower level code to do the updates and handle writing files to S3."""
+def manage_status_updates( backfill=False ):
+    """A top level function that calls lower level code to do the updates and handle writing files to S3.
+
+    :param backfill: Search every kind over the full window INTERVAL rather than from its sync cursor.
+    :return:
+    """
 
     dispute_data = []
     failure_data = []
@@ -151,15 +238,40 @@ def manage_status_updates():
     priority_sale_data = []
     with app.app_context():
 
-        # Begin updating the database.
-        logging.debug( '>>>>> 1/12 Retrieve priority sales' )
-        process_new_statuses( priority_sale_data )
+        date1 = datetime.utcnow()
+        logging.debug(
+            'Transaction updater cron job: %s%s', date1.strftime( MODEL_DATE_STRING_FORMAT ),
+            ' ( backfill )' if backfill else ''
+        )
+
+        # The listener is on the process-wide engine, and so only the statements of this thread are counted.
+        thread_id = threading.get_ident()
+        RUN_STATISTICS.update( { 'statements': 0, 'index_lookups': 0 } )
+
+        def count_statement( conn, cursor, statement, *args ):  # pylint: disable=unused-argument
+            if threading.get_ident() == thread_id:
+                RUN_STATISTICS[ 'statements' ] += 1
 
-        logging.debug( '>>>>> 2/12 Retrieve priority disputes' )
-        process_new_disputes( dispute_data, priority_dispute_data )
+        # Fetch the searches of every kind from Braintree, concurrently.
+        windows, results = fetch_braintree_searches( date1, backfill )
+
+        # Begin updating the database.
+        event.listen( database.engine, 'before_cursor_execute', count_statement )
+        try:
+            logging.debug( '>>>>> 1/12 Retrieve priority sales' )
+            process_new_statuses( priority_sale_data, date1, results )
+
+            logging.debug( '>>>>> 2/12 Retrieve priority disputes' )
+            process_new_disputes( dispute_data, priority_dispute_data, date1, windows, results )
+        finally:
+            event.remove( database.engine, 'before_cursor_execute', count_statement )
+            logging.info(
+                'Transaction updater statements: %s before the local index, %s after.',
+                RUN_STATISTICS[ 'statements' ] + RUN_STATISTICS[ 'index_lookups' ], RUN_STATISTICS[ 'statements' ]
+            )
 
         logging.debug( '>>>>> 3/12 Retrieve failures' )
-        process_failures( failure_data )
+        process_failures( failure_data, date1, results )
 
         # Save data to CSV files on S3.
         urls = {}
@@ -191,6 +303,266 @@ def manage_status_updates():
             logging.debug( '>>>>> 12/12 No data found' )
 
 
+def get_sync_start( sync_name, date1, backfill=False ):
+    """The start of the window searched for a kind: its watermark less the overlap, and at most INTERVAL before date1.
+
+    :param sync_name: The name of the sync cursor on the sync_state table.
+    :param date1: The end of the window, when the run started.
+    :param backfill: Whether to search the full window INTERVAL.
+    :return: The start of the window.
+    """
+
+    date0 = date1 - INTERVAL
+    if backfill:
+        return date0
+
+    sync_state = SyncStateModel.query.filter_by( name=sync_name ).one_or_none()
+    if sync_state and sync_state.watermark_in_utc:
+        date0 = max( date0, sync_state.watermark_in_utc - SYNC_OVERLAP )
+    logging.debug( '%s: %s ~ %s', sync_name, date0, date1 )
+    return date0
+
+
+def fetch_braintree_searches( date1, backfill=False ):
+    """Search every kind from its cursor to date1, concurrently on SEARCH_MAX_WORKERS threads.
+
+    The windows are read from the sync_state table here, and the threads only call Braintree.
+
+    :param date1: The end of the window, when the run started.
+    :param backfill: Whether to search the full window INTERVAL.
+    :return: A tuple of the start of the window of each kind, and the sales or disputes found for each kind, or None
+             for a kind whose search failed.
+    """
+
+    windows = OrderedDict()
+    searches = OrderedDict()
+    for status in TRACKED_STATUSES + FAILURE_STATUSES:
+        sync_name = SYNC_NAME_PREFIX + status
+        windows[ sync_name ] = get_sync_start( sync_name, date1, backfill )
+        searches[ sync_name ] = (
+            lambda date0, status=status: list( search_at( date0, date1, status, {} ).values() )
+        )
+    windows[ DISPUTES_SYNC_NAME ] = get_sync_start( DISPUTES_SYNC_NAME, date1, backfill )
+    retry_dispute_ids = get_retry_dispute_ids()
+    searches[ DISPUTES_SYNC_NAME ] = (
+        lambda date0: add_retry_disputes( search_disputes( date0, date1 ), retry_dispute_ids )
+    )
+
+    started = time.monotonic()
+    with ThreadPoolExecutor( max_workers=SEARCH_MAX_WORKERS ) as executor:
+        futures = OrderedDict(
+            ( sync_name, executor.submit( search_with_backoff, sync_name, search, windows[ sync_name ] ) )
+            for sync_name, search in searches.items()
+        )
+        results = OrderedDict( ( sync_name, future.result() ) for sync_name, future in futures.items() )
+
+    logging.info(
+        'Braintree searches in %.1f seconds: %s', time.monotonic() - started,
+        { sync_name: len( found ) if found is not None else 'failed' for sync_name, found in results.items() }
+    )
+    return windows, results
+
+
+def search_with_backoff( sync_name, search, date0 ):
+    """Make a search, retrying it with exponential backoff and jitter while Braintree rate limits or is unavailable.
+
+    :param sync_name: The name of the sync cursor of the search, for the logs.
+    :param search: A function of the start of the window that makes the search and returns a list of what it found.
+    :param date0: The start of the window.
+    :return: The list found, or None if the search failed.
+    """
+
+    for attempt in range( 1, SEARCH_MAX_ATTEMPTS + 1 ):
+        try:
+            return search( date0 )
+        except RETRIED_SEARCH_ERRORS as error:
+            if attempt == SEARCH_MAX_ATTEMPTS:
+                logging.error( 'Braintree search %s failed after %s attempts: %s', sync_name, attempt, repr( error ) )
+                return None
+            backoff = min( SEARCH_BACKOFF * 2 ** ( attempt - 1 ), SEARCH_MAX_BACKOFF )
+            backoff *= random.uniform( 0.5, 1.0 )
+            logging.warning( 'Braintree search %s retried in %.1f seconds: %s', sync_name, backoff, repr( error ) )
+            time.sleep( backoff )
+        except:  # noqa: E722
+            logging.exception( 'Braintree search %s failed.', sync_name )
+            return None
+    return None
+
+
+def advance_sync_cursor( sync_name, date1, rows_synced ):
+    """Advance the watermark of a kind to the end of the window searched, once all of it was processed.
+
+    :param sync_name: The name of the sync cursor on the sync_state table.
+    :param date1: The end of the window, when the run started.
+    :param rows_synced: The number of sales or disputes found in the window.
+    :return:
+    """
+
+    try:
+        sync_state = SyncStateModel.query.filter_by( name=sync_name ).one_or_none()
+        if not sync_state:
+            sync_state = SyncStateModel( name=sync_name )
+            database.session.add( sync_state )
+        sync_state.watermark_in_utc = date1
+        sync_state.last_synced_in_utc = datetime.utcnow()
+        sync_state.rows_synced = rows_synced
+        database.session.commit()
+    except:  # noqa: E722
+        database.session.rollback()
+        logging.debug(
+            UpdaterCriticalPathError( where='advance_sync_cursor', type_id=sync_name ).message
+        )
+
+
+# The columns of the transactions and gifts read by the handlers. The index holds these rather than the models, which
+# are expired by each commit and would be refreshed with a query per model.
+LocalTransaction = namedtuple(  # pylint: disable=invalid-name
+    'LocalTransaction', [ 'gift_id', 'reference_number', 'type', 'status', 'date_in_utc', 'gross_gift_amount' ]
+)
+LocalGift = namedtuple( 'LocalGift', [ 'id', 'user_id', 'recurring_subscription_id' ] )  # pylint: disable=invalid-name
+
+# A transaction built in the run has no ID until it is saved, and it is given one larger than any stored.
+BUILT_TRANSACTION_ID = math.inf
+
+# The statements executed by the handlers of a run, and the lookups the LocalIndex served in place of a query.
+RUN_STATISTICS = { 'statements': 0, 'index_lookups': 0 }
+
+
+class LocalIndex:
+    """In-memory indexes of the local transactions and gifts of the sales and disputes processed in a run."""
+
+    def __init__( self ):
+        self.transactions_by_reference = {}
+        self.latest_by_gift = {}
+        self.gifts_by_subscription = {}
+
+    def prefetch( self, reference_numbers, subscription_ids ):
+        """Load the transactions with the reference numbers, the balances of their gifts, and the gifts with the
+        subscription ID's.
+
+        :param reference_numbers: The Braintree sale, refunded sale and dispute ID's of the run.
+        :param subscription_ids: The Braintree subscription ID's of the recurring sales of the run.
+        :return:
+        """
+
+        reference_numbers = sorted( { str( number ) for number in reference_numbers if number } )
+        transactions = []
+        for chunk in get_chunks( reference_numbers ):
+            transactions.extend(
+                LocalTransaction( *row ) for row in database.session.query(
+                    *[ getattr( TransactionModel, field ) for field in LocalTransaction._fields ]
+                ).filter( TransactionModel.reference_number.in_( chunk ) ).all()
+            )
+
+        # The balance of each gift, from its latest transaction by date and then ID.
+        for chunk in get_chunks( sorted( { transaction.gift_id for transaction in transactions } ) ):
+            for gift_id, latest_transaction in get_latest_transactions( chunk ).items():
+                transaction_id, date_in_utc, gross_gift_amount = latest_transaction
+                self.latest_by_gift[ gift_id ] = ( ( date_in_utc, transaction_id ), gross_gift_amount )
+        for transaction in transactions:
+            self.index_transaction( transaction )
+
+        subscription_ids = sorted( { subscription_id for subscription_id in subscription_ids if subscription_id } )
+        for chunk in get_chunks( subscription_ids ):
+            for row in database.session.query( *[ getattr( GiftModel, field ) for field in LocalGift._fields ] ) \
+                    .filter( GiftModel.recurring_subscription_id.in_( chunk ) ).all():
+                self.add_gift( LocalGift( *row ) )
+
+    def add_transactions( self, transaction_models ):
+        """Add transactions built in the run to the indexes. A built transaction is saved after every stored one, and
+        so sorts after them on the same date: built on or after the date of the latest on its gift it is the latest,
+        and its gross_gift_amount the balance of the gift.
+        """
+
+        for transaction_model in transaction_models:
+            transaction = LocalTransaction(
+                *[ getattr( transaction_model, field ) for field in LocalTransaction._fields ]
+            )
+            self.index_transaction( transaction )
+
+            sort_key = ( transaction.date_in_utc, BUILT_TRANSACTION_ID )
+            latest = self.latest_by_gift.get( transaction.gift_id )
+            if not latest or sort_key >= latest[ 0 ]:
+                self.latest_by_gift[ transaction.gift_id ] = ( sort_key, Decimal( transaction.gross_gift_amount ) )
+
+    def index_transaction( self, transaction ):
+        """Add a LocalTransaction to the index on reference number, type and status."""
+
+        key = ( str( transaction.reference_number ), transaction.type, transaction.status )
+        self.transactions_by_reference.setdefault( key, [] ).append( transaction )
+
+    def add_gift( self, gift_model ):
+        """Add a gift, loaded or built in the run, to the index of the subscriptions."""
+
+        gift = LocalGift( *[ getattr( gift_model, field ) for field in LocalGift._fields ] )
+        if gift.recurring_subscription_id:
+            self.gifts_by_subscription.setdefault( gift.recurring_subscription_id, [] ).append( gift )
+
+    def find_transaction( self, reference_number, transaction_type, transaction_status ):
+        """The transaction with the reference number, type and status, as with one_or_none() on the query.
+
+        :param reference_number: The Braintree sale or dispute ID.
+        :param transaction_type: The transaction type, e.g. Gift.
+        :param transaction_status: The transaction status, e.g. Completed.
+        :return: The LocalTransaction or None.
+        """
+
+        RUN_STATISTICS[ 'index_lookups' ] += 1
+        transactions = self.transactions_by_reference.get(
+            ( str( reference_number ), transaction_type, transaction_status ), []
+        )
+        if len( transactions ) > 1:
+            raise MultipleResultsFound( 'Multiple transactions for reference number {}.'.format( reference_number ) )
+        return transactions[ 0 ] if transactions else None
+
+    def get_balance( self, gift_id ):
+        """The balance of a gift: the gross_gift_amount of its latest transaction. The balance of a gift that was not
+        prefetched, e.g. a recurring gift created in the run, is queried.
+        """
+
+        if gift_id not in self.latest_by_gift:
+            return get_gift_balance( gift_id )
+        RUN_STATISTICS[ 'index_lookups' ] += 1
+        return self.latest_by_gift[ gift_id ][ 1 ]
+
+    def get_subscription_gifts( self, subscription_id ):
+        """The gifts with a recurring subscription ID."""
+
+        RUN_STATISTICS[ 'index_lookups' ] += 1
+        return self.gifts_by_subscription.get( subscription_id, [] )
+
+
+def get_chunks( values ):
+    """Split the values for the IN clauses of the prefetch into chunks of PREFETCH_CHUNK_SIZE.
+
+    :param values: A list of values.
+    :return: A generator of lists.
+    """
+
+    for start in range( 0, len( values ), PREFETCH_CHUNK_SIZE ):
+        yield values[ start:start + PREFETCH_CHUNK_SIZE ]
+
+
+def commit_chunk( where, sale_ids ):
+    """Commit the sales or disputes applied since the last commit, each released from its SAVEPOINT.
+
+    :param where: The stage applying the chunk, for the logs.
+    :param sale_ids: The Braintree sale ID's of the chunk.
+    :return: False if the chunk was rolled back.
+    """
+
+    try:
+        database.session.commit()
+    except:  # noqa: E722
+        database.session.rollback()
+        for sale_id in sale_ids:
+            logging.debug(
+                UpdaterCriticalPathError( where='{} commit'.format( where ), type_id=sale_id ).message
+            )
+        return False
+    return True
+
+
 def generate_priority_sale_data( priority_sale_data, urls ):
     """Handle the priority sale data file generation."""
 
@@ -245,16 +617,24 @@ def generate_url( file_name ):
     return url
 
 
-def process_failures( failure_data ):
-    """Calls search_at to get sales that were declined, rejected, failed, and expired in the interval.
+def process_failures( failure_data, date1, results ):
+    """Report the sales that were declined, rejected, failed, and expired since each status's cursor.
 
     :param failure_data: A list to collect failure data to pass to the CSV writer.
+    :param date1: The end of the window, when the run started.
+    :param results: The sales found for each kind by fetch_braintree_searches().
     :return:
     """
 
     sales = {}
+    found = {}
     for status in FAILURE_STATUSES:
-        search_at( DATE0, DATE1, status, sales )
+        sync_name = SYNC_NAME_PREFIX + status
+        if results[ sync_name ] is None:
+            continue
+        found[ sync_name ] = len( results[ sync_name ] )
+        for sale in results[ sync_name ]:
+            sales.setdefault( sale.id, sale )
 
     # Each failure should be written to a CSV file for further review.
     for sale_id, sale in sales.items():  # pylint: disable=unused-variable
@@ -266,97 +646,218 @@ def process_failures( failure_data ):
             )
         )
 
+    # The failures are only reported, and so the cursors advance once the rows are collected.
+    for sync_name, rows_synced in found.items():
+        advance_sync_cursor( sync_name, date1, rows_synced )
 
-def process_new_disputes( dispute_data, priority_dispute_data ):
+
+def process_new_disputes(  # pylint: disable=too-many-locals
+        dispute_data, priority_dispute_data, date1, windows, results
+):
     """Function to do the work of updating database transactions with dispute information.
 
     :param dispute_data: A list to collect dispute data to pass to the CSV writer.
     :param priority_dispute_data: Collect priority dispute data ( inconsistencies with database ) for CSV.
+    :param date1: The end of the window, when the run started.
+    :param windows: The start of the window of each kind from fetch_braintree_searches().
+    :param results: The disputes found by fetch_braintree_searches().
     :return:
     """
 
-    # Disputes must be handled separately, partly because of how they are searched: effective_date of the event.
-    # The format of the object returned is different then a sale is another reason to handle it separately.
-    braintree_disputes = braintree.Dispute.search(
-        braintree.DisputeSearch.status.in_list(
-            [
-                braintree.Dispute.Status.Accepted,
-                braintree.Dispute.Status.Disputed,
-                braintree.Dispute.Status.Expired,
-                braintree.Dispute.Status.Open,
-                braintree.Dispute.Status.Lost,
-                braintree.Dispute.Status.Won
-            ]
-        ),
-        braintree.DisputeSearch.effective_date.between( DATE0, DATE1 )
+    disputes = results[ DISPUTES_SYNC_NAME ]
+    if disputes is None:
+        return
+    date0 = windows[ DISPUTES_SYNC_NAME ]
+
+    # The disputes that failed on earlier runs are applied whatever their updated_at.
+    retry_dispute_ids = get_retry_dispute_ids()
+
+    local_index = LocalIndex()
+    local_index.prefetch(
+        [ dispute.transaction.id for dispute in disputes ] + [ dispute.id for dispute in disputes ], []
     )
 
-    for dispute in braintree_disputes.disputes:
+    commit_failed = False
+    failed_dispute_ids = []
+    applied_dispute_ids = []
+    chunk = []
+    chunk_dispute_ids = []
+    chunk_dispute_data = []
+    for dispute in disputes:
 
         updated_at = datetime.strptime( dispute.updated_at, BRAINTREE_DATE_STRING_FORMAT )
-        if DATE0 <= updated_at <= DATE1:
+        if dispute.id not in retry_dispute_ids and not date0 <= updated_at <= date1:
+            continue
 
-            sale_id = dispute.transaction.id
+        sale_id = dispute.transaction.id
 
-            history_attributes = { 'dispute_history': {} }
-            for history_item in dispute.status_history:
-                history_attributes[ 'dispute_history' ][ history_item.status ] = \
-                    datetime.strptime( history_item.timestamp, BRAINTREE_DATE_STRING_FORMAT )
+        history_attributes = { 'dispute_history': {} }
+        for history_item in dispute.status_history:
+            history_attributes[ 'dispute_history' ][ history_item.status ] = \
+                datetime.strptime( history_item.timestamp, BRAINTREE_DATE_STRING_FORMAT )
 
-            history_attributes[ 'dispute_kind' ] = dispute.kind
+        history_attributes[ 'dispute_kind' ] = dispute.kind
 
-            try:
-                # This is a dispute.
-                transaction_initial = TransactionModel.query.filter_by( reference_number=sale_id ) \
-                    .filter_by( type='Gift' ) \
-                    .filter_by( status='Completed' ).one_or_none()
+        savepoint = database.session.begin_nested()
+        try:
+            applied = manage_dispute( sale_id, dispute, history_attributes, priority_dispute_data, local_index )
+            savepoint.commit()
+        except:  # noqa: E722
+            failed_dispute_ids.append( dispute.id )
+            savepoint.rollback()
+            logging.debug(
+                UpdaterCriticalPathError( where='disputes', type_id=sale_id ).message
+            )
+            continue
 
-                if not transaction_initial:
-                    priority_dispute_data.append(
-                        get_row_of_data(
-                            dispute,
-                            BRAINTREE_DISPUTE_FIELDS,
-                            'Dispute ID {} with no initial transaction.'.format( dispute.id )
-                        )
-                    )
-                    continue
-                else:
-                    gift_id = transaction_initial.gift_id
+        # Build CSV data, once the chunk is committed.
+        if applied:
+            chunk_dispute_data.append(
+                get_row_of_data(
+                    dispute,
+                    BRAINTREE_DISPUTE_FIELDS,
+                    'Dispute ID: {}.'.format( dispute.id )
+                )
+            )
+        chunk.append( sale_id )
+        chunk_dispute_ids.append( dispute.id )
+        if len( chunk ) >= COMMIT_CHUNK_SIZE:
+            if not commit_chunk( 'disputes', chunk ):
+                commit_failed = True
+                chunk = []
+                break
+            dispute_data.extend( chunk_dispute_data )
+            applied_dispute_ids.extend( chunk_dispute_ids )
+            chunk = []
+            chunk_dispute_ids = []
+            chunk_dispute_data = []
+
+    if chunk:
+        if commit_chunk( 'disputes', chunk ):
+            dispute_data.extend( chunk_dispute_data )
+            applied_dispute_ids.extend( chunk_dispute_ids )
+        else:
+            commit_failed = True
 
-                # Now update the transactions
-                refunded_transaction_id = None
-                transaction_models = build_transactions( dispute, history_attributes, gift_id, refunded_transaction_id )
+    update_dispute_retries( failed_dispute_ids, applied_dispute_ids )
 
-                database.session.bulk_save_objects( transaction_models )
-                database.session.commit()
-
-                # Build CSV data.
-                dispute_data.append(
-                    get_row_of_data(
-                        dispute,
-                        BRAINTREE_DISPUTE_FIELDS,
-                        'Dispute ID: {}.'.format( dispute.id )
-                    )
-                )
-            except:  # noqa: E722
-                database.session.rollback()
-                logging.debug(
-                    UpdaterCriticalPathError( where='disputes', type_id=sale_id ).message
-                )
+    # A dispute that failed is retried by its ID, and so the cursor advances past it. After a failed commit the
+    # disputes that followed were not applied, and the next run searches from the same watermark.
+    if not commit_failed:
+        advance_sync_cursor( DISPUTES_SYNC_NAME, date1, len( disputes ) )
+
+
+def get_retry_dispute_ids():
+    """The ID's of the disputes that failed on earlier runs and are still retried.
+
+    :return: A set of Braintree dispute ID's.
+    """
+
+    retries = database.session.query( BraintreeDisputeRetryModel.dispute_id ) \
+        .filter( BraintreeDisputeRetryModel.status == 'pending' ).all()
+    return { retry.dispute_id for retry in retries }
+
+
+def update_dispute_retries( failed_dispute_ids, applied_dispute_ids ):
+    """Keep the disputes that failed for a retry on the next run, and delete those that were applied.
+
+    A dispute that has failed DISPUTE_RETRY_MAX_ATTEMPTS times is given up on, and kept as failed for review.
+
+    :param failed_dispute_ids: The ID's of the disputes that failed in the run.
+    :param applied_dispute_ids: The ID's of the disputes that were applied and committed in the run.
+    :return:
+    """
 
+    try:
+        if applied_dispute_ids:
+            BraintreeDisputeRetryModel.query \
+                .filter( BraintreeDisputeRetryModel.dispute_id.in_( applied_dispute_ids ) ) \
+                .delete( synchronize_session=False )
+
+        now = datetime.utcnow()
+        for dispute_id in failed_dispute_ids:
+            retry = BraintreeDisputeRetryModel.query.get( dispute_id )
+            if not retry:
+                retry = BraintreeDisputeRetryModel( dispute_id=dispute_id, attempts=0, created_in_utc=now )
+                database.session.add( retry )
+            retry.attempts += 1
+            retry.last_attempt_in_utc = now
+            if retry.attempts >= DISPUTE_RETRY_MAX_ATTEMPTS:
+                retry.status = 'failed'
+                logging.error( 'Braintree dispute %s given up on after %s attempts.', dispute_id, retry.attempts )
+        database.session.commit()
+    except:  # noqa: E722
+        database.session.rollback()
+        logging.debug(
+            UpdaterCriticalPathError( where='update_dispute_retries', type_id=DISPUTES_SYNC_NAME ).message
+        )
+
+
+def manage_dispute( sale_id, dispute, history_attributes, priority_dispute_data, local_index ):
+    """Logic for one item in the loop over disputes, applied inside its SAVEPOINT.
 
-def process_new_statuses( priority_sale_data ):
+    :param sale_id: The Braintree sale ID of the dispute.
+    :param dispute: The Braintree dispute.
+    :param history_attributes: The history attributes for the dispute.
+    :param priority_dispute_data: Collect priority dispute data ( inconsistencies with database ) for CSV.
+    :param local_index: The LocalIndex of the run.
+    :return: True if the transactions of the dispute were built, and False if it has no initial transaction.
+    """
+
+    # This is a dispute.
+    transaction_initial = local_index.find_transaction( sale_id, 'Gift', 'Completed' )
+
+    if not transaction_initial:
+        priority_dispute_data.append(
+            get_row_of_data(
+                dispute,
+                BRAINTREE_DISPUTE_FIELDS,
+                'Dispute ID {} with no initial transaction.'.format( dispute.id )
+            )
+        )
+        return False
+    gift_id = transaction_initial.gift_id
+
+    # Now update the transactions
+    refunded_transaction_id = None
+    transaction_models = build_transactions(
+        dispute, history_attributes, gift_id, refunded_transaction_id, local_index
+    )
+
+    database.session.bulk_save_objects( transaction_models )
+    database.session.flush()
+    local_index.add_transactions( transaction_models )
+    return True
+
+
+def process_new_statuses( priority_sale_data, date1, results ):  # pylint: disable=too-many-locals
     """Function to do the work of updating database transactions with new statuses on Braintree sales.
 
     :param priority_sale_data: Collect priority sale data ( inconsistencies with database ) for CSV.
+    :param date1: The end of the window, when the run started.
+    :param results: The sales found for each kind by fetch_braintree_searches().
     :return:
     """
 
-    # Get all the updated sales in the interval.
-    sales = {}
+    # The updated sales since the cursor of each status, de-duplicated by ID.
+    sales = OrderedDict()
+    found = {}
     for status in TRACKED_STATUSES:
-        search_at( DATE0, DATE1, status, sales )
+        sync_name = SYNC_NAME_PREFIX + status
+        if results[ sync_name ] is None:
+            continue
+        found[ sync_name ] = len( results[ sync_name ] )
+        for sale in results[ sync_name ]:
+            sales.setdefault( sale.id, sale )
+
+    local_index = LocalIndex()
+    local_index.prefetch(
+        list( sales ) + [ sale.refunded_transaction_id for sale in sales.values() ],
+        [ sale.subscription_id for sale in sales.values() if sale.recurring ]
+    )
 
+    applied_sale_ids = set()
+    chunk = []
     for sale_id, sale in sales.items():
 
         # We need to know what kind of sale this is.
@@ -369,36 +870,65 @@ def process_new_statuses( priority_sale_data ):
             history_attributes[ 'disbursed' ] = disbursement_date
         history_attributes = { 'sale': history_attributes }
 
-        if sale.recurring:
-            manage_recurring_sales( sale_id, sale, history_attributes, priority_sale_data )
-
-        elif 'authorized' in history_attributes[ 'sale' ] and not sale.refunded_transaction_id:
-            manage_authorized_not_refund( sale_id, sale, history_attributes, priority_sale_data )
+        # Each sale is applied inside a SAVEPOINT so that a failure rolls back only the sale.
+        savepoint = database.session.begin_nested()
+        managed = True
+        try:
+            if sale.recurring:
+                managed = manage_recurring_sales( sale_id, sale, history_attributes, priority_sale_data, local_index )
 
-        elif 'authorized' not in history_attributes[ 'sale' ] and sale.refunded_transaction_id:
-            manage_not_authorized_refund( sale_id, sale, history_attributes, priority_sale_data )
+            elif 'authorized' in history_attributes[ 'sale' ] and not sale.refunded_transaction_id:
+                managed = manage_authorized_not_refund(
+                    sale_id, sale, history_attributes, priority_sale_data, local_index
+                )
 
-        try:
-            database.session.commit()
+            elif 'authorized' not in history_attributes[ 'sale' ] and sale.refunded_transaction_id:
+                managed = manage_not_authorized_refund(
+                    sale_id, sale, history_attributes, priority_sale_data, local_index
+                )
+            if managed:
+                savepoint.commit()
         except:  # noqa: E722
-            database.session.rollback()
+            managed = False
             logging.debug(
                 UpdaterCriticalPathError( where='process_new_statuses', type_id=sale_id ).message
             )
+        if not managed:
+            savepoint.rollback()
+            continue
 
+        chunk.append( sale_id )
+        if len( chunk ) >= COMMIT_CHUNK_SIZE:
+            if not commit_chunk( 'process_new_statuses', chunk ):
+                chunk = []
+                break
+            applied_sale_ids.update( chunk )
+            chunk = []
 
-def manage_recurring_sales( sale_id, sale, history_attributes, priority_sale_data ):
+    if chunk and commit_chunk( 'process_new_statuses', chunk ):
+        applied_sale_ids.update( chunk )
+
+    # The cursor of a status advances when every sale it found was applied, so that a sale that fails holds back only
+    # the statuses that found it.
+    for sync_name in found:
+        if all( sale.id in applied_sale_ids for sale in results[ sync_name ] ):
+            advance_sync_cursor( sync_name, date1, found[ sync_name ] )
+
+
+def manage_recurring_sales( sale_id, sale, history_attributes, priority_sale_data, local_index ):
     """Logic for one item in the loop over sales for new statuses when they are recurring.
 
     :param sale_id: The key of the loop, the Braintree sale ID.
     :param sale: The value for the loop, a Braintree sale.
     :param history_attributes: The history attributes for the sale.
-    :return:
+    :param priority_sale_data: Collect priority sale data ( inconsistencies with database ) for CSV.
+    :param local_index: The LocalIndex of the run.
+    :return: False if the sale could not be processed, and its SAVEPOINT should be rolled back.
     """
 
     try:
         # Try to get the user ID from previous gifts.
-        gifts_with_subscription_id = GiftModel.query.filter_by( recurring_subscription_id=sale.subscription_id ).all()
+        gifts_with_subscription_id = local_index.get_subscription_gifts( sale.subscription_id )
         user_id = None
         for gift in gifts_with_subscription_id:
             if gift.user_id and gift.user_id != 999999999:
@@ -417,9 +947,7 @@ def manage_recurring_sales( sale_id, sale, history_attributes, priority_sale_dat
         else:
             try:
                 # This is a subscription and needs its own gift if not already present.
-                transaction_initial = TransactionModel.query.filter_by( reference_number=sale_id ) \
-                    .filter_by( type='Gift' ) \
-                    .filter_by( status='Completed' ).one_or_none()
+                transaction_initial = local_index.find_transaction( sale_id, 'Gift', 'Completed' )
 
                 if not transaction_initial:
                     gift_dict = {
@@ -435,40 +963,44 @@ def manage_recurring_sales( sale_id, sale, history_attributes, priority_sale_dat
                     gift_model = from_json( GiftSchema(), gift_dict )
                     database.session.add( gift_model.data )
                     database.session.flush()
-                    database.session.commit()
                     gift_id = gift_model.data.id
+                    local_index.add_gift( gift_model.data )
                 else:
                     gift_id = transaction_initial.gift_id
 
                 transaction_models = build_transactions(
-                    sale, history_attributes, gift_id, sale.refunded_transaction_id
+                    sale, history_attributes, gift_id, sale.refunded_transaction_id, local_index
                 )
                 database.session.bulk_save_objects( transaction_models )
+                database.session.flush()
+                local_index.add_transactions( transaction_models )
             except:  # noqa: E722
-                database.session.rollback()
                 logging.debug(
                     UpdaterCriticalPathError( where='manage_recurring_sales rolling back', type_id=sale_id ).message
                 )
+                return False
     except:  # noqa: E722
         logging.debug(
             UpdaterCriticalPathError( where='manage_recurring_sales', type_id=sale_id ).message
         )
+        return False
+    return True
 
 
-def manage_authorized_not_refund( sale_id, sale, history_attributes, priority_sale_data ):
+def manage_authorized_not_refund( sale_id, sale, history_attributes, priority_sale_data, local_index ):
     """Logic for one item in the loop over sales that are not refunds and have status authorized.
 
     :param sale_id: The key of the loop, the Braintree sale ID.
     :param sale: The value for the loop, a Braintree sale.
     :param history_attributes: The history attributes for the sale.
-    :return:
+    :param priority_sale_data: Collect priority sale data ( inconsistencies with database ) for CSV.
+    :param local_index: The LocalIndex of the run.
+    :return: False if the sale could not be processed, and its SAVEPOINT should be rolled back.
     """
 
     # This is a sale and should definitely have a transaction in the database.
     try:
-        transaction_initial = TransactionModel.query.filter_by( reference_number=sale_id ) \
-            .filter_by( type='Gift' ) \
-            .filter_by( status='Completed' ).one_or_none()
+        transaction_initial = local_index.find_transaction( sale_id, 'Gift', 'Completed' )
 
         if not transaction_initial:
             priority_sale_data.append(
@@ -478,35 +1010,38 @@ def manage_authorized_not_refund( sale_id, sale, history_attributes, priority_sa
                     'Authorized in history without an initial transaction in database.'
                 )
             )
-            return
+            return True
 
         gift_id = transaction_initial.gift_id
         transaction_models = build_transactions(
-            sale, history_attributes, gift_id, sale.refunded_transaction_id
+            sale, history_attributes, gift_id, sale.refunded_transaction_id, local_index
         )
         database.session.bulk_save_objects( transaction_models )
+        database.session.flush()
+        local_index.add_transactions( transaction_models )
     except:  # noqa: E722
-        database.session.rollback()
         logging.debug(
             UpdaterCriticalPathError( where='manage_authorized_not_refund', type_id=sale_id ).message
         )
+        return False
+    return True
 
 
-def manage_not_authorized_refund( sale_id, sale, history_attributes, priority_sale_data ):
+def manage_not_authorized_refund( sale_id, sale, history_attributes, priority_sale_data, local_index ):
     """Logic for one item in the loop over sales that are refunds without authorized in the history.
 
     :param sale_id: The key of the loop, the Braintree sale ID.
     :param sale: The value for the loop, a Braintree sale.
     :param history_attributes: The history attributes for the sale.
-    :return:
+    :param priority_sale_data: Collect priority sale data ( inconsistencies with database ) for CSV.
+    :param local_index: The LocalIndex of the run.
+    :return: False if the sale could not be processed, and its SAVEPOINT should be rolled back.
     """
 
     # This is a refund and should have both a parent/refund transaction in the database.
     # If one doesn't exist back fill it.
     try:
-        transaction_parent = TransactionModel.query.filter_by( reference_number=sale.refunded_transaction_id ) \
-            .filter_by( type='Gift' ) \
-            .filter_by( status='Completed' ).one_or_none()
+        transaction_parent = local_index.find_transaction( sale.refunded_transaction_id, 'Gift', 'Completed' )
 
         if not transaction_parent:
             priority_sale_data.append(
@@ -516,22 +1051,25 @@ def manage_not_authorized_refund( sale_id, sale, history_attributes, priority_sa
                     'Refunded transaction without an initial parent transaction in database.'
                 )
             )
-            return
+            return True
 
         gift_id = transaction_parent.gift_id
         transaction_models = build_transactions(
-            sale, history_attributes, gift_id, sale.refunded_transaction_id
+            sale, history_attributes, gift_id, sale.refunded_transaction_id, local_index
         )
         database.session.bulk_save_objects( transaction_models )
+        database.session.flush()
+        local_index.add_transactions( transaction_models )
     except:  # noqa: E722
-        database.session.rollback()
         logging.debug(
             UpdaterCriticalPathError( where='manage_not_authorized_refund', type_id=sale_id ).message
         )
+        return False
+    return True
 
 
 def build_transactions(  # pylint: disable=too-many-locals
-        sale_or_dispute, history_attributes, gift_id, refunded_transaction_id
+        sale_or_dispute, history_attributes, gift_id, refunded_transaction_id, local_index
 ):
     """Given a sale or dispute, along with some other data build a transaction for the sale.
 
@@ -539,16 +1077,17 @@ def build_transactions(  # pylint: disable=too-many-locals
     :param history_attributes: The parsed history on the sale or dispute.
     :param gift_id: The gift ID the transaction is attached to.
     :param refunded_transaction_id: The parent ID to a refunded transaction.
+    :param local_index: The LocalIndex of the run.
     :return:
     """
 
     transaction_models = []
 
     is_dispute, history_attributes_sorted = get_sorted_history_attributes(
-        transaction_models, sale_or_dispute, history_attributes, gift_id
+        transaction_models, sale_or_dispute, history_attributes, gift_id, local_index
     )
 
-    total_amount = get_total_amount( gift_id )
+    total_amount = get_total_amount( gift_id, local_index )
 
     for status, timestamp in history_attributes_sorted.items():
         amount = Decimal( 0 )
@@ -572,9 +1111,7 @@ def build_transactions(  # pylint: disable=too-many-locals
         transaction_status = transaction_status_type[ 'status' ]
 
         # See if a transaction already exists.
-        transaction = TransactionModel.query.filter_by( reference_number=sale_or_dispute.id ) \
-            .filter_by( type=transaction_type ) \
-            .filter_by( status=transaction_status ).one_or_none()
+        transaction = local_index.find_transaction( sale_or_dispute.id, transaction_type, transaction_status )
 
         if not transaction:
 
@@ -604,13 +1141,14 @@ def build_transactions(  # pylint: disable=too-many-locals
     return transaction_models
 
 
-def get_sorted_history_attributes( transaction_models, sale_or_dispute, history_attributes, gift_id ):
+def get_sorted_history_attributes( transaction_models, sale_or_dispute, history_attributes, gift_id, local_index ):
     """Sort the history attributes and determine if a dispute or sale.
 
     :param transaction_models: The collected transaction_models.
     :param sale_or_dispute: The Braintree sale or dispute.
     :param history_attributes: The history attributes on the sale or dispute.
     :param gift_id: The gift ID.
+    :param local_index: The LocalIndex of the run.
     :return:
     """
 
@@ -618,7 +1156,7 @@ def get_sorted_history_attributes( transaction_models, sale_or_dispute, history_
     if 'dispute_history' in history_attributes:
         is_dispute = True
         # Before going on to updating the transactions on the gift make sure the chargeback fine is attached.
-        dispute_assess_fine( transaction_models, sale_or_dispute, history_attributes, gift_id )
+        dispute_assess_fine( transaction_models, sale_or_dispute, history_attributes, gift_id, local_index )
         history_attributes = history_attributes[ 'dispute_history' ]
     elif 'sale' in history_attributes:
         history_attributes = history_attributes[ 'sale' ]
@@ -627,27 +1165,20 @@ def get_sorted_history_attributes( transaction_models, sale_or_dispute, history_
     return is_dispute, history_attributes_sorted
 
 
-def get_total_amount( gift_id ):
+def get_total_amount( gift_id, local_index ):
     """Get the current total gross_gift_amount on the gift.
 
     :param gift_id: The gift ID.
+    :param local_index: The LocalIndex of the run.
     :return: Current total_amount on gift.
     """
 
-    # The current gross_gift_amount must be determined from the gift_id.
+    # The current gross_gift_amount is the balance of the gift, the gross_gift_amount of its latest transaction.
     # Remember that refunds and disputes are separate "transactions."
-    transactions = TransactionModel.query.filter_by( gift_id=gift_id ).all()
-    total_amount = Decimal( 0.00 )
-    if transactions:
-        the_date = None
-        for transaction in transactions:
-            if not the_date or transaction.date_in_utc > the_date:
-                the_date = transaction.date_in_utc
-                total_amount = Decimal( transaction.gross_gift_amount )
-    return total_amount
+    return local_index.get_balance( gift_id )
 
 
-def dispute_assess_fine( transaction_models, sale_or_dispute, history_attributes, gift_id ):
+def dispute_assess_fine( transaction_models, sale_or_dispute, history_attributes, gift_id, local_index ):
     """Build the transaction for the fine if the dispute is a chargeback.
 
     The history_status on a dispute does not contain information about fines. The Dispute kind ( dispute.kind )
@@ -660,12 +1191,11 @@ def dispute_assess_fine( transaction_models, sale_or_dispute, history_attributes
     :param sale_or_dispute: The dispute
     :param history_attributes: The history status
     :param gift_id: The gift_id associated with the Braintree reference number
+    :param local_index: The LocalIndex of the run.
     :return:
     """
     if history_attributes[ 'dispute_kind' ] == BRAINTREE_CHARGEBACK_TYPE:
-        transaction_for_fine = TransactionModel.query.filter_by( reference_number=sale_or_dispute.id ) \
-            .filter_by( type='Fine' ) \
-            .filter_by( status='Completed' ).one_or_none()
+        transaction_for_fine = local_index.find_transaction( sale_or_dispute.id, 'Fine', 'Completed' )
         if not transaction_for_fine:
             if 'open' in history_attributes[ 'dispute_history' ]:
                 date_in_utc = history_attributes[ 'dispute_history' ][ 'open' ].strftime( MODEL_DATE_STRING_FORMAT )
@@ -807,16 +1337,61 @@ def search_at( date0, date1, search_status_at, sales ):
     :param date1: Final date
     :param search_status_at: One from the list given above.
     :param sales: The sales found between those dates.
-    :return:
+    :return: The sales.
     """
 
     search_obj_at = getattr( braintree.TransactionSearch, search_status_at )
-    braintree_transactions = braintree.Transaction.search(
+    braintree_transactions = BRAINTREE_GATEWAY.transaction.search(
         search_obj_at.between( date0, date1 )
     )
     for braintree_transaction in braintree_transactions:
         if braintree_transaction.id not in sales:
             sales[ braintree_transaction.id ] = braintree_transaction
+    return sales
+
+
+def search_disputes( date0, date1 ):
+    """Returns a list of the disputes with an effective_date between the dates provided.
+
+    Disputes must be handled separately, partly because of how they are searched: effective_date of the event.
+    The format of the object returned is different then a sale is another reason to handle it separately.
+
+    :param date0: Initial date
+    :param date1: Final date
+    :return: The disputes.
+    """
+
+    braintree_disputes = BRAINTREE_GATEWAY.dispute.search(
+        braintree.DisputeSearch.status.in_list(
+            [
+                braintree.Dispute.Status.Accepted,
+                braintree.Dispute.Status.Disputed,
+                braintree.Dispute.Status.Expired,
+                braintree.Dispute.Status.Open,
+                braintree.Dispute.Status.Lost,
+                braintree.Dispute.Status.Won
+            ]
+        ),
+        braintree.DisputeSearch.effective_date.between( date0, date1 )
+    )
+    return list( braintree_disputes.disputes )
+
+
+def add_retry_disputes( disputes, dispute_ids ):
+    """Add the disputes that failed on earlier runs, found by their ID's, to the disputes of the search.
+
+    :param disputes: The disputes found by search_disputes().
+    :param dispute_ids: The ID's of the disputes to retry.
+    :return: The disputes.
+    """
+
+    found_dispute_ids = { dispute.id for dispute in disputes }
+    for dispute_id in sorted( dispute_ids - found_dispute_ids ):
+        try:
+            disputes.append( BRAINTREE_GATEWAY.dispute.find( dispute_id ) )
+        except braintree.exceptions.not_found_error.NotFoundError:
+            logging.warning( 'Braintree dispute %s to retry was not found.', dispute_id )
+    return disputes
 
 
 if __name__ == '__main__':
@@ -0,0 +1,30 @@
+"""Refill the pools of Braintree client tokens that the get-token endpoint pops from.
+
+python -c "import jobs.braintree_token_pool;jobs.braintree_token_pool.manage_braintree_token_pool()"
+"""
+import logging
+import os
+
+from application.app import create_app
+from application.helpers.braintree_token_pool import get_braintree_token_pool_statistics
+from application.helpers.braintree_token_pool import refill_braintree_token_pools
+
+# Check for how the application is being run and use that.
+# The environment variable is set in the Dockerfile.
+if 'APP_ENV' in os.environ:
+    app_config_env = os.environ[ 'APP_ENV' ]  # pylint: disable=invalid-name
+else:
+    app_config_env = 'DEFAULT'  # pylint: disable=invalid-name
+
+app = create_app( app_config_env )  # pylint: disable=C0103
+
+
+def manage_braintree_token_pool():
+    """A function to be called as a cron job to trim the expired tokens and fill the pools."""
+
+    with app.app_context():
+        refill_results = refill_braintree_token_pools()
+        logging.info(
+            'Braintree token pools refilled: %s, statistics: %s', refill_results, get_braintree_token_pool_statistics()
+        )
+        return refill_results
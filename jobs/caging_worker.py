@@ -0,0 +1,80 @@
+"""Run the RQ worker for caging with the application built once for the worker process.
+
+python -c "import jobs.caging_worker;jobs.caging_worker.run_caging_worker()"
+
+The per-job overhead of getting an application, before ( create_app() per job ) and after ( the worker's application
+context ), can be measured with:
+
+python -c "import jobs.caging_worker;jobs.caging_worker.measure_caging_job_overhead()"
+"""
+import logging
+import os
+import time
+
+from application.flask_essentials import redis_queue
+from application.worker import CagingWorker
+from application.worker import get_job_overhead_statistics
+from application.worker import get_worker_app
+from application.worker import worker_app_context
+
+# Check for how the application is being run and use that.
+# The environment variable is set in the Dockerfile.
+if 'APP_ENV' in os.environ:
+    app_config_env = os.environ[ 'APP_ENV' ]  # pylint: disable=invalid-name
+else:
+    app_config_env = 'DEFAULT'  # pylint: disable=invalid-name
+
+WORKER_TTL = 420
+
+
+def run_caging_worker( burst=False ):
+    """Build the application once and start a CagingWorker on the application's queues.
+
+    :param bool burst: Whether to quit when the queues are empty.
+    :return:
+    """
+
+    app = get_worker_app( app_config_env )
+    with app.app_context():
+        worker = CagingWorker(
+            redis_queue.queues,
+            connection=redis_queue.connection,
+            job_class=redis_queue.job_class,
+            default_worker_ttl=WORKER_TTL,
+            app=app
+        )
+        worker.work( burst=burst )
+        logging.info( 'Caging job overhead: %s', get_job_overhead_statistics() )
+
+
+def measure_caging_job_overhead( iterations=20 ):
+    """Report the mean and maximum seconds per job spent getting an application, before and after the worker mode.
+
+    :param int iterations: The number of jobs to simulate.
+    :return: A dictionary with the before and after statistics.
+    """
+
+    from application.app import create_app  # pylint: disable=cyclic-import
+
+    def summarize( timings ):
+        return { 'mean_seconds': sum( timings ) / len( timings ), 'maximum_seconds': max( timings ) }
+
+    # Before: every job built the application with create_app().
+    before = []
+    for _ in range( iterations ):
+        started = time.perf_counter()
+        app = create_app( app_config_env )
+        with app.app_context():
+            before.append( time.perf_counter() - started )
+
+    # After: the application is built once and each job pushes its context.
+    get_worker_app( app_config_env )
+    after = []
+    for _ in range( iterations ):
+        started = time.perf_counter()
+        with worker_app_context( app_config_env ):
+            after.append( time.perf_counter() - started )
+
+    report = { 'iterations': iterations, 'before': summarize( before ), 'after': summarize( after ) }
+    logging.warning( 'Caging job overhead: %s', report )
+    return report
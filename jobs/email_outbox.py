@@ -0,0 +1,28 @@
+"""Send the emails in the email outbox: receipts, thank you letters and statistics reports.
+
+python -c "import jobs.email_outbox;jobs.email_outbox.manage_email_outbox()"
+"""
+import logging
+import os
+
+from application.app import create_app
+from application.helpers.email_outbox import dispatch_email_outbox
+from application.helpers.email_outbox import get_email_outbox_statistics
+
+# Check for how the application is being run and use that.
+# The environment variable is set in the Dockerfile.
+if 'APP_ENV' in os.environ:
+    app_config_env = os.environ[ 'APP_ENV' ]  # pylint: disable=invalid-name
+else:
+    app_config_env = 'DEFAULT'  # pylint: disable=invalid-name
+
+app = create_app( app_config_env )  # pylint: disable=C0103
+
+
+def manage_email_outbox():
+    """A function to be called as a cron job to send the due emails in the outbox."""
+
+    with app.app_context():
+        dispatch_results = dispatch_email_outbox()
+        logging.info( 'Email outbox dispatched: %s, outbox: %s', dispatch_results, get_email_outbox_statistics() )
+        return dispatch_results
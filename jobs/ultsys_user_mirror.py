@@ -0,0 +1,57 @@
+"""Incrementally synchronize the local Ultsys user mirror, the user table, used by caging.
+
+python -c "import jobs.ultsys_user_mirror;jobs.ultsys_user_mirror.manage_ultsys_user_mirror()"
+
+To resynchronize every user on the mirror, picking up the changes of name, address and email:
+
+python -c "import jobs.ultsys_user_mirror;jobs.ultsys_user_mirror.manage_ultsys_user_mirror_resync()"
+
+To build the caging blocking index for the users already on the mirror:
+
+python -c "import jobs.ultsys_user_mirror;jobs.ultsys_user_mirror.rebuild_caging_block_index()"
+"""
+import logging
+import os
+
+from application.app import create_app
+from application.helpers.caging_blocks import rebuild_caging_blocks
+from application.helpers.ultsys_user_mirror import get_mirror_staleness
+from application.helpers.ultsys_user_mirror import resync_ultsys_user_mirror
+from application.helpers.ultsys_user_mirror import sync_ultsys_user_mirror
+
+# Check for how the application is being run and use that.
+# The environment variable is set in the Dockerfile.
+if 'APP_ENV' in os.environ:
+    app_config_env = os.environ[ 'APP_ENV' ]  # pylint: disable=invalid-name
+else:
+    app_config_env = 'DEFAULT'  # pylint: disable=invalid-name
+
+app = create_app( app_config_env )  # pylint: disable=C0103
+
+
+def manage_ultsys_user_mirror():
+    """A function to be called as a cron job to bring the mirror up to date with the Ultsys user service."""
+
+    with app.app_context():
+        logging.info( 'Ultsys user mirror staleness before synchronization: %s', get_mirror_staleness() )
+        sync_results = sync_ultsys_user_mirror()
+        logging.info( 'Ultsys user mirror synchronized: %s', sync_results )
+        return sync_results
+
+
+def manage_ultsys_user_mirror_resync():
+    """A function to be called as a daily cron job to resynchronize every user on the mirror."""
+
+    with app.app_context():
+        resync_results = resync_ultsys_user_mirror()
+        logging.info( 'Ultsys user mirror resynchronized: %s', resync_results )
+        return resync_results
+
+
+def rebuild_caging_block_index():
+    """A function to rebuild the caging blocking index from every user on the mirror, e.g. after a first load."""
+
+    with app.app_context():
+        indexed = rebuild_caging_blocks()
+        logging.info( 'Caging blocking index rebuilt for %s users.', indexed )
+        return indexed
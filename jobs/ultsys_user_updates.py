@@ -0,0 +1,55 @@
+"""Flush the write-behind buffer of the donation amounts sent to the Ultsys user service, and reconcile it.
+
+python -c "import jobs.ultsys_user_updates;jobs.ultsys_user_updates.manage_ultsys_user_updates()"
+python -c "import jobs.ultsys_user_updates;jobs.ultsys_user_updates.reconcile_ultsys_user_updates()"
+
+To make the failed updates due again once the user service is fixed:
+
+python -c "import jobs.ultsys_user_updates;jobs.ultsys_user_updates.retry_failed_updates()"
+"""
+import logging
+import os
+
+from application.app import create_app
+from application.helpers.ultsys_user_updates import flush_ultsys_user_updates
+from application.helpers.ultsys_user_updates import get_ultsys_user_update_report
+from application.helpers.ultsys_user_updates import retry_failed_ultsys_user_updates
+
+# Check for how the application is being run and use that.
+# The environment variable is set in the Dockerfile.
+if 'APP_ENV' in os.environ:
+    app_config_env = os.environ[ 'APP_ENV' ]  # pylint: disable=invalid-name
+else:
+    app_config_env = 'DEFAULT'  # pylint: disable=invalid-name
+
+app = create_app( app_config_env )  # pylint: disable=C0103
+
+
+def manage_ultsys_user_updates():
+    """A function to be called as a cron job to send the donation amounts in the buffer."""
+
+    with app.app_context():
+        flush_results = flush_ultsys_user_updates()
+        logging.info( 'Ultsys user updates flushed: %s', flush_results )
+        return flush_results
+
+
+def reconcile_ultsys_user_updates():
+    """A function to be called as a cron job to report the buffer by status, and the updates that failed."""
+
+    with app.app_context():
+        report = get_ultsys_user_update_report()
+        if report[ 'failed' ]:
+            logging.warning( 'Ultsys user updates failed for %s users: %s', len( report[ 'failed' ] ), report )
+        else:
+            logging.info( 'Ultsys user updates reconciled: %s', report )
+        return report
+
+
+def retry_failed_updates( user_ids=None ):
+    """A function to make the failed updates due again, for all users or those given."""
+
+    with app.app_context():
+        retried = retry_failed_ultsys_user_updates( user_ids )
+        logging.info( 'Ultsys user updates made due again: %s', retried )
+        return retried
@@ -18,7 +18,7 @@ from application.app import create_app
 from application.flask_essentials import database
 from application.helpers.braintree_api import init_braintree_credentials
 from application.helpers.model_serialization import from_json
-from application.models.agent import AgentModel
+from application.helpers.reference_data import find_agent
 from application.models.transaction import TransactionModel
 from application.schemas.gift import GiftSchema
 from application.schemas.transaction import TransactionSchema
@@ -50,7 +50,7 @@ MERCHANT_ID_GIVEN_TO = {
 
 # Get the Agent ID from the model for type Automated:
 with app.app_context():
-    AGENT_MODEL = AgentModel.get_agent( 'Automated', 'type', 'Automated' )  # pylint: disable=invalid-name
+    AGENT_MODEL = find_agent( 'Automated', 'type', 'Automated' )  # pylint: disable=invalid-name
     AGENT_ID = str( AGENT_MODEL.id )
 
 
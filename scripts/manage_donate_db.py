@@ -7,6 +7,7 @@ command line type:
 python -c "import scripts.manage_donate_db;scripts.manage_donate_db.drop_all_and_create()"
 python -c "import scripts.manage_donate_db;scripts.manage_donate_db.create_database_tables()"
 python -c "import scripts.manage_donate_db;scripts.manage_donate_db.create_gift_and_transaction()"
+python -c "import scripts.manage_donate_db;scripts.manage_donate_db.backfill_caged_donor_streets()"
 """
 import uuid
 from datetime import datetime
@@ -15,6 +16,8 @@ from decimal import Decimal
 
 from application.app import create_app
 from application.flask_essentials import database
+from application.helpers.caging import backfill_caged_donor_streets as backfill_streets
+from application.helpers.reference_data import invalidate_reference_data
 from application.schemas.agent import AgentSchema
 from application.schemas.gift import GiftSchema
 from application.schemas.transaction import TransactionSchema
@@ -100,6 +103,7 @@ def create_database_tables():
         # database.session.bulk_save_objects( agents )
 
         database.session.commit()
+        invalidate_reference_data()
 
 
 def create_agent_table():
@@ -126,6 +130,7 @@ def create_agent_table():
         database.session.bulk_save_objects( agents )
 
         database.session.commit()
+        invalidate_reference_data()
 
 
 def create_gift_and_transaction():
@@ -177,3 +182,17 @@ def create_gift_and_transaction():
                 database.session.add( transaction_model )
 
         database.session.commit()
+
+
+def backfill_caged_donor_streets():
+    """A function to fill in the normalized street of existing caged donors, used by the caged donor check.
+
+    Add the column and index first:
+
+        ALTER TABLE caged_donor ADD COLUMN user_street varchar(255) DEFAULT NULL,
+            ADD KEY ix_caged_donor_caging (user_last_name, user_first_name, user_zipcode, user_street);
+    """
+
+    with app.app_context():
+        updated = backfill_streets()
+        print( 'Caged donors updated: {}'.format( updated ) )
@@ -11,6 +11,7 @@ import uuid
 
 from application.app import create_app
 from application.flask_essentials import database
+from application.helpers.reference_data import invalidate_reference_data
 from application.schemas.agent import AgentSchema
 from application.schemas.caged_donor import CagedDonorSchema
 from application.schemas.queued_donor import QueuedDonorSchema
@@ -82,3 +83,4 @@ def create_database_tables():
         database.session.bulk_save_objects( agents )
 
         database.session.commit()
+        invalidate_reference_data()
@@ -7,6 +7,16 @@ CREATE TABLE `agent` (
   PRIMARY KEY (`id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=19 DEFAULT CHARSET=utf8mb4;
 
+CREATE TABLE `braintree_dispute_retry` (
+  `dispute_id` varchar(64) NOT NULL,
+  `status` varchar(7) NOT NULL DEFAULT 'pending',
+  `attempts` int(11) NOT NULL DEFAULT '0',
+  `created_in_utc` datetime NOT NULL,
+  `last_attempt_in_utc` datetime DEFAULT NULL,
+  PRIMARY KEY (`dispute_id`),
+  KEY `ix_braintree_dispute_retry_status` (`status`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
 CREATE TABLE `caged_donor` (
   `id` int(10) NOT NULL AUTO_INCREMENT,
   `gift_id` int(10) unsigned DEFAULT NULL,
@@ -22,9 +32,20 @@ CREATE TABLE `caged_donor` (
   `user_zipcode` varchar(5) DEFAULT NULL,
   `user_phone_number` bigint(10) unsigned DEFAULT '0',
   `times_viewed` smallint(5) unsigned DEFAULT NULL,
-  PRIMARY KEY (`id`)
+  `user_street` varchar(255) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `ix_caged_donor_caging` (`user_last_name`,`user_first_name`,`user_zipcode`,`user_street`)
 ) ENGINE=InnoDB AUTO_INCREMENT=2 DEFAULT CHARSET=utf8mb4;
 
+CREATE TABLE `caging_block` (
+  `id` int(10) NOT NULL AUTO_INCREMENT,
+  `block_key` varchar(320) NOT NULL,
+  `user_id` int(11) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `ix_caging_block_block_key` (`block_key`),
+  KEY `ix_caging_block_user_id` (`user_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
 CREATE TABLE `campaign` (
   `id` int(10) unsigned NOT NULL AUTO_INCREMENT,
   `name` varchar(80) DEFAULT NULL,
@@ -49,6 +70,21 @@ CREATE TABLE `campaign_amounts` (
   PRIMARY KEY (`id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=3 DEFAULT CHARSET=utf8mb4;
 
+CREATE TABLE `email_outbox` (
+  `id` int(10) NOT NULL AUTO_INCREMENT,
+  `email_type` varchar(10) NOT NULL,
+  `transaction_id` int(10) DEFAULT NULL,
+  `payload` text NOT NULL,
+  `status` varchar(7) NOT NULL DEFAULT 'pending',
+  `attempts` int(11) NOT NULL DEFAULT '0',
+  `next_attempt_in_utc` datetime NOT NULL,
+  `created_in_utc` datetime NOT NULL,
+  `sent_in_utc` datetime DEFAULT NULL,
+  `last_error` varchar(255) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `ix_email_outbox_dispatch` (`status`,`next_attempt_in_utc`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
 CREATE TABLE `gift` (
   `id` int(10) unsigned NOT NULL AUTO_INCREMENT,
   `searchable_id` binary(16) DEFAULT NULL,
@@ -59,7 +95,8 @@ CREATE TABLE `gift` (
   `sourced_from_agent_id` smallint(5) unsigned DEFAULT NULL,
   `given_to` enum('ABI','ACTION','BECK','GREEN','INTER','MCRI','NERF','P-USA','PROD','UNRES','VIDEO','TBD','SUPPORT') NOT NULL DEFAULT 'ACTION',
   `recurring_subscription_id` varchar(32) DEFAULT NULL,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  KEY `ix_gift_searchable_id` (`searchable_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=2 DEFAULT CHARSET=utf8mb4;
 
 CREATE TABLE `gift_thank_you_letter` (
@@ -98,9 +135,19 @@ CREATE TABLE `queued_donor` (
   `user_zipcode` varchar(5) DEFAULT NULL,
   `user_phone_number` bigint(10) unsigned DEFAULT '0',
   `times_viewed` smallint(5) unsigned DEFAULT NULL,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  KEY `ix_queued_donor_gift_id` (`gift_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=2 DEFAULT CHARSET=utf8mb4;
 
+CREATE TABLE `sync_state` (
+  `name` varchar(64) NOT NULL,
+  `watermark_id` int(11) DEFAULT NULL,
+  `watermark_in_utc` datetime DEFAULT NULL,
+  `last_synced_in_utc` datetime DEFAULT NULL,
+  `rows_synced` int(11) DEFAULT '0',
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
 CREATE TABLE `transaction` (
   `id` int(10) unsigned NOT NULL AUTO_INCREMENT,
   `gift_id` int(10) unsigned NOT NULL,
@@ -113,9 +160,27 @@ CREATE TABLE `transaction` (
   `gross_gift_amount` decimal(10,2) NOT NULL,
   `fee` decimal(8,2) NOT NULL,
   `notes` text,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  KEY `ix_transaction_gift_id` (`gift_id`),
+  KEY `ix_transaction_gift_id_date_in_utc` (`gift_id`,`date_in_utc`)
 ) ENGINE=InnoDB AUTO_INCREMENT=2 DEFAULT CHARSET=utf8mb4;
 
+CREATE TABLE `ultsys_user_update` (
+  `id` int(10) NOT NULL AUTO_INCREMENT,
+  `user_id` int(10) NOT NULL,
+  `gift_id` int(10) DEFAULT NULL,
+  `donation_amount` decimal(10,2) NOT NULL,
+  `status` varchar(7) NOT NULL DEFAULT 'pending',
+  `attempts` int(11) NOT NULL DEFAULT '0',
+  `next_attempt_in_utc` datetime NOT NULL,
+  `created_in_utc` datetime NOT NULL,
+  `sent_in_utc` datetime DEFAULT NULL,
+  `last_error` varchar(255) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `ix_ultsys_user_update_flush` (`status`,`next_attempt_in_utc`),
+  KEY `ix_ultsys_user_update_user_id` (`user_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
 CREATE TABLE `unresolved_paypal_etl_transaction` (
   `id` int(10) unsigned NOT NULL AUTO_INCREMENT,
   `enacted_by_agent_id` smallint(5) unsigned DEFAULT NULL,
@@ -149,5 +214,9 @@ CREATE TABLE `user` (
   `donation_sum` varchar(255) DEFAULT NULL,
   `donation_time` datetime DEFAULT NULL,
   `uid` int(11) DEFAULT NULL,
-  PRIMARY KEY (`ID`)
+  PRIMARY KEY (`ID`),
+  KEY `ix_user_email` (`email`),
+  KEY `ix_user_lastname` (`lastname`),
+  KEY `ix_user_zip` (`zip`),
+  KEY `ix_user_phone` (`phone`)
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
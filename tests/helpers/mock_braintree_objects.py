@@ -181,10 +181,10 @@ MockObjects.PAYMENT_METHOD_CREATE_SUCCESSFUL = mock.Mock(
 )
 
 
-def mock_init_braintree_gateway( current_app ):  # pylint: disable=unused-argument
-    """This is the function that mocks the init_braintree_gateway function.
+def mock_get_braintree_gateway( current_app ):  # pylint: disable=unused-argument
+    """This is the function that mocks the get_braintree_gateway function.
 
-    :param current_app: The current_app ( appears in the mocked function init_braintree_gateway() )
+    :param current_app: The current_app ( appears in the mocked function get_braintree_gateway() )
     :return:
     """
     class Transaction:
@@ -229,16 +229,6 @@ def mock_init_braintree_gateway( current_app ):  # pylint: disable=unused-argume
     return Gateway()
 
 
-def mock_init_braintree_credentials( current_app ):  # pylint: disable=unused-argument
-    """This is the function that mocks the init_braintree_credentials function.
-
-    :param current_app: The current_app
-    :return:
-    """
-
-    return
-
-
 def mock_generate_braintree_token():
     """Will mock getting a Braintree token for a transaction.
     :return: Braintree generated token.
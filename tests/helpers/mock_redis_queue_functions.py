@@ -1,4 +1,6 @@
 """Mock redis queue for functions using it in the code."""
+import time
+
 from application.helpers.caging import redis_queue_caging
 # pylint: disable=too-few-public-methods
 
@@ -38,3 +40,179 @@ def mock_caging( user, transaction, environment ):
     job = Job( 'redis-queue-job-id', 'queued' )
 
     return job
+
+
+class MockRedisConnection:
+    """An in-memory stand-in for the Redis commands used on redis_queue.connection: strings, counters, sets, lists,
+    hashes and pipelines. A key set with a time to live expires by time.time(), so that tests can move the clock.
+    """
+
+    def __init__( self ):
+        self.data = {}
+        self.expires = {}
+
+    def expire_key( self, key ):
+        """Drop the key if its time to live has passed."""
+
+        if key in self.expires and self.expires[ key ] <= time.time():
+            self.data.pop( key, None )
+            self.expires.pop( key )
+
+    def set( self, key, value, nx=False, ex=None ):  # pylint: disable=invalid-name
+        """Set the key, or only if it does not exist with nx=True, and expire it after ex seconds.
+
+        :return: True if the key was set, and otherwise None as Redis returns.
+        """
+
+        self.expire_key( key )
+        if nx and key in self.data:
+            return None
+        self.data[ key ] = value.encode( 'utf-8' ) if isinstance( value, str ) else value
+        if ex:
+            self.expires[ key ] = time.time() + ex
+        else:
+            self.expires.pop( key, None )
+        return True
+
+    def setex( self, key, ttl, value ):
+        """Set the key to expire after ttl seconds."""
+
+        return self.set( key, value, ex=ttl )
+
+    def get( self, key ):
+        """The value of the key as bytes, or None."""
+
+        self.expire_key( key )
+        return self.data.get( key )
+
+    def delete( self, *keys ):
+        """Delete the keys, given as strings or bytes.
+
+        :return: The number of keys deleted.
+        """
+
+        deleted = 0
+        for key in keys:
+            key = key.decode( 'utf-8' ) if isinstance( key, bytes ) else key
+            self.expires.pop( key, None )
+            if self.data.pop( key, None ) is not None:
+                deleted += 1
+        return deleted
+
+    def expire( self, key, ttl ):
+        """Expire an existing key after ttl seconds."""
+
+        self.expire_key( key )
+        if key not in self.data:
+            return False
+        self.expires[ key ] = time.time() + ttl
+        return True
+
+    def incr( self, key ):
+        """Increment the counter by one."""
+
+        return self.incrby( key, 1 )
+
+    def incrby( self, key, amount ):
+        """Increment the counter by the amount, from 0 if it does not exist."""
+
+        value = int( self.get( key ) or 0 ) + amount
+        self.data[ key ] = str( value ).encode( 'utf-8' )
+        return value
+
+    def sadd( self, key, *members ):
+        """Add the members to the set."""
+
+        self.expire_key( key )
+        self.data.setdefault( key, set() ).update(
+            member.encode( 'utf-8' ) if isinstance( member, str ) else member for member in members
+        )
+
+    def smembers( self, key ):
+        """The members of the set as bytes."""
+
+        self.expire_key( key )
+        return set( self.data.get( key, set() ) )
+
+    def rpush( self, key, *values ):
+        """Push the values onto the end of the list.
+
+        :return: The length of the list.
+        """
+
+        self.expire_key( key )
+        values = [ value.encode( 'utf-8' ) if isinstance( value, str ) else value for value in values ]
+        self.data.setdefault( key, [] ).extend( values )
+        return len( self.data[ key ] )
+
+    def lpop( self, key ):
+        """Pop the first value of the list, or None if it is empty."""
+
+        self.expire_key( key )
+        values = self.data.get( key )
+        if not values:
+            return None
+        value = values.pop( 0 )
+        if not values:
+            del self.data[ key ]
+        return value
+
+    def lindex( self, key, index ):
+        """The value at the index of the list, or None."""
+
+        self.expire_key( key )
+        values = self.data.get( key, [] )
+        return values[ index ] if -len( values ) <= index < len( values ) else None
+
+    def llen( self, key ):
+        """The length of the list."""
+
+        self.expire_key( key )
+        return len( self.data.get( key, [] ) )
+
+    def hincrby( self, key, field, amount ):
+        """Increment the field of the hash by the amount, from 0 if it does not exist."""
+
+        self.expire_key( key )
+        fields = self.data.setdefault( key, {} )
+        field = field.encode( 'utf-8' ) if isinstance( field, str ) else field
+        value = int( fields.get( field, 0 ) ) + amount
+        fields[ field ] = str( value ).encode( 'utf-8' )
+        return value
+
+    def hgetall( self, key ):
+        """The fields and values of the hash as bytes."""
+
+        self.expire_key( key )
+        return dict( self.data.get( key, {} ) )
+
+    def pipeline( self ):
+        """A pipeline that runs its commands on execute()."""
+
+        return MockRedisPipeline( self )
+
+
+class MockRedisPipeline:
+    """Queues the commands of a pipeline and runs them on the connection on execute()."""
+
+    def __init__( self, connection ):
+        self.connection = connection
+        self.commands = []
+
+    def __getattr__( self, name ):
+        command = getattr( self.connection, name )
+
+        def queue_command( *args, **kwargs ):
+            self.commands.append( ( command, args, kwargs ) )
+            return self
+        return queue_command
+
+    def execute( self ):
+        """Run the queued commands.
+
+        :return: The list of their results.
+        """
+
+        results = [ command( *args, **kwargs ) for command, args, kwargs in self.commands ]
+        self.commands = []
+        return results
@@ -36,8 +36,8 @@ def get_ultsys_user( search_terms ):
     """The mocked function helpers.ultsys_user.get_ultsys_user.
 
     The function get_ultsys_user() makes a request.get() that returns user data based on search terms. The mocked
-    function accepts only the search operator 'eq' and does not do chained searches. The argument to the function
-    is a dictionary called search_terms:
+    function accepts only the search operators 'eq' and 'in', and does not do chained searches. The argument to the
+    function is a dictionary called search_terms:
 
     "search_terms": {
             "id": {"eq": "3239868"}
@@ -50,6 +50,13 @@ def get_ultsys_user( search_terms ):
     """
 
     attribute = list( search_terms.copy().keys() )[ 0 ]
+
+    # The bulk search, find_ultsys_users(), uses the 'in' operator on ID or email.
+    if 'in' in search_terms[ attribute ]:
+        column = getattr( UltsysUserModel, attribute )
+        users_model_data = UltsysUserModel.query.filter( column.in_( search_terms[ attribute ][ 'in' ] ) ).all()
+        return Request( [ to_json( UltsysUserSchema(), user_model ).data for user_model in users_model_data ] )
+
     attribute_value = search_terms[ attribute ][ 'eq' ]
 
     # The mock function doesn't have to handle the complete functionality of the endpoint.
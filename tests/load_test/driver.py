@@ -0,0 +1,242 @@
+"""Drive the load test application with a concurrency sweep and report the throughput, latency and SQL statements.
+
+python -m tests.load_test.driver
+LOAD_TEST_SCENARIOS=donation,get_token LOAD_TEST_CONCURRENCY=1,10,50 python -m tests.load_test.driver
+
+Unless LOAD_TEST_URL is set the driver starts gunicorn with the gevent worker on tests.load_test.wsgi, waits for the
+heartbeat, and stops it at the end. For each scenario and each level of concurrency it sends LOAD_TEST_REQUESTS
+requests from as many concurrent clients, and reports:
+
+    1. The requests a second, and the number that did not return a 2xx status.
+    2. The p50, p95 and p99 latency in milliseconds.
+    3. The mean and maximum SQL statements per request, from the X-Statement-Count header set by the application.
+
+Configuration in environment variables:
+
+    LOAD_TEST_URL: The root URL of an application that is already running, e.g. http://127.0.0.1:8000.
+    LOAD_TEST_PORT: The port gunicorn is started on ( default 8000 ).
+    LOAD_TEST_GUNICORN_WORKERS: The gunicorn workers started ( default 2 ).
+    LOAD_TEST_SCENARIOS: The scenarios to run ( default all ): donation, get_token, gifts, transactions_by_gift
+        and dashboard.
+    LOAD_TEST_CONCURRENCY: The levels of concurrency ( default 1,5,10,25,50 ).
+    LOAD_TEST_REQUESTS: The requests sent at each level ( default 200 ).
+
+The latencies of the stand-ins for Braintree and Ultsys are set in fake_services.py, and the database is seeded by
+seed_database.py.
+"""
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from tests.helpers.default_dictionaries import get_donate_dict
+from tests.helpers.default_dictionaries import get_new_donor_dict
+from tests.helpers.mock_jwt_functions import ACCESS_TOKEN
+
+DEFAULT_PORT = 8000
+DEFAULT_GUNICORN_WORKERS = 2
+DEFAULT_CONCURRENCY = '1,5,10,25,50'
+DEFAULT_REQUESTS = 200
+STARTUP_TIMEOUT = 30
+
+STATEMENT_COUNT_HEADER = 'X-Statement-Count'
+HEADERS = { 'Authorization': 'Bearer {}'.format( ACCESS_TOKEN ), 'content-type': 'application/json' }
+
+
+def get_scenarios( searchable_ids ):
+    """The requests of each scenario: a function that returns the method, path and payload of the next request.
+
+    :param searchable_ids: The gift searchable ID's for the TransactionsByGift endpoint.
+    :return: A dictionary of the scenarios keyed by name.
+    """
+
+    return {
+        'donation': lambda index: (
+            'post',
+            '/donation/donate',
+            get_donate_dict( { 'user': get_new_donor_dict(), 'recurring_subscription': False } )
+        ),
+        'get_token': lambda index: ( 'get', '/donation/braintree/get-token', None ),
+        'gifts': lambda index: ( 'get', '/donation/gifts', None ),
+        'transactions_by_gift': lambda index: (
+            'get',
+            '/donation/gifts/{}/transactions'.format( searchable_ids[ index % len( searchable_ids ) ] ),
+            None
+        ),
+        'dashboard': lambda index: ( 'get', '/donation/dashboard/summary', None )
+    }
+
+
+def start_gunicorn( port, workers ):
+    """Start gunicorn with the gevent worker on the load test application, and wait for the heartbeat.
+
+    :param int port: The port to bind to.
+    :param int workers: The number of workers.
+    :return: The gunicorn process and the root URL.
+    """
+
+    process = subprocess.Popen( [
+        sys.executable, '-m', 'gunicorn',
+        '-k', 'gevent',
+        '-w', str( workers ),
+        '-b', '127.0.0.1:{}'.format( port ),
+        '-t', '120',
+        'tests.load_test.wsgi:load_test_app'
+    ] )
+    url = 'http://127.0.0.1:{}'.format( port )
+
+    started = time.monotonic()
+    while time.monotonic() - started < STARTUP_TIMEOUT:
+        try:
+            if requests.get( '{}/donation/heartbeat'.format( url ), timeout=1 ).status_code == 200:
+                return process, url
+        except requests.exceptions.ConnectionError:
+            pass
+        if process.poll() is not None:
+            break
+        time.sleep( 0.5 )
+
+    process.terminate()
+    raise RuntimeError( 'gunicorn did not start on port {}.'.format( port ) )
+
+
+def send_request( session, url, request ):
+    """Send a request and time it.
+
+    :param session: The requests session of the client.
+    :param str url: The root URL.
+    :param request: The method, path and payload.
+    :return: The latency in seconds, whether it succeeded, and the statement count.
+    """
+
+    method, path, payload = request
+    started = time.perf_counter()
+    try:
+        response = session.request(
+            method, url + path, headers=HEADERS, data=json.dumps( payload ) if payload else None, timeout=120
+        )
+    except requests.exceptions.RequestException:
+        return time.perf_counter() - started, False, None
+    latency = time.perf_counter() - started
+
+    statement_count = response.headers.get( STATEMENT_COUNT_HEADER )
+    return latency, 200 <= response.status_code < 300, int( statement_count ) if statement_count else None
+
+
+def run_level( url, scenario, concurrency, total_requests ):
+    """Send the requests of a scenario from concurrent clients, each on its own session.
+
+    :param str url: The root URL.
+    :param scenario: The function that returns the next request.
+    :param int concurrency: The number of concurrent clients.
+    :param int total_requests: The number of requests.
+    :return: A dictionary of the measurements.
+    """
+
+    def client( client_index ):
+        session = requests.Session()
+        return [
+            send_request( session, url, scenario( index ) )
+            for index in range( client_index, total_requests, concurrency )
+        ]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor( max_workers=concurrency ) as executor:
+        samples = [ sample for samples in executor.map( client, range( concurrency ) ) for sample in samples ]
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted( latency for latency, _, _ in samples )
+    statement_counts = [ count for _, _, count in samples if count is not None ]
+    return {
+        'concurrency': concurrency,
+        'requests': len( samples ),
+        'errors': len( [ succeeded for _, succeeded, _ in samples if not succeeded ] ),
+        'throughput': len( samples ) / elapsed,
+        'p50': percentile( latencies, 50 ),
+        'p95': percentile( latencies, 95 ),
+        'p99': percentile( latencies, 99 ),
+        'statements_mean': sum( statement_counts ) / len( statement_counts ) if statement_counts else None,
+        'statements_max': max( statement_counts ) if statement_counts else None
+    }
+
+
+def percentile( sorted_values, rank ):
+    """The nearest-rank percentile, in milliseconds, of values sorted in ascending order."""
+
+    if not sorted_values:
+        return None
+    index = max( 0, math.ceil( rank / 100.0 * len( sorted_values ) ) - 1 )
+    return sorted_values[ index ] * 1000.0
+
+
+def get_searchable_ids( url ):
+    """The searchable ID's of the seeded gifts, for the TransactionsByGift scenario."""
+
+    response = requests.get( '{}/donation/gifts'.format( url ), headers=HEADERS, timeout=120 )
+    return [ gift[ 'searchable_id' ] for gift in response.json() ] or [ '00000000-0000-0000-0000-000000000000' ]
+
+
+def print_report( scenario_name, levels ):
+    """Print a table of the measurements of a scenario."""
+
+    print( '\n{}'.format( scenario_name ) )
+    print( '{:>11} {:>8} {:>6} {:>9} {:>9} {:>9} {:>9} {:>10} {:>9}'.format(
+        'concurrency', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'stmts/req', 'max stmts'
+    ) )
+    for level in levels:
+        print( '{:>11} {:>8} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>10} {:>9}'.format(
+            level[ 'concurrency' ],
+            level[ 'requests' ],
+            level[ 'errors' ],
+            level[ 'throughput' ],
+            level[ 'p50' ],
+            level[ 'p95' ],
+            level[ 'p99' ],
+            '-' if level[ 'statements_mean' ] is None else '{:.1f}'.format( level[ 'statements_mean' ] ),
+            '-' if level[ 'statements_max' ] is None else level[ 'statements_max' ]
+        ) )
+
+
+def run_load_test():
+    """Run the concurrency sweep for each scenario and print the report.
+
+    :return: A dictionary of the measurements at each level, keyed by scenario.
+    """
+
+    process = None
+    url = os.environ.get( 'LOAD_TEST_URL' )
+    if not url:
+        process, url = start_gunicorn(
+            int( os.environ.get( 'LOAD_TEST_PORT' ) or DEFAULT_PORT ),
+            int( os.environ.get( 'LOAD_TEST_GUNICORN_WORKERS' ) or DEFAULT_GUNICORN_WORKERS )
+        )
+
+    try:
+        scenarios = get_scenarios( get_searchable_ids( url ) )
+        scenario_names = [ name for name in ( os.environ.get( 'LOAD_TEST_SCENARIOS' ) or '' ).split( ',' ) if name ]
+        concurrency_levels = [
+            int( level ) for level in ( os.environ.get( 'LOAD_TEST_CONCURRENCY' ) or DEFAULT_CONCURRENCY ).split( ',' )
+        ]
+        total_requests = int( os.environ.get( 'LOAD_TEST_REQUESTS' ) or DEFAULT_REQUESTS )
+
+        report = {}
+        for scenario_name in scenario_names or list( scenarios ):
+            report[ scenario_name ] = [
+                run_level( url, scenarios[ scenario_name ], concurrency, max( total_requests, concurrency ) )
+                for concurrency in concurrency_levels
+            ]
+            print_report( scenario_name, report[ scenario_name ] )
+        return report
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    run_load_test()
@@ -0,0 +1,125 @@
+"""Local stand-ins for Braintree and the Ultsys user service, with configurable latency, for the load test.
+
+The stand-ins patch the same functions the unit tests mock, and return the same objects:
+
+    1. Braintree: the customer, sale, subscription, payment method and client token calls of the gateway return the
+       objects in tests/helpers/mock_braintree_objects.py.
+    2. Ultsys: the search, create and update calls use tests/helpers/mock_ultsys_functions.py, which work on the user
+       table of the load test database.
+    3. Caging: the donor is not caged in the request, and the job is not queued, since caging runs on the worker.
+
+Each call sleeps for its latency first. Under the gevent worker the sleep is monkey patched and yields, as a call
+waiting on the network would. The latencies are set in environment variables, in seconds:
+
+    LOAD_TEST_BRAINTREE_LATENCY: The latency of a Braintree call ( default 0.3 ).
+    LOAD_TEST_ULTSYS_LATENCY: The latency of an Ultsys call ( default 0.1 ).
+    LOAD_TEST_LATENCY_JITTER: A fraction of the latency added or taken away at random ( default 0.2 ).
+"""
+import os
+import random
+import time
+
+import mock
+
+from tests.helpers.mock_braintree_objects import mock_generate_braintree_token
+from tests.helpers.mock_braintree_objects import MockObjects
+from tests.helpers.mock_redis_queue_functions import Job
+from tests.helpers.mock_ultsys_functions import create_user
+from tests.helpers.mock_ultsys_functions import get_ultsys_user
+from tests.helpers.mock_ultsys_functions import update_ultsys_user
+
+DEFAULT_BRAINTREE_LATENCY = 0.3
+DEFAULT_ULTSYS_LATENCY = 0.1
+DEFAULT_LATENCY_JITTER = 0.2
+
+
+def get_latency( name, default ):
+    """Get a latency from the environment and fall back to the default if it is missing or empty."""
+
+    value = os.environ.get( 'LOAD_TEST_{}'.format( name ) )
+    if value is None or value == '':
+        return default
+    return float( value )
+
+
+def with_latency( function, latency ):
+    """Wrap a function so that each call sleeps for the latency, with jitter, before it is made.
+
+    :param function: The function to wrap.
+    :param float latency: The latency in seconds.
+    :return: The wrapped function.
+    """
+
+    jitter = get_latency( 'LATENCY_JITTER', DEFAULT_LATENCY_JITTER )
+
+    def call_with_latency( *args, **kwargs ):
+        time.sleep( max( 0.0, latency * ( 1.0 + random.uniform( -jitter, jitter ) ) ) )
+        return function( *args, **kwargs )
+
+    return call_with_latency
+
+
+def returns( result ):
+    """A function that takes any arguments and returns the result, for a Braintree call."""
+
+    return lambda *args, **kwargs: result
+
+
+def mock_queue_caging( *args, **kwargs ):  # pylint: disable=unused-argument
+    """The caging job as queued, without running it."""
+
+    return Job( 'redis-queue-job-id', 'queued' )
+
+
+def get_fake_service_patches():
+    """The patches that put the stand-ins in place of Braintree, Ultsys and the caging queue.
+
+    :return: A list of mock patchers, not yet started.
+    """
+
+    braintree_latency = get_latency( 'BRAINTREE_LATENCY', DEFAULT_BRAINTREE_LATENCY )
+    ultsys_latency = get_latency( 'ULTSYS_LATENCY', DEFAULT_ULTSYS_LATENCY )
+
+    braintree_calls = {
+        'braintree.CustomerGateway.create': returns( MockObjects.CUSTOMER_CREATE_SUCCESSFUL ),
+        'braintree.CustomerGateway.find': returns( MockObjects.CUSTOMER_FIND_SUCCESSFUL ),
+        'braintree.TransactionGateway.sale': returns( MockObjects.SALE_CREATE_SUCCESSFUL ),
+        'braintree.SubscriptionGateway.create': returns( MockObjects.SUBSCRIPTION_CREATE_SUCCESSFUL ),
+        'braintree.payment_method_gateway.PaymentMethodGateway.create': returns(
+            MockObjects.PAYMENT_METHOD_CREATE_SUCCESSFUL
+        ),
+        'braintree.client_token_gateway.ClientTokenGateway.generate': returns( mock_generate_braintree_token() )
+    }
+    ultsys_calls = {
+        'application.helpers.ultsys_user.get_ultsys_user': get_ultsys_user,
+        'application.helpers.ultsys_user_mirror.get_ultsys_user': get_ultsys_user,
+        'application.models.gift_thank_you_letter.get_ultsys_user': get_ultsys_user,
+        'application.helpers.build_models.create_user': create_user,
+        'application.helpers.front_end_caging.create_user': create_user,
+        'application.helpers.ultsys_user_updates.update_ultsys_user': update_ultsys_user
+    }
+
+    patches = [
+        mock.patch( target, staticmethod( with_latency( function, braintree_latency ) ) )
+        for target, function in braintree_calls.items()
+    ]
+    patches.extend(
+        mock.patch( target, side_effect=with_latency( function, ultsys_latency ) )
+        for target, function in ultsys_calls.items()
+    )
+    patches.append(
+        mock.patch( 'application.controllers.donate.redis_queue_caging.queue', side_effect=mock_queue_caging )
+    )
+    return patches
+
+
+def install_fake_services():
+    """Start the patches for the life of the process, e.g. a gunicorn worker.
+
+    :return: The started patchers.
+    """
+
+    patches = get_fake_service_patches()
+    for patch in patches:
+        patch.start()
+    return patches
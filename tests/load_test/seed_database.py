@@ -0,0 +1,82 @@
+"""Create the load test database and seed it with the reference data, the Ultsys users and a set of gifts.
+
+python -m tests.load_test.seed_database
+LOAD_TEST_GIFTS=5000 python -m tests.load_test.seed_database
+
+The database is dropped and created again, as the unit tests do, and so it should be a database for the load test
+only: the TEST database, or LOAD_TEST_DATABASE_URI. The gifts are for the Gifts, TransactionsByGift and
+DashboardData endpoints, and each has LOAD_TEST_TRANSACTIONS_PER_GIFT transactions ( default 2 ) spread over the
+days before the seed.
+"""
+import os
+import random
+import uuid
+from datetime import datetime
+from datetime import timedelta
+
+from application.flask_essentials import database
+from application.helpers.model_serialization import from_json
+from application.models.gift import GiftModel
+from application.schemas.agent import AgentSchema
+from application.schemas.gift import GiftSchema
+from application.schemas.transaction import TransactionSchema
+from tests.helpers.create_method_used import create_method_used
+from tests.helpers.default_dictionaries import get_agent_jsons
+from tests.helpers.default_dictionaries import get_gift_dict
+from tests.helpers.default_dictionaries import get_transaction_dict
+from tests.helpers.manage_ultsys_user_database import create_ultsys_users
+from tests.load_test.wsgi import load_test_app
+
+DEFAULT_GIFTS = 1000
+DEFAULT_TRANSACTIONS_PER_GIFT = 2
+GIVEN_TO = [ 'ACTION', 'NERF', 'SUPPORT' ]
+
+
+def seed_database( total_gifts, transactions_per_gift ):
+    """Drop and create the tables, and seed them.
+
+    :param int total_gifts: The number of gifts to create.
+    :param int transactions_per_gift: The number of transactions for each gift.
+    :return:
+    """
+
+    with load_test_app.app_context():
+        database.reflect()
+        database.drop_all()
+        database.create_all()
+
+        agent_models = [ from_json( AgentSchema(), agent_json, create=True ).data for agent_json in get_agent_jsons() ]
+        database.session.add_all( agent_models )
+        database.session.add_all( create_method_used() )
+        database.session.commit()
+        create_ultsys_users()
+
+        gift_models = []
+        for _ in range( total_gifts ):
+            gift_json = get_gift_dict( { 'searchable_id': uuid.uuid4(), 'given_to': random.choice( GIVEN_TO ) } )
+            del gift_json[ 'id' ]
+            gift_models.append( from_json( GiftSchema(), gift_json, create=True ).data )
+        database.session.bulk_save_objects( gift_models )
+        database.session.commit()
+
+        now = datetime.utcnow()
+        transaction_models = []
+        for gift_id, in database.session.query( GiftModel.id ).all():
+            for _ in range( transactions_per_gift ):
+                date_in_utc = now - timedelta( hours=random.randint( 0, 24 * 30 ) )
+                transaction_json = get_transaction_dict( {
+                    'gift_id': gift_id,
+                    'date_in_utc': date_in_utc.strftime( '%Y-%m-%d %H:%M:%S' ),
+                    'gross_gift_amount': '{}.00'.format( random.randint( 5, 250 ) )
+                } )
+                del transaction_json[ 'id' ]
+                transaction_models.append( from_json( TransactionSchema(), transaction_json, create=True ).data )
+        database.session.bulk_save_objects( transaction_models )
+        database.session.commit()
+
+
+if __name__ == '__main__':
+    seed_database(
+        int( os.environ.get( 'LOAD_TEST_GIFTS' ) or DEFAULT_GIFTS ),
+        int( os.environ.get( 'LOAD_TEST_TRANSACTIONS_PER_GIFT' ) or DEFAULT_TRANSACTIONS_PER_GIFT )
+    )
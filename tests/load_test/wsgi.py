@@ -0,0 +1,65 @@
+"""The application for the load test, run by gunicorn with the gevent worker as in production:
+
+gunicorn -k gevent -w 2 -b 127.0.0.1:8000 tests.load_test.wsgi:load_test_app
+
+The application is built by create_app() for LOAD_TEST_APP_ENV ( default TEST ), with Braintree, Ultsys and the
+caging queue replaced by the stand-ins in fake_services.py. The database is that of the configuration, or
+LOAD_TEST_DATABASE_URI if it is set, e.g. sqlite:////tmp/donate_load_test.db for a laptop without MySQL.
+
+Every SQL statement executed for a request is counted, and the count returned in the X-Statement-Count header, so
+that the driver can report the statements per request along with the latency.
+"""
+import os
+
+from flask import g
+from flask import has_request_context
+from sqlalchemy import event
+from sqlalchemy.dialects.mysql import TINYINT
+from sqlalchemy.ext.compiler import compiles
+
+from application.app import create_app
+from application.flask_essentials import database
+from tests.load_test.fake_services import install_fake_services
+
+STATEMENT_COUNT_HEADER = 'X-Statement-Count'
+
+
+@compiles( TINYINT, 'sqlite' )
+def compile_tinyint_sqlite( type_, compiler, **kwargs ):  # pylint: disable=unused-argument
+    """SQLite has no TINYINT, and stores it as an INTEGER, so that the models can be created on SQLite."""
+
+    return 'INTEGER'
+
+
+def create_load_test_app():
+    """Build the application for the load test, with the stand-ins installed and the statements counted.
+
+    :return: The Flask application.
+    """
+
+    app = create_app( os.environ.get( 'LOAD_TEST_APP_ENV' ) or 'TEST' )
+    if os.environ.get( 'LOAD_TEST_DATABASE_URI' ):
+        app.config[ 'SQLALCHEMY_DATABASE_URI' ] = os.environ[ 'LOAD_TEST_DATABASE_URI' ]
+
+    install_fake_services()
+
+    with app.app_context():
+        def count_statement( conn, cursor, statement, *args ):  # pylint: disable=unused-argument
+            if has_request_context():
+                g.statement_count = g.get( 'statement_count', 0 ) + 1
+
+        event.listen( database.engine, 'before_cursor_execute', count_statement )
+
+    @app.before_request
+    def start_statement_count():  # pylint: disable=unused-variable
+        g.statement_count = 0
+
+    @app.after_request
+    def add_statement_count( response ):  # pylint: disable=unused-variable
+        response.headers[ STATEMENT_COUNT_HEADER ] = str( getattr( g, 'statement_count', 0 ) )
+        return response
+
+    return app
+
+
+load_test_app = create_load_test_app()  # pylint: disable=invalid-name
@@ -6,12 +6,15 @@ from decimal import Decimal
 import mock
 
 from application.app import create_app
+from application.controllers.donate import post_bulk_donation
 from application.controllers.donate import post_donation
 from application.flask_essentials import database
 from application.helpers.model_serialization import from_json
 from application.models.caged_donor import CagedDonorModel
+from application.models.email_outbox import EmailOutboxModel
 from application.models.gift import GiftModel
 from application.models.method_used import MethodUsedModel
+from application.models.queued_donor import QueuedDonorModel
 from application.models.transaction import TransactionModel
 from application.schemas.agent import AgentSchema
 from application.schemas.caged_donor import CagedDonorSchema
@@ -22,6 +25,7 @@ from tests.helpers.default_dictionaries import get_donate_dict
 from tests.helpers.default_dictionaries import get_exists_donor_dict
 from tests.helpers.default_dictionaries import get_new_donor_dict
 from tests.helpers.manage_ultsys_user_database import create_ultsys_users
+from tests.helpers.mock_redis_queue_functions import Job
 from tests.helpers.mock_redis_queue_functions import mock_caging
 from tests.helpers.mock_ultsys_functions import create_user
 from tests.helpers.mock_ultsys_functions import get_ultsys_user
@@ -82,7 +86,7 @@ class AdminDonateTestCase( unittest.TestCase ):
             database.session.close()
 
     @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
-    @mock.patch( 'application.helpers.build_models.update_ultsys_user', side_effect=update_ultsys_user )
+    @mock.patch( 'application.helpers.ultsys_user_updates.update_ultsys_user', side_effect=update_ultsys_user )
     @mock.patch( 'application.helpers.build_models.create_user', side_effect=create_user )
     @mock.patch( 'application.controllers.donate.redis_queue_caging.queue', side_effect=mock_caging )
     def test_admin_new_donor(
@@ -168,7 +172,7 @@ class AdminDonateTestCase( unittest.TestCase ):
             self.assertEqual( gift.given_to, self.parameters[ 'given_to' ] )
 
     @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
-    @mock.patch( 'application.helpers.build_models.update_ultsys_user', side_effect=update_ultsys_user )
+    @mock.patch( 'application.helpers.ultsys_user_updates.update_ultsys_user', side_effect=update_ultsys_user )
     @mock.patch( 'application.controllers.donate.redis_queue_caging.queue', side_effect=mock_caging )
     def test_admin_existing_donor(
             self,
@@ -425,3 +429,55 @@ class AdminDonateTestCase( unittest.TestCase ):
             self.assertEqual( caged_donor.gift_searchable_id, gift.searchable_id )
             self.assertEqual( caged_donor.user_first_name, caged_donor_dict[ 'user_first_name' ] )
             self.assertEqual( caged_donor.user_last_name, caged_donor_dict[ 'user_last_name' ] )
+
+    @mock.patch(
+        'application.controllers.donate.queue_caging_batches',
+        return_value=[ Job( 'redis-queue-job-id', 'queued' ) ]
+    )
+    def test_admin_bulk_donation( self, mock_caging_batches_function ):
+        """Test a batch of administrative donations: the gifts that validate are built, and the others reported."""
+
+        with self.app.app_context():
+            for agent_dict in [
+                    get_agent_dict( { 'name': 'Fidelity Bank' } ),
+                    get_agent_dict( { 'name': 'Aaron Peters', 'user_id': '3255162', 'type': 'Staff Member' } )
+            ]:
+                database.session.add( from_json( AgentSchema(), agent_dict, create=True ).data )
+            database.session.commit()
+
+            check = get_donate_dict( { 'gift': { 'method_used': 'Check' } } )
+            cash = get_donate_dict( { 'gift': { 'method_used': 'Cash' }, 'user': get_new_donor_dict() } )
+            credit_card = get_donate_dict()
+            response = post_bulk_donation(
+                { 'sourced_from_agent_user_id': '3255162', 'gifts': [ check, credit_card, cash ] }
+            )
+
+            self.assertEqual( response[ 'created' ], 2 )
+            self.assertEqual( response[ 'invalid' ], 1 )
+            self.assertEqual( response[ 'failed' ], 0 )
+            self.assertEqual( [ result[ 'index' ] for result in response[ 'results' ] ], [ 0, 1, 2 ] )
+            self.assertEqual( response[ 'results' ][ 1 ][ 'status' ], 'invalid' )
+            self.assertIn( 'method_used', response[ 'results' ][ 1 ][ 'errors' ] )
+            self.assertEqual( response[ 'job_ids' ], [ 'redis-queue-job-id' ] )
+
+            # The check has a Gift and a Deposit to Bank transaction, the cash a Gift transaction.
+            gifts = GiftModel.query.order_by( GiftModel.id ).all()
+            self.assertEqual(
+                [ str( gift.searchable_id ) for gift in gifts ],
+                [ response[ 'results' ][ index ][ 'gift_searchable_id' ] for index in [ 0, 2 ] ]
+            )
+            transactions = TransactionModel.query.order_by( TransactionModel.id ).all()
+            self.assertEqual(
+                [ ( transaction.gift_id, transaction.type ) for transaction in transactions ],
+                [ ( gifts[ 0 ].id, 'Gift' ), ( gifts[ 0 ].id, 'Deposit to Bank' ), ( gifts[ 1 ].id, 'Gift' ) ]
+            )
+            self.assertEqual( QueuedDonorModel.query.count(), 2 )
+            self.assertEqual(
+                [ outbox.transaction_id for outbox in EmailOutboxModel.query.order_by( EmailOutboxModel.id ) ],
+                [ transactions[ 0 ].id, transactions[ 2 ].id ]
+            )
+
+            # The donors are queued for caging together, with the ID's of what was built.
+            donors = mock_caging_batches_function.call_args[ 0 ][ 0 ]
+            self.assertEqual( [ donor[ 'user' ][ 'gift_id' ] for donor in donors ], [ gifts[ 0 ].id, gifts[ 1 ].id ] )
+            self.assertEqual( donors[ 0 ][ 'transactions' ][ 1 ][ 'id' ], transactions[ 1 ].id )
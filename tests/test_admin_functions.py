@@ -6,12 +6,15 @@ import mock
 
 import tests.helpers.mock_braintree_objects  # pylint: disable=C0412
 from application.app import create_app
+from application.controllers.admin import admin_bulk_operation
 from application.controllers.admin import admin_correct_gift
 from application.controllers.admin import admin_record_bounced_check
 from application.controllers.admin import admin_refund_transaction
 from application.controllers.admin import admin_void_transaction
 from application.flask_essentials import database
 from application.helpers.model_serialization import from_json
+from application.helpers.transaction_helpers import get_gift_balance
+from application.helpers.transaction_helpers import get_latest_transactions
 from application.models.gift import GiftModel
 from application.models.transaction import TransactionModel
 from application.schemas.agent import AgentSchema
@@ -183,11 +186,11 @@ class AdminFunctionsTestCase( unittest.TestCase ):
             self.assertEqual( transaction_bounced_check.gross_gift_amount, self.parameters[ 'gift_amount_bounced' ] )
 
     @mock.patch(
-        'braintree.Transaction.find',
+        'braintree.TransactionGateway.find',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.TRANSACTION_FIND_SETTLED )
     )
     @mock.patch(
-        'braintree.Transaction.refund',
+        'braintree.TransactionGateway.refund',
         staticmethod( lambda x, y: tests.helpers.mock_braintree_objects.MockObjects.TRANSACTION_REFUND_SUCCESSFUL )
     )
     @mock.patch(
@@ -198,7 +201,7 @@ class AdminFunctionsTestCase( unittest.TestCase ):
         'braintree.Transaction.Status.Settling',
         staticmethod( tests.helpers.mock_braintree_objects.MockObjects.TRANSACTION_STATUS_SETTLING )
     )
-    @mock.patch( 'application.helpers.general_helper_functions.get_ultsys_user', side_effect=get_ultsys_user )
+    @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
     def test_admin_refund_transaction( self, get_ultsys_user_function  ):   # pylint: disable=unused-argument
         """Test for creating a refund mocking Braintree's responses."""
 
@@ -267,15 +270,15 @@ class AdminFunctionsTestCase( unittest.TestCase ):
             self.assertEqual( transaction_refund.gross_gift_amount, current_gross_gift_amount )
 
     @mock.patch(
-        'braintree.Customer.find',
+        'braintree.CustomerGateway.find',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_FIND_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Subscription.find',
+        'braintree.SubscriptionGateway.find',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SUBSCRIPTION_FIND_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Subscription.update',
+        'braintree.SubscriptionGateway.update',
         staticmethod( lambda x, y: tests.helpers.mock_braintree_objects.MockObjects.SUBSCRIPTION_UPDATE_SUCCESSFUL )
     )
     def test_braintree_reallocate_gift( self ):
@@ -348,14 +351,14 @@ class AdminFunctionsTestCase( unittest.TestCase ):
             self.assertEqual( transaction_reallocate.gross_gift_amount, self.parameters[ 'gift_amount_reallocate' ] )
 
     @mock.patch(
-        'braintree.Transaction.find',
+        'braintree.TransactionGateway.find',
         staticmethod(
             lambda x:
             tests.helpers.mock_braintree_objects.MockObjects.TRANSACTION_FIND_SUBMITTED_FOR_SETTLEMENT
         )
     )
     @mock.patch(
-        'braintree.Transaction.void',
+        'braintree.TransactionGateway.void',
         staticmethod(
             lambda x:
             tests.helpers.mock_braintree_objects.MockObjects.TRANSACTION_VOID_SUCCESSFUL
@@ -425,3 +428,107 @@ class AdminFunctionsTestCase( unittest.TestCase ):
             self.assertEqual( transaction_void.gift_id, gift_id )
             self.assertEqual( transaction_void.enacted_by_agent_id, 2 )
             self.assertEqual( transaction_void.type, self.parameters[ 'transaction_type_void' ] )
+
+    @mock.patch(
+        'braintree.TransactionGateway.find',
+        staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.TRANSACTION_FIND_SETTLED )
+    )
+    @mock.patch(
+        'braintree.TransactionGateway.refund',
+        staticmethod( lambda x, y: tests.helpers.mock_braintree_objects.MockObjects.TRANSACTION_REFUND_SUCCESSFUL )
+    )
+    @mock.patch(
+        'braintree.Transaction.Status.Settled',
+        staticmethod( tests.helpers.mock_braintree_objects.MockObjects.TRANSACTION_STATUS_SETTLED )
+    )
+    @mock.patch(
+        'braintree.Transaction.Status.Settling',
+        staticmethod( tests.helpers.mock_braintree_objects.MockObjects.TRANSACTION_STATUS_SETTLING )
+    )
+    @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
+    def test_admin_bulk_refund( self, get_ultsys_user_function ):  # pylint: disable=unused-argument
+        """Test for refunding a batch of transactions, by transaction and searchable ID, with a result for each."""
+
+        with self.app.app_context():
+            gift_models = []
+            for _ in range( 2 ):
+                gift_model = from_json( GiftSchema(), get_gift_dict( { 'user_id': '5' } ), create=True ).data
+                database.session.add( gift_model )
+                database.session.flush()
+                transaction_dict = get_transaction_dict( { 'gift_id': gift_model.id } )
+                database.session.add( from_json( TransactionSchema(), transaction_dict, create=True ).data )
+                gift_models.append( gift_model )
+
+            # The Braintree agent sources the refunds, and the staff member enacts them.
+            database.session.add( from_json( AgentSchema(), get_agent_dict(), create=True ).data )
+            agent_user_id = '3255162'
+            agent_dict = get_agent_dict( { 'name': 'Aaron Peters', 'user_id': agent_user_id, 'type': 'Staff Member' } )
+            database.session.add( from_json( AgentSchema(), agent_dict, create=True ).data )
+            database.session.commit()
+            gift_ids = [ gift_model.id for gift_model in gift_models ]
+
+            payload = {
+                'user_id': agent_user_id,
+                'transaction_notes': 'Transaction notes.',
+                'items': [
+                    { 'transaction_id': 1, 'amount': self.parameters[ 'gift_amount_refund' ] },
+                    { 'searchable_id': str( gift_models[ 1 ].searchable_id ), 'amount': '1.00' },
+                    { 'transaction_id': 1, 'amount': '1.00' },
+                    { 'transaction_id': 99, 'amount': '1.00' }
+                ]
+            }
+            response = admin_bulk_operation( 'refund', payload )
+
+            self.assertEqual( response[ 'completed' ], 2 )
+            self.assertEqual( response[ 'invalid' ], 2 )
+            self.assertEqual(
+                [ result[ 'status' ] for result in response[ 'results' ] ],
+                [ 'completed', 'completed', 'invalid', 'invalid' ]
+            )
+
+            # A refund transaction for each gift, committed together.
+            refunds = TransactionModel.query.filter_by( type=self.parameters[ 'transaction_type_refund' ] ) \
+                .order_by( TransactionModel.id ).all()
+            self.assertEqual( [ refund.gift_id for refund in refunds ], gift_ids )
+            self.assertEqual(
+                [ refund.id for refund in refunds ],
+                [ result[ 'transaction_id' ] for result in response[ 'results' ][ :2 ] ]
+            )
+            current_gross_gift_amount = Decimal( '25.00' ) - self.parameters[ 'gift_amount_refund' ]
+            self.assertEqual( refunds[ 0 ].gross_gift_amount, current_gross_gift_amount )
+
+    def test_gift_balance( self ):
+        """The balance of a gift is the gross_gift_amount of its latest transaction, by date and then ID."""
+
+        with self.app.app_context():
+            gift_ids = []
+            for _ in range( 3 ):
+                gift_model = from_json( GiftSchema(), get_gift_dict( { 'user_id': '5' } ), create=True ).data
+                database.session.add( gift_model )
+                database.session.flush()
+                gift_ids.append( gift_model.id )
+
+            transactions = [
+                ( gift_ids[ 0 ], '2018-01-01 00:00:00', '25.00' ),
+                ( gift_ids[ 0 ], '2018-03-01 00:00:00', '15.00' ),
+                ( gift_ids[ 0 ], '2018-02-01 00:00:00', '20.00' ),
+                ( gift_ids[ 1 ], '2018-01-01 00:00:00', '10.00' ),
+                ( gift_ids[ 1 ], '2018-01-01 00:00:00', '5.00' )
+            ]
+            for gift_id, date_in_utc, gross_gift_amount in transactions:
+                transaction_dict = get_transaction_dict(
+                    { 'gift_id': gift_id, 'date_in_utc': date_in_utc, 'gross_gift_amount': gross_gift_amount }
+                )
+                database.session.add( from_json( TransactionSchema(), transaction_dict, create=True ).data )
+            database.session.commit()
+
+            self.assertEqual( get_gift_balance( gift_ids[ 0 ] ), Decimal( '15.00' ) )
+            self.assertEqual( get_gift_balance( gift_ids[ 1 ] ), Decimal( '5.00' ) )
+            self.assertEqual( get_gift_balance( gift_ids[ 2 ] ), Decimal( '0.00' ) )
+
+            latest_transactions = get_latest_transactions( gift_ids )
+            self.assertEqual(
+                { gift_id: latest[ 2 ] for gift_id, latest in latest_transactions.items() },
+                { gift_ids[ 0 ]: Decimal( '15.00' ), gift_ids[ 1 ]: Decimal( '5.00' ) }
+            )
+            self.assertEqual( latest_transactions[ gift_ids[ 1 ] ][ 0 ], 5 )
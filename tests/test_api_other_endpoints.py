@@ -1,18 +1,22 @@
 """The module tests various API endpoints to ensure a request is successfully made and valid data returned."""
+import functools
 import json
 import unittest
 
+import braintree
 import mock
+from braintree.util.http import Http
 from flask_api import status
 
 from application.app import create_app
 from application.flask_essentials import database
+from application.helpers.braintree_api import get_braintree_latency_statistics
+from application.helpers.braintree_api import PooledBraintreeHttp
 from application.schemas.agent import AgentSchema
 from application.schemas.caged_donor import CagedDonorSchema
 from tests.helpers.default_dictionaries import get_agent_jsons
 from tests.helpers.default_dictionaries import get_caged_donor_dict
 from tests.helpers.mock_braintree_objects import mock_generate_braintree_token
-from tests.helpers.mock_braintree_objects import mock_init_braintree_credentials
 from tests.helpers.mock_jwt_functions import ACCESS_TOKEN
 from tests.helpers.mock_webstorage_objects import mock_webstorage_get_bucket_file
 from tests.helpers.mock_webstorage_objects import mock_webstorage_init_storage
@@ -74,22 +78,17 @@ class APIOtherEndpointsTestCase( unittest.TestCase ):
             response = self.test_client.get( url, headers=self.headers )
             self.assertEqual( len( json.loads( response.data.decode( 'utf-8' ) ) ), len( agent_jsons ) )
 
-    @mock.patch(
-        'application.controllers.donate.init_braintree_credentials', side_effect=mock_init_braintree_credentials
-    )
+    @mock.patch( 'application.controllers.donate.pop_braintree_token', return_value=None )
     @mock.patch(
         'application.controllers.donate.generate_braintree_token', side_effect=mock_generate_braintree_token
     )
-    def test_get_token(
-            self,
-            mock_init_credentials_function,
-            mock_generate_token_function
-    ):  # pylint: disable=unused-argument
+    def test_get_token( self, mock_generate_token_function, mock_pop_token_function ):
+        # pylint: disable=unused-argument
         """Test to check that the endpoint exists ( methods = [ GET ] ).
 
-        The endpoint calls 2 functions that make calls to the BRAINTREE_TOKEN API. These functions are mocked. This
-        test basically makes sure that if the credentials are initialized and the token is retrieved it is returned
-        when the endpoint is called.
+        The endpoint calls a function that makes a call to the BRAINTREE_TOKEN API through the gateway when the token
+        pool is empty. This function is mocked. This test basically makes sure that the token is retrieved and
+        returned when the endpoint is called.
         """
 
         with self.app.app_context():
@@ -100,6 +99,47 @@ class APIOtherEndpointsTestCase( unittest.TestCase ):
             response = self.test_client.get( url, headers=self.headers )
             self.assertEqual( json.loads( response.data.decode( 'utf-8' ) ), BRAINTREE_TOKEN )
 
+    @mock.patch( 'application.controllers.donate.pop_braintree_token', return_value='pooled_braintree_token' )
+    @mock.patch( 'application.controllers.donate.generate_braintree_token' )
+    def test_get_token_from_pool( self, mock_generate_token_function, mock_pop_token_function ):
+        """The token is popped from the pool for the merchant account, without a call to the BRAINTREE_TOKEN API."""
+
+        with self.app.app_context():
+            url = '/donation/braintree/get-token?given_to=NERF'
+
+            response = self.test_client.get( url, headers=self.headers )
+            self.assertEqual( json.loads( response.data.decode( 'utf-8' ) ), 'pooled_braintree_token' )
+            mock_pop_token_function.assert_called_once_with( 'NERF' )
+            mock_generate_token_function.assert_not_called()
+
+    @mock.patch.dict( 'application.helpers.braintree_api.BRAINTREE_LATENCY', clear=True )
+    def test_braintree_latency_statistics( self ):
+        """The latency of the Braintree calls is recorded by method and resource, from the full URLs Braintree sends."""
+
+        session = mock.Mock()
+        session.request.return_value = mock.Mock( status_code=200, text='' )
+        configuration = braintree.Configuration(
+            braintree.Environment.Sandbox,
+            merchant_id='merchant_id',
+            public_key='public_key',
+            private_key='private_key',
+            http_strategy=functools.partial( PooledBraintreeHttp, session=session, timeout=( 1, 1 ) )
+        )
+        http = Http( configuration )
+        merchant_path = configuration.base_merchant_path()
+
+        http.post( merchant_path + '/transactions', { 'transaction': { 'amount': '10.00' } } )
+        http.put( merchant_path + '/transactions/transaction_id/void' )
+        http.get( merchant_path + '/customers/customer_id' )
+
+        # Braintree passes the full URL to the HTTP strategy.
+        self.assertTrue( session.request.call_args[ 0 ][ 1 ].startswith( 'https://' ) )
+
+        statistics = get_braintree_latency_statistics()
+        self.assertEqual( sorted( statistics ), [ 'GET customers', 'POST transactions', 'PUT transactions' ] )
+        self.assertEqual( statistics[ 'POST transactions' ][ 'calls' ], 1 )
+        self.assertEqual( statistics[ 'GET customers' ][ 'calls' ], 1 )
+
     def test_caged_donors( self ):
         """Caged donor API ( methods = [ GET ] )."""
         with self.app.app_context():
@@ -4,16 +4,25 @@ import uuid
 from decimal import Decimal
 
 import mock
+from sqlalchemy import event
 
 import tests.helpers.mock_braintree_objects  # pylint: disable=ungrouped-imports
 from application.app import create_app
 from application.controllers.donate import post_donation
+from application.exceptions.exception_donation import DonationIdempotencyKeyMismatchError
+from application.exceptions.exception_model import ModelGiftImproperFieldError
 from application.flask_essentials import database
 from application.helpers.braintree_api import init_braintree_credentials
+from application.helpers.donation_idempotency import get_donation_fingerprint
+from application.helpers.donation_idempotency import get_donation_idempotency_key
+from application.helpers.donation_idempotency import run_idempotent_donation
 from application.helpers.model_serialization import from_json
 from application.models.caged_donor import CagedDonorModel
+from application.models.email_outbox import EmailOutboxModel
 from application.models.gift import GiftModel
+from application.models.gift_thank_you_letter import GiftThankYouLetterModel
 from application.models.method_used import MethodUsedModel
+from application.models.queued_donor import QueuedDonorModel
 from application.models.transaction import TransactionModel
 from application.schemas.agent import AgentSchema
 from application.schemas.caged_donor import CagedDonorSchema
@@ -24,6 +33,7 @@ from tests.helpers.default_dictionaries import get_donate_dict
 from tests.helpers.default_dictionaries import get_new_donor_dict
 from tests.helpers.manage_ultsys_user_database import create_ultsys_users
 from tests.helpers.mock_redis_queue_functions import mock_caging
+from tests.helpers.mock_redis_queue_functions import MockRedisConnection
 from tests.helpers.mock_ultsys_functions import create_user
 from tests.helpers.mock_ultsys_functions import get_ultsys_user
 from tests.helpers.mock_ultsys_functions import update_ultsys_user
@@ -83,28 +93,28 @@ class BraintreeOnlineDonateTestCase( unittest.TestCase ):
             database.session.close()
 
     @mock.patch(
-        'braintree.Customer.create',
+        'braintree.CustomerGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Customer.find',
+        'braintree.CustomerGateway.find',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_FIND_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Transaction.sale',
+        'braintree.TransactionGateway.sale',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SALE_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Subscription.create',
+        'braintree.SubscriptionGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SUBSCRIPTION_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.PaymentMethod.create',
+        'braintree.payment_method_gateway.PaymentMethodGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.PAYMENT_METHOD_CREATE_SUCCESSFUL )
     )
     @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
     @mock.patch( 'application.helpers.build_models.create_user', side_effect=create_user )
-    @mock.patch( 'application.helpers.build_models.update_ultsys_user', side_effect=update_ultsys_user )
+    @mock.patch( 'application.helpers.ultsys_user_updates.update_ultsys_user', side_effect=update_ultsys_user )
     @mock.patch( 'application.controllers.donate.redis_queue_caging.queue', side_effect=mock_caging )
     def test_donation_new_donor(
             self,
@@ -158,27 +168,98 @@ class BraintreeOnlineDonateTestCase( unittest.TestCase ):
             self.assertEqual( gift.given_to, self.parameters[ 'given_to' ] )
 
     @mock.patch(
-        'braintree.Customer.create',
+        'braintree.CustomerGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Customer.find',
+        'braintree.CustomerGateway.find',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_FIND_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Transaction.sale',
+        'braintree.TransactionGateway.sale',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SALE_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Subscription.create',
+        'braintree.SubscriptionGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SUBSCRIPTION_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.PaymentMethod.create',
+        'braintree.payment_method_gateway.PaymentMethodGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.PAYMENT_METHOD_CREATE_SUCCESSFUL )
     )
     @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
-    @mock.patch( 'application.helpers.build_models.update_ultsys_user', side_effect=update_ultsys_user )
+    @mock.patch( 'application.controllers.donate.redis_queue_caging.queue', return_value=None )
+    def test_donation_unit_of_work( self, mock_caging_function, ultsys_user_function ):
+        # pylint: disable=unused-argument
+        """The donation is saved with a single commit: one flush for the gift and transaction, and a SAVEPOINT each for
+        the receipt, Thank You letter and queued donor.
+
+        :param mock_caging_function: Argument for mocked function.
+        :param ultsys_user_function: Argument for mocked function.
+        :return:
+        """
+        with self.app.app_context():
+            self.app.config[ 'THANK_YOU_LETTER_THRESHOLD' ] = '1.00'
+
+            agent_model = from_json( AgentSchema(), get_agent_dict(), create=True )
+            database.session.add( agent_model.data )
+            database.session.commit()
+
+            statements = []
+            commits = []
+
+            def count_statement( conn, cursor, statement, *args ):  # pylint: disable=unused-argument
+                statements.append( statement.strip().split( None, 1 )[ 0 ].upper() )
+
+            # The engine's commit event is the database COMMIT: a SAVEPOINT is released rather than committed.
+            def count_commit( conn ):
+                commits.append( conn )
+
+            event.listen( database.engine, 'before_cursor_execute', count_statement )
+            event.listen( database.engine, 'commit', count_commit )
+            try:
+                payload = get_donate_dict( { 'user': get_new_donor_dict(), 'recurring_subscription': False } )
+                result = post_donation( payload )
+            finally:
+                event.remove( database.engine, 'before_cursor_execute', count_statement )
+                event.remove( database.engine, 'commit', count_commit )
+
+            self.assertIn( 'gift_searchable_id', result )
+            self.assertEqual( len( commits ), 1 )
+
+            # The gift, transaction, receipt, Thank You letter and queued donor, and no updates of them afterwards.
+            self.assertEqual( statements.count( 'INSERT' ), 5 )
+            self.assertEqual( statements.count( 'UPDATE' ), 0 )
+            self.assertEqual( statements.count( 'SAVEPOINT' ), 3 )
+
+            gift = GiftModel.query.one()
+            self.assertEqual( TransactionModel.query.one().gift_id, gift.id )
+            self.assertEqual( GiftThankYouLetterModel.query.one().gift_id, gift.id )
+            self.assertEqual( QueuedDonorModel.query.one().gift_id, gift.id )
+            self.assertEqual( EmailOutboxModel.query.one().email_type, 'receipt' )
+
+    @mock.patch(
+        'braintree.CustomerGateway.create',
+        staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_CREATE_SUCCESSFUL )
+    )
+    @mock.patch(
+        'braintree.CustomerGateway.find',
+        staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_FIND_SUCCESSFUL )
+    )
+    @mock.patch(
+        'braintree.TransactionGateway.sale',
+        staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SALE_CREATE_SUCCESSFUL )
+    )
+    @mock.patch(
+        'braintree.SubscriptionGateway.create',
+        staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SUBSCRIPTION_CREATE_SUCCESSFUL )
+    )
+    @mock.patch(
+        'braintree.payment_method_gateway.PaymentMethodGateway.create',
+        staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.PAYMENT_METHOD_CREATE_SUCCESSFUL )
+    )
+    @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
+    @mock.patch( 'application.helpers.ultsys_user_updates.update_ultsys_user', side_effect=update_ultsys_user )
     @mock.patch( 'application.controllers.donate.redis_queue_caging.queue', side_effect=mock_caging )
     def test_donation_existing_donor(
             self, ultsys_user_function, build_models_function, mock_caging_function
@@ -223,24 +304,24 @@ class BraintreeOnlineDonateTestCase( unittest.TestCase ):
             self.assertEqual( gift.given_to, self.parameters[ 'given_to' ] )
 
     @mock.patch(
-        'braintree.Customer.create',
+        'braintree.CustomerGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Customer.find',
+        'braintree.CustomerGateway.find',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_FIND_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Transaction.sale',
+        'braintree.TransactionGateway.sale',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SALE_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Customer.update',
+        'braintree.CustomerGateway.update',
         staticmethod( lambda x, y: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_UPDATE_SUCCESSFUL )
     )
     @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
     @mock.patch( 'application.helpers.build_models.create_user', side_effect=create_user )
-    @mock.patch( 'application.helpers.build_models.update_ultsys_user', side_effect=update_ultsys_user )
+    @mock.patch( 'application.helpers.ultsys_user_updates.update_ultsys_user', side_effect=update_ultsys_user )
     @mock.patch( 'application.controllers.donate.redis_queue_caging.queue', side_effect=mock_caging )
     def test_donation_donor_update(
             self, ultsys_user_function,
@@ -285,23 +366,23 @@ class BraintreeOnlineDonateTestCase( unittest.TestCase ):
             self.assertNotEqual( user.zip, int( new_info[ 'user' ][ 'user_address' ][ 'user_zipcode' ] ) )
 
     @mock.patch(
-        'braintree.Customer.create',
+        'braintree.CustomerGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Customer.find',
+        'braintree.CustomerGateway.find',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_FIND_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Transaction.sale',
+        'braintree.TransactionGateway.sale',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SALE_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Subscription.create',
+        'braintree.SubscriptionGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SUBSCRIPTION_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.PaymentMethod.create',
+        'braintree.payment_method_gateway.PaymentMethodGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.PAYMENT_METHOD_CREATE_SUCCESSFUL )
     )
     @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
@@ -372,23 +453,23 @@ class BraintreeOnlineDonateTestCase( unittest.TestCase ):
             self.assertEqual( caged_donor.user_address, caged_donor_dict[ 'user_address' ] )
 
     @mock.patch(
-        'braintree.Customer.create',
+        'braintree.CustomerGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Customer.find',
+        'braintree.CustomerGateway.find',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_FIND_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Transaction.sale',
+        'braintree.TransactionGateway.sale',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SALE_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Subscription.create',
+        'braintree.SubscriptionGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SUBSCRIPTION_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.PaymentMethod.create',
+        'braintree.payment_method_gateway.PaymentMethodGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.PAYMENT_METHOD_CREATE_SUCCESSFUL )
     )
     @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
@@ -462,3 +543,84 @@ class BraintreeOnlineDonateTestCase( unittest.TestCase ):
             self.assertEqual( caged_donor.customer_id, self.parameters[ 'customer_id' ] )
             self.assertEqual( caged_donor.user_first_name, caged_donor_dict[ 'user_first_name' ] )
             self.assertEqual( caged_donor.user_last_name, caged_donor_dict[ 'user_last_name' ] )
+
+    @mock.patch( 'application.helpers.donation_idempotency.redis_queue' )
+    def test_donation_idempotency( self, redis_queue_mock ):
+        """A retried donation returns the stored response of the first, and a failed donation can be retried.
+
+        :param redis_queue_mock: Argument for mocked object.
+        :return:
+        """
+
+        redis_queue_mock.connection = MockRedisConnection()
+        with self.app.app_context():
+            payload = get_donate_dict( { 'user': get_new_donor_dict(), 'recurring_subscription': False } )
+            retried_payload = get_donate_dict( { 'user': get_new_donor_dict(), 'recurring_subscription': False } )
+            idempotency_key = get_donation_idempotency_key( payload )
+            self.assertEqual( idempotency_key, get_donation_idempotency_key( retried_payload ) )
+            self.assertNotEqual( idempotency_key, get_donation_idempotency_key( payload, 'client-key' ) )
+
+            # A donation without a nonce or a header is not deduplicated.
+            del payload[ 'payment_method_nonce' ]
+            self.assertIsNone( get_donation_idempotency_key( payload ) )
+
+            donations = []
+
+            def make_donation():
+                donations.append( 1 )
+                return { 'gift_searchable_id': 'gift_searchable_id', 'job_id': None, 'job_status': None }
+
+            def fail_donation():
+                raise ModelGiftImproperFieldError
+
+            self.assertRaises( ModelGiftImproperFieldError, run_idempotent_donation, idempotency_key, fail_donation )
+
+            first = run_idempotent_donation( idempotency_key, make_donation )
+            retried = run_idempotent_donation( idempotency_key, make_donation )
+
+            self.assertEqual( len( donations ), 1 )
+            self.assertEqual( first, ( retried[ 0 ], False ) )
+            self.assertTrue( retried[ 1 ] )
+
+    @mock.patch( 'application.helpers.donation_idempotency.redis_queue' )
+    def test_donation_idempotency_key_mismatch( self, redis_queue_mock ):
+        """A client key sent with a different donation, or by a different caller, is rejected rather than replayed.
+
+        :param redis_queue_mock: Argument for mocked object.
+        :return:
+        """
+
+        redis_queue_mock.connection = MockRedisConnection()
+        with self.app.app_context():
+            payload = get_donate_dict( { 'user': get_new_donor_dict(), 'recurring_subscription': False } )
+            other_payload = get_donate_dict( { 'user': get_new_donor_dict(), 'recurring_subscription': False } )
+            other_payload[ 'transaction' ][ 'gross_gift_amount' ] = '99.00'
+            idempotency_key = get_donation_idempotency_key( payload, 'client-key' )
+            self.assertEqual( idempotency_key, get_donation_idempotency_key( other_payload, 'client-key' ) )
+
+            fingerprint = get_donation_fingerprint( payload )
+            self.assertNotEqual( fingerprint, get_donation_fingerprint( other_payload ) )
+
+            donations = []
+
+            def make_donation():
+                donations.append( 1 )
+                return { 'gift_searchable_id': 'gift_searchable_id', 'job_id': None, 'job_status': None }
+
+            first = run_idempotent_donation( idempotency_key, make_donation, fingerprint )
+            retried = run_idempotent_donation( idempotency_key, make_donation, fingerprint )
+            self.assertEqual( retried, ( first[ 0 ], True ) )
+
+            # A different amount under the same key, and the same donation from a different caller.
+            other_fingerprints = [
+                get_donation_fingerprint( other_payload ), get_donation_fingerprint( payload, ultsys_id=1234 )
+            ]
+            for other_fingerprint in other_fingerprints:
+                self.assertRaises(
+                    DonationIdempotencyKeyMismatchError,
+                    run_idempotent_donation,
+                    idempotency_key,
+                    make_donation,
+                    other_fingerprint
+                )
+            self.assertEqual( len( donations ), 1 )
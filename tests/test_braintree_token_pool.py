@@ -0,0 +1,134 @@
+"""Tests the pool of Braintree client tokens generated ahead of the donation forms."""
+import json
+import time
+import unittest
+
+import mock
+
+from application.app import create_app
+from application.controllers.donate import get_braintree_token
+from application.helpers.braintree_token_pool import get_braintree_token_pool_statistics
+from application.helpers.braintree_token_pool import pop_braintree_token
+from application.helpers.braintree_token_pool import refill_braintree_token_pools
+from application.helpers.braintree_token_pool import TOKEN_POOL_KEY
+from application.helpers.braintree_token_pool import trim_expired_tokens
+from tests.helpers.mock_redis_queue_functions import MockRedisConnection
+
+
+class BraintreeTokenPoolTestCase( unittest.TestCase ):
+    """This test suite is designed to verify that the Braintree token pools are refilled to their size, that expired
+    tokens are trimmed, and that the endpoint generates a token with a live call when a pool is empty.
+
+    python -m unittest discover -v
+    python -m unittest -v tests.test_braintree_token_pool.BraintreeTokenPoolTestCase
+    python -m unittest -v tests.test_braintree_token_pool.BraintreeTokenPoolTestCase.test_refill_pools
+    """
+
+    def setUp( self ):
+        self.app = create_app( 'TEST' )
+        self.app.testing = True
+        self.app.config.update(
+            {
+                'NUMBERSUSA': 'numbersusa',
+                'NUMBERSUSA_ACTION': 'numbersusa_action',
+                'BRAINTREE_TOKEN_POOL_SIZE': 3,
+                'BRAINTREE_TOKEN_POOL_MAX_AGE': 3600
+            }
+        )
+
+        self.connection = MockRedisConnection()
+        redis_queue_patch = mock.patch( 'application.helpers.braintree_token_pool.redis_queue' )
+        self.addCleanup( redis_queue_patch.stop )
+        redis_queue_patch.start().connection = self.connection
+
+    def push_tokens( self, pool_name, expires ):
+        """Push tokens onto a pool, one for each expiry.
+
+        :param str pool_name: The name of the pool, e.g. NERF.
+        :param list expires: The expiry time of each token, in order.
+        :return:
+        """
+
+        for index, token_expires in enumerate( expires ):
+            self.connection.rpush(
+                TOKEN_POOL_KEY.format( pool_name ),
+                json.dumps( { 'token': 'token_{}'.format( index ), 'expires': token_expires } )
+            )
+
+    @mock.patch( 'application.controllers.donate.generate_braintree_token', return_value='live_braintree_token' )
+    def test_empty_pool_falls_back( self, generate_braintree_token_function ):
+        """A pop from an empty pool, or one with only expired tokens, is a miss and the endpoint generates a token for
+        the pool's merchant account with a live call.
+
+        :param generate_braintree_token_function: Argument for mocked function.
+        :return:
+        """
+
+        with self.app.app_context():
+            self.assertIsNone( pop_braintree_token( 'NERF' ) )
+            self.assertEqual( get_braintree_token( 'NERF' ), 'live_braintree_token' )
+            generate_braintree_token_function.assert_called_once_with( 'numbersusa' )
+
+            self.push_tokens( 'NERF', [ time.time() - 1 ] )
+            self.assertEqual( get_braintree_token( 'NERF' ), 'live_braintree_token' )
+
+            statistics = get_braintree_token_pool_statistics()[ 'NERF' ]
+            self.assertEqual( ( statistics[ 'depth' ], statistics[ 'hits' ], statistics[ 'misses' ] ), ( 0, 0, 3 ) )
+
+    @mock.patch( 'application.controllers.donate.generate_braintree_token' )
+    @mock.patch( 'application.helpers.braintree_token_pool.generate_braintree_token' )
+    def test_refill_pools( self, refill_generate_function, endpoint_generate_function ):
+        """Each pool is refilled up to its size, keeping its fresh tokens first, and the endpoint pops them in order.
+
+        :param refill_generate_function: Argument for mocked function.
+        :param endpoint_generate_function: Argument for mocked function.
+        :return:
+        """
+
+        refill_generate_function.side_effect = lambda merchant_account_id=None: 'generated_{}'.format(
+            merchant_account_id
+        )
+
+        with self.app.app_context():
+            self.push_tokens( 'NERF', [ time.time() + 60 ] )
+
+            summary = refill_braintree_token_pools()
+            self.assertEqual(
+                summary,
+                {
+                    'default': { 'added': 3, 'depth': 3 },
+                    'NERF': { 'added': 2, 'depth': 3 },
+                    'ACTION': { 'added': 3, 'depth': 3 }
+                }
+            )
+            self.assertEqual( refill_generate_function.call_count, 8 )
+
+            # A full pool is left as it is.
+            summary = refill_braintree_token_pools()
+            self.assertEqual( summary[ 'NERF' ], { 'added': 0, 'depth': 3 } )
+            self.assertEqual( refill_generate_function.call_count, 8 )
+
+            tokens = [ get_braintree_token( 'NERF' ) for _ in range( 3 ) ]
+            self.assertEqual( tokens, [ 'token_0', 'generated_numbersusa', 'generated_numbersusa' ] )
+            endpoint_generate_function.assert_not_called()
+
+            statistics = get_braintree_token_pool_statistics()[ 'NERF' ]
+            self.assertEqual( ( statistics[ 'depth' ], statistics[ 'hits' ], statistics[ 'misses' ] ), ( 0, 3, 0 ) )
+
+    def test_trim_expired_tokens( self ):
+        """Only the expired tokens at the front of a pool are trimmed, and the fresh tokens are kept in order."""
+
+        with self.app.app_context():
+            now = time.time()
+            self.push_tokens( 'NERF', [ now - 60, now - 1, now + 60, now + 120 ] )
+            key = TOKEN_POOL_KEY.format( 'NERF' )
+
+            self.assertEqual( trim_expired_tokens( key ), 2 )
+            self.assertEqual( self.connection.llen( key ), 2 )
+            self.assertEqual( pop_braintree_token( 'NERF' ), 'token_2' )
+
+            # Once every token has expired the pool is emptied.
+            with mock.patch( 'time.time', return_value=now + 121 ):
+                self.assertEqual( trim_expired_tokens( key ), 1 )
+            self.assertEqual( self.connection.llen( key ), 0 )
+            self.assertEqual( trim_expired_tokens( key ), 0 )
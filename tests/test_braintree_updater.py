@@ -0,0 +1,272 @@
+"""Tests the Braintree status updater in jobs/braintree.py."""
+import importlib
+import os
+import unittest
+from datetime import datetime
+from datetime import timedelta
+from decimal import Decimal
+
+import mock
+from sqlalchemy import event
+
+from application.app import create_app
+from application.flask_essentials import database
+from application.helpers.model_serialization import from_json
+from application.models.braintree_dispute_retry import BraintreeDisputeRetryModel
+from application.models.sync_state import SyncStateModel
+from application.models.transaction import TransactionModel
+from application.schemas.agent import AgentSchema
+from application.schemas.gift import GiftSchema
+from application.schemas.transaction import TransactionSchema
+from tests.helpers.default_dictionaries import get_agent_jsons
+from tests.helpers.default_dictionaries import get_gift_dict
+from tests.helpers.default_dictionaries import get_transaction_dict
+
+
+def import_updater():
+    """Import the updater, which builds its app for APP_ENV and reads the Donate API agent when it is imported.
+
+    :return: The jobs.braintree module.
+    """
+
+    with mock.patch.dict( os.environ, { 'APP_ENV': 'TEST' } ), \
+            mock.patch( 's3_web_storage.web_storage.WebStorage.init_storage' ):
+        return importlib.import_module( 'jobs.braintree' )
+
+
+def get_sale( sale_id, statuses=( 'authorized', ), authorized_at=None ):
+    """A Braintree sale, authorized and not a refund, as returned by the searches.
+
+    :param sale_id: The Braintree sale ID.
+    :param statuses: The statuses of the sale's history, a minute apart.
+    :param authorized_at: The time of the first status.
+    :return: The sale.
+    """
+
+    authorized_at = authorized_at or datetime.utcnow()
+    return mock.Mock(
+        id=sale_id,
+        amount=Decimal( '25.00' ),
+        service_fee_amount=None,
+        recurring=False,
+        refunded_transaction_id=None,
+        subscription_id=None,
+        disbursement_details=mock.Mock( disbursement_date=None ),
+        status_history=[
+            mock.Mock( status=status, timestamp=authorized_at + timedelta( minutes=index ) )
+            for index, status in enumerate( statuses )
+        ]
+    )
+
+
+def get_dispute( dispute_id, updated_at ):
+    """A Braintree dispute, as returned by the search."""
+
+    return mock.Mock(
+        id=dispute_id,
+        transaction=mock.Mock( id='sale_id' ),
+        updated_at=updated_at.strftime( '%Y-%m-%dT%H:%M:%SZ' ),
+        status_history=[],
+        kind='chargeback'
+    )
+
+
+class BraintreeUpdaterTestCase( unittest.TestCase ):
+    """This test suite is designed to verify the Braintree status updater: the local index of the transactions and
+    gifts of a run, the statements of a run, and the sync cursors of the search kinds.
+
+    python -m unittest discover -v
+    python -m unittest -v tests.test_braintree_updater.BraintreeUpdaterTestCase
+    python -m unittest -v tests.test_braintree_updater.BraintreeUpdaterTestCase.test_local_index_balance
+    """
+
+    def setUp( self ):
+        self.app = create_app( 'TEST' )
+        self.app.testing = True
+
+        with self.app.app_context():
+            database.reflect()
+            database.drop_all()
+            database.create_all()
+
+            for agent_json in get_agent_jsons():
+                database.session.add( from_json( AgentSchema(), agent_json, create=True ).data )
+            database.session.commit()
+
+        self.updater = import_updater()
+
+    def tearDown( self ):
+        with self.app.app_context():
+            database.session.commit()
+            database.session.close()
+
+    def test_local_index_balance( self ):
+        """The balance of a gift is that of its latest transaction by date and then ID, and is replaced only by a
+        transaction built in the run on or after that date.
+        """
+
+        with self.updater.app.app_context():
+            gift_model = from_json( GiftSchema(), get_gift_dict( { 'user_id': '5' } ), create=True ).data
+            database.session.add( gift_model )
+            database.session.flush()
+            gift_id = gift_model.id
+
+            # Two transactions on the same date: the refund, with the larger ID, is the latest.
+            transactions = [
+                ( 'sale_id', 'Gift', '25.00' ),
+                ( 'refund_id', 'Refund', '20.00' )
+            ]
+            for reference_number, transaction_type, gross_gift_amount in transactions:
+                transaction_dict = get_transaction_dict(
+                    {
+                        'gift_id': gift_id,
+                        'date_in_utc': '2018-07-12 00:00:00',
+                        'type': transaction_type,
+                        'reference_number': reference_number,
+                        'gross_gift_amount': gross_gift_amount
+                    }
+                )
+                database.session.add( from_json( TransactionSchema(), transaction_dict, create=True ).data )
+            database.session.commit()
+
+            # Only the sale is in the run, and it is not the latest on its gift.
+            local_index = self.updater.LocalIndex()
+            local_index.prefetch( [ 'sale_id' ], [] )
+            self.assertEqual( local_index.find_transaction( 'sale_id', 'Gift', 'Completed' ).gift_id, gift_id )
+            self.assertEqual( local_index.get_balance( gift_id ), Decimal( '20.00' ) )
+
+            built_transactions = [
+                ( '2018-07-11 00:00:00', '30.00', Decimal( '20.00' ) ),
+                ( '2018-07-12 00:00:00', '15.00', Decimal( '15.00' ) )
+            ]
+            for date_in_utc, gross_gift_amount, balance in built_transactions:
+                transaction_dict = get_transaction_dict(
+                    {
+                        'gift_id': gift_id,
+                        'date_in_utc': date_in_utc,
+                        'type': 'Void',
+                        'reference_number': 'sale_id',
+                        'gross_gift_amount': gross_gift_amount
+                    }
+                )
+                local_index.add_transactions( [ from_json( TransactionSchema(), transaction_dict, create=True ).data ] )
+                self.assertEqual( local_index.get_balance( gift_id ), balance )
+
+    def test_statements_per_run( self ):
+        """The SELECT statements of a run do not grow with the number of sales, since the local transactions and gifts
+        are prefetched rather than queried per sale, and the lookups the index serves in their place do.
+        """
+
+        with self.updater.app.app_context():
+            select_counts = []
+            for sale_count in ( 2, 20 ):
+                select_counts.append( self.count_selects_voiding_sales( sale_count ) )
+                self.assertGreaterEqual( self.updater.RUN_STATISTICS[ 'index_lookups' ], sale_count )
+            self.assertEqual( select_counts[ 0 ], select_counts[ 1 ] )
+            self.assertEqual( TransactionModel.query.filter_by( type='Void' ).count(), 22 )
+
+    def count_selects_voiding_sales( self, sale_count ):
+        """Run the updater on sales voided in Braintree, with the statements counted as manage_status_updates() does.
+
+        :param sale_count: The number of sales voided.
+        :return: The number of SELECT statements of the run.
+        """
+
+        authorized_at = datetime.utcnow() - timedelta( hours=1 )
+        sales = []
+        for index in range( sale_count ):
+            sale_id = 'sale_{}_{}'.format( sale_count, index )
+            gift_model = from_json( GiftSchema(), get_gift_dict( { 'user_id': '5' } ), create=True ).data
+            database.session.add( gift_model )
+            database.session.flush()
+            transaction_dict = get_transaction_dict(
+                {
+                    'gift_id': gift_model.id,
+                    'date_in_utc': authorized_at.strftime( '%Y-%m-%d %H:%M:%S' ),
+                    'reference_number': sale_id
+                }
+            )
+            database.session.add( from_json( TransactionSchema(), transaction_dict, create=True ).data )
+            sales.append( get_sale( sale_id, ( 'authorized', 'voided' ), authorized_at ) )
+        database.session.commit()
+
+        results = { self.updater.SYNC_NAME_PREFIX + status: [] for status in self.updater.TRACKED_STATUSES }
+        results[ 'braintree_voided_at' ] = sales
+
+        select_count = [ 0 ]
+        self.updater.RUN_STATISTICS[ 'index_lookups' ] = 0
+
+        def count_statement( conn, cursor, statement, *args ):  # pylint: disable=unused-argument
+            if statement.lstrip().upper().startswith( 'SELECT' ):
+                select_count[ 0 ] += 1
+
+        event.listen( database.engine, 'before_cursor_execute', count_statement )
+        try:
+            self.updater.process_new_statuses( [], datetime.utcnow(), results )
+        finally:
+            event.remove( database.engine, 'before_cursor_execute', count_statement )
+        return select_count[ 0 ]
+
+    def test_sync_cursors_per_status( self ):
+        """The cursor of a status advances when every sale it found was applied, whatever the other statuses found."""
+
+        with self.updater.app.app_context():
+            results = {
+                self.updater.SYNC_NAME_PREFIX + status: [] for status in self.updater.TRACKED_STATUSES
+            }
+            results[ 'braintree_authorized_at' ] = [ get_sale( 'applied_sale_id' ) ]
+            results[ 'braintree_settled_at' ] = [ get_sale( 'failed_sale_id' ), get_sale( 'applied_sale_id' ) ]
+            results[ 'braintree_voided_at' ] = None
+
+            with mock.patch.object(
+                self.updater,
+                'manage_authorized_not_refund',
+                side_effect=lambda sale_id, *args: sale_id != 'failed_sale_id'
+            ):
+                self.updater.process_new_statuses( [], datetime.utcnow(), results )
+
+            advanced = { sync_state.name for sync_state in SyncStateModel.query.all() }
+            self.assertEqual( advanced, { 'braintree_authorized_at', 'braintree_submitted_for_settlement_at' } )
+
+    def test_dispute_retry( self ):
+        """A dispute that fails is kept for a retry and the cursor advances, and the retry is applied on the next run
+        whatever the dispute's updated_at.
+        """
+
+        with self.updater.app.app_context():
+            date1 = datetime.utcnow()
+            dispute_date = date1 - timedelta( minutes=1 )
+            dispute = get_dispute( 'dispute_id', dispute_date )
+            windows = { self.updater.DISPUTES_SYNC_NAME: date1 - timedelta( hours=1 ) }
+            results = { self.updater.DISPUTES_SYNC_NAME: [ dispute ] }
+
+            with mock.patch.object( self.updater, 'manage_dispute', side_effect=Exception ):
+                self.updater.process_new_disputes( [], [], date1, windows, results )
+
+            retry = BraintreeDisputeRetryModel.query.get( 'dispute_id' )
+            self.assertEqual( ( retry.status, retry.attempts ), ( 'pending', 1 ) )
+            watermark = SyncStateModel.query.get( self.updater.DISPUTES_SYNC_NAME ).watermark_in_utc
+            self.assertGreater( watermark, dispute_date )
+
+            # The next run finds the dispute by its ID, outside the window searched.
+            with mock.patch.object( self.updater, 'BRAINTREE_GATEWAY' ) as gateway:
+                gateway.dispute.find.return_value = dispute
+                retry_disputes = self.updater.add_retry_disputes( [], self.updater.get_retry_dispute_ids() )
+            self.assertEqual( retry_disputes, [ dispute ] )
+
+            date1 += timedelta( hours=2 )
+            windows = { self.updater.DISPUTES_SYNC_NAME: date1 - timedelta( hours=1 ) }
+            results = { self.updater.DISPUTES_SYNC_NAME: retry_disputes }
+            with mock.patch.object( self.updater, 'manage_dispute', return_value=False ) as manage_dispute:
+                self.updater.process_new_disputes( [], [], date1, windows, results )
+            self.assertEqual( manage_dispute.call_count, 1 )
+            self.assertIsNone( BraintreeDisputeRetryModel.query.get( 'dispute_id' ) )
+
+            # A dispute that keeps failing is given up on.
+            windows = { self.updater.DISPUTES_SYNC_NAME: dispute_date - timedelta( hours=1 ) }
+            with mock.patch.object( self.updater, 'DISPUTE_RETRY_MAX_ATTEMPTS', 2 ), \
+                    mock.patch.object( self.updater, 'manage_dispute', side_effect=Exception ):
+                for _ in range( 2 ):
+                    self.updater.process_new_disputes( [], [], date1, windows, results )
+            self.assertEqual( BraintreeDisputeRetryModel.query.get( 'dispute_id' ).status, 'failed' )
+            self.assertEqual( self.updater.get_retry_dispute_ids(), set() )
@@ -19,7 +19,7 @@ from tests.helpers.default_dictionaries import get_agent_jsons
 from tests.helpers.default_dictionaries import get_gift_dict
 from tests.helpers.default_dictionaries import get_transaction_dict
 from tests.helpers.manage_ultsys_user_database import create_ultsys_users
-from tests.helpers.mock_braintree_objects import mock_init_braintree_gateway
+from tests.helpers.mock_braintree_objects import mock_get_braintree_gateway
 from tests.helpers.mock_braintree_webhooks import mock_subscription_notification
 from tests.helpers.mock_ultsys_functions import get_ultsys_user
 
@@ -58,13 +58,13 @@ class BraintreeWebhooksTestCase( unittest.TestCase ):
             database.session.close()
 
     @mock.patch(
-        'application.controllers.braintree_webhooks.init_braintree_gateway', side_effect=mock_init_braintree_gateway
+        'application.controllers.braintree_webhooks.get_braintree_gateway', side_effect=mock_get_braintree_gateway
     )
     @mock.patch(
         'application.controllers.braintree_webhooks.get_braintree_notification',
         side_effect=mock_subscription_notification
     )
-    @mock.patch( 'application.helpers.general_helper_functions.get_ultsys_user', side_effect=get_ultsys_user )
+    @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
     def test_braintree_webhooks(
             self,
             mock_init_gateway_function,
@@ -5,21 +5,38 @@ import uuid
 from datetime import datetime
 
 import mock
+from sqlalchemy.exc import SQLAlchemyError
 
 from application.app import create_app
 from application.flask_essentials import database
 from application.helpers.build_models import build_models_sale
 from application.helpers.caging import categorize_donor
+from application.helpers.caging import check_if_caged
+from application.helpers.caging import score_donor
+from application.helpers.caging_batch import cage_donor_batch
+from application.helpers.caging_blocks import find_caging_candidates
+from application.helpers.caging_blocks import rebuild_caging_blocks
+from application.helpers.caging_scoring import numpy
+from application.helpers.caging_scoring import score_donor_vectorized
 from application.helpers.general_helper_functions import flatten_user_dict
 from application.helpers.model_serialization import from_json
+from application.helpers.reference_data import find_agent
+from application.helpers.reference_data import invalidate_reference_data
+from application.helpers.ultsys_user_mirror import find_mirror_users
+from application.helpers.ultsys_user_mirror import MIRROR_RESYNC_NAME
+from application.helpers.ultsys_user_mirror import MIRROR_SYNC_NAME
+from application.helpers.ultsys_user_mirror import resync_ultsys_user_mirror
 from application.models.agent import AgentModel
 from application.models.caged_donor import CagedDonorModel
+from application.models.caging_block import CagingBlockModel
 from application.models.campaign import CampaignAmountsModel
 from application.models.campaign import CampaignModel
 from application.models.gift import GiftModel
 from application.models.gift_thank_you_letter import GiftThankYouLetterModel
 from application.models.queued_donor import QueuedDonorModel
+from application.models.sync_state import SyncStateModel
 from application.models.transaction import TransactionModel
+from application.models.ultsys_user import UltsysUserModel
 from application.schemas.agent import AgentSchema
 from application.schemas.caged_donor import CagedDonorSchema
 from application.schemas.campaign import CampaignAmountsSchema
@@ -42,11 +59,40 @@ from tests.helpers.manage_ultsys_user_database import create_ultsys_users
 from tests.helpers.mock_ultsys_functions import create_user
 from tests.helpers.mock_ultsys_functions import get_ultsys_user
 from tests.helpers.mock_ultsys_functions import update_ultsys_user
+from tests.helpers.mock_ultsys_user_data import ULTSYS_USER_DATA
 from tests.helpers.model_helpers import ensure_query_session_aligned
 
 AGENT_INDEX = 6
 
 
+def build_caging_batch( donors ):
+    """Add a gift and a queued donor for each donor, and build the batch of donors to cage.
+
+    :param list donors: The donor dictionaries.
+    :return: A list of dictionaries with the user and transactions: { 'user': {}, 'transactions': [] }.
+    """
+
+    batch = []
+    for donor in donors:
+        gift_model = from_json( GiftSchema(), get_gift_dict(), create=True ).data
+        gift_model.searchable_id = uuid.uuid4()
+        queued_donor_model = from_json( QueuedDonorSchema(), get_queued_donor_dict(), create=True ).data
+        database.session.add( gift_model )
+        database.session.add( queued_donor_model )
+        database.session.flush()
+        donor.update(
+            {
+                'gift_id': gift_model.id,
+                'queued_donor_id': queued_donor_model.id,
+                'campaign_id': None,
+                'customer_id': 'customer_id'
+            }
+        )
+        batch.append( { 'user': donor, 'transactions': [ get_transaction_dict() ] } )
+    database.session.commit()
+    return batch
+
+
 class DonateModelsTestCase( unittest.TestCase ):
     """This test suite is designed to verify the underlying functions that update the models and categorize a donor.
 
@@ -117,6 +163,245 @@ class DonateModelsTestCase( unittest.TestCase ):
             category = categorize_donor( flatten_user_dict( get_new_donor_dict() ) )
             self.assertEqual( category[ 0 ], 'new' )
 
+    @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
+    def test_categorize_donor_on_mirror( self, ultsys_user_function ):
+        """With a fresh local Ultsys user mirror caging gives the same categories without calling the user service."""
+
+        config_patch = mock.patch.dict( self.app.config, { 'ULTSYS_USER_MIRROR_ENABLED': True } )
+        self.addCleanup( config_patch.stop )
+        config_patch.start()
+
+        with self.app.app_context():
+            database.session.add( SyncStateModel( name=MIRROR_SYNC_NAME, last_synced_in_utc=datetime.utcnow() ) )
+            database.session.commit()
+            # The users are loaded in bulk, bypassing the upsert that maintains their blocking keys.
+            rebuild_caging_blocks()
+
+            category = categorize_donor( flatten_user_dict( get_exists_donor_dict() ) )
+            self.assertEqual( category[ 0 ], 'exists' )
+
+            caged_donor_dict = get_caged_donor_dict( { 'gift_searchable_id': uuid.uuid4() } )
+            caged_donor = from_json( CagedDonorSchema(), caged_donor_dict )
+            database.session.add( caged_donor.data )
+            database.session.commit()
+            category = categorize_donor( caged_donor_dict )
+            self.assertEqual( category[ 0 ], 'caged' )
+
+            # The mirror finds the user by email, and so the donor to cage needs an email no user has.
+            cage_donor = copy.deepcopy( get_exists_donor_dict() )
+            cage_donor[ 'user_address' ][ 'user_first_name' ] = 'Sherry'
+            cage_donor[ 'user_address' ][ 'user_email_address' ] = 'sherryalbers@disney.com'
+            category = categorize_donor( flatten_user_dict( cage_donor ) )
+            self.assertEqual( category[ 0 ], 'cage' )
+
+            category = categorize_donor( flatten_user_dict( get_new_donor_dict() ) )
+            self.assertEqual( category[ 0 ], 'new' )
+
+            self.assertFalse( ultsys_user_function.called )
+
+    @mock.patch( 'application.helpers.ultsys_user_mirror.search_ultsys_users' )
+    def test_resync_ultsys_user_mirror( self, search_ultsys_users_function ):
+        """The resynchronization searches every ID window of the mirror again, picks up a change of name and a user
+        without an email, and resumes from the last window committed when it fails.
+
+        :param search_ultsys_users_function: Argument for mocked function.
+        :return:
+        """
+
+        config_patch = mock.patch.dict( self.app.config, { 'ULTSYS_USER_MIRROR_ID_WINDOW': 30 } )
+        self.addCleanup( config_patch.stop )
+        config_patch.start()
+
+        with self.app.app_context():
+            database.session.add( SyncStateModel( name=MIRROR_SYNC_NAME, watermark_id=66 ) )
+            database.session.commit()
+
+            changed_user = { 'ID': 1, 'firstname': 'Michael', 'lastname': 'Albers-Smith', 'email': None }
+            search_ultsys_users_function.side_effect = [ [ changed_user ], ValueError( 'The service is down.' ) ]
+            with self.assertRaises( ValueError ):
+                resync_ultsys_user_mirror()
+
+            user_model = UltsysUserModel.query.filter_by( ID=1 ).one()
+            self.assertEqual( ( user_model.lastname, user_model.email ), ( 'Albers-Smith', '' ) )
+            resync_state = SyncStateModel.query.filter_by( name=MIRROR_RESYNC_NAME ).one()
+            self.assertEqual( ( resync_state.watermark_id, resync_state.last_synced_in_utc ), ( 30, None ) )
+
+            database.session.rollback()
+            search_ultsys_users_function.reset_mock()
+            search_ultsys_users_function.side_effect = [ [], [] ]
+            self.assertEqual( resync_ultsys_user_mirror(), { 'resynced_users': 0, 'end_id': 66 } )
+            searches = [ call[ 0 ][ 0 ] for call in search_ultsys_users_function.call_args_list ]
+            self.assertEqual( searches, [ { 'ID': { 'gt': 30, 'le': 60 } }, { 'ID': { 'gt': 60, 'le': 66 } } ] )
+
+            resync_state = SyncStateModel.query.filter_by( name=MIRROR_RESYNC_NAME ).one()
+            self.assertEqual( resync_state.watermark_id, 0 )
+            self.assertIsNotNone( resync_state.last_synced_in_utc )
+
+    def test_check_if_caged_normalized_street( self ):
+        """The caged donor's normalized street is kept when it is created and updated, and matched by caging."""
+
+        with self.app.app_context():
+            caged_donor_dict = get_caged_donor_dict( { 'gift_searchable_id': uuid.uuid4() } )
+            caged_donor = from_json( CagedDonorSchema(), caged_donor_dict )
+            database.session.add( caged_donor.data )
+            database.session.commit()
+            self.assertEqual( caged_donor.data.user_street, '4370bombardierway' )
+
+            self.assertEqual( check_if_caged( dict( caged_donor_dict, user_address='4370 Bombardier Way.' ) ), 3 )
+            self.assertEqual( check_if_caged( dict( caged_donor_dict, user_address='4371 Bombardier Way' ) ), 0 )
+            self.assertEqual( check_if_caged( dict( caged_donor_dict, user_address='' ) ), 0 )
+
+            caged_donor.data.user_address = '1011 Hornblower Drive'
+            database.session.commit()
+            self.assertEqual( check_if_caged( dict( caged_donor_dict, user_address='1011 Hornblower Dr.ive' ) ), 3 )
+            self.assertEqual( check_if_caged( caged_donor_dict ), 0 )
+
+    def test_caging_blocks_match_last_name_scoring( self ):
+        """Scoring the blocking key candidates gives the same category as scoring every user with the last name."""
+
+        with self.app.app_context():
+            # Users with an empty or '0' zip, email and phone, which score_donor() matches but for the donor phone '0'.
+            for user_id, value in [ ( 101, '' ), ( 102, '0' ) ]:
+                user_model = UltsysUserModel( ID=user_id, firstname='Empty', lastname='Albers', address='' )
+                user_model.zip, user_model.email, user_model.phone = value, value, value
+                database.session.add( user_model )
+            database.session.commit()
+            rebuild_caging_blocks()
+
+            # Each mocked user as a donor, and then with each field but the last name varied in turn, and together.
+            variations = {
+                'user_first_name': 'Zebulon',
+                'user_zipcode': '00000',
+                'user_address': '1 Nowhere Road',
+                'user_email_address': 'nobody@nowhere.com',
+                'user_phone_number': '0000000000'
+            }
+            empty_variations = [
+                { field: value for field in [ 'user_zipcode', 'user_email_address', 'user_phone_number' ] }
+                for value in [ '', '0' ]
+            ]
+            empty_variations += [
+                { field: value } for field in [ 'user_zipcode', 'user_email_address', 'user_phone_number' ]
+                for value in [ '', '0' ]
+            ]
+            donor_dicts = [ flatten_user_dict( get_exists_donor_dict() ), flatten_user_dict( get_new_donor_dict() ) ]
+            for ultsys_user in ULTSYS_USER_DATA:
+                donor_dict = {
+                    'user_first_name': ultsys_user[ 'firstname' ],
+                    'user_last_name': ultsys_user[ 'lastname' ],
+                    'user_zipcode': ultsys_user[ 'zip' ],
+                    'user_address': ultsys_user[ 'address' ],
+                    'user_email_address': ultsys_user[ 'email' ],
+                    'user_phone_number': ultsys_user[ 'phone' ]
+                }
+                donor_dicts.append( donor_dict )
+                for field, value in variations.items():
+                    donor_dicts.append( dict( donor_dict, **{ field: value } ) )
+                donor_dicts.append( dict( donor_dict, **variations ) )
+                for empty_variation in empty_variations:
+                    donor_dicts.append( dict( donor_dict, **empty_variation ) )
+                    donor_dicts.append( dict( donor_dict, user_first_name='Empty', **empty_variation ) )
+
+            for donor_dict in donor_dicts:
+                users_by_last_name = find_mirror_users( { 'lastname': { 'eq': donor_dict[ 'user_last_name' ] } } )
+                expected_weight, expected_user_ids = score_donor( donor_dict, users_by_last_name )
+                weight, user_ids = score_donor( donor_dict, find_caging_candidates( donor_dict ) )
+                self.assertEqual( weight, expected_weight )
+                self.assertEqual( sorted( user_ids ), sorted( expected_user_ids ) )
+
+    def test_rebuild_caging_blocks_rollback( self ):
+        """A rebuild of the blocking index that fails leaves the index it started with."""
+
+        with self.app.app_context():
+            rebuild_caging_blocks()
+            block_count = CagingBlockModel.query.count()
+            self.assertGreater( block_count, 0 )
+
+            with mock.patch(
+                'application.helpers.caging_blocks.build_user_block_keys', side_effect=[ { 'lz:albers|' }, ValueError ]
+            ):
+                with self.assertRaises( ValueError ):
+                    rebuild_caging_blocks( batch_size=1 )
+            self.assertEqual( CagingBlockModel.query.count(), block_count )
+
+    @unittest.skipIf( numpy is None, 'NumPy is not installed.' )
+    def test_score_donor_vectorized( self ):
+        """The vectorized scoring engine gives the same weight and user IDs as the loop over the candidates."""
+
+        with self.app.app_context():
+            last_names = list( { ultsys_user[ 'lastname' ] for ultsys_user in ULTSYS_USER_DATA } )
+            users = find_mirror_users( { 'lastname': { 'in': last_names } } )
+            for ultsys_user in users:
+                donor_dict = {
+                    'user_first_name': ultsys_user[ 'firstname' ],
+                    'user_last_name': ultsys_user[ 'lastname' ],
+                    'user_zipcode': ultsys_user[ 'zip' ],
+                    'user_address': ultsys_user[ 'address' ],
+                    'user_email_address': ultsys_user[ 'email' ],
+                    'user_phone_number': ultsys_user[ 'phone' ]
+                }
+                variations = [
+                    donor_dict, dict( donor_dict, user_first_name='Zebulon' ), dict( donor_dict, user_zipcode='' )
+                ]
+                # Every user is scored, and twice, to include the duplicates the loop skips.
+                for variation in variations:
+                    self.assertEqual(
+                        score_donor_vectorized( variation, users + users ), score_donor( variation, users + users )
+                    )
+
+    @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
+    @mock.patch( 'application.helpers.ultsys_user_updates.update_ultsys_user', side_effect=update_ultsys_user )
+    @mock.patch( 'application.helpers.build_models.create_user', side_effect=create_user )
+    def test_cage_donor_batch(
+            self, create_user_function, update_ultsys_user_function, ultsys_user_function
+    ):  # pylint: disable=unused-argument
+        """A batch is caged with shared searches and one commit, and a repeat donation by a new donor is found."""
+
+        with self.app.app_context():
+            # The batched email search finds the user by email, and so the donor to cage needs an email no user has.
+            cage_donor = get_exists_donor_dict()
+            cage_donor[ 'user_address' ][ 'user_first_name' ] = 'Sherry'
+            cage_donor[ 'user_address' ][ 'user_email_address' ] = 'sherryalbers@disney.com'
+            batch = build_caging_batch(
+                [ get_exists_donor_dict(), get_new_donor_dict(), get_new_donor_dict(), cage_donor ]
+            )
+
+            summary = cage_donor_batch( batch )
+            self.assertEqual( summary[ 'failed' ], [] )
+            self.assertEqual( [ summary[ 'exists' ], summary[ 'new' ], summary[ 'cage' ] ], [ 2, 1, 1 ] )
+
+            # The second donation by the new donor is given the user created for the first.
+            self.assertEqual( create_user_function.call_count, 1 )
+            gift_user_ids = [ GiftModel.query.get( donor[ 'user' ][ 'gift_id' ] ).user_id for donor in batch ]
+            self.assertEqual( gift_user_ids[ 1 ], gift_user_ids[ 2 ] )
+            self.assertEqual( gift_user_ids[ 3 ], -1 )
+            self.assertEqual( QueuedDonorModel.query.count(), 0 )
+            self.assertEqual( CagedDonorModel.query.count(), 1 )
+
+    @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
+    @mock.patch( 'application.helpers.ultsys_user_updates.update_ultsys_user', side_effect=update_ultsys_user )
+    @mock.patch( 'application.helpers.build_models.create_user', side_effect=create_user )
+    def test_cage_donor_batch_commit_failure(
+            self, create_user_function, update_ultsys_user_function, ultsys_user_function
+    ):  # pylint: disable=unused-argument
+        """A batch whose commit fails creates no Ultsys user, and keeps its queued donors for the retry."""
+
+        with self.app.app_context():
+            batch = build_caging_batch( [ get_exists_donor_dict(), get_new_donor_dict() ] )
+
+            with mock.patch.object( database.session, 'commit', side_effect=SQLAlchemyError( 'Lost connection.' ) ):
+                with self.assertRaises( SQLAlchemyError ):
+                    cage_donor_batch( batch )
+
+            create_user_function.assert_not_called()
+            self.assertEqual( QueuedDonorModel.query.count(), 2 )
+
+            # The retry creates the user once.
+            summary = cage_donor_batch( batch )
+            self.assertEqual( [ summary[ 'exists' ], summary[ 'new' ], summary[ 'failed' ] ], [ 1, 1, [] ] )
+            self.assertEqual( create_user_function.call_count, 1 )
+            self.assertEqual( QueuedDonorModel.query.count(), 0 )
+
     def test_agent_model( self ):
         """A test to ensure that gifts are saved correctly to the database."""
 
@@ -139,6 +424,29 @@ class DonateModelsTestCase( unittest.TestCase ):
             }
             ensure_query_session_aligned( kwargs )
 
+    def test_reference_data_cache( self ):
+        """A test to ensure that the reference data cache finds the same agents as the model, and is invalidated."""
+
+        with self.app.app_context():
+            for agent_dict in get_agent_jsons():
+                database.session.add( from_json( AgentSchema(), agent_dict, create=True ).data )
+            database.session.commit()
+
+            # Lookups by name and user ID, compared as the MySQL collation does, with no query once loaded.
+            braintree_agent = find_agent( 'Organization', 'name', 'Braintree' )
+            with mock.patch.object( AgentModel, 'query' ) as agent_query:
+                self.assertEqual( find_agent( 'Organization', 'name', ' braintree ' ), braintree_agent )
+                self.assertEqual( find_agent( 'Staff Member', 'user_id', '1234' ).name, 'Dan Marsh' )
+                agent_query.order_by.assert_not_called()
+            self.assertEqual( braintree_agent.id, AgentModel.get_agent( 'Organization', 'name', 'Braintree' ).id )
+
+            # A miss falls back to the unknown agent for the type, as AgentModel.get_agent() does.
+            self.assertIsNone( find_agent( 'Staff Member', 'user_id', 9999 ) )
+            database.session.add( AgentModel( name='Unknown Staff Member', type='Staff Member' ) )
+            database.session.commit()
+            invalidate_reference_data( 'agent' )
+            self.assertEqual( find_agent( 'Staff Member', 'user_id', 9999 ).name, 'Unknown Staff Member' )
+
     def test_gift_thank_you_model( self ):
         """A test to ensure that gifts are saved correctly to the database."""
 
@@ -309,7 +617,7 @@ class DonateModelsTestCase( unittest.TestCase ):
             ensure_query_session_aligned( kwargs )
 
     @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
-    @mock.patch( 'application.helpers.build_models.update_ultsys_user', side_effect=update_ultsys_user )
+    @mock.patch( 'application.helpers.ultsys_user_updates.update_ultsys_user', side_effect=update_ultsys_user )
     @mock.patch( 'application.helpers.build_models.create_user', side_effect=create_user )
     def test_build_models(
             self, ultsys_user_function, create_ultsys_user_function, update_ultsys_user_function
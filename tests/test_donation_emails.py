@@ -9,7 +9,9 @@ from application.app import create_app
 from application.controllers.donate import post_donation
 from application.flask_essentials import database
 from application.helpers.braintree_api import init_braintree_credentials
+from application.helpers.email_outbox import dispatch_email_outbox
 from application.helpers.model_serialization import from_json
+from application.models.email_outbox import EmailOutboxModel
 from application.models.gift_thank_you_letter import GiftThankYouLetterModel
 from application.models.transaction import TransactionModel
 from application.schemas.agent import AgentSchema
@@ -56,35 +58,37 @@ class DonationEmailsTestCase( unittest.TestCase ):
             database.session.close()
 
     @mock.patch(
-        'braintree.Customer.create',
+        'braintree.CustomerGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Customer.find',
+        'braintree.CustomerGateway.find',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_FIND_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Transaction.sale',
+        'braintree.TransactionGateway.sale',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SALE_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Subscription.create',
+        'braintree.SubscriptionGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SUBSCRIPTION_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.PaymentMethod.create',
+        'braintree.payment_method_gateway.PaymentMethodGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.PAYMENT_METHOD_CREATE_SUCCESSFUL )
     )
     @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
     @mock.patch( 'application.helpers.build_models.create_user', side_effect=create_user )
-    @mock.patch( 'application.helpers.build_models.update_ultsys_user', side_effect=update_ultsys_user )
+    @mock.patch( 'application.helpers.ultsys_user_updates.update_ultsys_user', side_effect=update_ultsys_user )
     @mock.patch( 'application.controllers.donate.redis_queue_caging.queue', side_effect=mock_caging )
+    @mock.patch( 'application.helpers.email_outbox.send_email', return_value=True )
     def test_small_donation_emails(
             self,
             ultsys_user_function,
             create_ultsys_user_function,
             update_ultsys_user_function,
-            mock_caging_function
+            mock_caging_function,
+            send_email_function
     ):  # pylint: disable=unused-argument
         """Test small donation does not add entry to GiftThankYouLetter table.
 
@@ -114,40 +118,53 @@ class DonationEmailsTestCase( unittest.TestCase ):
             gift_thank_you_letter = GiftThankYouLetterModel.query.filter_by( gift_id=1 ).one_or_none()
             self.assertIsNone( gift_thank_you_letter )
 
+            # The receipt is in the outbox and is not sent on the request path.
             transaction = TransactionModel.query.filter_by( gift_id=1 ).one_or_none()
             self.assertIsNotNone( transaction )
+            self.assertIsNone( transaction.receipt_sent_in_utc )
+            outbox_model = EmailOutboxModel.query.one()
+            self.assertEqual( ( outbox_model.email_type, outbox_model.transaction_id ), ( 'receipt', transaction.id ) )
+            self.assertFalse( send_email_function.called )
+
+            # The dispatcher sends it and sets the receipt sent date.
+            self.assertEqual( dispatch_email_outbox(), { 'sent': 1, 'retried': 0, 'failed': 0 } )
+            database.session.expire_all()
+            transaction = TransactionModel.query.filter_by( gift_id=1 ).one_or_none()
             self.assertIsInstance( transaction.receipt_sent_in_utc, datetime )
+            self.assertEqual( EmailOutboxModel.query.one().status, 'sent' )
 
     @mock.patch(
-        'braintree.Customer.create',
+        'braintree.CustomerGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Customer.find',
+        'braintree.CustomerGateway.find',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.CUSTOMER_FIND_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Transaction.sale',
+        'braintree.TransactionGateway.sale',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SALE_CREATE_LARGE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.Subscription.create',
+        'braintree.SubscriptionGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.SUBSCRIPTION_CREATE_SUCCESSFUL )
     )
     @mock.patch(
-        'braintree.PaymentMethod.create',
+        'braintree.payment_method_gateway.PaymentMethodGateway.create',
         staticmethod( lambda x: tests.helpers.mock_braintree_objects.MockObjects.PAYMENT_METHOD_CREATE_SUCCESSFUL )
     )
     @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', side_effect=get_ultsys_user )
     @mock.patch( 'application.helpers.build_models.create_user', side_effect=create_user )
-    @mock.patch( 'application.helpers.build_models.update_ultsys_user', side_effect=update_ultsys_user )
+    @mock.patch( 'application.helpers.ultsys_user_updates.update_ultsys_user', side_effect=update_ultsys_user )
     @mock.patch( 'application.controllers.donate.redis_queue_caging.queue', side_effect=mock_caging )
+    @mock.patch( 'application.helpers.email_outbox.send_email', return_value=True )
     def test_large_donation_emails(
             self,
             ultsys_user_function,
             create_ultsys_user_function,
             update_ultsys_user_function,
-            mock_caging_function
+            mock_caging_function,
+            send_email_function
     ):  # pylint: disable=unused-argument
         """Test large donation adds entry to GiftThankYouLetter table.
 
@@ -178,6 +195,17 @@ class DonationEmailsTestCase( unittest.TestCase ):
             gift_thank_you_letter = GiftThankYouLetterModel.query.filter_by( gift_id=1 ).one_or_none()
             self.assertEqual( gift_thank_you_letter.gift_id, 1 )
 
+            # The receipt is in the outbox and is not sent on the request path.
             transaction = TransactionModel.query.filter_by( gift_id=1 ).one_or_none()
             self.assertIsNotNone( transaction )
+            self.assertIsNone( transaction.receipt_sent_in_utc )
+            outbox_model = EmailOutboxModel.query.one()
+            self.assertEqual( ( outbox_model.email_type, outbox_model.transaction_id ), ( 'receipt', transaction.id ) )
+            self.assertFalse( send_email_function.called )
+
+            # The dispatcher sends it and sets the receipt sent date.
+            self.assertEqual( dispatch_email_outbox(), { 'sent': 1, 'retried': 0, 'failed': 0 } )
+            database.session.expire_all()
+            transaction = TransactionModel.query.filter_by( gift_id=1 ).one_or_none()
             self.assertIsInstance( transaction.receipt_sent_in_utc, datetime )
+            self.assertEqual( EmailOutboxModel.query.one().status, 'sent' )
@@ -0,0 +1,38 @@
+"""Smoke test of the stand-ins for Braintree and the Ultsys user service used by the load test."""
+import os
+import unittest
+
+import braintree
+import mock
+
+from tests.helpers.mock_braintree_objects import MockObjects
+from tests.load_test.fake_services import install_fake_services
+
+
+class LoadTestFakeServicesTestCase( unittest.TestCase ):
+    """This test suite is designed to verify that the stand-ins of the load test can be installed, so that the
+    load test application in tests/load_test/wsgi.py can be built.
+
+    python -m unittest discover -v
+    python -m unittest -v tests.test_load_test_fake_services.LoadTestFakeServicesTestCase
+    python -m unittest -v tests.test_load_test_fake_services.LoadTestFakeServicesTestCase.test_install_fake_services
+    """
+
+    @mock.patch.dict(
+        os.environ,
+        { 'LOAD_TEST_BRAINTREE_LATENCY': '0', 'LOAD_TEST_ULTSYS_LATENCY': '0', 'LOAD_TEST_LATENCY_JITTER': '0' }
+    )
+    def test_install_fake_services( self ):
+        """Every patch of the stand-ins starts, and the Braintree gateway calls return the mocked objects."""
+
+        patches = install_fake_services()
+        try:
+            self.assertEqual(
+                braintree.payment_method_gateway.PaymentMethodGateway.create( {} ),
+                MockObjects.PAYMENT_METHOD_CREATE_SUCCESSFUL
+            )
+            self.assertEqual( braintree.client_token_gateway.ClientTokenGateway.generate( {} ), 'braintree_token' )
+            self.assertEqual( braintree.TransactionGateway.sale( {} ), MockObjects.SALE_CREATE_SUCCESSFUL )
+        finally:
+            for patch in patches:
+                patch.stop()
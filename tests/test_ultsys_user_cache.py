@@ -0,0 +1,170 @@
+"""Tests the read-through cache of the Ultsys user search service."""
+import time
+import unittest
+
+import mock
+
+from application.app import create_app
+from application.helpers.ultsys_user import create_user
+from application.helpers.ultsys_user import find_ultsys_user
+from application.helpers.ultsys_user import update_ultsys_user
+from application.helpers.ultsys_user_cache import clear_local_cache
+from tests.helpers.mock_redis_queue_functions import MockRedisConnection
+from tests.helpers.mock_ultsys_functions import Request
+
+ULTSYS_USER = { 'ID': 1234, 'firstname': 'Joe', 'lastname': 'Baker', 'email': 'jbaker@gmail.com' }
+
+
+def find_users( search_terms ):
+    """Find the users for the search terms, unsorted.
+
+    :param dict search_terms: The search terms.
+    :return: The list of users.
+    """
+
+    return find_ultsys_user( { 'action': 'find', 'search_terms': search_terms, 'sort_terms': [] } )
+
+
+class UltsysUserCacheTestCase( unittest.TestCase ):
+    """This test suite is designed to verify that the searches of the Ultsys user service are cached, expire, and are
+    dropped when a user is created or updated.
+
+    python -m unittest discover -v
+    python -m unittest -v tests.test_ultsys_user_cache.UltsysUserCacheTestCase
+    python -m unittest -v tests.test_ultsys_user_cache.UltsysUserCacheTestCase.test_cache_hit
+    """
+
+    def setUp( self ):
+        self.app = create_app( 'TEST' )
+        self.app.testing = True
+        self.app.config.update(
+            {
+                'ULTSYS_USER_CACHE_ENABLED': True,
+                'ULTSYS_USER_CACHE_TTL': 300,
+                'ULTSYS_API_KEY': 'api_key',
+                'ULTSYS_CREATE_API_KEY': 'create_api_key',
+                'ULTSYS_USER_CREATE_SERVICE': 'https://ultsys/create',
+                'ULTSYS_USER_UPDATE_SERVICE': 'https://ultsys/update'
+            }
+        )
+        clear_local_cache()
+
+        redis_queue_patch = mock.patch( 'application.helpers.ultsys_user_cache.redis_queue' )
+        self.addCleanup( redis_queue_patch.stop )
+        redis_queue_patch.start().connection = MockRedisConnection()
+
+    @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', return_value=Request( [ ULTSYS_USER ] ) )
+    def test_cache_hit( self, get_ultsys_user_function ):
+        """The same search, up to the type and case of its values, is sent to the service once, and a "like" search is
+        never cached.
+
+        :param get_ultsys_user_function: Argument for mocked function.
+        :return:
+        """
+
+        with self.app.app_context():
+            self.assertEqual( find_users( { 'ID': { 'eq': 1234 } } ), [ ULTSYS_USER ] )
+            self.assertEqual( find_users( { 'ID': { 'eq': '1234' } } ), [ ULTSYS_USER ] )
+            self.assertEqual( get_ultsys_user_function.call_count, 1 )
+
+            find_users( { 'email': { 'in': [ 'jbaker@gmail.com', 'jsmith@gmail.com' ] } } )
+            find_users( { 'email': { 'in': [ 'JSmith@gmail.com', 'jbaker@gmail.com' ] } } )
+            self.assertEqual( get_ultsys_user_function.call_count, 2 )
+
+            find_users( { 'lastname': { 'like': '%Bak%' } } )
+            find_users( { 'lastname': { 'like': '%Bak%' } } )
+            self.assertEqual( get_ultsys_user_function.call_count, 4 )
+
+    @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', return_value=Request( [ ULTSYS_USER ] ) )
+    def test_cache_expiry( self, get_ultsys_user_function ):
+        """A search is sent to the service again once its entry has outlived the TTL.
+
+        :param get_ultsys_user_function: Argument for mocked function.
+        :return:
+        """
+
+        with self.app.app_context():
+            now = time.time()
+            with mock.patch( 'time.time', return_value=now ):
+                find_users( { 'ID': { 'eq': 1234 } } )
+            with mock.patch( 'time.time', return_value=now + 299 ):
+                find_users( { 'ID': { 'eq': 1234 } } )
+            self.assertEqual( get_ultsys_user_function.call_count, 1 )
+
+            with mock.patch( 'time.time', return_value=now + 301 ):
+                find_users( { 'ID': { 'eq': 1234 } } )
+            self.assertEqual( get_ultsys_user_function.call_count, 2 )
+
+    @mock.patch( 'application.helpers.ultsys_user.get_http_session' )
+    @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', return_value=Request( [ ULTSYS_USER ] ) )
+    def test_invalidation_on_create( self, get_ultsys_user_function, get_http_session_function ):
+        """Creating a user drops the cached "eq" and "in" searches on any of its fields, and keeps the others.
+
+        :param get_ultsys_user_function: Argument for mocked function.
+        :param get_http_session_function: Argument for mocked function.
+        :return:
+        """
+
+        get_http_session_function.return_value.post.return_value = mock.Mock( status_code=200 )
+        get_http_session_function.return_value.post.return_value.json.return_value = { 'uid': 5678 }
+
+        with self.app.app_context():
+            stale_searches = [
+                { 'lastname': { 'eq': 'Baker' } },
+                { 'firstname': { 'eq': 'Alex' } },
+                { 'email': { 'in': [ 'ALEX@aol.com', 'jbaker@gmail.com' ] } },
+                { 'uid': { 'eq': 5678 } }
+            ]
+            fresh_search = { 'lastname': { 'eq': 'Smith' } }
+            for search_terms in stale_searches + [ fresh_search ]:
+                find_users( search_terms )
+            self.assertEqual( get_ultsys_user_function.call_count, 5 )
+
+            create_user(
+                {
+                    'action': 'create',
+                    'firstname': 'Alex',
+                    'lastname': 'Baker',
+                    'zip': '22202',
+                    'city': 'Arlington',
+                    'state': 'VA',
+                    'email': 'alex@aol.com',
+                    'phone': '7035555555'
+                }
+            )
+
+            for search_terms in stale_searches + [ fresh_search ]:
+                find_users( search_terms )
+            self.assertEqual( get_ultsys_user_function.call_count, 9 )
+
+    @mock.patch( 'application.helpers.ultsys_user.get_http_session' )
+    @mock.patch( 'application.helpers.ultsys_user.get_ultsys_user', return_value=Request( [ ULTSYS_USER ] ) )
+    def test_invalidation_on_update( self, get_ultsys_user_function, get_http_session_function ):
+        """Updating a user drops every cached search that holds the user, and keeps the others.
+
+        :param get_ultsys_user_function: Argument for mocked function.
+        :param get_http_session_function: Argument for mocked function.
+        :return:
+        """
+
+        get_http_session_function.return_value.post.return_value = mock.Mock( status_code=200 )
+
+        with self.app.app_context():
+            stale_searches = [
+                { 'ID': { 'eq': 1234 } },
+                { 'email': { 'in': [ 'jbaker@gmail.com' ] } },
+                { 'firstname': { 'eq': 'Joe' }, 'lastname': { 'eq': 'Baker' } }
+            ]
+            for search_terms in stale_searches:
+                find_users( search_terms )
+
+            get_ultsys_user_function.return_value = Request( [] )
+            fresh_search = { 'lastname': { 'eq': 'Smith' } }
+            find_users( fresh_search )
+            self.assertEqual( get_ultsys_user_function.call_count, 4 )
+
+            update_ultsys_user( { 'id': 1234 }, '25.00' )
+
+            for search_terms in stale_searches + [ fresh_search ]:
+                find_users( search_terms )
+            self.assertEqual( get_ultsys_user_function.call_count, 7 )
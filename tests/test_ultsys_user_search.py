@@ -0,0 +1,104 @@
+"""Tests the bulk search of the Ultsys user service by ID and email."""
+import unittest
+
+import mock
+
+from application.app import create_app
+from application.helpers.ultsys_user import build_search_batches
+from application.helpers.ultsys_user import find_ultsys_users
+
+ULTSYS_USERS = [
+    { 'ID': 1, 'firstname': 'Joe', 'lastname': 'Baker', 'email': 'jbaker@gmail.com' },
+    { 'ID': 2, 'firstname': 'Jane', 'lastname': 'Baker', 'email': 'JBaker@gmail.com ' },
+    { 'ID': 3, 'firstname': 'Alex', 'lastname': 'Smith', 'email': 'asmith@gmail.com' },
+    { 'ID': 4, 'firstname': 'Sam', 'lastname': 'Jones', 'email': '' }
+]
+
+
+def mock_find_ultsys_user( query_parameters ):
+    """The mocked find_ultsys_user() for an "in" search on ID or email, matched as the service does.
+
+    :param dict query_parameters: The query parameters with the search terms.
+    :return: A list of the users found.
+    """
+
+    field, operation = list( query_parameters[ 'search_terms' ].items() )[ 0 ]
+    values = [ str( value ).lower() for value in operation[ 'in' ] ]
+    return [ user for user in ULTSYS_USERS if str( user[ field ] ).strip().lower() in values ]
+
+
+class UltsysUserSearchTestCase( unittest.TestCase ):
+    """This test suite is designed to verify that find_ultsys_users() splits its values into batches at the size and
+    URL length limits, de-duplicates them, and merges the users found by ID and by email.
+
+    python -m unittest discover -v
+    python -m unittest -v tests.test_ultsys_user_search.UltsysUserSearchTestCase
+    python -m unittest -v tests.test_ultsys_user_search.UltsysUserSearchTestCase.test_build_search_batches
+    """
+
+    def setUp( self ):
+        self.app = create_app( 'TEST' )
+        self.app.testing = True
+
+    def test_build_search_batches( self ):
+        """A batch is closed at ULTSYS_BATCH_SIZE values, or before its URL encoded values pass
+        ULTSYS_BATCH_URL_LENGTH, and a value longer than the limit is a batch of its own.
+        """
+
+        with self.app.app_context():
+            self.app.config.update( { 'ULTSYS_BATCH_SIZE': 3, 'ULTSYS_BATCH_URL_LENGTH': 1500 } )
+            self.assertEqual( build_search_batches( list( range( 1, 8 ) ) ), [ [ 1, 2, 3 ], [ 4, 5, 6 ], [ 7 ] ] )
+            self.assertEqual( build_search_batches( [] ), [] )
+
+            # Each email is 22 characters URL encoded with its separator, and so two fit in 44.
+            self.app.config.update( { 'ULTSYS_BATCH_SIZE': 100, 'ULTSYS_BATCH_URL_LENGTH': 44 } )
+            emails = [ 'a{}@x.com'.format( index ) for index in range( 1, 6 ) ]
+            self.assertEqual( build_search_batches( emails ), [ emails[ 0:2 ], emails[ 2:4 ], emails[ 4: ] ] )
+
+            long_email = '{}@x.com'.format( 'a' * 40 )
+            self.assertEqual(
+                build_search_batches( [ emails[ 0 ], long_email, emails[ 1 ] ] ),
+                [ [ emails[ 0 ] ], [ long_email ], [ emails[ 1 ] ] ]
+            )
+
+    @mock.patch( 'application.helpers.ultsys_user.find_ultsys_user', side_effect=mock_find_ultsys_user )
+    def test_find_ultsys_users( self, find_ultsys_user_function ):
+        """The users found by ID and by email are merged into one dictionary, keyed by integer ID and lowercase email,
+        and duplicate values are searched once.
+
+        :param find_ultsys_user_function: Argument for mocked function.
+        :return:
+        """
+
+        with self.app.app_context():
+            self.app.config.update( { 'ULTSYS_BATCH_SIZE': 2, 'ULTSYS_BATCH_URL_LENGTH': 1500 } )
+
+            ultsys_users = find_ultsys_users(
+                ids=[ '1', 1, 3, '4', 99 ],
+                emails=[ 'JBAKER@gmail.com', ' jbaker@gmail.com', 'asmith@gmail.com', '', None, 'nobody@gmail.com' ]
+            )
+
+            self.assertEqual(
+                ultsys_users,
+                {
+                    1: [ ULTSYS_USERS[ 0 ] ],
+                    3: [ ULTSYS_USERS[ 2 ] ],
+                    4: [ ULTSYS_USERS[ 3 ] ],
+                    'jbaker@gmail.com': [ ULTSYS_USERS[ 0 ], ULTSYS_USERS[ 1 ] ],
+                    'asmith@gmail.com': [ ULTSYS_USERS[ 2 ] ]
+                }
+            )
+
+            # The de-duplicated values are sorted and batched: IDs 1, 3 | 4, 99 and the three unique emails.
+            searches = [ call[ 0 ][ 0 ][ 'search_terms' ] for call in find_ultsys_user_function.call_args_list ]
+            self.assertEqual(
+                searches,
+                [
+                    { 'ID': { 'in': [ 1, 3 ] } },
+                    { 'ID': { 'in': [ 4, 99 ] } },
+                    { 'email': { 'in': [ 'asmith@gmail.com', 'jbaker@gmail.com' ] } },
+                    { 'email': { 'in': [ 'nobody@gmail.com' ] } }
+                ]
+            )
+
+            self.assertEqual( find_ultsys_users(), {} )
@@ -0,0 +1,135 @@
+"""Tests the write-behind buffer of the donation amounts sent to the Ultsys user service."""
+import unittest
+from datetime import datetime
+from datetime import timedelta
+from decimal import Decimal
+
+import mock
+
+from application.app import create_app
+from application.exceptions.exception_ultsys_user import UltsysUserInternalServerError
+from application.flask_essentials import database
+from application.helpers.ultsys_user_updates import flush_ultsys_user_updates
+from application.helpers.ultsys_user_updates import get_ultsys_user_update_report
+from application.helpers.ultsys_user_updates import queue_ultsys_user_update
+from application.models.ultsys_user_update import UltsysUserUpdateModel
+
+
+class UltsysUserUpdatesTestCase( unittest.TestCase ):
+    """This test suite is designed to verify that the donation amounts queued for the Ultsys users are sent in order
+    for each user, and retried when the user service fails.
+
+    python -m unittest discover -v
+    python -m unittest -v tests.test_ultsys_user_updates.UltsysUserUpdatesTestCase
+    python -m unittest -v tests.test_ultsys_user_updates.UltsysUserUpdatesTestCase.test_flush_sends_updates_in_order
+    """
+
+    def setUp( self ):
+        self.app = create_app( 'TEST' )
+        self.app.testing = True
+
+        with self.app.app_context():
+            database.reflect()
+            database.drop_all()
+            database.create_all()
+
+    def tearDown( self ):
+        with self.app.app_context():
+            database.session.commit()
+            database.session.close()
+
+    @mock.patch( 'application.helpers.ultsys_user_updates.redis_queue_flush_ultsys_user_updates.queue' )
+    @mock.patch( 'application.helpers.ultsys_user_updates.update_ultsys_user', return_value=200 )
+    def test_flush_sends_updates_in_order( self, update_ultsys_user_function, flush_queue_function ):
+        # pylint: disable=unused-argument
+        """The updates of a user are sent one per gift, in the order they were queued, and marked sent.
+
+        :param update_ultsys_user_function: Argument for mocked function.
+        :param flush_queue_function: Argument for mocked function.
+        :return:
+        """
+
+        with self.app.app_context():
+            queue_ultsys_user_update( 1234, '10.00', 1 )
+            queue_ultsys_user_update( 1234, '15.00', 2 )
+            queue_ultsys_user_update( 5678, '25.00', 3 )
+            database.session.commit()
+
+            summary = flush_ultsys_user_updates()
+
+            self.assertEqual( summary, { 'users': 2, 'sent': 3, 'retried': 0, 'failed': 0 } )
+            updates = [
+                ( call[ 0 ][ 0 ][ 'id' ], Decimal( call[ 0 ][ 1 ] ) )
+                for call in update_ultsys_user_function.call_args_list
+            ]
+            self.assertEqual(
+                updates, [ ( 1234, Decimal( '10.00' ) ), ( 1234, Decimal( '15.00' ) ), ( 5678, Decimal( '25.00' ) ) ]
+            )
+            self.assertEqual( UltsysUserUpdateModel.query.filter_by( status='sent' ).count(), 3 )
+
+    @mock.patch( 'application.helpers.ultsys_user_updates.redis_queue_flush_ultsys_user_updates.queue' )
+    @mock.patch( 'application.helpers.ultsys_user_updates.update_ultsys_user' )
+    def test_flush_keeps_order_after_failure( self, update_ultsys_user_function, flush_queue_function ):
+        # pylint: disable=unused-argument
+        """After an update of a user fails, their later updates, and those queued since, wait for its retry.
+
+        :param update_ultsys_user_function: Argument for mocked function.
+        :param flush_queue_function: Argument for mocked function.
+        :return:
+        """
+
+        update_ultsys_user_function.side_effect = [ UltsysUserInternalServerError, 200, 200, 200, 200 ]
+
+        with self.app.app_context():
+            queue_ultsys_user_update( 1234, '10.00', 1 )
+            queue_ultsys_user_update( 1234, '15.00', 2 )
+            queue_ultsys_user_update( 5678, '25.00', 3 )
+            database.session.commit()
+
+            summary = flush_ultsys_user_updates()
+            self.assertEqual( summary, { 'users': 1, 'sent': 1, 'retried': 2, 'failed': 0 } )
+
+            # A gift since is not sent ahead of the retry.
+            queue_ultsys_user_update( 1234, '20.00', 4 )
+            database.session.commit()
+            self.assertEqual( flush_ultsys_user_updates()[ 'sent' ], 0 )
+
+            UltsysUserUpdateModel.query.filter_by( status='pending' ).update(
+                { 'next_attempt_in_utc': datetime.utcnow() - timedelta( seconds=1 ) }, synchronize_session=False
+            )
+            database.session.commit()
+            self.assertEqual( flush_ultsys_user_updates()[ 'sent' ], 3 )
+
+            amounts = [ Decimal( call[ 0 ][ 1 ] ) for call in update_ultsys_user_function.call_args_list ]
+            self.assertEqual(
+                amounts, [ Decimal( amount ) for amount in [ '10.00', '25.00', '10.00', '15.00', '20.00' ] ]
+            )
+
+    @mock.patch( 'application.helpers.ultsys_user_updates.redis_queue_flush_ultsys_user_updates.queue' )
+    @mock.patch(
+        'application.helpers.ultsys_user_updates.update_ultsys_user', side_effect=UltsysUserInternalServerError
+    )
+    def test_flush_retries_and_reports_failures( self, update_ultsys_user_function, flush_queue_function ):
+        # pylint: disable=unused-argument
+        """An update that fails is retried until the most attempts, and is then reported as failed.
+
+        :param update_ultsys_user_function: Argument for mocked function.
+        :param flush_queue_function: Argument for mocked function.
+        :return:
+        """
+
+        with self.app.app_context():
+            self.app.config[ 'ULTSYS_UPDATE_MAX_ATTEMPTS' ] = 2
+            self.app.config[ 'ULTSYS_UPDATE_BACKOFF' ] = 0
+
+            queue_ultsys_user_update( 1234, '10.00', 1 )
+            database.session.commit()
+
+            self.assertEqual( flush_ultsys_user_updates( max_batches=1 )[ 'retried' ], 1 )
+            self.assertEqual( flush_ultsys_user_updates( max_batches=1 )[ 'failed' ], 1 )
+
+            report = get_ultsys_user_update_report()
+            self.assertEqual( report[ 'statuses' ][ 'failed' ][ 'updates' ], 1 )
+            self.assertEqual( report[ 'failed' ][ 0 ][ 'user_id' ], 1234 )
+            self.assertEqual( report[ 'failed' ][ 0 ][ 'gift_ids' ], [ 1 ] )
+            self.assertIsNone( report[ 'oldest_waiting_in_utc' ] )